@@ -6,9 +6,11 @@ import time
 
 import numpy as np
 
-from dswx_sar import dswx_sar_util, filter_SAR, generate_log
+from dswx_sar import dswx_sar_util, generate_log
 from dswx_sar.dswx_runconfig import DSWX_S1_POL_DICT, _get_parser, RunConfig
-from dswx_sar.pre_processing import pol_ratio
+from dswx_sar.pre_processing import (get_filtered_ratio_path,
+                                     get_filtering_method,
+                                     pol_ratio)
 from dswx_sar.masking_with_ancillary import FillMaskLandCover
 
 logger = logging.getLogger('dswx_sar')
@@ -21,6 +23,8 @@ def run(cfg):
     t_all = time.time()
 
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='inundated_vegetation')
     outputdir = cfg.groups.product_path_group.scratch_path
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
@@ -73,7 +77,7 @@ def run(cfg):
             crosspol_ind = polind
 
     rtc_dual_path = f"{outputdir}/filtered_image_{pol_all_str}.tif"
-    if not os.path.isfile(rtc_dual_path):
+    if not dswx_sar_util.scratch_store.exists(rtc_dual_path):
         err_str = f'{rtc_dual_path} is not found.'
         raise FileExistsError(err_str)
 
@@ -91,78 +95,70 @@ def run(cfg):
                     im_meta['width']),
         pad_shape=pad_shape)
 
-    for block_param in block_params:
-
-        rtc_dual = dswx_sar_util.get_raster_block(
-            rtc_dual_path,
-            block_param)
-
-        rtc_ratio = pol_ratio(
-            np.squeeze(rtc_dual[copol_ind, :, :]),
-            np.squeeze(rtc_dual[crosspol_ind, :, :]))
-
-        if filter_method == 'lee':
-            filtering_method = filter_SAR.lee_enhanced_filter
-            filter_option = vars(filter_options.lee_filter)
-
-        elif filter_method == 'anisotropic_diffusion':
-            filtering_method = filter_SAR.anisotropic_diffusion
-            filter_option = vars(filter_options.anisotropic_diffusion)
-
-        elif filter_method == 'guided_filter':
-            filtering_method = filter_SAR.guided_filter
-            filter_option = vars(filter_options.guided_filter)
-
-        elif filter_method == 'bregman':
-            filtering_method = filter_SAR.tv_bregman
-            filter_option = vars(filter_options.bregman)
-
-        filt_ratio = filtering_method(
-                        rtc_ratio, **filter_option)
-        filt_ratio_db = 10 * np.log10(filt_ratio +
-                                      dswx_sar_util.Constants.negligible_value)
-        cross_db = 10 * np.log10(
-            np.squeeze(rtc_dual[crosspol_ind, :, :]) +
-            dswx_sar_util.Constants.negligible_value)
-
-        output_data = np.zeros(filt_ratio.shape, dtype='uint8')
-
-        target_cross_pol = cross_db > inundated_vege_cross_pol_min
-
-        target_inundated_vege_class = mask_obj.get_mask(
-            mask_label=inundated_vege_target,
-            block_param=block_param)
-
-        inundated_vegetation = (
-            filt_ratio_db > inundated_vege_ratio_threshold) & \
-            target_cross_pol & \
-            target_inundated_vege_class
-
-        output_data[inundated_vegetation] = 2
+    # The filtered ratio is computed in the pre-processing for the
+    # dual polarizations. Otherwise, it is computed from the filtered image.
+    filtered_ratio_path = get_filtered_ratio_path(outputdir, pol_all_str)
+    filtered_ratio_flag = dswx_sar_util.scratch_store.exists(
+        filtered_ratio_path)
+    if filtered_ratio_flag:
+        logger.info(f'Filtered ratio is read from {filtered_ratio_path}')
+    else:
+        filtering_method, filter_option = get_filtering_method(
+            filter_method, filter_options)
 
-        dswx_sar_util.write_raster_block(
-            out_raster=inundated_vege_path,
-            data=output_data,
-            block_param=block_param,
+    with dswx_sar_util.RasterBlockWriter(
+            inundated_vege_path,
             geotransform=im_meta['geotransform'],
             projection=im_meta['projection'],
             datatype='byte',
-            cog_flag=True,
-            scratch_dir=outputdir)
-
-        if processing_cfg.debug_mode:
-            dswx_sar_util.write_raster_block(
-                out_raster=os.path.join(
-                    outputdir, f'intensity_db_ratio_{pol_all_str}.tif'),
-                data=filt_ratio_db,
-                block_param=block_param,
-                geotransform=im_meta['geotransform'],
-                projection=im_meta['projection'],
-                datatype='float32',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-    dswx_sar_util._save_as_cog(inundated_vege_path, outputdir)
+            scratch_dir=outputdir) as inundated_vege_writer, \
+        dswx_sar_util.RasterBlockWriter(
+            os.path.join(outputdir, f'intensity_db_ratio_{pol_all_str}.tif'),
+            geotransform=im_meta['geotransform'],
+            projection=im_meta['projection'],
+            datatype='float32',
+            scratch_dir=outputdir) as ratio_writer:
+        for block_param in block_params:
+
+            rtc_dual = dswx_sar_util.get_raster_block(
+                rtc_dual_path,
+                block_param)
+
+            if filtered_ratio_flag:
+                filt_ratio = dswx_sar_util.get_raster_block(
+                    filtered_ratio_path,
+                    block_param)
+            else:
+                rtc_ratio = pol_ratio(
+                    np.squeeze(rtc_dual[copol_ind, :, :]),
+                    np.squeeze(rtc_dual[crosspol_ind, :, :]))
+                filt_ratio = filtering_method(
+                                rtc_ratio, **filter_option)
+            filt_ratio_db = 10 * np.log10(
+                filt_ratio + dswx_sar_util.Constants.negligible_value)
+            cross_db = 10 * np.log10(
+                np.squeeze(rtc_dual[crosspol_ind, :, :]) +
+                dswx_sar_util.Constants.negligible_value)
+
+            output_data = np.zeros(filt_ratio.shape, dtype='uint8')
+
+            target_cross_pol = cross_db > inundated_vege_cross_pol_min
+
+            target_inundated_vege_class = mask_obj.get_mask(
+                mask_label=inundated_vege_target,
+                block_param=block_param)
+
+            inundated_vegetation = (
+                filt_ratio_db > inundated_vege_ratio_threshold) & \
+                target_cross_pol & \
+                target_inundated_vege_class
+
+            output_data[inundated_vegetation] = 2
+
+            inundated_vege_writer.write_block(output_data, block_param)
+
+            if processing_cfg.debug_mode:
+                ratio_writer.write_block(filt_ratio_db, block_param)
 
     t_time_end = time.time()
 
@@ -4,6 +4,7 @@ import logging
 import time
 
 from dswx_sar import (detect_inundated_vegetation,
+                      dswx_sar_util,
                       fuzzy_value_computation,
                       initial_threshold,
                       masking_with_ancillary,
@@ -29,60 +30,73 @@ def dswx_s1_workflow(cfg):
     input_list = cfg.groups.input_file_group.input_file_path
     dswx_workflow = processing_cfg.dswx_workflow
     inundated_veg_cfg = processing_cfg.inundated_vegetation
-
-    logger.info("")
-    logger.info("Starting DSWx-S1 algorithm")
-    logger.info(f"Number of RTC products: {len(input_list)}")
-    logger.info(f"Polarizations : {pol_list}")
-
-    # Create mosaic burst RTCs
-    mosaic_rtc_burst.run(cfg)
-
-    if pol_mode == 'MIX_DUAL_POL':
-        proc_pol_set = [DSWX_S1_POL_DICT['DV_POL'],
-                        DSWX_S1_POL_DICT['DH_POL']]
-    elif pol_mode == 'MIX_SINGLE_POL':
-        proc_pol_set = [DSWX_S1_POL_DICT['SV_POL'],
-                        DSWX_S1_POL_DICT['SH_POL']]
-    elif pol_mode == 'MIX_DUAL_H_SINGLE_V_POL':
-        proc_pol_set = [DSWX_S1_POL_DICT['DH_POL'],
-                        DSWX_S1_POL_DICT['SV_POL']]
-    elif pol_mode == 'MIX_DUAL_V_SINGLE_H_POL':
-        proc_pol_set = [DSWX_S1_POL_DICT['DV_POL'],
-                        DSWX_S1_POL_DICT['SH_POL']]
-    else:
-        proc_pol_set = [pol_list]
-
-    for pol_set in proc_pol_set:
-        processing_cfg.polarizations = pol_set
-        # preprocessing (relocating ancillary data and filtering)
-        pre_processing.run(cfg)
-
-        # Estimate threshold for given polarizations
-        initial_threshold.run(cfg)
-
-        # Fuzzy value computation
-        fuzzy_value_computation.run(cfg)
-
-        # Region Growing
-        region_growing.run(cfg)
-
-        if dswx_workflow == 'opera_dswx_s1':
-            # Land use map
-            masking_with_ancillary.run(cfg)
-
-            # Refinement
-            refine_with_bimodality.run(cfg)
-
-            if ((inundated_veg_cfg.enabled == 'auto') and
-               len(pol_set) >= 2) or \
-               inundated_veg_cfg.enabled is True:
-
-                detect_inundated_vegetation.run(cfg)
-
-    processing_cfg.polarizations = pol_list
-    # save product as mgrs tiles.
-    save_mgrs_tiles.run(cfg)
+    dswx_sar_util.scratch_store.configure_from_cfg(processing_cfg)
+
+    try:
+        logger.info("")
+        logger.info("Starting DSWx-S1 algorithm")
+        logger.info(f"Number of RTC products: {len(input_list)}")
+        logger.info(f"Polarizations : {pol_list}")
+
+        # Create mosaic burst RTCs
+        mosaic_rtc_burst.run(cfg)
+
+        if pol_mode == 'MIX_DUAL_POL':
+            proc_pol_set = [DSWX_S1_POL_DICT['DV_POL'],
+                            DSWX_S1_POL_DICT['DH_POL']]
+        elif pol_mode == 'MIX_SINGLE_POL':
+            proc_pol_set = [DSWX_S1_POL_DICT['SV_POL'],
+                            DSWX_S1_POL_DICT['SH_POL']]
+        elif pol_mode == 'MIX_DUAL_H_SINGLE_V_POL':
+            proc_pol_set = [DSWX_S1_POL_DICT['DH_POL'],
+                            DSWX_S1_POL_DICT['SV_POL']]
+        elif pol_mode == 'MIX_DUAL_V_SINGLE_H_POL':
+            proc_pol_set = [DSWX_S1_POL_DICT['DV_POL'],
+                            DSWX_S1_POL_DICT['SH_POL']]
+        else:
+            proc_pol_set = [pol_list]
+
+        for pol_set in proc_pol_set:
+            processing_cfg.polarizations = pol_set
+            # preprocessing (relocating ancillary data and filtering)
+            pre_processing.run(cfg)
+
+            # Estimate threshold for given polarizations
+            initial_threshold.run(cfg)
+
+            # Fuzzy value computation
+            fuzzy_value_computation.run(cfg)
+
+            # Region Growing
+            region_growing.run(cfg)
+
+            if dswx_workflow == 'opera_dswx_s1':
+                # Land use map
+                masking_with_ancillary.run(cfg)
+
+                # Refinement
+                refine_with_bimodality.run(cfg)
+
+                if ((inundated_veg_cfg.enabled == 'auto') and
+                   len(pol_set) >= 2) or \
+                   inundated_veg_cfg.enabled is True:
+
+                    detect_inundated_vegetation.run(cfg)
+
+        processing_cfg.polarizations = pol_list
+        # save product as mgrs tiles.
+        save_mgrs_tiles.run(cfg)
+
+        # Keep every intermediate layer as GeoTIFF in debug mode
+        if processing_cfg.debug_mode:
+            dswx_sar_util.scratch_store.materialize_all()
+    finally:
+        # Remove the stored layers also when a stage fails, so that
+        # a rerun in the same scratch directory does not find them.
+        dswx_sar_util.scratch_store.cleanup()
+
+    dswx_sar_util.raster_handle_cache.log_stats(logger)
+    dswx_sar_util.raster_handle_cache.clear()
 
     t_time_end = time.time()
     logger.info(f'total processing time: {t_time_end - t_all} sec')
@@ -1,14 +1,24 @@
+import contextlib
+import fnmatch
+import json
 import logging
 import os
 import shutil
 import tempfile
+import threading
+import uuid
 import rasterio
 
+from collections import OrderedDict
 from dataclasses import dataclass
+import cv2
 import matplotlib.pyplot as plt
 import numpy as np
+from joblib import Parallel, delayed
 from osgeo import gdal, osr, ogr
 from pyproj import Transformer
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 
 gdal.DontUseExceptions()
 
@@ -85,6 +95,73 @@ class Constants:
     negligible_value: float = 1e-5
 
 
+# Creation options for intermediate rasters stored in the scratch
+# directory. Tiles are left uncompressed so that block writes that do
+# not align with the tile grid are updated in place.
+SCRATCH_GTIFF_CREATION_OPTIONS = ['TILED=YES',
+                                  'BLOCKXSIZE=512',
+                                  'BLOCKYSIZE=512',
+                                  'BIGTIFF=IF_SAFER']
+
+
+class ScratchRasterPolicy:
+    """Storage policy for intermediate rasters in the scratch directory.
+
+    Only the final products need to be cloud-optimized GeoTIFFs (COG).
+    By default, intermediate layers are stored as tiled GeoTIFFs
+    without overviews and are written only once. Individual stages
+    can still be stored as COG (e.g., for inspection in debug mode).
+
+    Parameters
+    ----------
+    imagery_format: str
+        Default format of the intermediate rasters, 'GTiff' or 'COG'
+    cog_stages: list
+        Names of the stages whose intermediate rasters are stored as
+        COG regardless of `imagery_format`
+    """
+    def __init__(self, imagery_format='GTiff', cog_stages=None):
+        self.stage = None
+        self.configure(imagery_format, cog_stages)
+
+    def configure(self, imagery_format='GTiff', cog_stages=None):
+        if imagery_format not in ['GTiff', 'COG']:
+            raise ValueError(
+                f'Invalid scratch imagery format: {imagery_format}')
+        self.imagery_format = imagery_format
+        self.cog_stages = set(cog_stages) if cog_stages else set()
+
+    def configure_from_cfg(self, processing_cfg, stage=None):
+        """Set the policy from the `scratch_imagery` runconfig group
+        and the stage whose intermediate rasters are being written."""
+        self.stage = stage
+        scratch_cfg = getattr(processing_cfg, 'scratch_imagery', None)
+        if scratch_cfg is None:
+            return
+        self.configure(scratch_cfg.format, scratch_cfg.cog_stages)
+
+    def set_stage(self, stage):
+        """Set the stage whose intermediate rasters are being written."""
+        self.stage = stage
+
+    def use_cog(self, stage=None):
+        """Return True if rasters of `stage` (default: current stage)
+        are to be stored as COG."""
+        if stage is None:
+            stage = self.stage
+        return self.imagery_format == 'COG' or stage in self.cog_stages
+
+
+scratch_raster_policy = ScratchRasterPolicy()
+
+
+def _resolve_cog_flag(cog_flag):
+    """Resolve a `cog_flag` argument; None follows the scratch policy."""
+    if cog_flag is None:
+        return scratch_raster_policy.use_cog()
+    return cog_flag
+
+
 def get_interpreted_dswx_s1_ctable():
     """Get colortable for DSWx-S1 products
 
@@ -146,6 +223,19 @@ def read_geotiff(input_tif_str, band_ind=None, verbose=True):
     tifdata: numpy.ndarray
         image from geotiff
     """
+    layer = scratch_store.lookup(input_tif_str)
+    if layer is not None:
+        if band_ind is None:
+            tifdata = np.array(layer['array'])
+            if tifdata.shape[0] == 1:
+                tifdata = tifdata[0]
+        else:
+            tifdata = np.array(layer['array'][band_ind])
+        if verbose:
+            print(f" -- Reading {input_tif_str} (store) ... "
+                  f"{tifdata.shape}")
+        return tifdata
+
     tif = gdal.Open(input_tif_str)
     if band_ind is None:
         tifdata = tif.ReadAsArray()
@@ -162,7 +252,8 @@ def read_geotiff(input_tif_str, band_ind=None, verbose=True):
 
 def save_raster_gdal(data, output_file, geotransform,
                      projection, scratch_dir='.',
-                     datatype='float32'):
+                     datatype='float32',
+                     cog_flag=None):
     """Save images using Gdal
 
     Parameters
@@ -179,6 +270,10 @@ def save_raster_gdal(data, output_file, geotransform,
         temporary file path to process COG file.
     datatype: str
         Data types to save the file.
+    cog_flag: bool
+        If True, the file is saved as COG. If False, the file is saved
+        as tiled GeoTIFF. If None (default), the scratch raster
+        policy decides.
     """
     gdal_type = np2gdal_conversion[str(datatype)]
     image_size = data.shape
@@ -193,11 +288,19 @@ def save_raster_gdal(data, output_file, geotransform,
         nx = image_size[1]
         ndim = 1
 
-    driver = gdal.GetDriverByName("GTiff")
+    cog_flag = _resolve_cog_flag(cog_flag)
+
     output_file_path = os.path.join(output_file)
-    gdal_ds = driver.Create(output_file_path,
-                            nx, ny,
-                            ndim, gdal_type)
+    raster_handle_cache.invalidate(output_file_path)
+    scratch_store.release(output_file_path)
+    if cog_flag:
+        # Fill an in-memory dataset and copy it into a COG at once
+        gdal_ds = gdal.GetDriverByName('MEM').Create(
+            '', nx, ny, ndim, gdal_type)
+    else:
+        gdal_ds = gdal.GetDriverByName("GTiff").Create(
+            output_file_path, nx, ny, ndim, gdal_type,
+            options=SCRATCH_GTIFF_CREATION_OPTIONS)
     gdal_ds.SetGeoTransform(geotransform)
     gdal_ds.SetProjection(projection)
 
@@ -208,11 +311,58 @@ def save_raster_gdal(data, output_file, geotransform,
             gdal_ds.GetRasterBand(im_ind+1).WriteArray(
                 np.squeeze(data[im_ind, :, :]))
 
+    if cog_flag:
+        _copy_dataset_as_cog(gdal_ds, output_file_path)
+
     gdal_ds.FlushCache()
     gdal_ds = None
     del gdal_ds  # close the dataset (Python object and pointers)
 
-    _save_as_cog(output_file, scratch_dir)
+
+def assign_dswx_classes(wtr, datatype='uint8', logger=None,
+                        verbose=True, **dswx_processed_bands):
+    """Assign the class values of the processed bands to a
+    classified image. Inundated vegetation is assigned last.
+
+    Parameters
+    ----------
+    wtr: numpy.ndarray
+        classified image for DSWx-S1 product
+    datatype: str
+        data type of the output image
+    logger: logging.Logger
+        logger to report the assigned classes
+    verbose: bool
+        If True, the assigned classes are reported.
+    dswx_processed_bands
+        masks of the classes to assign
+
+    Returns
+    -------
+    wtr: numpy.ndarray
+        classified image with the class values assigned
+    """
+    wtr = np.asarray(wtr, dtype=datatype)
+    dswx_processed_bands_keys = dswx_processed_bands.keys()
+
+    band_value_dict = band_assign_value_dict
+    sorted_band_keys = sorted(
+        band_value_dict.keys(),
+        key=lambda x: x.lower() == 'inundated_vegetation')
+
+    for band_key in sorted_band_keys:
+        if band_key.lower() in dswx_processed_bands_keys:
+            dswx_product_value = band_value_dict[band_key]
+            wtr[dswx_processed_bands[band_key.lower()] == 1] = \
+                dswx_product_value
+            if not verbose:
+                continue
+            msg = f'    {band_key.lower()} found {dswx_product_value}'
+            if logger is not None:
+                logger.info(msg)
+            else:
+                print(msg)
+    return wtr
 
 
 def save_dswx_product(wtr, output_file, geotransform,
@@ -241,9 +391,7 @@ def save_dswx_product(wtr, output_file, geotransform,
         classes to save to output
     """
     shape = wtr.shape
-    driver = gdal.GetDriverByName("GTiff")
-    wtr = np.asarray(wtr, dtype=datatype)
-    dswx_processed_bands_keys = dswx_processed_bands.keys()
+    driver = gdal.GetDriverByName("MEM")
 
     msg = f'Saving dswx product : {output_file} '
     if logger is not None:
@@ -251,25 +399,15 @@ def save_dswx_product(wtr, output_file, geotransform,
     else:
         print(msg)
 
+    wtr = assign_dswx_classes(wtr, datatype=datatype, logger=logger,
+                              **dswx_processed_bands)
     band_value_dict = band_assign_value_dict
-    sorted_band_keys = sorted(
-        band_value_dict.keys(),
-        key=lambda x: x.lower() == 'inundated_vegetation')
-
-    for band_key in sorted_band_keys:
-        if band_key.lower() in dswx_processed_bands_keys:
-            dswx_product_value = band_value_dict[band_key]
-            wtr[dswx_processed_bands[band_key.lower()] == 1] = \
-                dswx_product_value
-            msg = f'    {band_key.lower()} found {dswx_product_value}'
-            if logger is not None:
-                logger.info(msg)
-            else:
-                print(msg)
 
     gdal_type = np2gdal_conversion[str(datatype)]
+    raster_handle_cache.invalidate(output_file)
+    scratch_store.release(output_file)
 
-    gdal_ds = driver.Create(output_file,
+    gdal_ds = driver.Create('',
                             shape[1], shape[0], 1, gdal_type)
     gdal_ds.SetGeoTransform(geotransform)
     gdal_ds.SetProjection(projection)
@@ -291,11 +429,224 @@ def save_dswx_product(wtr, output_file, geotransform,
     gdal_band.FlushCache()
     gdal_band = None
 
-    gdal_ds.FlushCache()
+    _copy_dataset_as_cog(gdal_ds, output_file)
+
     gdal_ds = None
     del gdal_ds  # close the dataset (Python object and pointers)
 
-    _save_as_cog(output_file, scratch_dir)
+
+class DSWxProductWriter:
+    """Streaming writer of a DSWx product assembled block by block.
+
+    The product is written as a tiled GeoTIFF with the no-data value,
+    color table and description of `save_dswx_product`, and the class
+    values are assigned to each block as it is written.
+
+    Parameters
+    ----------
+    output_file: str
+        full path for filename to save the DSWx-S1 file
+    geotransform: gdal
+        gdaltransform information
+    projection: gdal
+        projection object
+    length: int
+        number of lines of the product
+    width: int
+        number of columns of the product
+    scratch_dir: str
+        temporary file path to process COG file.
+    description: str
+        description for DSWx-S1
+    metadata: dict
+        metadata of the product band
+    is_diag: bool
+        If True, the color table is not set.
+    datatype: str
+        data type of the product
+    cog_flag: bool
+        If True, the product is converted to COG on close. If None
+        (default), the scratch raster policy decides.
+    logger: logging.Logger
+        logger to report the progress
+
+    Examples
+    --------
+    >>> with DSWxProductWriter(path, geotransform, projection,
+    ...                        length, width) as writer:
+    ...     for block_param in block_params:
+    ...         writer.write_block(wtr_block, block_param,
+    ...                            no_data=no_data_block)
+    """
+    def __init__(self, output_file, geotransform, projection,
+                 length, width, scratch_dir='.',
+                 description=None, metadata=None,
+                 is_diag=False, datatype='uint8',
+                 cog_flag=None, logger=None):
+        self.output_file = output_file
+        self.datatype = datatype
+        self.scratch_dir = scratch_dir
+        self.cog_flag = _resolve_cog_flag(cog_flag)
+        self.logger = logger
+        self._first_block = True
+
+        msg = f'Saving dswx product : {output_file} '
+        if logger is not None:
+            logger.info(msg)
+        else:
+            print(msg)
+
+        raster_handle_cache.invalidate(output_file)
+        scratch_store.release(output_file)
+        driver = gdal.GetDriverByName('GTiff')
+        gdal_ds = driver.Create(output_file, width, length, 1,
+                                np2gdal_conversion[str(datatype)],
+                                options=SCRATCH_GTIFF_CREATION_OPTIONS)
+        if not gdal_ds:
+            raise IOError(f"Failed to create raster: {output_file}")
+        gdal_ds.SetGeoTransform(geotransform)
+        gdal_ds.SetProjection(projection)
+
+        gdal_band = gdal_ds.GetRasterBand(1)
+        gdal_band.SetNoDataValue(band_assign_value_dict['no_data'])
+        gdal_band.SetMetadata(metadata)
+        # set color table and color interpretation
+        if not is_diag:
+            dswx_ctable = get_interpreted_dswx_s1_ctable()
+            gdal_band.SetRasterColorTable(dswx_ctable)
+            gdal_band.SetRasterColorInterpretation(
+                gdal.GCI_PaletteIndex)
+        if description is not None:
+            gdal_band.SetDescription(description)
+        self._gdal_ds = gdal_ds
+        self._gdal_band = gdal_band
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(finalize=exc_type is None)
+        return False
+
+    def write_block(self, wtr, block_param, **dswx_processed_bands):
+        """Assign the classes to a block and write it to the product.
+
+        Parameters
+        ----------
+        wtr: numpy.ndarray
+            classified image of the block without padding
+        block_param: BlockParam
+            Specifications for the block to be written
+        dswx_processed_bands
+            masks of the classes of the block to assign
+        """
+        wtr = assign_dswx_classes(wtr, datatype=self.datatype,
+                                  logger=self.logger,
+                                  verbose=self._first_block,
+                                  **dswx_processed_bands)
+        self._first_block = False
+        self._gdal_band.WriteArray(wtr, xoff=0,
+                                   yoff=block_param.write_start_line)
+
+    def close(self, finalize=True):
+        """Close the product and convert it to COG if requested."""
+        if self._gdal_ds is None:
+            return
+        self._gdal_band.FlushCache()
+        self._gdal_band = None
+        self._gdal_ds = None
+        if finalize and self.cog_flag:
+            _save_as_cog(self.output_file, self.scratch_dir, self.logger)
+
+
+def _get_cog_creation_options(gdal_dtype,
+                              ovr_resamp_algorithm=None,
+                              compression='DEFLATE',
+                              nbits=16,
+                              tile_size=512):
+    """Get creation options of the GDAL COG driver for a data type.
+
+    Parameters
+    ----------
+    gdal_dtype: int
+            GDAL data type of the raster
+    ovr_resamp_algorithm: str (optional)
+            Resampling algorithm for overviews. Defaults to "NEAREST",
+            if integer, and "CUBICSPLINE", otherwise.
+    compression: str (optional)
+            Compression type.
+    nbits: int (optional)
+            Number of bits per sample. Ignored when it is not smaller
+            than the size of the data type.
+    tile_size: int (optional)
+            Tile size in pixels
+
+    Returns
+    -------
+    cog_options: list
+            COG driver creation options
+    """
+    dtype_name = gdal.GetDataTypeName(gdal_dtype).lower()
+    is_integer = 'byte' in dtype_name or 'int' in dtype_name
+
+    if ovr_resamp_algorithm is None and is_integer:
+        ovr_resamp_algorithm = 'NEAREST'
+    elif ovr_resamp_algorithm is None:
+        ovr_resamp_algorithm = 'CUBICSPLINE'
+
+    # Blocks of 512 x 512 => 256 KiB (UInt8) or 1MiB (Float32)
+    cog_options = ['BIGTIFF=IF_SAFER',
+                   'MAX_Z_ERROR=0',
+                   f'BLOCKSIZE={tile_size}',
+                   f'OVERVIEW_RESAMPLING={ovr_resamp_algorithm}']
+
+    if compression:
+        # YES selects horizontal differencing (2) for integers and
+        # floating point prediction (3) for floats
+        cog_options += [f'COMPRESS={compression}', 'PREDICTOR=YES']
+
+    # NBITS=16 stores Float32 as half-precision floats
+    dtype_bits = gdal.GetDataTypeSize(gdal_dtype)
+    if nbits is not None and nbits < dtype_bits and \
+       (is_integer or (dtype_name == 'float32' and nbits == 16)):
+        cog_options += [f'NBITS={nbits}']
+
+    return cog_options
+
+
+def _copy_dataset_as_cog(gdal_ds, filename,
+                         ovr_resamp_algorithm=None,
+                         compression='DEFLATE',
+                         nbits=16):
+    """Write an opened GDAL dataset (e.g., a MEM dataset) as a
+    cloud-optimized GeoTIFF in a single pass. Overviews are computed
+    by the COG driver while the file is written.
+
+    Parameters
+    ----------
+    gdal_ds: gdal.Dataset
+            Source dataset
+    filename: str
+            Output cloud-optimized GeoTIFF
+    ovr_resamp_algorithm: str (optional)
+            Resampling algorithm for overviews.
+    compression: str (optional)
+            Compression type.
+    nbits: int (optional)
+            Number of bits per sample.
+    """
+    cog_options = _get_cog_creation_options(
+        gdal_ds.GetRasterBand(1).DataType,
+        ovr_resamp_algorithm=ovr_resamp_algorithm,
+        compression=compression,
+        nbits=nbits)
+
+    raster_handle_cache.invalidate(filename)
+    cog_ds = gdal.GetDriverByName('COG').CreateCopy(
+        filename, gdal_ds, options=cog_options)
+    if cog_ds is None:
+        raise IOError(f"Failed to create COG: {filename}")
+    cog_ds = None
 
 
 def _save_as_cog(filename,
@@ -307,6 +658,9 @@ def _save_as_cog(filename,
                  nbits=16):
     """Save (overwrite) a GeoTIFF file as a cloud-optimized GeoTIFF.
 
+    The tiled, compressed layout and the overviews are produced in a
+    single pass by the GDAL COG driver.
+
     Parameters
     ----------
     filename: str
@@ -326,59 +680,44 @@ def _save_as_cog(filename,
     """
     if logger is None:
         logger = logging.getLogger('proteus')
+    raster_handle_cache.invalidate(filename)
 
-    logger.info('        COG step 1: add overviews')
-    gdal_ds = gdal.Open(filename, gdal.GA_Update)
-    gdal_dtype = gdal_ds.GetRasterBand(1).DataType
-    dtype_name = gdal.GetDataTypeName(gdal_dtype).lower()
-
-    overviews_list = [4, 16, 64, 128]
-
-    is_integer = 'byte' in dtype_name or 'int' in dtype_name
-    if ovr_resamp_algorithm is None and is_integer:
-        ovr_resamp_algorithm = 'NEAREST'
-    elif ovr_resamp_algorithm is None:
-        ovr_resamp_algorithm = 'CUBICSPLINE'
-
-    gdal_ds.BuildOverviews(ovr_resamp_algorithm, overviews_list,
-                           gdal.TermProgress_nocb)
-
-    del gdal_ds  # close the dataset (Python object and pointers)
     external_overview_file = filename + '.ovr'
     if os.path.isfile(external_overview_file):
         os.remove(external_overview_file)
 
-    logger.info('        COG step 2: save as COG')
+    logger.info('        COG: save as COG')
     temp_file = tempfile.NamedTemporaryFile(
                     dir=scratch_dir, suffix='.tif').name
 
-    # Blocks of 512 x 512 => 256 KiB (UInt8) or 1MiB (Float32)
-    tile_size = 512
-    gdal_translate_options = ['BIGTIFF=IF_SAFER',
-                              'MAX_Z_ERROR=0',
-                              'TILED=YES',
-                              f'BLOCKXSIZE={tile_size}',
-                              f'BLOCKYSIZE={tile_size}',
-                              'COPY_SRC_OVERVIEWS=YES']
-
-    if compression:
-        gdal_translate_options += [f'COMPRESS={compression}']
+    gdal_ds = gdal.Open(filename, gdal.GA_ReadOnly)
+    _copy_dataset_as_cog(gdal_ds,
+                         temp_file,
+                         ovr_resamp_algorithm=ovr_resamp_algorithm,
+                         compression=compression if flag_compress else None,
+                         nbits=nbits)
+    gdal_ds = None
 
-    if is_integer:
-        gdal_translate_options += ['PREDICTOR=2']
-    else:
-        gdal_translate_options += ['PREDICTOR=3']
+    shutil.move(temp_file, filename)
 
-    if nbits is not None:
-        gdal_translate_options += [f'NBITS={nbits}']
 
-        # suppress type casting errors
-        gdal.SetConfigOption('CPL_LOG', '/dev/null')
+def save_scratch_raster(filename, scratch_dir='.', logger=None, **kwargs):
+    """Finalize an intermediate raster written to the scratch directory.
 
-    gdal.Translate(temp_file, filename,
-                   creationOptions=gdal_translate_options)
+    The raster is converted to COG only when the scratch raster policy
+    requires it; otherwise, it is left as written.
 
-    shutil.move(temp_file, filename)
+    Parameters
+    ----------
+    filename: str
+            GeoTIFF written in the scratch directory
+    scratch_dir: str (optional)
+            Temporary Directory
+    kwargs: dict
+            Additional arguments to `_save_as_cog`
+    """
+    if scratch_raster_policy.use_cog():
+        _save_as_cog(filename, scratch_dir, logger, **kwargs)
 
 
 def convert_rounded_coordinates(
@@ -522,27 +861,26 @@ def get_invalid_area(geotiff_path,
                     im_meta['width']),
         pad_shape=pad_shape)
 
-    for block_param in block_params:
-        image = get_raster_block(
-            geotiff_path,
-            block_param)
-
-        if image.ndim == 3:
-            no_data_raster = np.isnan(
-                np.squeeze(image[0, :, :]))
-        else:
-            no_data_raster = np.isnan(image)
-
-        write_raster_block(
-            out_raster=output_path,
-            data=no_data_raster,
-            block_param=block_param,
+    with RasterBlockWriter(
+            output_path,
             geotransform=im_meta['geotransform'],
             projection=im_meta['projection'],
-            datatype='byte')
+            datatype='byte',
+            cog_flag=None if scratch_dir is not None else False,
+            scratch_dir=scratch_dir) as writer:
+
+        for block_param in block_params:
+            image = get_raster_block(
+                geotiff_path,
+                block_param)
+
+            if image.ndim == 3:
+                no_data_raster = np.isnan(
+                    np.squeeze(image[0, :, :]))
+            else:
+                no_data_raster = np.isnan(image)
 
-    if scratch_dir is not None:
-        _save_as_cog(output_path, scratch_dir)
+            writer.write_block(no_data_raster, block_param)
 
 
 def get_meta_from_tif(tif_file_name):
@@ -563,6 +901,9 @@ def get_meta_from_tif(tif_file_name):
         tif_name = tif_file_name[0]
     else:
         tif_name = tif_file_name
+    meta_dict = scratch_store.get_meta(tif_name)
+    if meta_dict is not None:
+        return meta_dict
     tif_gdal = gdal.Open(tif_name)
     meta_dict = {}
     meta_dict['band_number'] = tif_gdal.RasterCount
@@ -798,6 +1139,7 @@ def create_geotiff_with_one_value(outpath, shape, filled_value):
     height, width = shape
 
     # Create the file with a single band, Float32 type
+    raster_handle_cache.invalidate(outpath)
     driver = gdal.GetDriverByName("GTiff")
     ds = driver.Create(outpath, width, height, 1, gdal.GDT_Float32)
 
@@ -809,6 +1151,1045 @@ def create_geotiff_with_one_value(outpath, shape, filled_value):
     ds = None  # Close the file
 
 
+class RasterHandleCache:
+    """Process-local LRU cache of opened GDAL dataset handles.
+
+    Handles are keyed by (path, access mode) so that repeated block
+    reads of the same raster do not re-open and re-parse the file.
+    A cached handle is dropped when a writer touches the same path
+    (see `invalidate`) or when the file on disk changes size or
+    modification time. Handles are never shared across processes;
+    the cache empties itself when it is used from a forked child.
+
+    Parameters
+    ----------
+    max_handles: int
+        Maximum number of dataset handles kept open at once.
+        The least recently used handle is closed when exceeded.
+    """
+    def __init__(self, max_handles=32):
+        self.max_handles = max_handles
+        self.hits = 0
+        self.misses = 0
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _normalize_path(raster_path):
+        if raster_path.startswith('/vsi'):
+            return raster_path
+        return os.path.abspath(raster_path)
+
+    @staticmethod
+    def _file_signature(raster_path):
+        try:
+            stat = os.stat(raster_path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _check_process(self):
+        # Dataset handles inherited through fork() share file offsets
+        # with the parent, so discard them without closing.
+        if self._pid != os.getpid():
+            self._handles = OrderedDict()
+            self._lock = threading.RLock()
+            self._pid = os.getpid()
+            self.hits = 0
+            self.misses = 0
+
+    def open(self, raster_path, mode=gdal.GA_ReadOnly):
+        """Return a (possibly cached) GDAL dataset for `raster_path`.
+
+        Parameters
+        ----------
+        raster_path: str
+            GDAL-friendly raster path
+        mode: int
+            gdal.GA_ReadOnly (default) or gdal.GA_Update
+
+        Returns
+        -------
+        ds_data: gdal.Dataset
+            Opened dataset. The caller must not close it.
+        """
+        self._check_process()
+        path = self._normalize_path(raster_path)
+        key = (path, mode)
+        signature = self._file_signature(path)
+
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is not None:
+                ds_data, cached_signature = entry
+                if cached_signature == signature:
+                    self._handles.move_to_end(key)
+                    self.hits += 1
+                    return ds_data
+                # File was rewritten behind our back
+                del self._handles[key]
+                ds_data = None
+
+            self.misses += 1
+            ds_data = gdal.Open(raster_path, mode)
+            if ds_data is None:
+                raise IOError(f"Failed to open raster: {raster_path}")
+
+            self._handles[key] = (ds_data, signature)
+            while len(self._handles) > self.max_handles:
+                self._handles.popitem(last=False)
+            return ds_data
+
+    def invalidate(self, raster_path):
+        """Close every cached handle (all modes) for `raster_path`.
+        Must be called before a raster is created, updated or replaced.
+        """
+        self._check_process()
+        path = self._normalize_path(raster_path)
+        with self._lock:
+            for key in [key for key in self._handles if key[0] == path]:
+                ds_data, _ = self._handles.pop(key)
+                ds_data.FlushCache()
+                ds_data = None
+
+    def clear(self):
+        """Close all cached handles."""
+        self._check_process()
+        with self._lock:
+            for ds_data, _ in self._handles.values():
+                ds_data.FlushCache()
+            self._handles.clear()
+
+    def stats(self):
+        """Return the hit/miss counters of the cache.
+
+        Returns
+        -------
+        stats_dict: dict
+            'hits', 'misses' and number of currently 'open' handles
+        """
+        self._check_process()
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'open': len(self._handles)}
+
+    def log_stats(self, logger=None):
+        """Report the hit/miss counters to the logger."""
+        if logger is None:
+            logger = logging.getLogger('dswx_sar')
+        stats_dict = self.stats()
+        total = stats_dict['hits'] + stats_dict['misses']
+        hit_rate = 100 * stats_dict['hits'] / total if total else 0
+        logger.info('Raster handle cache: '
+                    f'{stats_dict["hits"]} hits, '
+                    f'{stats_dict["misses"]} misses '
+                    f'({hit_rate:.1f}% hit rate), '
+                    f'{stats_dict["open"]} handles open')
+
+
+raster_handle_cache = RasterHandleCache()
+
+
+class ScratchStore:
+    """Store for the intermediate layers handed between processing
+    stages, keyed by their scratch GeoTIFF paths.
+
+    With the 'disk' backend, every layer is a GeoTIFF file in the
+    scratch directory. With the 'memory' backend, the layers matching
+    `layer_patterns` are kept as raw memory-mapped numpy arrays, so the
+    next stage reads them without GeoTIFF encoding and decoding. Arrays
+    are placed in `memory_dir` (e.g. '/dev/shm') until `memory_budget`
+    is reached and spill to the scratch directory beyond it. A small
+    JSON sidecar next to the scratch path records where the array
+    lives, so worker processes can find the layer by its usual path.
+    Layers are written as GeoTIFF only when `materialize` is called.
+
+    Parameters
+    ----------
+    backend: str
+        'disk' or 'memory'
+    memory_dir: str
+        Directory for in-memory arrays, preferably a RAM-backed
+        file system
+    memory_budget_mb: float
+        Maximum size of the arrays kept in `memory_dir` in MB
+    layer_patterns: list
+        Scratch file names (glob patterns) handled by the store
+    """
+    sidecar_suffix = '.store.json'
+
+    default_layer_patterns = ['filtered_image_*.tif',
+                              'filtered_ratio_*.tif',
+                              'fuzzy_image_*.tif',
+                              'no_data_area_*.tif']
+
+    def __init__(self, backend='disk', memory_dir='/dev/shm',
+                 memory_budget_mb=4096, layer_patterns=None):
+        self._layers = {}
+        self._foreign_layers = {}
+        self._run_dir = None
+        self.memory_bytes = 0
+        self.configure(backend, memory_dir, memory_budget_mb,
+                       layer_patterns)
+
+    def configure(self, backend='disk', memory_dir='/dev/shm',
+                  memory_budget_mb=4096, layer_patterns=None):
+        if backend not in ['disk', 'memory']:
+            raise ValueError(f'Invalid scratch store backend: {backend}')
+        self.backend = backend
+        self.memory_dir = memory_dir
+        self.memory_budget = int(memory_budget_mb * 1024 ** 2)
+        self.layer_patterns = layer_patterns \
+            if layer_patterns is not None else self.default_layer_patterns
+
+    def configure_from_cfg(self, processing_cfg):
+        """Set the store from the `scratch_store` runconfig group."""
+        store_cfg = getattr(processing_cfg, 'scratch_store', None)
+        if store_cfg is None:
+            return
+        self.configure(store_cfg.backend,
+                       store_cfg.memory_dir,
+                       store_cfg.memory_budget_mb)
+
+    def is_managed(self, raster_path):
+        """Return True if `raster_path` is to be kept in the store."""
+        if self.backend != 'memory':
+            return False
+        basename = os.path.basename(raster_path)
+        return any(fnmatch.fnmatch(basename, pattern)
+                   for pattern in self.layer_patterns)
+
+    def _sidecar_path(self, raster_path):
+        return raster_path + self.sidecar_suffix
+
+    def _get_run_dir(self):
+        if self._run_dir is None:
+            self._run_dir = os.path.join(
+                self.memory_dir, f'dswx_sar_{os.getpid()}_{uuid.uuid4().hex}')
+            os.makedirs(self._run_dir, exist_ok=True)
+        return self._run_dir
+
+    def create(self, raster_path, shape, datatype, geotransform,
+               projection):
+        """Allocate a layer for `raster_path`.
+
+        Parameters
+        ----------
+        raster_path: str
+            Scratch GeoTIFF path identifying the layer
+        shape: tuple
+            (band, length, width) of the layer
+        datatype: str
+            numpy data type name
+        geotransform: tuple
+            GeoTransform parameters of the layer
+        projection: str
+            Projection string of the layer
+
+        Returns
+        -------
+        array: numpy.memmap
+            Writable array of the layer
+        """
+        self.release(raster_path)
+        raster_handle_cache.invalidate(raster_path)
+        # Remove stale GeoTIFF so that no reader picks it up
+        if os.path.isfile(raster_path):
+            os.remove(raster_path)
+
+        nbytes = int(np.prod(shape)) * np.dtype(datatype).itemsize
+        in_memory = self.memory_bytes + nbytes <= self.memory_budget and \
+            os.path.isdir(self.memory_dir)
+        if in_memory:
+            array_path = os.path.join(self._get_run_dir(),
+                                      os.path.basename(raster_path) + '.npy')
+            self.memory_bytes += nbytes
+        else:
+            logger.info(f'Scratch store budget exceeded; {raster_path} '
+                        'spills to disk')
+            array_path = raster_path + '.npy'
+
+        array = np.lib.format.open_memmap(
+            array_path, mode='w+', dtype=datatype, shape=tuple(shape))
+
+        layer = {'array_path': array_path,
+                 'in_memory': in_memory,
+                 'nbytes': nbytes,
+                 'geotransform': list(geotransform),
+                 'projection': projection}
+        with open(self._sidecar_path(raster_path), 'w') as sidecar:
+            json.dump(layer, sidecar)
+
+        layer['array'] = array
+        self._layers[raster_path] = layer
+        return array
+
+    def lookup(self, raster_path):
+        """Return the layer stored for `raster_path` or None."""
+        layer = self._layers.get(raster_path)
+        if layer is not None:
+            return layer
+
+        # Layer written by another process
+        sidecar_path = self._sidecar_path(raster_path)
+        try:
+            sidecar_mtime = os.stat(sidecar_path).st_mtime_ns
+        except OSError:
+            self._foreign_layers.pop(raster_path, None)
+            return None
+
+        layer = self._foreign_layers.get(raster_path)
+        if layer is not None and layer['sidecar_mtime'] == sidecar_mtime:
+            return layer
+
+        with open(sidecar_path, 'r') as sidecar:
+            layer = json.load(sidecar)
+        # Sidecar left by a run whose arrays are already removed
+        if not os.path.isfile(layer['array_path']):
+            logger.warning(f'Ignoring stale scratch store sidecar '
+                           f'{sidecar_path}')
+            self._foreign_layers.pop(raster_path, None)
+            return None
+        layer['array'] = np.load(layer['array_path'], mmap_mode='r')
+        layer['sidecar_mtime'] = sidecar_mtime
+        self._foreign_layers[raster_path] = layer
+        return layer
+
+    def exists(self, raster_path):
+        """Return True if the layer is in the store or on disk."""
+        return self.lookup(raster_path) is not None or \
+            os.path.isfile(raster_path)
+
+    def get_meta(self, raster_path):
+        """Return metadata like `get_meta_from_tif` or None."""
+        layer = self.lookup(raster_path)
+        if layer is None:
+            return None
+        band_number, length, width = layer['array'].shape
+        proj = osr.SpatialReference(wkt=layer['projection'])
+        return {'band_number': band_number,
+                'geotransform': tuple(layer['geotransform']),
+                'projection': layer['projection'],
+                'length': length,
+                'width': width,
+                'utmzone': proj.GetUTMZone(),
+                'epsg': proj.GetAttrValue('AUTHORITY', 1)}
+
+    def materialize(self, raster_path, cog_flag=None, scratch_dir=None):
+        """Write the layer of `raster_path` as GeoTIFF at that path.
+
+        Parameters
+        ----------
+        raster_path: str
+            Scratch GeoTIFF path identifying the layer
+        cog_flag: bool
+            Save as COG. If None, the scratch raster policy decides.
+        scratch_dir: str
+            Temporary directory for the COG conversion
+        """
+        layer = self.lookup(raster_path)
+        if layer is None or os.path.isfile(raster_path):
+            return
+        array = layer['array']
+        band_number, length, width = array.shape
+        logger.info(f'Materializing {raster_path}')
+
+        raster_handle_cache.invalidate(raster_path)
+        ds_data = gdal.GetDriverByName('GTiff').Create(
+            raster_path, width, length, band_number,
+            np2gdal_conversion[str(array.dtype)],
+            options=SCRATCH_GTIFF_CREATION_OPTIONS)
+        ds_data.SetGeoTransform(layer['geotransform'])
+        ds_data.SetProjection(layer['projection'])
+        lines_per_chunk = 1024
+        for start_line in range(0, length, lines_per_chunk):
+            end_line = min(start_line + lines_per_chunk, length)
+            ds_data.WriteArray(np.asarray(array[:, start_line:end_line, :]),
+                               xoff=0, yoff=start_line)
+        ds_data.FlushCache()
+        ds_data = None
+
+        if _resolve_cog_flag(cog_flag):
+            if scratch_dir is None:
+                scratch_dir = os.path.dirname(raster_path)
+            _save_as_cog(raster_path, scratch_dir)
+
+    def materialize_all(self, cog_flag=None):
+        """Write every layer created by this process as GeoTIFF."""
+        for raster_path in list(self._layers):
+            self.materialize(raster_path, cog_flag=cog_flag)
+
+    def release(self, raster_path):
+        """Drop the layer of `raster_path` and delete its array."""
+        self._foreign_layers.pop(raster_path, None)
+        layer = self._layers.pop(raster_path, None)
+        sidecar_path = self._sidecar_path(raster_path)
+        if layer is None and os.path.isfile(sidecar_path):
+            with open(sidecar_path, 'r') as sidecar:
+                layer = json.load(sidecar)
+        if layer is None:
+            return
+        layer.pop('array', None)
+        if os.path.isfile(layer['array_path']):
+            os.remove(layer['array_path'])
+            if layer['in_memory'] and self._run_dir is not None and \
+               layer['array_path'].startswith(self._run_dir):
+                self.memory_bytes -= layer['nbytes']
+        if os.path.isfile(sidecar_path):
+            os.remove(sidecar_path)
+
+    def cleanup(self):
+        """Release all layers created by this process."""
+        for raster_path in list(self._layers):
+            self.release(raster_path)
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+        self.memory_bytes = 0
+
+    def write_block(self, raster_path, data, block_param, geotransform,
+                    projection, datatype):
+        """Write a block to a stored layer. The layer is allocated
+        when the first block of the raster is written.
+        """
+        data = _strip_block_padding(np.asarray(data, dtype=datatype),
+                                    block_param)
+        if data.ndim == 2:
+            data = data[np.newaxis, :, :]
+        layer = self._layers.get(raster_path)
+        if layer is None or block_param.write_start_line == 0:
+            array = self.create(
+                raster_path,
+                (data.shape[0], block_param.data_length,
+                 block_param.data_width),
+                datatype, geotransform, projection)
+        else:
+            array = layer['array']
+        array[:, block_param.write_start_line:
+              block_param.write_start_line + data.shape[1], :] = data
+
+
+scratch_store = ScratchStore()
+
+
+class SharedRaster:
+    """Read-only raster published once as a memory-mapped numpy array
+    and shared with the worker processes of `Parallel`.
+
+    The parent process publishes the raster, and only the location of
+    the array is pickled into each task. Workers map the array once per
+    task and slice views of it, so a block or window is neither copied
+    nor read through GDAL. Layers already held by the memory backend of
+    `scratch_store` are shared as they are. Other rasters are copied
+    once. The copy goes to the memory directory of `scratch_store` only
+    with the 'memory' backend and when the remaining memory budget
+    covers it; otherwise it goes to `shared_dir` on disk.
+
+    A handle created with `direct` reads the raster itself instead, for
+    processing without worker processes.
+
+    Parameters
+    ----------
+    array_path: str
+        Path of the .npy array with shape (band, length, width)
+    owned: bool
+        True if the array was created by `publish` and is deleted
+        by `release`
+    raster_path: str
+        Raster read by `get_block` and `get_window` when there is no
+        array
+    memory_nbytes: int
+        Bytes of the memory budget of `scratch_store` taken by the array
+
+    Examples
+    --------
+    >>> with SharedRaster.publish(label_path) as shared_label:
+    ...     Parallel(n_jobs=4)(delayed(worker)(shared_label, block_param)
+    ...                        for block_param in block_params)
+    """
+    def __init__(self, array_path=None, owned=False, raster_path=None,
+                 memory_nbytes=0):
+        self.array_path = array_path
+        self.owned = owned
+        self.raster_path = raster_path
+        self.memory_nbytes = memory_nbytes
+        self._array = None
+
+    def __getstate__(self):
+        # Only the location of the array is sent to the workers.
+        state = self.__dict__.copy()
+        state['_array'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    @classmethod
+    def direct(cls, raster_path):
+        """Return a handle reading `raster_path` block by block."""
+        return cls(raster_path=raster_path)
+
+    @classmethod
+    def publish(cls, raster_path, lines_per_block=1000, shared_dir=None):
+        """Publish a raster or stored layer for the worker processes.
+
+        Parameters
+        ----------
+        raster_path: str
+            GDAL-friendly raster path or scratch path of a stored layer
+        lines_per_block: int
+            lines read at once when the raster is copied
+        shared_dir: str
+            directory of the shared array when it is not kept in the
+            memory directory of `scratch_store`. If None, the directory
+            of `raster_path` is used.
+
+        Returns
+        -------
+        shared_raster: SharedRaster
+            Handle to be passed to the workers
+        """
+        layer = scratch_store.lookup(raster_path)
+        if layer is not None:
+            return cls(layer['array_path'], owned=False)
+
+        if shared_dir is None:
+            shared_dir = os.path.dirname(os.path.abspath(raster_path))
+
+        meta_info = get_meta_from_tif(raster_path)
+        shape = (meta_info['band_number'], meta_info['length'],
+                 meta_info['width'])
+        array = None
+        memory_nbytes = 0
+        block_params = block_param_generator(
+            lines_per_block, shape[1:], (0, 0))
+        for block_param in block_params:
+            data_block = get_raster_block(raster_path, block_param)
+            if array is None:
+                nbytes = int(np.prod(shape)) * data_block.dtype.itemsize
+                # A RAM-backed file system cannot exceed its size, so
+                # the memory directory is used within the budget only.
+                if scratch_store.backend == 'memory' and \
+                   scratch_store.memory_bytes + nbytes <= \
+                   scratch_store.memory_budget and \
+                   os.path.isdir(scratch_store.memory_dir):
+                    array_dir = scratch_store._get_run_dir()
+                    memory_nbytes = nbytes
+                    scratch_store.memory_bytes += nbytes
+                else:
+                    array_dir = shared_dir
+                array_path = os.path.join(
+                    array_dir,
+                    f'{os.path.basename(raster_path)}.'
+                    f'{uuid.uuid4().hex}.npy')
+                array = np.lib.format.open_memmap(
+                    array_path, mode='w+', dtype=data_block.dtype,
+                    shape=shape)
+            array[:, block_param.read_start_line:
+                  block_param.read_start_line + block_param.read_length,
+                  :] = data_block.reshape(
+                      shape[0], block_param.read_length, shape[2])
+        array.flush()
+        del array
+
+        return cls(array_path, owned=True, memory_nbytes=memory_nbytes)
+
+    @property
+    def array(self):
+        """Read-only (band, length, width) memory-mapped array"""
+        if self._array is None:
+            self._array = np.load(self.array_path, mmap_mode='r')
+        return self._array
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def _squeeze(self, data):
+        if data.shape[0] == 1:
+            return data[0]
+        return data
+
+    def get_block(self, block_param):
+        """Return a view of the lines of an unpadded block.
+
+        Parameters
+        ----------
+        block_param: BlockParam
+            lines to be sliced. Padding is not supported.
+
+        Returns
+        -------
+        data_block: numpy.ndarray
+            (length, width) for single-band rasters; otherwise
+            (band, length, width)
+        """
+        if np.any(block_param.block_pad):
+            raise ValueError('SharedRaster blocks cannot be padded')
+        if self.array_path is None:
+            return get_raster_block(self.raster_path, block_param)
+        return self._squeeze(
+            self.array[:, block_param.read_start_line:
+                       block_param.read_start_line +
+                       block_param.read_length, :])
+
+    def get_window(self, xoff, yoff, xsize, ysize):
+        """Return a view of a window, like `get_raster_window`."""
+        if self.array_path is None:
+            return get_raster_window(self.raster_path, xoff, yoff,
+                                     xsize, ysize)
+        return self._squeeze(
+            self.array[:, yoff:yoff + ysize, xoff:xoff + xsize])
+
+    def release(self):
+        """Unmap the array and delete it if it was copied by `publish`.
+        Workers which still map the array keep their views valid.
+        """
+        self._array = None
+        if self.owned and os.path.isfile(self.array_path):
+            os.remove(self.array_path)
+            scratch_store.memory_bytes -= self.memory_nbytes
+            self.memory_nbytes = 0
+
+
+@contextlib.contextmanager
+def publish_shared_rasters(raster_dict, lines_per_block=1000,
+                           shared_dir=None, number_workers=-1):
+    """Publish several rasters as SharedRaster and release them on exit.
+
+    Parameters
+    ----------
+    raster_dict: dict
+        raster paths keyed by layer name
+    lines_per_block: int
+        lines read at once when a raster is copied
+    shared_dir: str
+        directory of the shared arrays on disk, see
+        `SharedRaster.publish`
+    number_workers: int
+        number of workers of the `Parallel` call. With a single
+        worker, nothing is published and the rasters are read
+        directly.
+
+    Yields
+    ------
+    shared_rasters: dict
+        SharedRaster keyed by layer name
+    """
+    if number_workers == 1:
+        yield {key: SharedRaster.direct(raster_path)
+               for key, raster_path in raster_dict.items()}
+        return
+
+    with contextlib.ExitStack() as stack:
+        shared_rasters = {}
+        for key, raster_path in raster_dict.items():
+            shared_rasters[key] = stack.enter_context(
+                SharedRaster.publish(raster_path,
+                                     lines_per_block=lines_per_block,
+                                     shared_dir=shared_dir))
+        yield shared_rasters
+
+
+class ThresholdSurface:
+    """Threshold surface kept as the compact set of values it is
+    interpolated from, and evaluated for any window on demand.
+
+    The surface is either written as a full-resolution raster
+    (`write_raster`) or saved as a small sidecar file next to the raster
+    path (`save`), which `get_threshold_block` evaluates per block
+    instead of reading the raster.
+
+    Parameters
+    ----------
+    rows, cols: int
+        size of the surface
+    method: str
+        'constant' : single value over the surface
+        'bilinear' : bilinear interpolation of values defined at the
+        centers of regular tiles, extended from the outermost centers
+        'invdist' : inverse distance to a power of scattered values,
+        as the 'invdist' algorithm of gdal_grid
+    values: numpy.ndarray
+        constant value, tile values (tile rows, tile columns), or
+        values of the scattered points
+    x_points, y_points: numpy.ndarray
+        column and line coordinates of the scattered points where the
+        center of pixel (i, j) is (j + 0.5, i + 0.5) ('invdist')
+    block_row, block_col: int
+        lines and columns of the tiles ('bilinear')
+    radius_x, radius_y: float
+        radii of the search ellipse along the columns and the lines
+        ('invdist')
+    power: float
+        weighting power ('invdist')
+    smoothing: float
+        smoothing parameter ('invdist')
+    no_data: float
+        value of the pixels without points within the search ellipse
+        ('invdist')
+    """
+    sidecar_suffix = '.surface.npz'
+
+    _loaded_surfaces = {}
+
+    def __init__(self, rows, cols, method, values,
+                 x_points=None, y_points=None,
+                 block_row=None, block_col=None,
+                 radius_x=None, radius_y=None,
+                 power=0.5, smoothing=1.0, no_data=0):
+        if method not in ['constant', 'bilinear', 'invdist']:
+            raise ValueError(f'Invalid threshold surface method: {method}')
+        self.rows = int(rows)
+        self.cols = int(cols)
+        self.method = method
+        self.values = np.asarray(values, dtype=np.float64)
+        self.x_points = None if x_points is None else \
+            np.asarray(x_points, dtype=np.float64)
+        self.y_points = None if y_points is None else \
+            np.asarray(y_points, dtype=np.float64)
+        self.block_row = block_row
+        self.block_col = block_col
+        self.radius_x = radius_x
+        self.radius_y = radius_y
+        self.power = power
+        self.smoothing = smoothing
+        self.no_data = no_data
+        self._kernel_cache = {}
+
+        if method == 'invdist':
+            self._half_width = int(np.ceil(radius_x)) + 1
+            self._half_length = int(np.ceil(radius_y)) + 1
+            # Pixel index of the kernel origin and
+            # sub-pixel offsets of the points
+            base_x = np.floor(self.x_points - 0.5)
+            base_y = np.floor(self.y_points - 0.5)
+            self._frac_x = np.round(self.x_points - 0.5 - base_x, 6)
+            self._frac_y = np.round(self.y_points - 0.5 - base_y, 6)
+            self._col_origin = base_x.astype(np.int64) - self._half_width
+            self._row_origin = base_y.astype(np.int64) - self._half_length
+
+    @classmethod
+    def sidecar_path(cls, raster_path):
+        return raster_path + cls.sidecar_suffix
+
+    def _get_invdist_kernel(self, frac_x, frac_y):
+        # weights of the pixels around a point for its sub-pixel offset
+        kernel_key = (frac_x, frac_y)
+        if kernel_key in self._kernel_cache:
+            return self._kernel_cache[kernel_key]
+
+        dx = np.arange(-self._half_width, self._half_width + 2) - frac_x
+        dy = np.arange(-self._half_length, self._half_length + 2) - frac_y
+        dx2 = dx[np.newaxis, :] ** 2
+        dy2 = dy[:, np.newaxis] ** 2
+
+        inside_ellipse = (self.radius_y ** 2 * dx2 +
+                          self.radius_x ** 2 * dy2 <=
+                          self.radius_x ** 2 * self.radius_y ** 2)
+        kernel = 1 / np.power(dx2 + dy2 + self.smoothing ** 2,
+                              self.power / 2)
+        kernel[~inside_ellipse] = 0
+        self._kernel_cache[kernel_key] = kernel
+
+        return kernel
+
+    def _get_bilinear_index(self, start, end, tile_size, num_tile):
+        # fractional tile index of the pixel centers
+        tile_index = np.clip((np.arange(start, end) + 0.5) / tile_size - 0.5,
+                             0, num_tile - 1)
+        index0 = np.floor(tile_index).astype(np.int64)
+        index1 = np.minimum(index0 + 1, num_tile - 1)
+        return index0, index1, tile_index - index0
+
+    def evaluate_window(self, row_start, row_end, col_start=0, col_end=None):
+        """Evaluate the surface over a window.
+
+        Parameters
+        ----------
+        row_start, row_end: int
+            first line and the line after the last line of the window
+        col_start, col_end: int
+            first column and the column after the last column of the
+            window. Defaults to the entire width.
+
+        Returns
+        -------
+        threshold_window: numpy.ndarray
+            float32 thresholds of the window
+        """
+        if col_end is None:
+            col_end = self.cols
+        window_shape = (row_end - row_start, col_end - col_start)
+
+        if self.method == 'constant':
+            return np.full(window_shape, self.values, dtype=np.float32)
+
+        if self.method == 'bilinear':
+            tau_row, tau_col = self.values.shape
+            row0, row1, row_weight = self._get_bilinear_index(
+                row_start, row_end, self.block_row, tau_row)
+            col0, col1, col_weight = self._get_bilinear_index(
+                col_start, col_end, self.block_col, tau_col)
+            z_cols = self.values[:, col0] * (1 - col_weight) + \
+                self.values[:, col1] * col_weight
+            row_weight = row_weight[:, np.newaxis]
+            threshold_window = z_cols[row0] * (1 - row_weight) + \
+                z_cols[row1] * row_weight
+            return threshold_window.astype(np.float32)
+
+        kernel_width = 2 * self._half_width + 2
+        kernel_length = 2 * self._half_length + 2
+        weight_sum = np.zeros(window_shape)
+        value_sum = np.zeros(window_shape)
+
+        point_indices = np.flatnonzero(
+            (self._row_origin < row_end) &
+            (self._row_origin + kernel_length > row_start) &
+            (self._col_origin < col_end) &
+            (self._col_origin + kernel_width > col_start))
+        for point_ind in point_indices:
+            kernel = self._get_invdist_kernel(self._frac_x[point_ind],
+                                              self._frac_y[point_ind])
+            row_origin = self._row_origin[point_ind]
+            col_origin = self._col_origin[point_ind]
+            row0 = max(row_origin, row_start)
+            row1 = min(row_origin + kernel_length, row_end)
+            col0 = max(col_origin, col_start)
+            col1 = min(col_origin + kernel_width, col_end)
+            kernel_sub = kernel[row0 - row_origin:row1 - row_origin,
+                                col0 - col_origin:col1 - col_origin]
+
+            weight_sum[row0 - row_start:row1 - row_start,
+                       col0 - col_start:col1 - col_start] += kernel_sub
+            value_sum[row0 - row_start:row1 - row_start,
+                      col0 - col_start:col1 - col_start] += \
+                kernel_sub * self.values[point_ind]
+
+        threshold_window = np.full(window_shape, self.no_data,
+                                   dtype=np.float64)
+        valid_weight = weight_sum > 0
+        threshold_window[valid_weight] = \
+            value_sum[valid_weight] / weight_sum[valid_weight]
+
+        return threshold_window.astype(np.float32)
+
+    def write_raster(self, output_file, lines_per_block=400,
+                     scratch_dir='.'):
+        """Write the surface as a full-resolution float32 raster
+        block by block.
+        """
+        self.remove_sidecar(output_file)
+        lines_per_block = min(self.rows, int(lines_per_block))
+        block_params = block_param_generator(
+            lines_per_block, (self.rows, self.cols), (0, 0))
+
+        surface_writer = RasterBlockWriter(
+            output_file,
+            geotransform=(0, 1, 0, self.rows, 0, -1),
+            projection='',
+            datatype='float32',
+            cog_flag=False,
+            scratch_dir=scratch_dir)
+        for block_param in block_params:
+            surface_writer.write_block(
+                self.evaluate_window(
+                    block_param.read_start_line,
+                    block_param.read_start_line + block_param.block_length),
+                block_param)
+        surface_writer.close()
+
+    def save(self, raster_path):
+        """Save the surface as a sidecar file of `raster_path`.
+        A raster previously written at `raster_path` is removed.
+        """
+        raster_handle_cache.invalidate(raster_path)
+        if os.path.isfile(raster_path):
+            os.remove(raster_path)
+
+        surface_dict = {'rows': self.rows,
+                        'cols': self.cols,
+                        'method': self.method,
+                        'values': self.values,
+                        'power': self.power,
+                        'smoothing': self.smoothing,
+                        'no_data': self.no_data}
+        for key in ['x_points', 'y_points', 'block_row', 'block_col',
+                    'radius_x', 'radius_y']:
+            if getattr(self, key) is not None:
+                surface_dict[key] = getattr(self, key)
+
+        # np.savez appends '.npz' to names without the extension
+        with open(self.sidecar_path(raster_path), 'wb') as sidecar:
+            np.savez(sidecar, **surface_dict)
+
+    @classmethod
+    def load(cls, raster_path):
+        """Load the surface saved for `raster_path`.
+
+        Returns
+        -------
+        surface: ThresholdSurface
+            The surface, or None if no surface is saved for the path.
+        """
+        sidecar_path = cls.sidecar_path(raster_path)
+        try:
+            sidecar_mtime = os.stat(sidecar_path).st_mtime_ns
+        except OSError:
+            cls._loaded_surfaces.pop(sidecar_path, None)
+            return None
+
+        cached = cls._loaded_surfaces.get(sidecar_path)
+        if cached is not None and cached[0] == sidecar_mtime:
+            return cached[1]
+
+        with np.load(sidecar_path, allow_pickle=False) as surface_file:
+            surface_dict = {key: surface_file[key]
+                            for key in surface_file.files}
+        for key in surface_dict:
+            if surface_dict[key].ndim == 0:
+                surface_dict[key] = surface_dict[key].item()
+        surface = cls(**surface_dict)
+        cls._loaded_surfaces[sidecar_path] = (sidecar_mtime, surface)
+
+        return surface
+
+    @classmethod
+    def remove_sidecar(cls, raster_path):
+        """Remove the surface saved for `raster_path`, if any."""
+        sidecar_path = cls.sidecar_path(raster_path)
+        cls._loaded_surfaces.pop(sidecar_path, None)
+        if os.path.isfile(sidecar_path):
+            os.remove(sidecar_path)
+
+
+def get_threshold_block(raster_path, block_param):
+    """Get a block of a threshold surface. The surface saved for
+    `raster_path` is evaluated if available. Otherwise, the block is
+    read from the raster.
+
+    Parameters
+    ----------
+    raster_path: str
+        path of the threshold raster
+    block_param: BlockParam
+        Object specifying size of block and where to read from raster,
+        and amount of padding for the read array
+
+    Returns
+    -------
+    threshold_block: np.ndarray
+        thresholds of the block
+    """
+    surface = ThresholdSurface.load(raster_path)
+    if surface is None:
+        return get_raster_block(raster_path, block_param)
+
+    threshold_block = surface.evaluate_window(
+        block_param.read_start_line,
+        block_param.read_start_line + block_param.read_length)
+    threshold_block = np.pad(threshold_block, block_param.block_pad,
+                             mode='constant', constant_values=0)
+
+    return threshold_block
+
+
+def _strip_block_padding(data, block_param):
+    """Remove the line padding of a block read with `block_param`."""
+    if data.ndim == 1:
+        return np.reshape(data, [1, len(data)])
+    data_start_without_pad = block_param.write_start_line - \
+        block_param.read_start_line + block_param.block_pad[0][0]
+    data_end_without_pad = data_start_without_pad + \
+        block_param.block_length
+    return data[..., data_start_without_pad:data_end_without_pad, :]
+
+
+def get_line_block_param(start_line, end_line, data_shape):
+    """Get the BlockParam reading the lines from `start_line` to
+    `end_line` (exclusive) over the entire width without padding.
+
+    Parameters
+    ----------
+    start_line, end_line: int
+        first line and the line after the last line of the block
+    data_shape: tuple(int, int)
+        Length and width of the raster
+
+    Returns
+    -------
+    _: BlockParam
+        BlockParam object of the lines
+    """
+    return BlockParam(block_length=int(end_line - start_line),
+                      write_start_line=int(start_line),
+                      read_start_line=int(start_line),
+                      read_length=int(end_line - start_line),
+                      block_pad=((0, 0), (0, 0)),
+                      data_width=int(data_shape[1]),
+                      data_length=int(data_shape[0]))
+
+
+def get_unpadded_block_param(block_param):
+    """Get the BlockParam reading only the lines written by
+    `block_param`, i.e., the block without its padding.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        Object specifying size of block and where to read from raster,
+        and amount of padding for the read array
+
+    Returns
+    -------
+    _: BlockParam
+        BlockParam object of the block without padding
+    """
+    return BlockParam(block_length=block_param.block_length,
+                      write_start_line=block_param.write_start_line,
+                      read_start_line=block_param.write_start_line,
+                      read_length=block_param.block_length,
+                      block_pad=((0, 0), (0, 0)),
+                      data_width=block_param.data_width,
+                      data_length=block_param.data_length)
+
+
+def get_raster_window(raster_path, xoff, yoff, xsize, ysize):
+    """Read a window of all bands from a raster or a stored layer.
+
+    Parameters
+    ----------
+    raster_path: str
+        raster path where the window is to be read from
+    xoff, yoff: int
+        column and line of the upper left corner of the window
+    xsize, ysize: int
+        width and length of the window
+
+    Returns
+    -------
+    data_window: np.ndarray
+        (length, width) for single-band rasters; otherwise
+        (band, length, width)
+    """
+    layer = scratch_store.lookup(raster_path)
+    if layer is not None:
+        data_window = np.array(
+            layer['array'][:, yoff:yoff + ysize, xoff:xoff + xsize])
+        if data_window.shape[0] == 1:
+            data_window = data_window[0]
+        return data_window
+
+    ds_data = raster_handle_cache.open(raster_path)
+    return ds_data.ReadAsArray(xoff, yoff, xsize, ysize)
+
+
 def get_raster_block(raster_path, block_param):
     ''' Get a block of data from raster.
         Raster can be a HDF5 file or a GDAL-friendly raster
@@ -827,8 +2208,23 @@ def get_raster_block(raster_path, block_param):
     data_block: np.ndarray
         Block read from raster with shape specified in block_param.
     '''
-    # Open input data using GDAL to get raster length
-    ds_data = gdal.Open(raster_path, gdal.GA_Update)
+    layer = scratch_store.lookup(raster_path)
+    if layer is not None:
+        data_blocks = np.array(
+            layer['array'][:,
+                           block_param.read_start_line:
+                           block_param.read_start_line +
+                           block_param.read_length,
+                           :])
+        pad_width = ((0, 0),) + tuple(block_param.block_pad)
+        data_blocks = np.pad(data_blocks, pad_width,
+                             mode='constant', constant_values=0)
+        if data_blocks.shape[0] == 1:
+            data_blocks = data_blocks[0]
+        return data_blocks
+
+    # Reuse a read-only handle from the process-local cache
+    ds_data = raster_handle_cache.open(raster_path)
 
     # Number of bands in the raster
     num_bands = ds_data.RasterCount
@@ -861,7 +2257,7 @@ def get_raster_block(raster_path, block_param):
 def write_raster_block(out_raster, data,
                        block_param, geotransform, projection,
                        datatype='byte',
-                       cog_flag=False,
+                       cog_flag=None,
                        scratch_dir='.'):
     """
     Write processed data block to the specified raster file.
@@ -882,11 +2278,19 @@ def write_raster_block(out_raster, data,
     datatype : str, optional
         Data type of the raster. Defaults to 'byte'.
     cog_flag : bool, optional
-        If True, converts the raster to COG format. Defaults to False.
+        If True, converts the raster to COG format. If None (default),
+        the scratch raster policy decides.
     scratch_dir : str, optional
         Directory for intermediate processing. Defaults to '.'.
     """
+    if scratch_store.is_managed(out_raster):
+        scratch_store.write_block(out_raster, data, block_param,
+                                  geotransform, projection, datatype)
+        return
+
     gdal_type = np2gdal_conversion[datatype]
+    cog_flag = _resolve_cog_flag(cog_flag)
+    raster_handle_cache.invalidate(out_raster)
 
     data = np.array(data, dtype=datatype)
     ndim = data.ndim
@@ -898,11 +2302,14 @@ def write_raster_block(out_raster, data,
         block_param.block_length
 
     if block_param.write_start_line == 0:
+        # A layer stored for this path would shadow the new GeoTIFF.
+        scratch_store.release(out_raster)
         driver = gdal.GetDriverByName('GTiff')
         ds_data = driver.Create(out_raster,
                                 block_param.data_width,
                                 block_param.data_length,
-                                number_band, gdal_type)
+                                number_band, gdal_type,
+                                options=SCRATCH_GTIFF_CREATION_OPTIONS)
         if not ds_data:
             raise IOError(f"Failed to create raster: {out_raster}")
 
@@ -942,6 +2349,200 @@ def write_raster_block(out_raster, data,
         _save_as_cog(out_raster, scratch_dir)
 
 
+class RasterBlockWriter:
+    """Streaming GeoTIFF writer for block-processed rasters.
+
+    The output dataset is created when the first block arrives and
+    the same handle is kept open until the writer is closed, so
+    blocks can be written in any order (e.g., as they are returned
+    by `Parallel(...)`). Written line ranges are tracked, and the
+    COG conversion, if requested, is run exactly once on close.
+
+    Parameters
+    ----------
+    out_raster : str
+        Path of the GeoTIFF to be written.
+    geotransform : tuple
+        GeoTransform parameters for the raster.
+    projection : str
+        Projection string for the raster.
+    datatype : str, optional
+        Data type of the raster. Defaults to 'byte'.
+    cog_flag : bool, optional
+        If True, converts the raster to COG format on close. If False,
+        the raster is kept as a tiled GeoTIFF. If None (default), the
+        scratch raster policy decides.
+    scratch_dir : str, optional
+        Directory for intermediate processing. Defaults to '.'.
+
+    Examples
+    --------
+    >>> with RasterBlockWriter(path, geotransform, projection,
+    ...                        datatype='float32') as writer:
+    ...     for block_param in block_params:
+    ...         writer.write_block(data, block_param)
+    """
+    def __init__(self, out_raster, geotransform, projection,
+                 datatype='byte', cog_flag=None, scratch_dir='.'):
+        self.out_raster = out_raster
+        self.geotransform = geotransform
+        self.projection = projection
+        self.datatype = datatype
+        self.cog_flag = _resolve_cog_flag(cog_flag)
+        self.scratch_dir = scratch_dir
+
+        self.number_band = None
+        self.data_length = None
+        self.data_width = None
+        self._ds_data = None
+        self._array = None
+        self._written_ranges = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Skip the COG conversion of a partially written raster
+        # when an exception is propagating.
+        self.close(finalize=exc_type is None)
+        return False
+
+    def _create(self, number_band, block_param):
+        self.number_band = number_band
+        self.data_length = block_param.data_length
+        self.data_width = block_param.data_width
+
+        if scratch_store.is_managed(self.out_raster):
+            self._array = scratch_store.create(
+                self.out_raster,
+                (number_band, self.data_length, self.data_width),
+                self.datatype, self.geotransform, self.projection)
+            return
+
+        raster_handle_cache.invalidate(self.out_raster)
+        # A layer stored for this path would shadow the new GeoTIFF.
+        scratch_store.release(self.out_raster)
+        driver = gdal.GetDriverByName('GTiff')
+        ds_data = driver.Create(self.out_raster,
+                                block_param.data_width,
+                                block_param.data_length,
+                                number_band,
+                                np2gdal_conversion[self.datatype],
+                                options=SCRATCH_GTIFF_CREATION_OPTIONS)
+        if not ds_data:
+            raise IOError(f"Failed to create raster: {self.out_raster}")
+
+        ds_data.SetGeoTransform(self.geotransform)
+        ds_data.SetProjection(self.projection)
+        self._ds_data = ds_data
+
+    def write_block(self, data, block_param):
+        """Write one processed block to the output raster.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Block to be written. 3D arrays are written as
+            (band, line, column); padding given in `block_param`
+            is removed before writing.
+        block_param : BlockParam
+            Specifications for the data block to be written.
+        """
+        if self._closed:
+            raise IOError(f"Raster writer is closed: {self.out_raster}")
+
+        data = np.asarray(data, dtype=self.datatype)
+        if data.ndim == 1:
+            data = np.reshape(data, [1, len(data)])
+        number_band = 1 if data.ndim < 3 else data.shape[0]
+
+        if self.number_band is None:
+            self._create(number_band, block_param)
+        elif number_band != self.number_band:
+            raise ValueError(
+                f'Block has {number_band} bands but {self.out_raster} '
+                f'was created with {self.number_band} bands')
+
+        data_towrite = _strip_block_padding(data, block_param)
+        if self._array is not None:
+            self._array[:,
+                        block_param.write_start_line:
+                        block_param.write_start_line +
+                        data_towrite.shape[-2],
+                        :] = data_towrite
+        elif data_towrite.ndim == 3:
+            # Write all bands with a single call
+            self._ds_data.WriteArray(data_towrite,
+                                     xoff=0,
+                                     yoff=block_param.write_start_line)
+        else:
+            self._ds_data.GetRasterBand(1).WriteArray(
+                data_towrite,
+                xoff=0,
+                yoff=block_param.write_start_line)
+
+        self._written_ranges.append(
+            (block_param.write_start_line,
+             block_param.write_start_line + data_towrite.shape[-2]))
+
+    def missing_lines(self):
+        """Return the line ranges that have not been written yet.
+
+        Returns
+        -------
+        missing_ranges : list of tuple
+            List of (start_line, end_line) ranges, end exclusive.
+        """
+        if self.data_length is None:
+            return []
+        missing_ranges = []
+        next_line = 0
+        for start, end in sorted(self._written_ranges):
+            if start > next_line:
+                missing_ranges.append((next_line, start))
+            next_line = max(next_line, end)
+        if next_line < self.data_length:
+            missing_ranges.append((next_line, self.data_length))
+        return missing_ranges
+
+    def close(self, finalize=True):
+        """Close the dataset and convert it to COG if requested.
+
+        Parameters
+        ----------
+        finalize : bool, optional
+            If False, the dataset is only closed and the COG
+            conversion is skipped. Defaults to True.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self.number_band is None:
+            return
+
+        if self._array is not None:
+            # Stored layers are materialized on demand, not as COG
+            self._array.flush()
+            self._array = None
+            finalize_cog = False
+        else:
+            self._ds_data.FlushCache()
+            self._ds_data = None
+            finalize_cog = self.cog_flag
+
+        if not finalize:
+            return
+
+        missing_ranges = self.missing_lines()
+        if missing_ranges:
+            logger.warning(f'{self.out_raster} was closed with unwritten '
+                           f'lines: {missing_ranges}')
+
+        if finalize_cog:
+            _save_as_cog(self.out_raster, self.scratch_dir)
+
+
 def block_param_generator(lines_per_block, data_shape, pad_shape):
     ''' Generator for block specific parameter class.
 
@@ -1069,8 +2670,605 @@ class BlockParam:
     data_length: int
 
 
+@dataclass
+class ComponentStats:
+    '''
+    Per-component statistics of the connected components of a binary
+    image. Index 0 of the arrays is the background, so they can be
+    indexed directly with the label image.
+    '''
+    # Label image of the components; 0 for the background
+    label_image: np.ndarray
+
+    # Number of components, background not included
+    number_components: int
+
+    # Number of pixels of each label; 0 for the background
+    sizes: np.ndarray
+
+    # Bounding box (x, y, width, height) of each label
+    bboxes: np.ndarray
+
+    def component_sum(self, values, start_line=0):
+        """Sum the values over each component. NaN values are ignored.
+
+        Parameters
+        ----------
+        values: numpy.ndarray
+            2 dimensional layer. It may cover only the lines from
+            `start_line` of the label image, so that a layer can be
+            accumulated block by block.
+        start_line: int
+            First line of the label image covered by `values`
+
+        Returns
+        -------
+        sums: numpy.ndarray
+            sum of the values of each label
+        """
+        values = np.asarray(values, dtype='float64')
+        labels = self.label_image[start_line:start_line + values.shape[0]]
+        valid = np.isfinite(values)
+        return np.bincount(labels[valid], weights=values[valid],
+                           minlength=self.number_components + 1)
+
+    def component_mean(self, values):
+        """Average the values over each component, ignoring NaN values.
+
+        Parameters
+        ----------
+        values: numpy.ndarray
+            layer with the shape of the label image
+
+        Returns
+        -------
+        means: numpy.ndarray
+            mean of the values of each label; NaN for the background
+            and the components without valid values
+        """
+        values = np.asarray(values, dtype='float64')
+        sums = self.component_sum(values)
+        counts = self.component_sum(np.isfinite(values))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        means[0] = np.nan
+        return means
+
+    def to_image(self, values, background=0, dtype=None):
+        """Map per-component values to the pixels of the components.
+
+        Parameters
+        ----------
+        values: numpy.ndarray
+            values of the components. Either one value per label,
+            including the background, or one value per component.
+        background: float
+            value assigned to the background
+        dtype: str, optional
+            data type of the image. Defaults to the type of `values`.
+
+        Returns
+        -------
+        image: numpy.ndarray
+            image with the value of the component of each pixel
+        """
+        values = np.asarray(values, dtype=dtype)
+        if len(values) == self.number_components:
+            values = np.insert(values, 0, background)
+        else:
+            values = values.copy()
+            values[0] = background
+        return values[self.label_image]
+
+
+def compute_component_stats(binary, connectivity=8):
+    """Label the connected components of a binary image and gather
+    their size and bounding box in one pass.
+
+    Parameters
+    ----------
+    binary: numpy.ndarray
+        binary image; non-zero pixels belong to the components
+    connectivity: int
+        4 or 8 connectivity of the components
+
+    Returns
+    -------
+    _: ComponentStats
+        labels and statistics of the components
+    """
+    number_labels, label_image, stats, _ = \
+        cv2.connectedComponentsWithStats(
+            np.asarray(binary, dtype=np.uint8),
+            connectivity=connectivity)
+    sizes = stats[:, cv2.CC_STAT_AREA].copy()
+    sizes[0] = 0
+    return ComponentStats(label_image=label_image,
+                          number_components=number_labels - 1,
+                          sizes=sizes,
+                          bboxes=stats[:, :cv2.CC_STAT_AREA])
+
+
+def get_buffered_bboxes(bboxes, sizes, buffer, data_shape):
+    """Expand the bounding boxes of components with a buffer.
+    The buffer grows with the square root of the component size
+    so that it is balanced with the object area.
+
+    Parameters
+    ----------
+    bboxes: numpy.ndarray
+        (x, y, width, height) of the components
+    sizes: numpy.ndarray
+        number of pixels of the components
+    buffer: int
+        base buffer size
+    data_shape: tuple
+        length and width of the image
+
+    Returns
+    -------
+    buffered_bboxes: numpy.ndarray
+        (x_start, x_end, y_start, y_end) of the buffered boxes
+        clipped to the image
+    """
+    rows, cols = data_shape
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    extra_buffer = ((np.sqrt(2) - 1.2) *
+                    np.sqrt(np.asarray(sizes, dtype=np.float64)))
+    extra_buffer = np.maximum(extra_buffer.astype(np.int64), 1)
+    buffer_all = extra_buffer + buffer
+
+    x, y, w, h = bboxes.T
+    return np.stack([np.maximum(0, x - buffer_all),
+                     np.minimum(cols, x + w + buffer_all),
+                     np.maximum(0, y - buffer_all),
+                     np.minimum(rows, y + h + buffer_all)], axis=1)
+
+
+def schedule_component_tasks(component_index, labels, max_lines_per_task):
+    """Assign each component to exactly one task.
+    A task covers a range of lines over the entire width, which contains
+    the buffered bounding boxes of all its components. The components
+    are sorted by the first line of their boxes, and consecutive
+    components are batched while the lines of the task do not exceed
+    `max_lines_per_task`. A component whose box alone spans more lines
+    is given its own task.
+
+    Parameters
+    ----------
+    component_index: ComponentIndex
+        index of the components
+    labels: numpy.ndarray
+        labels of the components to be processed
+    max_lines_per_task: int
+        maximum number of lines of a task with several components
+
+    Returns
+    -------
+    task_list: list
+        tuples of the BlockParam of the lines of the task and
+        the labels of its components
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(labels) == 0:
+        return []
+    data_shape = (component_index.rows, component_index.cols)
+    start_lines = component_index.buffered_bboxes[labels, 2]
+    end_lines = component_index.buffered_bboxes[labels, 3]
+    order = np.argsort(start_lines, kind='stable')
+
+    task_list = []
+    task_labels = []
+    task_start = task_end = 0
+    for label_ind in order:
+        start_line = start_lines[label_ind]
+        end_line = end_lines[label_ind]
+        if task_labels and \
+           max(task_end, end_line) - task_start <= max_lines_per_task:
+            task_labels.append(labels[label_ind])
+            task_end = max(task_end, end_line)
+            continue
+        if task_labels:
+            task_list.append((get_line_block_param(task_start, task_end,
+                                                   data_shape),
+                              np.array(task_labels)))
+        task_labels = [labels[label_ind]]
+        task_start, task_end = start_line, end_line
+    task_list.append((get_line_block_param(task_start, task_end,
+                                           data_shape),
+                      np.array(task_labels)))
+
+    return task_list
+
+
+def _label_component_block(block_param, binary_path, connectivity,
+                           node_lookup=None):
+    """Label the components of a block of a binary raster.
+
+    Returns
+    -------
+    If `node_lookup` is None, the sizes, the frame bounding boxes, and
+    the first and last lines of the labels of the block. Otherwise, the
+    labels of the block mapped with `node_lookup`.
+    """
+    binary = get_raster_block(binary_path, block_param)
+    component_stats = compute_component_stats(binary > 0, connectivity)
+    del binary
+
+    if node_lookup is not None:
+        return block_param, node_lookup[component_stats.label_image]
+
+    bboxes = component_stats.bboxes.copy()
+    bboxes[:, 1] += block_param.write_start_line
+    return (block_param,
+            component_stats.sizes,
+            bboxes,
+            component_stats.label_image[0].copy(),
+            component_stats.label_image[-1].copy())
+
+
+class ComponentIndex:
+    """Frame-wide index of the connected components of a binary raster.
+
+    The components are labeled block by block, and the labels touching
+    across the block boundaries are merged, so the index does not depend
+    on the block size. The label raster is written once, and a compact
+    table of the components is saved as a sidecar file next to it.
+    Later stages query the table and read only the windows of the
+    components they process.
+
+    Index 0 of the table is the background, so the arrays can be
+    indexed directly with the labels.
+
+    Parameters
+    ----------
+    label_path: str
+        path of the label raster
+    rows, cols: int
+        size of the raster
+    sizes: numpy.ndarray
+        number of pixels of the components
+    bboxes: numpy.ndarray
+        (x, y, width, height) of the components
+    buffer: int
+        base buffer size of the buffered bounding boxes
+    connectivity: int
+        4 or 8 connectivity of the components
+    source_path: str, optional
+        binary raster the index is built from
+    source_mtime: int, optional
+        modification time (ns) of `source_path` when indexed
+    """
+    sidecar_suffix = '.components.npz'
+
+    # Flags of the frame boundaries touched by the components
+    TOUCH_TOP = 1
+    TOUCH_BOTTOM = 2
+    TOUCH_LEFT = 4
+    TOUCH_RIGHT = 8
+
+    _loaded_indices = {}
+
+    def __init__(self, label_path, rows, cols, sizes, bboxes, buffer=10,
+                 connectivity=8, source_path=None, source_mtime=None):
+        self.label_path = label_path
+        self.rows = int(rows)
+        self.cols = int(cols)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+        self.buffer = int(buffer)
+        self.connectivity = int(connectivity)
+        self.source_path = source_path
+        self.source_mtime = source_mtime
+
+        self.buffered_bboxes = get_buffered_bboxes(
+            self.bboxes, self.sizes, self.buffer, (self.rows, self.cols))
+
+        x, y, w, h = self.bboxes.T
+        boundary_flags = \
+            (y == 0) * self.TOUCH_TOP + \
+            (y + h == self.rows) * self.TOUCH_BOTTOM + \
+            (x == 0) * self.TOUCH_LEFT + \
+            (x + w == self.cols) * self.TOUCH_RIGHT
+        boundary_flags[0] = 0
+        self.boundary_flags = boundary_flags.astype(np.uint8)
+
+    @property
+    def number_components(self):
+        return len(self.sizes) - 1
+
+    @classmethod
+    def sidecar_path(cls, label_path):
+        return label_path + cls.sidecar_suffix
+
+    def select(self, min_size=None, max_size=None,
+               exclude_boundary=False):
+        """Select the labels of the components.
+
+        Parameters
+        ----------
+        min_size, max_size: int, optional
+            bounds of the component sizes, inclusive
+        exclude_boundary: bool
+            If True, the components touching the frame
+            boundaries are excluded.
+
+        Returns
+        -------
+        labels: numpy.ndarray
+            selected labels in increasing order
+        """
+        selected = np.ones(len(self.sizes), dtype=bool)
+        selected[0] = False
+        if min_size is not None:
+            selected &= self.sizes >= min_size
+        if max_size is not None:
+            selected &= self.sizes <= max_size
+        if exclude_boundary:
+            selected &= self.boundary_flags == 0
+        return np.flatnonzero(selected)
+
+    def get_window(self, label):
+        """Get the buffered window of a component.
+
+        Returns
+        -------
+        window: tuple
+            (xoff, yoff, xsize, ysize) as used by `get_raster_window`
+        """
+        x_start, x_end, y_start, y_end = self.buffered_bboxes[label]
+        return (int(x_start), int(y_start),
+                int(x_end - x_start), int(y_end - y_start))
+
+    def read_labels(self, label):
+        """Read the labels over the buffered window of a component.
+
+        Returns
+        -------
+        window: tuple
+            (xoff, yoff, xsize, ysize) of the window
+        label_window: numpy.ndarray
+            labels of the window
+        """
+        window = self.get_window(label)
+        return window, get_raster_window(self.label_path, *window)
+
+    def component_sum(self, values, block_param):
+        """Sum the values of a block over each component.
+        NaN values are ignored.
+
+        Parameters
+        ----------
+        values: numpy.ndarray
+            layer of the block
+        block_param: BlockParam
+            Object specifying where the block is read from
+
+        Returns
+        -------
+        sums: numpy.ndarray
+            sum of the values of each label within the block
+        """
+        labels = get_raster_block(self.label_path, block_param)
+        values = np.asarray(values, dtype='float64')
+        valid = np.isfinite(values)
+        return np.bincount(labels[valid], weights=values[valid],
+                           minlength=len(self.sizes))
+
+    def save(self):
+        """Save the table as a sidecar file of the label raster."""
+        index_dict = {'rows': self.rows,
+                      'cols': self.cols,
+                      'sizes': self.sizes,
+                      'bboxes': self.bboxes,
+                      'buffer': self.buffer,
+                      'connectivity': self.connectivity}
+        if self.source_path is not None:
+            index_dict['source_path'] = self.source_path
+            index_dict['source_mtime'] = self.source_mtime
+
+        # np.savez appends '.npz' to names without the extension
+        with open(self.sidecar_path(self.label_path), 'wb') as sidecar:
+            np.savez(sidecar, **index_dict)
+
+    @classmethod
+    def load(cls, label_path):
+        """Load the index saved for `label_path`.
+
+        Returns
+        -------
+        component_index: ComponentIndex
+            The index, or None if no index is saved for the path.
+        """
+        sidecar_path = cls.sidecar_path(label_path)
+        try:
+            sidecar_mtime = os.stat(sidecar_path).st_mtime_ns
+        except OSError:
+            cls._loaded_indices.pop(sidecar_path, None)
+            return None
+
+        cached = cls._loaded_indices.get(sidecar_path)
+        if cached is not None and cached[0] == sidecar_mtime:
+            return cached[1]
+
+        with np.load(sidecar_path, allow_pickle=False) as index_file:
+            index_dict = {key: index_file[key]
+                          for key in index_file.files}
+        for key in index_dict:
+            if index_dict[key].ndim == 0:
+                index_dict[key] = index_dict[key].item()
+        component_index = cls(label_path, **index_dict)
+        cls._loaded_indices[sidecar_path] = (sidecar_mtime,
+                                             component_index)
+
+        return component_index
+
+    def is_current(self, binary_path):
+        """Return True if the index was built from the current
+        version of `binary_path`."""
+        try:
+            source_mtime = os.stat(binary_path).st_mtime_ns
+        except OSError:
+            return False
+        return (self.source_path == os.path.abspath(binary_path) and
+                self.source_mtime == source_mtime and
+                os.path.isfile(self.label_path))
+
+    @classmethod
+    def build(cls, binary_path, label_path, lines_per_block=1000,
+              buffer=10, connectivity=8, number_workers=1,
+              scratch_dir='.'):
+        """Label the components of a binary raster over the frame and
+        save the label raster and the table. An index previously built
+        for the same version of `binary_path` is reused.
+
+        Parameters
+        ----------
+        binary_path: str
+            binary raster; non-zero pixels belong to the components
+        label_path: str
+            path of the label raster to write
+        lines_per_block: int
+            lines per block to label
+        buffer: int
+            base buffer size of the buffered bounding boxes
+        connectivity: int
+            4 or 8 connectivity of the components
+        number_workers: int
+            Number of worker processes. -1 uses all available CPUs.
+        scratch_dir: str
+            directory for intermediate processing
+
+        Returns
+        -------
+        component_index: ComponentIndex
+            index of the components
+        """
+        component_index = cls.load(label_path)
+        if component_index is not None and \
+           component_index.buffer == buffer and \
+           component_index.connectivity == connectivity and \
+           component_index.is_current(binary_path):
+            logger.info(f'reuse component index of {binary_path}')
+            return component_index
+
+        meta_info = get_meta_from_tif(binary_path)
+        data_shape = (meta_info['length'], meta_info['width'])
+        block_params = list(block_param_generator(
+            min(int(lines_per_block), data_shape[0]), data_shape, (0, 0)))
+
+        # First pass: label the blocks and summarize the block borders
+        block_summary = Parallel(n_jobs=number_workers)(
+            delayed(_label_component_block)(
+                block_param, binary_path, connectivity)
+            for block_param in block_params)
+
+        # Global index of the labels. Label 0 (background) of every block
+        # is mapped to the node 0.
+        label_offsets = np.cumsum(
+            [0] + [len(summary[1]) - 1 for summary in block_summary])
+        num_nodes = label_offsets[-1] + 1
+
+        node_sizes = np.zeros(num_nodes, dtype=np.int64)
+        node_bboxes = np.zeros([num_nodes, 4], dtype=np.int64)
+        for block_ind, summary in enumerate(block_summary):
+            node_sizes[label_offsets[block_ind] + 1:
+                       label_offsets[block_ind + 1] + 1] = summary[1][1:]
+            node_bboxes[label_offsets[block_ind] + 1:
+                        label_offsets[block_ind + 1] + 1] = summary[2][1:]
+
+        # Link the labels touching across the block boundaries.
+        # With 8-connectivity, the diagonal neighbors are linked too.
+        shifts = [0] if connectivity == 4 else [-1, 0, 1]
+        edge_src = [np.zeros(0, dtype=np.int64)]
+        edge_dst = [np.zeros(0, dtype=np.int64)]
+        for block_ind in range(len(block_summary) - 1):
+            bottom_line = block_summary[block_ind][4]
+            top_line = block_summary[block_ind + 1][3]
+            for shift in shifts:
+                bottom_strip = bottom_line[max(0, -shift):
+                                           len(bottom_line) - max(0, shift)]
+                top_strip = top_line[max(0, shift):
+                                     len(top_line) - max(0, -shift)]
+                touching = (bottom_strip > 0) & (top_strip > 0)
+                edge_src.append(bottom_strip[touching] +
+                                label_offsets[block_ind])
+                edge_dst.append(top_strip[touching] +
+                                label_offsets[block_ind + 1])
+        edge_src = np.concatenate(edge_src)
+        edge_dst = np.concatenate(edge_dst)
+
+        # Node 0 has no link and is the first node, so the background
+        # stays 0 and the components are numbered in the order of the
+        # lines.
+        label_graph = sparse.coo_matrix(
+            (np.ones(len(edge_src), dtype=np.int8), (edge_src, edge_dst)),
+            shape=(num_nodes, num_nodes))
+        number_labels, component_ind = connected_components(
+            label_graph, directed=False)
+
+        sizes = np.bincount(component_ind, weights=node_sizes,
+                            minlength=number_labels).astype(np.int64)
+        sizes[0] = 0
+        x_start = np.full(number_labels, data_shape[1], dtype=np.int64)
+        y_start = np.full(number_labels, data_shape[0], dtype=np.int64)
+        x_end = np.zeros(number_labels, dtype=np.int64)
+        y_end = np.zeros(number_labels, dtype=np.int64)
+        np.minimum.at(x_start, component_ind[1:], node_bboxes[1:, 0])
+        np.minimum.at(y_start, component_ind[1:], node_bboxes[1:, 1])
+        np.maximum.at(x_end, component_ind[1:],
+                      node_bboxes[1:, 0] + node_bboxes[1:, 2])
+        np.maximum.at(y_end, component_ind[1:],
+                      node_bboxes[1:, 1] + node_bboxes[1:, 3])
+        bboxes = np.stack([x_start, y_start,
+                           x_end - x_start, y_end - y_start], axis=1)
+        bboxes[0] = [0, 0, data_shape[1], data_shape[0]]
+        del block_summary, node_sizes, node_bboxes
+
+        logger.info(f'component index labeled {number_labels - 1} '
+                    f'components of {binary_path} over '
+                    f'{len(block_params)} blocks with '
+                    f'{len(edge_src)} boundary links')
+
+        # Second pass: write the labels merged over the frame
+        component_ind = component_ind.astype(np.int32)
+        label_writer = RasterBlockWriter(
+            label_path,
+            geotransform=meta_info['geotransform'],
+            projection=meta_info['projection'],
+            datatype='int32',
+            cog_flag=False,
+            scratch_dir=scratch_dir)
+        label_blocks = Parallel(n_jobs=number_workers,
+                                return_as='generator')(
+            delayed(_label_component_block)(
+                block_param, binary_path, connectivity,
+                np.concatenate(
+                    [[0],
+                     component_ind[label_offsets[block_ind] + 1:
+                                   label_offsets[block_ind + 1] + 1]]))
+            for block_ind, block_param in enumerate(block_params))
+        for block_param, label_block in label_blocks:
+            label_writer.write_block(label_block, block_param)
+        label_writer.close()
+
+        component_index = cls(label_path,
+                              rows=data_shape[0],
+                              cols=data_shape[1],
+                              sizes=sizes,
+                              bboxes=bboxes,
+                              buffer=buffer,
+                              connectivity=connectivity,
+                              source_path=os.path.abspath(binary_path),
+                              source_mtime=os.stat(
+                                  binary_path).st_mtime_ns)
+        component_index.save()
+
+        return component_index
+
+
 def merge_binary_layers(layer_list, value_list, merged_layer_path,
-                        lines_per_block, mode='or', cog_flag=True,
+                        lines_per_block, mode='or', cog_flag=None,
                         scratch_dir='.'):
     """
     Merges multiple raster layers into a single binary layer based on specified
@@ -1092,7 +3290,8 @@ def merge_binary_layers(layer_list, value_list, merged_layer_path,
         Logical operation to apply for merging ('and' or 'or').
         The default is 'or'.
     cog_flag : bool, optional
-        Write to COG if True. Defaults to True.
+        Write to COG if True. If None (default), the scratch raster
+        policy decides.
     scratch_dir : str, optional
         Path to scrath dir. Defaults to '.'.
 
@@ -1118,30 +3317,31 @@ def merge_binary_layers(layer_list, value_list, merged_layer_path,
     # Determine the logical operation function
     logical_function = np.logical_or if mode == 'or' else np.logical_and
 
-    # Iterating through blocks
-    for block_param in block_params:
-        combined_binary_image = None
-
-        for layer, value in zip(layer_list, value_list):
-            layer_block = get_raster_block(layer, block_param)
-            binary_image = (layer_block == value).astype(np.uint8)
-
-            if combined_binary_image is None:
-                combined_binary_image = binary_image
-            else:
-                combined_binary_image = logical_function(
-                    combined_binary_image, binary_image).astype(np.uint8)
-
-        # Writing the merged block to the output raster
-        write_raster_block(
-            out_raster=merged_layer_path,
-            data=combined_binary_image,
-            block_param=block_param,
+    with RasterBlockWriter(
+            merged_layer_path,
             geotransform=meta_info['geotransform'],
             projection=meta_info['projection'],
             datatype='byte',
             cog_flag=cog_flag,
-            scratch_dir=scratch_dir)
+            scratch_dir=scratch_dir) as writer:
+
+        # Iterating through blocks
+        for block_param in block_params:
+            combined_binary_image = None
+
+            for layer, value in zip(layer_list, value_list):
+                layer_block = get_raster_block(layer, block_param)
+                binary_image = (layer_block == value).astype(np.uint8)
+
+                if combined_binary_image is None:
+                    combined_binary_image = binary_image
+                else:
+                    combined_binary_image = logical_function(
+                        combined_binary_image,
+                        binary_image).astype(np.uint8)
+
+            # Writing the merged block to the output raster
+            writer.write_block(combined_binary_image, block_param)
 
 
 def intensity_display(intensity, outputdir, pol, immin=-30, immax=0):
@@ -1450,8 +3650,9 @@ def _save_array(input_array, output_file, dswx_metadata_dict, geotransform,
     os.makedirs(scratch_dir, exist_ok=True)
 
     shape = input_array.shape
-    driver = gdal.GetDriverByName("GTiff")
-    gdal_ds = driver.Create(output_file, shape[1], shape[0], 1, output_dtype)
+    raster_handle_cache.invalidate(output_file)
+    driver = gdal.GetDriverByName("MEM")
+    gdal_ds = driver.Create('', shape[1], shape[0], 1, output_dtype)
     if dswx_metadata_dict is not None:
         gdal_ds.SetMetadata(dswx_metadata_dict)
     gdal_ds.SetGeoTransform(geotransform)
@@ -1469,11 +3670,10 @@ def _save_array(input_array, output_file, dswx_metadata_dict, geotransform,
         raster_band.SetRasterColorInterpretation(
                 gdal.GCI_PaletteIndex)
 
-    gdal_ds.FlushCache()
+    raster_band = None
+    _copy_dataset_as_cog(gdal_ds, output_file)
     gdal_ds = None
 
-    _save_as_cog(output_file, scratch_dir, logger)
-
     if output_files_list is not None:
         output_files_list.append(output_file)
     logger.info(f'file saved: {output_file}')
@@ -11,7 +11,7 @@ CU_DEFAULT = 0.523
 CMAX_DEFAULT = 1.73
 
 
-def masked_convolve2d(array, window, *args, **kwargs):
+def masked_convolve2d(array, window, *args, nan_threshold=0.2, **kwargs):
     '''Perform convolution without spreading nan value to the neighbor pixels
 
     Parameters
@@ -20,6 +20,9 @@ def masked_convolve2d(array, window, *args, **kwargs):
         2 dimensional array
     window: integer
         2 dimensional window
+    nan_threshold: float
+        pixels where the weight of the NaN values exceeds this value
+        are set to NaN. If None, no pixel is set to NaN.
     '''
     frames_complex = np.zeros_like(array, dtype=np.complex64)
     frames_complex[np.isnan(array)] = np.array((1j))
@@ -27,16 +30,108 @@ def masked_convolve2d(array, window, *args, **kwargs):
         array[np.bitwise_not(np.isnan(array))]
 
     convolved_array = signal.convolve(frames_complex, window, *args, **kwargs)
-    convolved_array[np.imag(convolved_array) > 0.2] = np.nan
+    if nan_threshold is not None:
+        convolved_array[np.imag(convolved_array) > nan_threshold] = np.nan
     convolved_array = convolved_array.real.astype(np.float32)
 
     return convolved_array
 
 
-def compute_window_mean_std(arr, winsize):
+def compute_window_sum_count(arr, winsize):
+    '''
+    Compute the sums of the valid values, their squares, and the number
+    of NaN values within the window by moving the window from the
+    2 dimensional array. The sums are computed with separable box
+    filters in float32. The pixels outside of the array are zeros.
+
+    Parameters
+    ----------
+    arr: numpy.ndarray
+        2 dimensional array
+    winsize: integer
+        window size to compute the sums.
+
+    Returns
+    -------
+    window_sum: numpy.ndarray
+        sum of the valid values
+    window_sq_sum: numpy.ndarray
+        sum of the squares of the valid values
+    nan_count: numpy.ndarray
+        number of NaN values
+    '''
+    arr = np.asarray(arr, dtype=np.float32)
+    nan_mask = np.isnan(arr)
+    arr_valid = np.where(nan_mask, np.float32(0), arr)
+    window_area = winsize * winsize
+
+    # uniform_filter returns the window sum divided by the window area
+    window_sum = ndimage.uniform_filter(
+        arr_valid, size=winsize, mode='constant', cval=0) * window_area
+    window_sq_sum = ndimage.uniform_filter(
+        arr_valid * arr_valid, size=winsize,
+        mode='constant', cval=0) * window_area
+    nan_count = compute_window_nan_count(nan_mask, winsize)
+
+    return window_sum, window_sq_sum, nan_count
+
+
+def compute_window_nan_count(nan_mask, winsize):
+    '''
+    Count the NaN pixels within the window by moving the window from
+    the 2 dimensional mask. The counts are exact integers.
+    The pixels outside of the array are not counted.
+
+    Parameters
+    ----------
+    nan_mask: numpy.ndarray
+        2 dimensional boolean array of the NaN pixels
+    winsize: integer
+        window size to count the NaN pixels.
+
+    Returns
+    -------
+    nan_count: numpy.ndarray
+        number of NaN values as int32
+    '''
+    window = np.ones(winsize, dtype=np.int32)
+    nan_count = ndimage.correlate1d(
+        nan_mask.astype(np.int32), window, axis=0,
+        mode='constant', cval=0)
+    nan_count = ndimage.correlate1d(
+        nan_count, window, axis=1, mode='constant', cval=0)
+
+    return nan_count
+
+
+def get_window_invalid_mask(nan_count, winsize):
+    '''
+    Return the windows where more than 20 % of the pixels are NaN.
+    The test is done with integers, so that a window with exactly
+    20 % of NaN pixels is always valid.
+
+    Parameters
+    ----------
+    nan_count: numpy.ndarray
+        number of NaN values within the window
+    winsize: integer
+        window size
+
+    Returns
+    -------
+    invalid_mask: numpy.ndarray
+        True for the windows to be set to NaN
+    '''
+    return 5 * nan_count > winsize * winsize
+
+
+def compute_window_mean_std(arr, winsize, method='box'):
     '''
     Compute mean and standard deviation within window size
     by moving the window from 2 dimensional array.
+    The sums of the window are divided by the window size,
+    and the windows where more than 20 % of the pixels are NaN
+    are set to NaN.
 
     Parameters
     ----------
@@ -44,6 +139,10 @@ def compute_window_mean_std(arr, winsize):
         2 dimensional array
     winsize: integer
         window size to compute the mean and std.
+    method: str
+        'box' computes the window sums with separable box filters
+        in float32. 'convolve' uses the convolution of
+        `masked_convolve2d`.
 
     Returns
     -------
@@ -52,10 +151,31 @@ def compute_window_mean_std(arr, winsize):
     std: numpy.ndarray
         std array
     '''
-    window = np.ones([winsize, winsize]) / (winsize * winsize)
-    arr_masked = np.ma.masked_equal(arr, np.nan)
-    mean = masked_convolve2d(arr_masked, window, mode='same')
-    c2 = masked_convolve2d(arr_masked*arr_masked, window, mode='same')
+    if method == 'box':
+        window_area = winsize * winsize
+        window_sum, window_sq_sum, nan_count = \
+            compute_window_sum_count(arr, winsize)
+        invalid_mask = get_window_invalid_mask(nan_count, winsize)
+
+        mean = window_sum / np.float32(window_area)
+        c2 = window_sq_sum / np.float32(window_area)
+        mean[invalid_mask] = np.nan
+        c2[invalid_mask] = np.nan
+    elif method == 'convolve':
+        window = np.ones([winsize, winsize]) / (winsize * winsize)
+        arr_masked = np.ma.masked_equal(arr, np.nan)
+        mean = masked_convolve2d(arr_masked, window, mode='same',
+                                 nan_threshold=None)
+        c2 = masked_convolve2d(arr_masked*arr_masked, window, mode='same',
+                               nan_threshold=None)
+        # The NaN fraction from the convolution is subject to round-off,
+        # so the windows are invalidated with the exact counts.
+        invalid_mask = get_window_invalid_mask(
+            compute_window_nan_count(np.isnan(arr), winsize), winsize)
+        mean[invalid_mask] = np.nan
+        c2[invalid_mask] = np.nan
+    else:
+        raise ValueError(f'Invalid method for window statistics: {method}')
 
     var = (c2 - mean * mean)
 
@@ -68,7 +188,7 @@ def compute_window_mean_std(arr, winsize):
 
 
 def weightingarr(im, winsize, k=K_DEFAULT,
-                 cu=CU_DEFAULT, cmax=CMAX_DEFAULT):
+                 cu=CU_DEFAULT, cmax=CMAX_DEFAULT, method='box'):
     """
     Computes the weighthing function for Lee filter using cu as the noise
     coefficient.
@@ -79,6 +199,9 @@ def weightingarr(im, winsize, k=K_DEFAULT,
         2 dimensional array
     winsize: integer
         window size to compute the mean and std.
+    method: str
+        method to compute the mean and std of the window
+        (see `compute_window_mean_std`)
 
     Returns
     -------
@@ -89,11 +212,12 @@ def weightingarr(im, winsize, k=K_DEFAULT,
         std array
     """
     # cu is the noise variation coefficient
-    window_mean, window_std = compute_window_mean_std(im, winsize=winsize)
+    window_mean, window_std = compute_window_mean_std(im, winsize=winsize,
+                                                      method=method)
 
     # ci is the variation coefficient in the window
     ci = window_std / window_mean
-    w_t_arr = np.zeros(im.shape)
+    w_t_arr = np.zeros(im.shape, dtype=np.result_type(im.dtype, np.float32))
     w_t_arr[ci <= cu] = 1
     w_t_arr[(ci > cu) & (ci < cmax)] =\
         np.exp((-k * (ci[(ci > cu) & (ci < cmax)] - cu))
@@ -117,8 +241,12 @@ def lee_enhanced_filter(img, k=K_DEFAULT, cu=CU_DEFAULT,
     ----------
     img: numpy.ndarray
         2 dimensional array which has real intensity values
-    win_size: integer
+    window_size: integer
         window size to apply filter
+    method: str
+        method to compute the window statistics. 'box' (default)
+        uses box filters in float32, and 'convolve' uses the
+        convolution of `masked_convolve2d` in float64.
 
     Returns
     -------
@@ -127,10 +255,14 @@ def lee_enhanced_filter(img, k=K_DEFAULT, cu=CU_DEFAULT,
     """
     print('>> lee_enhanced_filter', kwargs)
     win_size = kwargs.get('window_size', 3)
-
-    # we process the entire img as float64 to avoid type overflow error
-    img = np.float64(img)
-    w_t, mean, _ = weightingarr(img, win_size, k, cu, cmax)
+    method = kwargs.get('method', 'box')
+
+    if method == 'box':
+        img = np.asarray(img, dtype=np.float32)
+    else:
+        # we process the entire img as float64 to avoid type overflow error
+        img = np.float64(img)
+    w_t, mean, _ = weightingarr(img, win_size, k, cu, cmax, method=method)
     filter_im = (mean * w_t) + (img * (1 - w_t))
 
     return filter_im
@@ -1,3 +1,4 @@
+import contextlib
 import copy
 import logging
 import mimetypes
@@ -6,6 +7,7 @@ import time
 
 import cv2
 import numpy as np
+from joblib import Parallel, delayed
 
 from dswx_sar import (dswx_sar_util,
                       generate_log,
@@ -47,44 +49,28 @@ def compute_slope_dem(dem):
     return slope_angle
 
 
-def create_slope_angle_geotiff(dem_path,
-                               slope_path,
-                               lines_per_block):
-    """create Geotiff File for slope angle
+def compute_slope_block(dem_path, block_param):
+    """Compute the slope angle of a block from the DEM.
+    The DEM is read with the padding of `block_param` so that the
+    Sobel kernel has its halo, and the padding is removed from the
+    slope angle.
+
     Parameters
     ----------
     dem_path: str
-        GeoTiff path for filename to read input dem
-    slope_path: str
-        full path for filename to save the slope angle
-    lines_per_block: int
-        lines per block processing
-    """
-    pad_shape = (SOBEL_KERNEL_SIZE, 0)
-    im_meta = dswx_sar_util.get_meta_from_tif(dem_path)
-    scratch_dir = os.path.dirname(slope_path)
-
-    block_params = dswx_sar_util.block_param_generator(
-        lines_per_block=lines_per_block,
-        data_shape=(im_meta['length'],
-                    im_meta['width']),
-        pad_shape=pad_shape)
-
-    for block_param in block_params:
-        dem = dswx_sar_util.get_raster_block(
-            dem_path,
-            block_param)
-        slope = compute_slope_dem(dem)
+        GeoTiff path of the DEM
+    block_param: BlockParam
+        Object specifying size of block and where to read from raster,
+        and amount of padding for the read array
 
-        dswx_sar_util.write_raster_block(
-            out_raster=slope_path,
-            data=slope,
-            block_param=block_param,
-            geotransform=im_meta['geotransform'],
-            projection=im_meta['projection'],
-            datatype='float32',
-            cog_flag=True,
-            scratch_dir=scratch_dir)
+    Returns
+    -------
+    slope: numpy.ndarray
+        slope angle of the block without padding
+    """
+    dem = dswx_sar_util.get_raster_block(dem_path, block_param)
+    slope = compute_slope_dem(dem)
+    return dswx_sar_util._strip_block_padding(slope, block_param)
 
 
 def smf(values, minv, maxv):
@@ -196,20 +182,8 @@ def calculate_water_area(binary_raster):
         Each component in input binary raster is replaced with the size value
         of connected components
     '''
-    nb_components, output, stats, _ \
-        = cv2.connectedComponentsWithStats(
-            np.array(binary_raster, dtype=np.uint8),
-            connectivity=8)
-    # Identify the labels of the areas not to provide the number of the pixels
-    excluded_area_ind = np.unique(output[binary_raster == 0])
-    sizes = stats[:, -1]
-    sizes = np.delete(sizes, excluded_area_ind)
-    nb_components = nb_components - 1
-
-    old_val = np.arange(1, nb_components + 1) - 0.1
-    kin = np.searchsorted(old_val, output)
-    sizes = np.insert(sizes, 0, 0, axis=0)
-    size_raster = sizes[kin]
+    component_stats = dswx_sar_util.compute_component_stats(binary_raster)
+    size_raster = component_stats.to_image(component_stats.sizes)
 
     return size_raster
 
@@ -224,7 +198,8 @@ def compute_fuzzy_value(intensity,
                         outputdir,
                         workflow,
                         fuzzy_option,
-                        block_param):
+                        block_param,
+                        water_area=None):
     '''Compute fuzzy values from intensity, dem,
     reference water, and HAND
 
@@ -273,6 +248,9 @@ def compute_fuzzy_value(intensity,
     block_param: BlockParam
         Object specifying size of block and where to read from raster,
         and amount of padding for the read array
+    water_area : numpy.ndarray, optional
+        size of the initial water bodies computed over the frame.
+        If None, the sizes are computed within the block.
 
     Returns
     -------
@@ -307,9 +285,9 @@ def compute_fuzzy_value(intensity,
             outputdir, f"intensity_threshold_filled_{pol}.tif")
         thresh_peak_str = os.path.join(outputdir, f"mode_tau_filled_{pol}.tif")
 
-        valley_threshold_raster = dswx_sar_util.get_raster_block(
+        valley_threshold_raster = dswx_sar_util.get_threshold_block(
             thresh_valley_str, block_param)
-        peak_threshold_raster = dswx_sar_util.get_raster_block(
+        peak_threshold_raster = dswx_sar_util.get_threshold_block(
             thresh_peak_str, block_param)
 
         intensity_band = intensity[int_id, :, :]
@@ -404,9 +382,12 @@ def compute_fuzzy_value(intensity,
                   fuzzy_option['slope_max'])
 
     # Compute area membership
-    handem = hand < fuzzy_option['hand_threshold']
-    wbsmask = (initial_map == 1) & (handem)
-    watermap = calculate_water_area(wbsmask)
+    if water_area is None:
+        handem = hand < fuzzy_option['hand_threshold']
+        wbsmask = (initial_map == 1) & (handem)
+        watermap = calculate_water_area(wbsmask)
+    else:
+        watermap = water_area
     area_s = smf(watermap,
                  fuzzy_option['area_min'],
                  fuzzy_option['area_max'])
@@ -443,6 +424,249 @@ def compute_fuzzy_value(intensity,
         slope_z, area_s, reference_water_s, copol_only
 
 
+def compute_initial_water_block(block_param,
+                                layer_paths,
+                                pol_list,
+                                outputdir,
+                                hand_threshold):
+    """Compute the initial water bodies of a block, i.e., the pixels
+    darker than the peak thresholds of all polarizations where HAND is
+    lower than the threshold. The area membership is computed from
+    their sizes.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        Object specifying where to read the block
+    layer_paths: dict
+        Paths of the 'intensity' and 'hand' rasters
+    pol_list: list
+        list of the input polarizations
+    outputdir: str
+        directory of the threshold rasters
+    hand_threshold: float
+        HAND value to mask out
+
+    Returns
+    -------
+    block_param: BlockParam
+        BlockParam of the block
+    initial_water: numpy.ndarray
+        binary layer of the initial water bodies
+    """
+    intensity = dswx_sar_util.get_raster_block(
+        layer_paths['intensity'], block_param)
+    if intensity.ndim == 2:
+        intensity = intensity[np.newaxis, :, :]
+    intensity = 10 * np.log10(intensity)
+
+    hand = dswx_sar_util.get_raster_block(
+        layer_paths['hand'], block_param)
+    hand[np.isnan(hand)] = 0
+    initial_water = hand < hand_threshold
+
+    for int_id, pol in enumerate(pol_list):
+        peak_threshold_raster = dswx_sar_util.get_threshold_block(
+            os.path.join(outputdir, f"mode_tau_filled_{pol}.tif"),
+            block_param)
+        initial_water &= intensity[int_id, :, :] < peak_threshold_raster
+
+    return block_param, initial_water
+
+
+def index_initial_water(block_params,
+                        layer_paths,
+                        pol_list,
+                        outputdir,
+                        hand_threshold,
+                        initial_water_path,
+                        water_label_path,
+                        im_meta,
+                        lines_per_block,
+                        number_workers=1):
+    """Write the initial water bodies and index them over the frame.
+    The water bodies are labeled over the whole frame, so that the
+    sizes of the bodies crossing the block boundaries do not depend
+    on the block size.
+
+    Parameters
+    ----------
+    block_params: iterable
+        BlockParam objects of the blocks without padding
+    layer_paths: dict
+        Paths of the 'intensity' and 'hand' rasters
+    pol_list: list
+        list of the input polarizations
+    outputdir: str
+        directory of the threshold rasters and the outputs
+    hand_threshold: float
+        HAND value to mask out
+    initial_water_path: str
+        path of the GeoTiff to save the initial water bodies
+    water_label_path: str
+        path of the GeoTiff to save the labels of the water bodies
+    im_meta: dict
+        metadata of the filtered image
+    lines_per_block: int
+        lines per block to label the water bodies
+    number_workers: int
+        Number of worker processes. -1 uses all available CPUs.
+
+    Returns
+    -------
+    component_index: dswx_sar_util.ComponentIndex
+        index of the initial water bodies
+    """
+    water_blocks = Parallel(n_jobs=number_workers,
+                            return_as='generator')(
+        delayed(compute_initial_water_block)(
+            block_param,
+            layer_paths=layer_paths,
+            pol_list=pol_list,
+            outputdir=outputdir,
+            hand_threshold=hand_threshold)
+        for block_param in block_params)
+
+    with dswx_sar_util.RasterBlockWriter(
+            initial_water_path,
+            geotransform=im_meta['geotransform'],
+            projection=im_meta['projection'],
+            datatype='byte',
+            cog_flag=False,
+            scratch_dir=outputdir) as water_writer:
+        for block_param, initial_water_block in water_blocks:
+            water_writer.write_block(initial_water_block, block_param)
+
+    component_index = dswx_sar_util.ComponentIndex.build(
+        initial_water_path,
+        water_label_path,
+        lines_per_block=lines_per_block,
+        number_workers=number_workers,
+        scratch_dir=outputdir)
+    logger.info(f'{component_index.number_components} initial water '
+                'bodies are found for the area membership')
+
+    return component_index
+
+
+def compute_fuzzy_block(block_param,
+                        layer_paths,
+                        pol_list,
+                        outputdir,
+                        workflow,
+                        fuzzy_option,
+                        landcover_label,
+                        ref_water_max,
+                        ref_no_data,
+                        debug_mode=False):
+    """Compute the fuzzy value of a block. The inputs are read by
+    the function itself, so that it can run in a worker process.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        Object specifying where to read the block. The padding is
+        only used for the slope angle computed from the DEM.
+    layer_paths: dict
+        Paths of the 'intensity', 'no_data', 'dem', 'hand',
+        'landcover', and 'reference_water' rasters, and optionally
+        of the 'water_label' raster indexing the initial water bodies
+    pol_list: list
+        list of the input polarizations
+    outputdir: str
+        directory of the threshold rasters
+    workflow: str
+        workflows i.e.twele or opera_dswx_s1
+    fuzzy_option: dict
+        fuzzy options passed to `compute_fuzzy_value`
+    landcover_label: dict
+        dict consisting of landcover labels
+    ref_water_max: float
+        maximum value of the reference water to normalize it
+    ref_no_data: float
+        no data value of the reference water
+    debug_mode: bool
+        If True, the membership layers and slope angle are returned.
+
+    Returns
+    -------
+    block_param_out: BlockParam
+        BlockParam of the block without padding
+    band_dict: dict
+        'fuzzy_value' of the block without padding and, in debug mode,
+        'slope', 'hand_z', 'slope_z', 'area_s', 'ref_water',
+        'copol_only', and 'intensity_<pol>' layers
+    """
+    block_param_out = dswx_sar_util.get_unpadded_block_param(block_param)
+
+    intensity = dswx_sar_util.get_raster_block(
+        layer_paths['intensity'], block_param_out)
+    if intensity.ndim == 2:
+        intensity = intensity[np.newaxis, :, :]
+
+    no_data_raster = dswx_sar_util.get_raster_block(
+        layer_paths['no_data'], block_param_out)
+
+    # Read Ancillary files
+    interphand = dswx_sar_util.get_raster_block(
+        layer_paths['hand'], block_param_out)
+
+    landcover_map = dswx_sar_util.get_raster_block(
+        layer_paths['landcover'], block_param_out)
+
+    wbd = dswx_sar_util.get_raster_block(
+        layer_paths['reference_water'], block_param_out)
+    wbd = np.array(wbd, dtype='float32')
+    wbd[wbd == ref_no_data] = np.nan
+    # normalize water occurrence/seasonality value
+    wbd = wbd / ref_water_max
+
+    # Compute slope angle from the padded DEM block
+    slope = compute_slope_block(layer_paths['dem'], block_param)
+
+    if layer_paths.get('water_label') is not None:
+        component_index = dswx_sar_util.ComponentIndex.load(
+            layer_paths['water_label'])
+        water_area = component_index.sizes[
+            dswx_sar_util.get_raster_block(layer_paths['water_label'],
+                                           block_param_out)]
+    else:
+        water_area = None
+
+    # compute fuzzy value
+    (fuzzy_avgvalue, intensity_z, hand_z,
+     slope_z, area_s, ref_water, copol_only) = \
+        compute_fuzzy_value(
+            intensity=10*np.log10(intensity),
+            slope=slope,
+            hand=interphand,
+            landcover=landcover_map,
+            landcover_label=landcover_label,
+            reference_water=wbd,
+            pol_list=pol_list,
+            outputdir=outputdir,
+            fuzzy_option=fuzzy_option,
+            workflow=workflow,
+            block_param=block_param_out,
+            water_area=water_area)
+
+    fuzzy_avgvalue[interphand > fuzzy_option['hand_threshold']] = 0
+    fuzzy_avgvalue[no_data_raster == 1] = -1
+
+    band_dict = {'fuzzy_value': fuzzy_avgvalue}
+    if debug_mode:
+        band_dict.update({'slope': slope,
+                          'hand_z': hand_z,
+                          'slope_z': slope_z,
+                          'area_s': area_s,
+                          'ref_water': ref_water,
+                          'copol_only': copol_only})
+        for polind, pol in enumerate(pol_list):
+            band_dict[f'intensity_{pol}'] = intensity_z[polind, :, :]
+
+    return block_param_out, band_dict
+
+
 def run(cfg):
     '''
     Run fuzzy logic calculation with parameters in cfg dictionary
@@ -452,6 +676,8 @@ def run(cfg):
     outputdir = cfg.groups.product_path_group.scratch_path
 
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='fuzzy_value')
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
 
@@ -523,123 +749,103 @@ def run(cfg):
     # read metadata including geotransform, projection, size
     im_meta = dswx_sar_util.get_meta_from_tif(filt_im_str)
 
-    create_slope_angle_geotiff(
-        dem_gdal_str,
-        slope_gdal_str,
-        lines_per_block=lines_per_block)
-
     landcover_label = masking_with_ancillary.get_label_landcover_esa_10()
 
+    layer_paths = {'intensity': filt_im_str,
+                   'no_data': no_data_raster_path,
+                   'dem': dem_gdal_str,
+                   'hand': hand_gdal_str,
+                   'landcover': landcover_gdal_str,
+                   'reference_water': reference_water_gdal_str}
+
+    # The area membership is computed from the sizes of the initial
+    # water bodies labeled over the whole frame.
+    if workflow == 'twele' or processing_cfg.debug_mode:
+        water_label_path = os.path.join(
+            outputdir, f"fuzzy_water_label_{pol_all_str}.tif")
+        index_initial_water(
+            dswx_sar_util.block_param_generator(
+                lines_per_block,
+                [im_meta['length'], im_meta['width']],
+                (0, 0)),
+            layer_paths=layer_paths,
+            pol_list=pol_list,
+            outputdir=outputdir,
+            hand_threshold=option_dict['hand_threshold'],
+            initial_water_path=os.path.join(
+                outputdir, f"fuzzy_initial_water_{pol_all_str}.tif"),
+            water_label_path=water_label_path,
+            im_meta=im_meta,
+            lines_per_block=lines_per_block,
+            number_workers=fuzzy_cfg.number_cpu)
+        layer_paths['water_label'] = water_label_path
+
+    # The slope angle is computed from the DEM for each block.
+    # The padding provides the halo of the Sobel kernel.
     data_shape = [im_meta['length'], im_meta['width']]
-    pad_shape = (0, 0)
-    block_params = dswx_sar_util.block_param_generator(
+    pad_shape = (SOBEL_KERNEL_SIZE, 0)
+    block_params = list(dswx_sar_util.block_param_generator(
         lines_per_block,
         data_shape,
-        pad_shape)
-
-    for block_ind, block_param in enumerate(block_params):
-        logger.info(f'fuzzy logic computation block {block_ind}')
-        intensity = dswx_sar_util.get_raster_block(
-            filt_im_str, block_param)
-        if im_meta['band_number'] == 1:
-            intensity = intensity[np.newaxis, :, :]
-
-        no_data_raster = dswx_sar_util.get_raster_block(
-            no_data_raster_path, block_param)
-
-        # Read Ancillary files
-        interphand = dswx_sar_util.get_raster_block(
-            hand_gdal_str, block_param)
-
-        landcover_map = dswx_sar_util.get_raster_block(
-            landcover_gdal_str, block_param)
-
-        wbd = dswx_sar_util.get_raster_block(
-            reference_water_gdal_str, block_param)
-        wbd = np.array(wbd, dtype='float32')
-        wbd[wbd == ref_no_data] = np.nan
-        # normalize water occurrence/seasonality value
-        wbd = wbd / ref_water_max
-
-        # Compute slope angle from DEM
-        slope = dswx_sar_util.get_raster_block(
-            slope_gdal_str, block_param)
-
-        # compute fuzzy value
-        (fuzzy_avgvalue, intensity_z, hand_z,
-         slope_z, area_s, ref_water, copol_only) = \
-            compute_fuzzy_value(
-                intensity=10*np.log10(intensity),
-                slope=slope,
-                hand=interphand,
-                landcover=landcover_map,
-                landcover_label=landcover_label,
-                reference_water=wbd,
+        pad_shape))
+
+    debug_raster_names = ['hand_z', 'slope_z', 'area_s',
+                          'ref_water', 'copol_only']
+
+    # The writers are closed without finalizing if a block fails.
+    with contextlib.ExitStack() as stack:
+        def _get_writer(output_path, cog_flag=None):
+            return stack.enter_context(dswx_sar_util.RasterBlockWriter(
+                output_path,
+                geotransform=im_meta['geotransform'],
+                projection=im_meta['projection'],
+                datatype='float32',
+                cog_flag=cog_flag,
+                scratch_dir=outputdir))
+
+        writer_dict = {'fuzzy_value': _get_writer(fuzzy_output_str)}
+        if processing_cfg.debug_mode:
+            writer_dict['slope'] = _get_writer(slope_gdal_str)
+            for raster_name in debug_raster_names:
+                writer_dict[raster_name] = _get_writer(
+                    os.path.join(outputdir,
+                                 f"fuzzy_{raster_name}_{pol_all_str}.tif"),
+                    cog_flag=False)
+            for pol in pol_list:
+                writer_dict[f'intensity_{pol}'] = _get_writer(
+                    os.path.join(outputdir, f"fuzzy_intensity_{pol}.tif"),
+                    cog_flag=False)
+
+        fuzzy_blocks = Parallel(n_jobs=fuzzy_cfg.number_cpu,
+                                return_as='generator')(
+            delayed(compute_fuzzy_block)(
+                block_param,
+                layer_paths=layer_paths,
                 pol_list=pol_list,
                 outputdir=outputdir,
-                fuzzy_option=option_dict,
                 workflow=workflow,
-                block_param=block_param)
-
-        fuzzy_avgvalue[interphand > option_dict['hand_threshold']] = 0
-        fuzzy_avgvalue[no_data_raster == 1] = -1
-
-        dswx_sar_util.write_raster_block(
-            out_raster=fuzzy_output_str,
-            data=fuzzy_avgvalue,
-            block_param=block_param,
-            geotransform=im_meta['geotransform'],
-            projection=im_meta['projection'],
-            datatype='float32',
-            cog_flag=True,
-            scratch_dir=outputdir)
-
-        if processing_cfg.debug_mode:
-
-            rasters_to_save = [
-                ('hand_z', hand_z),
-                ('slope_z', slope_z),
-                ('area_s', area_s),
-                ('ref_water', ref_water),
-                ('copol_only', copol_only)]
-
-            for raster_name, raster in rasters_to_save:
-                output_file_name = os.path.join(
-                    outputdir, f"fuzzy_{raster_name}_{pol_all_str}.tif")
-                dswx_sar_util.write_raster_block(
-                    out_raster=output_file_name,
-                    data=raster,
-                    block_param=block_param,
-                    geotransform=im_meta['geotransform'],
-                    projection=im_meta['projection'],
-                    datatype='float32',
-                    cog_flag=True,
-                    scratch_dir=outputdir)
-
-            for polind, pol in enumerate(pol_list):
-                dswx_sar_util.write_raster_block(
-                    out_raster=os.path.join(
-                        outputdir, f"fuzzy_intensity_{pol}.tif"),
-                    data=np.reshape(intensity_z[polind, :, :],
-                                    [intensity_z.shape[1],
-                                     intensity_z.shape[2]]),
-                    block_param=block_param,
-                    geotransform=im_meta['geotransform'],
-                    projection=im_meta['projection'],
-                    datatype='float32',
-                    cog_flag=True,
-                    scratch_dir=outputdir)
+                fuzzy_option=option_dict,
+                landcover_label=landcover_label,
+                ref_water_max=ref_water_max,
+                ref_no_data=ref_no_data,
+                debug_mode=processing_cfg.debug_mode)
+            for block_param in block_params)
+
+        # Blocks are returned in order and written as they arrive.
+        for block_ind, (block_param, band_dict) in enumerate(fuzzy_blocks):
+            logger.info(f'fuzzy logic computation block {block_ind} '
+                        f'({block_ind + 1}/{len(block_params)})')
+            for band_name, band in band_dict.items():
+                writer_dict[band_name].write_block(band, block_param)
 
     if processing_cfg.debug_mode:
 
-        for raster_name, _ in rasters_to_save:
+        for raster_name in debug_raster_names:
             filename = os.path.join(
                 outputdir,
                 f"fuzzy_{raster_name}_{pol_all_str}.tif")
-            if not filename.endswith('.tif'):
-                continue
             logger.info(f'    processing file: {filename}')
-            dswx_sar_util._save_as_cog(
+            dswx_sar_util.save_scratch_raster(
                 filename,
                 outputdir,
                 logger,
@@ -649,7 +855,7 @@ def run(cfg):
         for pol in pol_list:
             filename = os.path.join(
                 outputdir, f"fuzzy_intensity_{pol}.tif")
-            dswx_sar_util._save_as_cog(
+            dswx_sar_util.save_scratch_raster(
                 filename,
                 outputdir,
                 logger,
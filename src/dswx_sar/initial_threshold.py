@@ -36,6 +36,54 @@ def convert_pow2db(intensity):
     return 10 * np.log10(intensity)
 
 
+def compute_summed_area_table(array):
+    """Compute the summed-area table (integral image) of an array
+    with a leading row and column of zeros.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        2D array to integrate
+
+    Returns
+    -------
+    summed_area_table : numpy.ndarray
+        array of shape (rows + 1, cols + 1) where element [i, j] is
+        the sum of array[:i, :j]
+    """
+    rows, cols = array.shape
+    accum_dtype = np.float64 if array.dtype.kind in 'fc' else np.int64
+    summed_area_table = np.zeros((rows + 1, cols + 1), dtype=accum_dtype)
+    np.cumsum(array, axis=0, dtype=accum_dtype,
+              out=summed_area_table[1:, 1:])
+    np.cumsum(summed_area_table[1:, 1:], axis=1,
+              out=summed_area_table[1:, 1:])
+
+    return summed_area_table
+
+
+def sum_windows(summed_area_table, row_start, row_end, col_start, col_end):
+    """Sum the windows [row_start:row_end, col_start:col_end] using
+    a summed-area table.
+
+    Parameters
+    ----------
+    summed_area_table : numpy.ndarray
+        summed-area table from `compute_summed_area_table`
+    row_start, row_end, col_start, col_end : numpy.ndarray
+        window bounds clipped to the array shape
+
+    Returns
+    -------
+    window_sum : numpy.ndarray
+        sum of each window
+    """
+    return (summed_area_table[row_end, col_end]
+            - summed_area_table[row_start, col_end]
+            - summed_area_table[row_end, col_start]
+            + summed_area_table[row_start, col_start])
+
+
 class TileSelection:
     '''
     Select tile candidates that have boundary between water and non-water
@@ -263,6 +311,127 @@ class TileSelection:
 
         return water_area_flag
 
+    def get_window_statistics(self, intensity, intensity_gray, water_mask):
+        """Compute the summed-area tables used to evaluate the
+        searching windows of any size.
+
+        Parameters
+        ----------
+        intensity : numpy.ndarray
+            intensity image in linear scale
+        intensity_gray : numpy.ndarray
+            intensity image in gray scale
+        water_mask : numpy.ndarray
+            layers of water masks
+
+        Returns
+        -------
+        window_stats : dict
+            summed-area tables of the valid intensity, the valid and
+            non-finite gray scale values, the gray scale sums and squared
+            sums, the valid water mask, and the water mask of each layer
+        """
+        gray_valid = ~np.isnan(intensity_gray)
+        gray_finite = np.isfinite(intensity_gray)
+        mean_gray = np.nanmean(intensity_gray[gray_finite]) \
+            if np.any(gray_finite) else 0
+        # Values are centered to keep the squared sums accurate
+        gray_centered = np.where(gray_finite,
+                                 intensity_gray.astype(np.float64) - mean_gray,
+                                 0)
+
+        window_stats = {
+            'intensity_valid': compute_summed_area_table(
+                ~np.isnan(intensity)),
+            'gray_valid': compute_summed_area_table(gray_valid),
+            'gray_nonfinite': compute_summed_area_table(
+                gray_valid & ~gray_finite),
+            'gray_center': mean_gray,
+            'gray_sum': compute_summed_area_table(gray_centered),
+            'gray_sq_sum': compute_summed_area_table(gray_centered ** 2),
+            'water_valid': compute_summed_area_table(
+                ~np.isnan(water_mask[0])),
+            'water_sum': [compute_summed_area_table(
+                np.nan_to_num(water_layer))
+                for water_layer in water_mask]}
+
+        return window_stats
+
+    def select_tile_twele_windows(self,
+                                  window_stats,
+                                  intensity_gray,
+                                  window_bounds,
+                                  mean_intensity_global,
+                                  thresholds=None):
+        """Apply Twele's method to multiple windows at once using
+        the summed-area tables. The windows whose statistics are close
+        to the thresholds or include non-finite values are evaluated
+        with `select_tile_twele`.
+
+        Parameters
+        ----------
+        window_stats : dict
+            summed-area tables from `get_window_statistics`
+        intensity_gray : np.ndarray
+            intensity image [gray scale, dB]
+        window_bounds : tuple
+            row_start, row_end, col_start, and col_end arrays
+            of the windows clipped to the image shape
+        mean_intensity_global : float
+            global mean intensity image
+        thresholds : list
+            three thresholds to select tile
+
+        Returns
+        -------
+        select_flag : numpy.ndarray
+            Indicates whether each window is selected.
+        """
+        if thresholds is None:
+            thresholds = self.threshold_twele
+
+        num_valid = sum_windows(window_stats['gray_valid'], *window_bounds)
+        num_nonfinite = sum_windows(window_stats['gray_nonfinite'],
+                                    *window_bounds)
+        gray_sum = sum_windows(window_stats['gray_sum'], *window_bounds)
+        gray_sq_sum = sum_windows(window_stats['gray_sq_sum'],
+                                  *window_bounds)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_centered = gray_sum / num_valid
+            mean_int = mean_centered + window_stats['gray_center']
+            sig_int = np.sqrt(np.maximum(
+                gray_sq_sum / num_valid - mean_centered ** 2, 0))
+            cvx = sig_int / mean_int
+            rx = mean_int / mean_intensity_global
+
+        select_flag = (cvx >= thresholds[0]) & \
+                      (rx >= thresholds[1]) & \
+                      (rx <= thresholds[2])
+
+        # The gray scale image is single precision, so the windows
+        # around the thresholds are evaluated as the original method.
+        tolerance = 1e-5
+        near_threshold = \
+            (np.abs(cvx - thresholds[0]) <=
+             tolerance * max(abs(thresholds[0]), 1)) | \
+            (np.abs(rx - thresholds[1]) <=
+             tolerance * max(abs(thresholds[1]), 1)) | \
+            (np.abs(rx - thresholds[2]) <=
+             tolerance * max(abs(thresholds[2]), 1))
+        recheck = near_threshold | (num_nonfinite > 0) | (num_valid == 0) | \
+            ~np.isfinite(mean_intensity_global)
+
+        row_start, row_end, col_start, col_end = window_bounds
+        for window_ind in np.flatnonzero(recheck):
+            select_flag[window_ind], _, _ = self.select_tile_twele(
+                intensity_gray[row_start[window_ind]:row_end[window_ind],
+                               col_start[window_ind]:col_end[window_ind]],
+                mean_intensity_global,
+                thresholds=thresholds)
+
+        return select_flag
+
     def tile_selection_wbd(self,
                            intensity,
                            water_mask,
@@ -272,7 +441,11 @@ class TileSelection:
                            minimum_pixel_number=40):
         '''Select the tile candidates containing water and non-water
         from aid of water body layer based on the selection method
-        {twele, chini, bimodality, combined}.
+        {twele, chini, bimodality, combined}. The pixel counts, water
+        portions, and Twele's statistics of all searching windows are
+        computed from summed-area tables that are shared by the
+        successively smaller windows, and the histogram-based tests
+        are only applied to the remaining windows.
 
         Parameters
         ----------
@@ -329,24 +502,24 @@ class TileSelection:
             # Check if number of pixel is enough
             num_pixel_max = win_size * win_size / 3
 
-            number_y_window = np.ceil(height / win_size)
-            number_x_window = np.ceil(width / win_size)
-
-            number_y_window = number_y_window + \
-                (1 if np.mod(height, win_size) > 0 else 0)
-            number_x_window = number_x_window + \
-                (1 if np.mod(width, win_size) > 0 else 0)
-
             ind_subtile = 0
-
-            bimodality_max_set = []
             coordinate = []
-
-            selected_tile_twele = []
-            selected_tile_chini = []
-            selected_tile_bimodality = []
             selected_tile = []
-            detected_box_array = []
+
+            # Tests that are carried out and tests that a window
+            # should pass to be selected
+            run_tests = {
+                method: bool({method, 'combined'}.intersection(
+                    set(selection_methods)))
+                for method in ['twele', 'chini', 'bimodality']}
+            if 'combined' in selection_methods:
+                required_tests = ['twele', 'chini', 'bimodality']
+            else:
+                required_tests = [method
+                                  for method in ['twele', 'chini',
+                                                 'bimodality']
+                                  if method in selection_methods]
+
             # convert linear to dB scale
             intensity_db = convert_pow2db(intensity)
 
@@ -360,169 +533,108 @@ class TileSelection:
 
             mean_intensity_global = np.nanmean(intensity_gray)
 
-            box_count = 0
-            num_detected_box = 0
             num_detected_box_sum = 0
-            subrun = 0
 
             # Initially check if the area under the searching window contains
             # both water bodies and lands from the reference water map.
             # if 0.0 < water_coverage < 1 and 0.0 < land_coverage < 1:
             if water_area_flag:
+                window_stats = self.get_window_statistics(
+                    intensity, intensity_gray, water_mask)
+
                 while (num_detected_box_sum <= mininum_tile) and \
                         (win_size >= minimum_pixel_number):
 
-                    subrun += 1
-                    number_y_window = np.int16(height / win_size)
-                    number_x_window = np.int16(width / win_size)
-
                     # Define step sizes
                     x_step = win_size // 2
                     y_step = win_size // 2
 
-                    # Loop through the rectangle array with the sliding window
-                    for x_coord in range(0, width - win_size + 1, x_step):
-                        for y_coord in range(0, height - win_size + 1, y_step):
-                            # Grab the small area using the window
-                            x_start = x_coord
-                            x_end = x_coord + win_size
-                            y_start = y_coord
-                            y_end = y_coord + win_size
-
-                            x_end = min(x_end, height)
-                            y_end = min(y_end, width)
-                            box_count = box_count + 1
-
-                            intensity_sub = intensity[x_start:x_end,
-                                                      y_start:y_end]
-
-                            intensity_sub_gray = intensity_gray[x_start:x_end,
-                                                                y_start:y_end]
-
-                            validnum = np.count_nonzero(
-                                ~np.isnan(intensity_sub))
-
-                            # create subset from water mask
-                            water_mask_sublock = water_mask[:, x_start:x_end,
-                                                            y_start:y_end]
-
-                            # compute valid pixels from subset
-                            water_number_sample_sub = np.count_nonzero(
-                                    ~np.isnan(water_mask_sublock[0, :, :]))
-
-                            # compute spatial portion for each polarization
-                            water_area_sublock_flag = \
-                                self.get_water_portion_mask(water_mask_sublock)
-
-                            if water_number_sample_sub > 0 \
-                                    and water_area_sublock_flag \
-                                    and validnum > num_pixel_max:
-
-                                # Initially set flag as True
-                                tile_selected_flag = True
-
-                                if {'twele', 'combined'}.intersection(
-                                        set(selection_methods)):
-                                    tile_selected_flag, _, _ = \
-                                        self.select_tile_twele(
-                                            intensity_sub_gray,
-                                            mean_intensity_global)
-                                    if tile_selected_flag:
-                                        selected_tile_twele.append(True)
-                                    else:
-                                        selected_tile_twele.append(False)
-                                else:
-                                    selected_tile_twele.append(False)
-
-                                if {'chini', 'combined'}.intersection(
-                                        set(selection_methods)):
-                                    # Once 'combined' method is selected,
-                                    # the chini test is carried when the
-                                    # 'twele' method passed.
-                                    if (selection_methods in ['combined']) & \
-                                       (not tile_selected_flag):
-
-                                        selected_tile_chini.append(False)
-
-                                    else:
-                                        tile_selected_flag = \
-                                            self.select_tile_chini(
-                                                intensity_sub
-                                                )
-
-                                        if tile_selected_flag:
-                                            selected_tile_chini.append(True)
-                                        else:
-                                            selected_tile_chini.append(False)
-
-                                else:
-                                    selected_tile_chini.append(False)
-
-                                if {'bimodality', 'combined'}.intersection(
-                                        set(selection_methods)):
-
-                                    if (selection_methods == 'combined') and \
-                                        not tile_selected_flag:
-
-                                        selected_tile_bimodality.append(False)
-                                    else:
-                                        _, _, tile_bimode_flag = \
-                                            self.select_tile_bimodality(
-                                                intensity_sub,
-                                                threshold=self.threshold_bimodality
-                                                )
-
-                                        if tile_bimode_flag:
-                                            selected_tile_bimodality.append(
-                                                True
-                                                )
-                                        else:
-                                            selected_tile_bimodality.append(
-                                                False
-                                                )
-                                else:
-                                    selected_tile_bimodality.append(False)
-
-                            else:
-                                bimodality_max_set.append(np.nan)
-                                selected_tile_twele.append(False)
-                                selected_tile_chini.append(False)
-                                selected_tile_bimodality.append(False)
-
-                            # keep coordiates for the searching window.
-                            coordinate.append(
-                                [ind_subtile,
-                                 x_start, x_end,
-                                 y_start, y_end])
-                            ind_subtile += 1
-
-                    if 'combined' in selection_methods:
-                        selected_tile_merged = np.logical_and(
-                            selected_tile_twele,
-                            selected_tile_chini)
-                        selected_tile_merged = np.logical_and(
-                            selected_tile_merged,
-                            selected_tile_bimodality)
-                        num_detected_box = np.sum(selected_tile_merged)
+                    # Sliding windows in the order of the x and y loops
+                    x_coords = np.arange(0, width - win_size + 1, x_step)
+                    y_coords = np.arange(0, height - win_size + 1, y_step)
+                    x_start = np.repeat(x_coords, len(y_coords))
+                    y_start = np.tile(y_coords, len(x_coords))
+                    x_end = np.minimum(x_start + win_size, height)
+                    y_end = np.minimum(y_start + win_size, width)
+                    num_windows = len(x_start)
+
+                    # window bounds clipped to the image
+                    window_bounds = (np.minimum(x_start, height),
+                                     np.maximum(np.minimum(x_start, height),
+                                                x_end),
+                                     np.minimum(y_start, width),
+                                     np.maximum(np.minimum(y_start, width),
+                                                y_end))
+                    window_sample = \
+                        (window_bounds[1] - window_bounds[0]) * \
+                        (window_bounds[3] - window_bounds[2])
+
+                    validnum = sum_windows(window_stats['intensity_valid'],
+                                           *window_bounds)
+                    water_number_sample_sub = sum_windows(
+                        window_stats['water_valid'], *window_bounds)
+
+                    # the windows where any water mask contains
+                    # both water and non-water
+                    water_area_sublock_flag = np.zeros(num_windows,
+                                                       dtype=bool)
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        for water_sum_table in window_stats['water_sum']:
+                            water_spatial_portion = np.where(
+                                window_sample > 0,
+                                sum_windows(water_sum_table,
+                                            *window_bounds) /
+                                window_sample,
+                                0)
+                            water_area_sublock_flag |= \
+                                (water_spatial_portion > 0) & \
+                                (water_spatial_portion < 1)
+
+                    if required_tests:
+                        window_selected = (water_number_sample_sub > 0) & \
+                            water_area_sublock_flag & \
+                            (validnum > num_pixel_max)
                     else:
-                        # Initialize the result array with False values
-                        detected_box_array = np.ones_like(selected_tile_twele,
-                                                          dtype=bool)
-                        # Check and aggregate the results
-                        # based on the selection_methods
-                        if 'twele' in selection_methods:
-                            detected_box_array = np.logical_and(
-                                detected_box_array,
-                                selected_tile_twele)
-                        if 'chini' in selection_methods:
-                            detected_box_array = np.logical_and(
-                                detected_box_array,
-                                selected_tile_chini)
-                        if 'bimodality' in selection_methods:
-                            detected_box_array = np.logical_and(
-                                detected_box_array,
-                                selected_tile_bimodality)
-                        num_detected_box = np.sum(detected_box_array)
+                        window_selected = np.ones(num_windows, dtype=bool)
+
+                    for method in required_tests:
+                        if not run_tests[method]:
+                            window_selected[:] = False
+                            break
+
+                        if method == 'twele':
+                            candidate_ind = np.flatnonzero(window_selected)
+                            window_selected[candidate_ind] = \
+                                self.select_tile_twele_windows(
+                                    window_stats,
+                                    intensity_gray,
+                                    tuple(bound[candidate_ind]
+                                          for bound in window_bounds),
+                                    mean_intensity_global)
+                            continue
+
+                        for window_ind in np.flatnonzero(window_selected):
+                            intensity_sub = intensity[
+                                x_start[window_ind]:x_end[window_ind],
+                                y_start[window_ind]:y_end[window_ind]]
+                            if method == 'chini':
+                                window_selected[window_ind] = \
+                                    self.select_tile_chini(intensity_sub)
+                            else:
+                                _, _, window_selected[window_ind] = \
+                                    self.select_tile_bimodality(
+                                        intensity_sub,
+                                        threshold=self.threshold_bimodality)
+
+                    # keep coordiates for the searching window.
+                    coordinate.extend(np.column_stack(
+                        [np.arange(ind_subtile, ind_subtile + num_windows),
+                         x_start, x_end,
+                         y_start, y_end]).tolist())
+                    ind_subtile += num_windows
+                    selected_tile.extend(window_selected.tolist())
+
+                    num_detected_box = np.sum(selected_tile)
 
                     if num_detected_box_sum <= mininum_tile:
                         # try tile-selection with smaller win size
@@ -534,17 +646,9 @@ class TileSelection:
             else:
                 logger.info('No water body found')
 
-            if 'combined' in selection_methods:
-                selected_tile = np.logical_and(
-                    selected_tile_twele,
-                    selected_tile_chini)
-                selected_tile = np.logical_and(
-                    selected_tile,
-                    selected_tile_bimodality)
-            else:
-                selected_tile = detected_box_array
             coordinate = np.array(coordinate)
-            candidate_tile_coords = coordinate[selected_tile]
+            candidate_tile_coords = coordinate[np.array(selected_tile,
+                                                        dtype=bool)]
 
         return candidate_tile_coords
 
@@ -586,10 +690,9 @@ def create_three_water_masks(
         Array containing water masks for normal, flood, and drought conditions.
     """
 
-    wbd_gdal = gdal.Open(wbd_im_str)
-    wbd = wbd_gdal.ReadAsArray()
-    del wbd_gdal
     water_meta = dswx_sar_util.get_meta_from_tif(wbd_im_str)
+    wbd = dswx_sar_util.get_raster_window(
+        wbd_im_str, 0, 0, water_meta['width'], water_meta['length'])
 
     wbd = np.asarray(wbd, dtype='float32')
     wbd[wbd == no_data] = wbd_max_value
@@ -1277,16 +1380,22 @@ def optimize_inter_distribution_threshold(
     return threshold
 
 
-def fill_threshold_with_gdal(threshold_array,
-                             rows,
-                             cols,
-                             filename,
-                             outputdir,
-                             pol_list,
-                             filled_value,
-                             no_data=-50,
-                             average_tile=True):
-    """Interpolate thresholds over a 2-D grid.
+def fill_threshold_surface(threshold_array,
+                           rows,
+                           cols,
+                           filename,
+                           outputdir,
+                           pol_list,
+                           filled_value,
+                           no_data=-50,
+                           average_tile=True,
+                           method='invdist',
+                           lines_per_block=400,
+                           surface_format='raster'):
+    """Interpolate thresholds over a 2-D grid. The invalid thresholds
+    are filled with linear and then nearest interpolation, and the
+    threshold surfaces are saved as full-resolution rasters written
+    block by block or as compact grids.
 
     Parameters
     ----------
@@ -1309,14 +1418,26 @@ def fill_threshold_with_gdal(threshold_array,
         flag to average the thresholds within each tile.
         If true, the single threshold will be assigned to each tile.
         If false, the thresholds are stored with their positions.
+    method : str
+        'invdist' : inverse distance to a power, as the 'invdist'
+        algorithm of gdal_grid
+        'bilinear' : bilinear upsampling of the tile thresholds, which
+        is only available when `average_tile` is True
+    lines_per_block : int
+        lines per block to write the threshold rasters
+    surface_format : str
+        'raster' : full-resolution threshold rasters
+        'grid' : compact threshold grids evaluated on demand. Inverse
+        distance surfaces are always written as rasters.
     """
+    if method == 'bilinear' and not average_tile:
+        logger.info('Bilinear upsampling requires the averaged tile '
+                    'thresholds. Inverse distance is used instead.')
 
     if average_tile:
         tau_row, tau_col, _ = threshold_array['array'].shape
         y_tau = threshold_array['block_row'] * np.arange(0, tau_row) + \
             threshold_array['block_row'] / 2
-        # y axis should be flipped
-        y_tau = np.ones_like(y_tau) * rows - y_tau
         x_tau = threshold_array['block_col'] * np.arange(0, tau_col) + \
             threshold_array['block_col'] / 2
         x_arr_tau, y_arr_tau = np.meshgrid(x_tau, y_tau)
@@ -1387,94 +1508,84 @@ def fill_threshold_with_gdal(threshold_array,
                                                y_arr_tau.flatten()),
                                               method='nearest')
 
-            if average_tile:
-                data_valid = np.vstack([x_arr_tau.flatten(),
-                                        y_arr_tau.flatten(),
-                                        interp_tau])
-            else:
-                data_valid = np.vstack([np.hstack([x_arr_tau.flatten(),
-                                                   x_arr_tau_valid]),
-                                        np.hstack([y_arr_tau.flatten(),
-                                                   y_arr_tau_valid]),
-                                        np.hstack([interp_tau,
-                                                   z_arr_tau_valid])])
-
-            csv_file_str = os.path.join(outputdir,
-                                        f"data_thres_{pol}_{filename}.csv")
-            np.savetxt(csv_file_str, data_valid.transpose(), delimiter=",")
-
-            vrt_file = os.path.join(outputdir,
-                                    f"data_thres_{pol}_{filename}.vrt")
-
-            with open(vrt_file, 'w') as fpar:
-                fpar.write('<OGRVRTDataSource>\n')
-                fpar.write(f'<OGRVRTLayer name="data_thres_{pol}_{filename}">\n')
-                fpar.write(f"    <SrcDataSource>{csv_file_str}</SrcDataSource>\n")
-                fpar.write('    <GeometryType>wkbPoint</GeometryType>\n')
-                fpar.write('    <GeometryField encoding="PointFromColumns" x="field_1" y="field_2" z="field_3"/>\n')
-                fpar.write('</OGRVRTLayer>\n')
-                fpar.write('</OGRVRTDataSource>')
-
-            if average_tile:
-                gdal_grid_str = \
-                    "gdal_grid -zfield field_3 -l " \
-                    f"data_thres_{pol}_{filename} {vrt_file}  {tif_file_str}" \
-                    f" -txe 0 {cols} -tye  0 {rows} -a invdist:power=0.500:" \
-                    "smoothing=1.0:radius1=" \
-                    f"{threshold_array['block_row']*2}:radius2=" \
-                    f"{threshold_array['block_col']*2}:angle=0.000000:" \
-                    "max_points=0:min_points=1:nodata=0.000000 " \
-                    f" -outsize {cols} {rows} -ot Float32"
+            if average_tile and method == 'bilinear':
+                threshold_surface = dswx_sar_util.ThresholdSurface(
+                    rows, cols, 'bilinear',
+                    interp_tau.reshape([tau_row, tau_col]),
+                    block_row=threshold_array['block_row'],
+                    block_col=threshold_array['block_col'])
+            elif average_tile:
+                threshold_surface = dswx_sar_util.ThresholdSurface(
+                    rows, cols, 'invdist',
+                    interp_tau,
+                    x_points=x_arr_tau.flatten(),
+                    y_points=y_arr_tau.flatten(),
+                    radius_x=threshold_array['block_row'] * 2,
+                    radius_y=threshold_array['block_col'] * 2)
             else:
-                gdal_grid_str = \
-                    "gdal_grid -zfield field_3 " \
-                    f"-l data_thres_{pol}_{filename} {vrt_file} " \
-                    f" {tif_file_str} " \
-                    f" -txe 0 {cols} -tye 0 {rows} " \
-                    f" -a invdist:power=0.5000000:smoothing=1.000000:" \
-                    f"radius1={400*2}:radius2={400*2}:angle=0.000000:" \
-                    "max_points=0:min_points=1:nodata=0.000 "\
-                    f"-outsize {cols} {rows} -ot Float32"
-
-            os.system(gdal_grid_str)
+                threshold_surface = dswx_sar_util.ThresholdSurface(
+                    rows, cols, 'invdist',
+                    np.hstack([interp_tau, z_arr_tau_valid]),
+                    x_points=np.hstack([x_arr_tau.flatten(),
+                                        x_arr_tau_valid]),
+                    y_points=np.hstack([y_arr_tau.flatten(),
+                                        y_arr_tau_valid]),
+                    radius_x=400 * 2,
+                    radius_y=400 * 2)
         elif len(z_arr_tau_valid) == 1:
-            dswx_sar_util.create_geotiff_with_one_value(
-                tif_file_str,
-                shape=[rows, cols],
-                filled_value=z_arr_tau_valid[0])
+            threshold_surface = dswx_sar_util.ThresholdSurface(
+                rows, cols, 'constant', z_arr_tau_valid[0])
 
         else:
             logger.info('threshold array is empty')
+            threshold_surface = dswx_sar_util.ThresholdSurface(
+                rows, cols, 'constant', no_data)
 
-            # Define the GeoTransform
-            geotransform = (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
-
-            # Define the projection
-            projection = "EPSG:4326"
-
-            # Create an empty NumPy array filled with zeros
-            empty_data = np.ones((rows, cols)) * no_data
+        save_threshold_surface(threshold_surface,
+                               tif_file_str,
+                               outputdir,
+                               surface_format=surface_format,
+                               lines_per_block=lines_per_block)
 
-            # Create a new GeoTIFF dataset
-            driver = gdal.GetDriverByName('GTiff')
-            ds = driver.Create(tif_file_str, cols, rows, 1, gdal.GDT_Float32)
 
-            # Set the GeoTransform and Projection
-            ds.SetGeoTransform(geotransform)
-            ds.SetProjection(projection)
+def save_threshold_surface(threshold_surface,
+                           tif_file_str,
+                           outputdir,
+                           surface_format='raster',
+                           lines_per_block=400):
+    """Save a threshold surface as a full-resolution raster or as
+    a compact grid evaluated by the following steps.
 
-            # Write the empty data to the dataset
-            ds.GetRasterBand(1).WriteArray(empty_data)
-
-            # Close the dataset
-            ds = None
+    Parameters
+    ----------
+    threshold_surface : dswx_sar_util.ThresholdSurface
+        threshold surface to save
+    tif_file_str : str
+        path of the threshold raster
+    outputdir : str
+        output dir path
+    surface_format : str
+        'raster' : full-resolution raster
+        'grid' : sidecar file of `tif_file_str` holding the grid.
+        Only 'constant' and 'bilinear' surfaces are saved as grids.
+        An 'invdist' surface is costly to evaluate and is read by
+        several steps, so it is always written as a raster.
+    lines_per_block : int
+        lines per block to write the threshold raster
+    """
+    if surface_format == 'grid' and threshold_surface.method != 'invdist':
+        threshold_surface.save(tif_file_str)
+        return
 
-        dswx_sar_util._save_as_cog(
-            tif_file_str,
-            outputdir,
-            logger,
-            compression='DEFLATE',
-            nbits=16)
+    threshold_surface.write_raster(tif_file_str,
+                                   lines_per_block=lines_per_block,
+                                   scratch_dir=outputdir)
+    dswx_sar_util.save_scratch_raster(
+        tif_file_str,
+        outputdir,
+        logger,
+        compression='DEFLATE',
+        nbits=16)
 
 
 def fill_threshold_with_distance(threshold_array,
@@ -1856,19 +1967,17 @@ def process_block(ii, jj,
                 f" - {ii * n_cols_block + jj + 1}/"
                 f"{n_rows_block * n_cols_block}")
 
-    filt_raster_tif = gdal.Open(filt_im_str)
-    image_sub = filt_raster_tif.ReadAsArray(jj * block_col,
-                                            ii * block_row,
-                                            x_size,
-                                            y_size)
-    filt_raster_tif = None
-
-    wbd_gdal = gdal.Open(wbd_im_str)
-    wbd_sub = wbd_gdal.ReadAsArray(jj * block_col,
-                                   ii * block_row,
-                                   x_size,
-                                   y_size)
-    wbd_gdal = None
+    image_sub = dswx_sar_util.get_raster_window(filt_im_str,
+                                                jj * block_col,
+                                                ii * block_row,
+                                                x_size,
+                                                y_size)
+
+    wbd_sub = dswx_sar_util.get_raster_window(wbd_im_str,
+                                              jj * block_col,
+                                              ii * block_row,
+                                              x_size,
+                                              y_size)
     threshold_tau_block, mode_tau_block, candidate_tile_coords = \
         run_sub_block(
             image_sub,
@@ -2073,6 +2182,8 @@ def run(cfg):
     logger.info('Start Initial Threshold')
 
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='initial_threshold')
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
 
@@ -2088,6 +2199,7 @@ def run(cfg):
     tile_selection_method = init_threshold_cfg.selection_method
     average_threshold_flag = init_threshold_cfg.tile_average
     threshold_extending_method = init_threshold_cfg.extending_method
+    threshold_surface_format = init_threshold_cfg.threshold_surface_format
     lines_per_block = init_threshold_cfg.line_per_block
 
     logger.info(f'Tile selection method: {tile_selection_method}')
@@ -2152,10 +2264,13 @@ def run(cfg):
             thresh_peak_str = os.path.join(
                 outputdir, f"mode_tau_filled_{pol_str}.tif")
             for filled_file_path in [thresh_file_str, thresh_peak_str]:
-                dswx_sar_util.create_geotiff_with_one_value(
+                save_threshold_surface(
+                    dswx_sar_util.ThresholdSurface(
+                        height, width, 'constant', 30),
                     filled_file_path,
-                    shape=[height, width],
-                    filled_value=30)
+                    outputdir,
+                    surface_format=threshold_surface_format,
+                    lines_per_block=lines_per_block)
     else:
         # Here we compute the bounds of the backscattering of water objects
 
@@ -2313,14 +2428,17 @@ def run(cfg):
 
         if not threshold_tau_dict:
             logger.info('No threshold_tau')
-        # Currently, only 'gdal_grid' method is supported.
-        if threshold_extending_method == 'gdal_grid':
+        # 'gdal_grid' is the inverse distance interpolation of gdal_grid
+        # computed in-process.
+        if threshold_extending_method in ['gdal_grid', 'bilinear']:
             dict_threshold_list = [threshold_tau_dict, mode_tau_dict]
             interp_thres_str_list = ['intensity_threshold_filled',
                                      'mode_tau_filled']
+            surface_method = 'bilinear' \
+                if threshold_extending_method == 'bilinear' else 'invdist'
             for dict_thres, thres_str in zip(dict_threshold_list,
                                              interp_thres_str_list):
-                fill_threshold_with_gdal(
+                fill_threshold_surface(
                     threshold_array=dict_thres,
                     rows=height,
                     cols=width,
@@ -2329,7 +2447,10 @@ def run(cfg):
                     pol_list=pol_list,
                     filled_value=thres_max,
                     no_data=-50,
-                    average_tile=average_threshold_flag)
+                    average_tile=average_threshold_flag,
+                    method=surface_method,
+                    lines_per_block=lines_per_block,
+                    surface_format=threshold_surface_format)
 
     if processing_cfg.debug_mode:
 
@@ -2372,7 +2493,7 @@ def run(cfg):
                 outputdir, f"intensity_threshold_filled_{pol}_georef.tif")
 
             for block_param in block_params:
-                threshold_block = dswx_sar_util.get_raster_block(
+                threshold_block = dswx_sar_util.get_threshold_block(
                     thresh_file_path, block_param=block_param)
                 intensity_block = dswx_sar_util.get_raster_block(
                     filt_im_str, block_param=block_param)
@@ -2392,7 +2513,6 @@ def run(cfg):
                     geotransform=water_meta['geotransform'],
                     projection=water_meta['projection'],
                     datatype='byte',
-                    cog_flag=True,
                     scratch_dir=outputdir)
 
                 dswx_sar_util.write_raster_block(
@@ -2402,7 +2522,6 @@ def run(cfg):
                     geotransform=water_meta['geotransform'],
                     projection=water_meta['projection'],
                     datatype='float32',
-                    cog_flag=True,
                     scratch_dir=outputdir)
 
     t_all_elapsed = time.time() - t_all
@@ -4,12 +4,8 @@ import mimetypes
 import os
 import time
 
-import cv2
 import numpy as np
-import rasterio
-from osgeo import gdal
 from joblib import Parallel, delayed
-from rasterio.windows import Window
 from scipy import ndimage
 from skimage.filters import threshold_multiotsu
 from typing import List, Tuple
@@ -131,30 +127,12 @@ def extract_bbox_with_buffer(
 
     # computes the connected components labeled image of boolean image
     # and also produces a statistics output for each label
-    nb_components_water, label_image, stats_water, _ = \
-        cv2.connectedComponentsWithStats(binary.astype(np.uint8),
-                                         connectivity=8)
-    nb_components_water -= 1
-
-    sizes = stats_water[1:, -1]
-    bboxes = stats_water[1:, :4]
-
-    coord_list = []
-    for i, (x, y, w, h) in enumerate(bboxes):
-        # additional buffer areas should be balanced with the object area.
-        extra_buffer = int((np.sqrt(2) - 1.2) * np.sqrt(sizes[i]))
-        extra_buffer = max(extra_buffer, 1)
-        buffer_all = extra_buffer + buffer
-
-        sub_x_start = int(max(0, x - buffer_all))
-        sub_y_start = int(max(0, y - buffer_all))
-        sub_x_end = int(min(cols, x + w + buffer_all))
-        sub_y_end = int(min(rows, y + h + buffer_all))
-
-        coord_list.append([sub_x_start,
-                           sub_x_end,
-                           sub_y_start,
-                           sub_y_end])
+    component_stats = dswx_sar_util.compute_component_stats(binary)
+    label_image = component_stats.label_image
+
+    sizes = component_stats.sizes[1:]
+    coord_list = dswx_sar_util.get_buffered_bboxes(
+        component_stats.bboxes[1:], sizes, buffer, (rows, cols)).tolist()
 
     return coord_list, sizes, label_image
 
@@ -322,6 +300,68 @@ def check_water_land_mixture(args):
     return i, change_flag, water_mask
 
 
+def check_water_land_mixture_task(block_param,
+                                  labels,
+                                  label_path,
+                                  shared_rasters,
+                                  minimum_pixel,
+                                  pol_ind):
+    """Check the water-land mixture of the components of a task.
+    The lines of the task are read once and shared by its components.
+
+    Parameters
+    ----------
+    block_param : BlockParam
+        Lines of the task covering the boxes of its components.
+    labels : numpy.ndarray
+        Labels of the components of the task.
+    label_path : str
+        Label raster of the dswx_sar_util.ComponentIndex.
+    shared_rasters : dict
+        dswx_sar_util.SharedRaster of the linear 'intensity' and
+        the 'label' rasters.
+    minimum_pixel : int
+        Minimum pixel threshold for processing.
+    pol_ind : int
+        Polarization index.
+
+    Returns
+    -------
+    removed_rows : numpy.ndarray
+        Rows of the removed water pixels in the frame.
+    removed_cols : numpy.ndarray
+        Columns of the removed water pixels in the frame.
+    """
+    component_index = dswx_sar_util.ComponentIndex.load(label_path)
+    intensity_block = shared_rasters['intensity'].get_block(block_param)
+    label_block = shared_rasters['label'].get_block(block_param)
+    water_mask_block = label_block > 0
+    start_line = block_param.read_start_line
+
+    removed_rows = []
+    removed_cols = []
+    for label in labels:
+        x_start, x_end, y_start, y_end = \
+            component_index.buffered_bboxes[label]
+        bounds = [x_start, x_end, y_start - start_line, y_end - start_line]
+        _, change_flag, water_mask_subset = check_water_land_mixture(
+            (label - 1, component_index.sizes[label], minimum_pixel,
+             bounds, intensity_block, label_block, water_mask_block,
+             pol_ind))
+        if not change_flag:
+            continue
+        label_subset = label_block[bounds[2]:bounds[3],
+                                   bounds[0]:bounds[1]]
+        rows, cols = np.nonzero((label_subset == label) &
+                                (water_mask_subset == 0))
+        removed_rows.append(rows + y_start)
+        removed_cols.append(cols + x_start)
+
+    if not removed_rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(removed_rows), np.concatenate(removed_cols)
+
+
 def split_extended_water_parallel(
         water_mask_path: str,
         output_path: str,
@@ -349,7 +389,9 @@ def split_extended_water_parallel(
     number_workers : int
         Number of parallel workers for processing.
     input_lines_per_block: int
-        Lines per block processing
+        Lines per block processing. Components are grouped into tasks
+        spanning at most this number of lines unless a single component
+        is taller.
 
     Returns
     -------
@@ -358,154 +400,82 @@ def split_extended_water_parallel(
         subsets in the specified output path.
     """
     meta_info = dswx_sar_util.get_meta_from_tif(water_mask_path)
-    # exceed the size of the block. To prevent discontinuity and incorrect
-    # decisions, the block size increases within the for loop.
-    # Initially, the procedure is run for the entire area using a small block
-    # size (input_lines_per_block), and then the size is increased by a
-    # multiple of 3 and 20.
-    lines_per_block_set = [input_lines_per_block,
-                           input_lines_per_block * 3,
-                           input_lines_per_block * 20,
-                           meta_info['length']]
-    pad_shape = (0, 0)
-
-    temp_prefix = 'split_extended_water_parallel_temp'
-    temp_path_set = []
+    rows, cols = meta_info['length'], meta_info['width']
     minimum_pixel = 5000
 
-    for block_iter, lines_per_block in enumerate(lines_per_block_set):
-        block_params = dswx_sar_util.block_param_generator(
-            lines_per_block,
-            [meta_info['length'], meta_info['width']],
-            pad_shape)
-        if len(lines_per_block_set) > 1:
-            removed_false_water_path = os.path.join(
-                outputdir,
-                f'{temp_prefix}_{block_iter}.tif')
-        else:
-            removed_false_water_path = output_path
-
-        temp_path_set.append(removed_false_water_path)
+    # The water bodies are labeled once over the frame, and every
+    # component is evaluated exactly once with its entire bounding box.
+    component_index = dswx_sar_util.ComponentIndex.build(
+        water_mask_path,
+        os.path.join(outputdir, 'water_label_split_extended_water.tif'),
+        lines_per_block=input_lines_per_block,
+        buffer=10,
+        number_workers=number_workers,
+        scratch_dir=outputdir)
 
-        for block_ind, block_param in enumerate(block_params):
-            logger.info(
-                f'split_extended_water_parallel block #{block_ind} '
-                f'from {block_param.read_start_line} to '
-                f'{block_param.read_start_line + block_param.read_length}')
+    labels = component_index.select(min_size=minimum_pixel)
+    task_list = dswx_sar_util.schedule_component_tasks(
+        component_index,
+        labels,
+        max_lines_per_task=input_lines_per_block)
+    logger.info(f'split_extended_water_parallel: {len(labels)} components '
+                f'are assigned to {len(task_list)} tasks')
+
+    # Check if the objects have heterogeneous characteristics
+    # If so, split the objects using multi-otsu thresholds
+    # and check bimodality.
+    # The layers are published once and sliced by the workers.
+    removed_rows = []
+    removed_cols = []
+    with dswx_sar_util.publish_shared_rasters(
+            {'intensity': input_dict['intensity'],
+             'label': component_index.label_path},
+            lines_per_block=input_lines_per_block,
+            shared_dir=outputdir,
+            number_workers=number_workers) as shared_rasters:
+        task_results = Parallel(n_jobs=number_workers,
+                                return_as='generator')(
+            delayed(check_water_land_mixture_task)(
+                block_param,
+                task_labels,
+                label_path=component_index.label_path,
+                shared_rasters=shared_rasters,
+                minimum_pixel=minimum_pixel,
+                pol_ind=pol_ind)
+            for block_param, task_labels in task_list)
+
+        for task_rows, task_cols in task_results:
+            removed_rows.append(task_rows)
+            removed_cols.append(task_cols)
+    removed_rows = np.concatenate(removed_rows) if removed_rows \
+        else np.array([], dtype=np.int64)
+    removed_cols = np.concatenate(removed_cols) if removed_cols \
+        else np.array([], dtype=np.int64)
+    order = np.argsort(removed_rows, kind='stable')
+    removed_rows = removed_rows[order]
+    removed_cols = removed_cols[order]
+
+    # If water need to be refined, then update the water mask.
+    block_params = dswx_sar_util.block_param_generator(
+        input_lines_per_block, [rows, cols], (0, 0))
+    with dswx_sar_util.RasterBlockWriter(
+            output_path,
+            geotransform=meta_info['geotransform'],
+            projection=meta_info['projection'],
+            datatype='byte',
+            scratch_dir=outputdir) as writer:
+        for block_param in block_params:
             water_mask = dswx_sar_util.get_raster_block(
                 water_mask_path, block_param)
-            intensity_block = dswx_sar_util.get_raster_block(
-                input_dict['intensity'], block_param)
-
-            # Extract bounding boxes with buffer
-            coord_list, sizes, label_image = extract_bbox_with_buffer(
-                binary=water_mask, buffer=10)
-
-            filtered_sizes = []
-            filtered_coord_list = []
-            filtered_index = []
-            check_output = np.ones(len(sizes), dtype='byte')
-            old_val = np.arange(1, len(sizes) + 1) - .1
-            index_array_to_image = np.array(
-                np.searchsorted(old_val, label_image),
-                dtype='uint32')
-
-            for ind, (coords, size) in enumerate(zip(coord_list, sizes)):
-                (bbox_x_start,
-                 bbox_x_end,
-                 bbox_y_start,
-                 bbox_y_end) = coords
-
-                # Check if the component touches the boundary
-                if bbox_y_start != 0 and \
-                   bbox_x_end != block_param.block_length and \
-                   size >= minimum_pixel:
-
-                    filtered_index.append(ind)
-                    filtered_coord_list.append([bbox_x_start, bbox_x_end,
-                                                bbox_y_start, bbox_y_end])
-                    filtered_sizes.append(size)
-
-            # check if the individual water body candidates has bimodality
-            # bright water vs dark water
-            # water vs land
-            # Prepare arguments for parallel processing
-            args_list = [(filtered_index[i], filtered_sizes[i],
-                          minimum_pixel, filtered_coord_list[i],
-                          intensity_block,
-                          label_image,
-                          water_mask,
-                          pol_ind) for i in range(len(filtered_sizes))]
-
-            # Check if the objects have heterogeneous characteristics
-            # If so, split the objects using multi-otsu thresholds
-            # and check bimodality.
-            results = Parallel(n_jobs=number_workers)(
-                delayed(check_water_land_mixture)(args)
-                for args in args_list)
-
-            # If water need to be refined (change_flat=True),
-            # then update the water mask.
-            for i, change_flag, water_mask_subset in results:
-                if change_flag:
-                    water_mask[coord_list[i][2]: coord_list[i][3],
-                               coord_list[i][0]: coord_list[i][1]] = \
-                                water_mask_subset
-                check_output[i] = 0
-
-            del results
-            dswx_sar_util.write_raster_block(
-                removed_false_water_path,
-                water_mask,
-                block_param,
-                geotransform=meta_info['geotransform'],
-                projection=meta_info['projection'],
-                datatype='byte',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-            if block_iter < len(lines_per_block_set) - 1:
-                check_output = np.insert(check_output, 0, 0, axis=0)
-                check_image = np.array(
-                    check_output[index_array_to_image], dtype='byte')
-
-                # 'check_remove_false_water' has 1 value for unprocessed
-                # components when binary area touches the boundaries.
-                # processed components have 0 values.
-                check_remove_false_water_path = os.path.join(
-                    outputdir, f'check_water_land_mixture_{block_iter}.tif')
-                dswx_sar_util.write_raster_block(
-                    check_remove_false_water_path,
-                    check_image,
-                    block_param,
-                    geotransform=meta_info['geotransform'],
-                    projection=meta_info['projection'],
-                    datatype='byte',
-                    cog_flag=True,
-                    scratch_dir=outputdir)
-                del check_image
-
-            if block_param.block_length + block_param.read_start_line >= \
-               meta_info['length']:
-                water_mask_path = check_remove_false_water_path
-
-    if len(temp_path_set) >= 2:
-        # Merge multiple results processed with different block sizes
-        merged_removed_false_water_path = output_path
-
-        dswx_sar_util.merge_binary_layers(
-            layer_list=temp_path_set,
-            value_list=[1] * len(lines_per_block_set),
-            merged_layer_path=merged_removed_false_water_path,
-            lines_per_block=input_lines_per_block,
-            mode='or',
-            cog_flag=True,
-            scratch_dir=outputdir)
-    else:
-        merged_removed_false_water_path = temp_path_set[0]
+            start_line = block_param.read_start_line
+            first, last = np.searchsorted(
+                removed_rows,
+                [start_line, start_line + block_param.block_length])
+            water_mask[removed_rows[first:last] - start_line,
+                       removed_cols[first:last]] = 0
+            writer.write_block(water_mask, block_param)
 
-    logger.info(f'split_extended_water_parallel output: '
-                f'{merged_removed_false_water_path}')
+    logger.info(f'split_extended_water_parallel output: {output_path}')
 
 
 def compute_spatial_coverage_from_ancillary_parallel(
@@ -519,8 +489,10 @@ def compute_spatial_coverage_from_ancillary_parallel(
         number_workers: int = -1,
         lines_per_block: int = 400):
     """
-    Computes spatial coverage of water areas using ancillary data,
-    processing in parallel for efficiency.
+    Computes spatial coverage of water areas using ancillary data.
+    The components are indexed over the frame, and the portion of the
+    dry dark land is gathered for all components in a single pass over
+    the blocks.
 
     Parameters
     ----------
@@ -539,7 +511,7 @@ def compute_spatial_coverage_from_ancillary_parallel(
     spatial_coverage_threshold : float, optional
         Threshold for spatial coverage of land.
     number_workers : int, optional
-        Number of parallel workers for processing.
+        Number of parallel workers for labeling the components.
     lines_per_block : int, optional
         Number of lines per block for processing.
 
@@ -549,40 +521,30 @@ def compute_spatial_coverage_from_ancillary_parallel(
         Saves the computed water mask indicating water areas in the
         specified output file path.
     """
-    water_mask = dswx_sar_util.read_geotiff(flase_water_binary_path)
     meta_info = dswx_sar_util.get_meta_from_tif(flase_water_binary_path)
 
-    # Extract bounding boxes with buffer
-    coord_list, sizes, label_image = extract_bbox_with_buffer(
-        binary=water_mask, buffer=10)
-
-    # Save label image into geotiff file. The labels are assigned to
-    # dark land candidates. This Geotiff file will be used in parallel
-    # processing to read sub-areas instead of reading entire image.
-    water_label_filename = 'water_label_landcover_spatial_coverage.tif'
-    water_label_str = os.path.join(outputdir, water_label_filename)
-    dswx_sar_util.save_raster_gdal(
-        data=label_image,
-        output_file=water_label_str,
-        geotransform=meta_info['geotransform'],
-        projection=meta_info['projection'],
+    # Label the dark land candidates over the frame
+    component_index = dswx_sar_util.ComponentIndex.build(
+        flase_water_binary_path,
+        os.path.join(outputdir, 'water_label_landcover_spatial_coverage.tif'),
+        lines_per_block=lines_per_block,
+        number_workers=number_workers,
         scratch_dir=outputdir)
 
-    nb_components_water = len(sizes)
-
     # From reference water map (0: non-water, 1: permanent water) and
     # landcover map (ex. bare/sparse vegetation), extract the areas
     # which are likely mis-classified as water.
     data_shape = [meta_info['length'], meta_info['width']]
 
     pad_shape = (0, 0)
-    block_params = dswx_sar_util.block_param_generator(
+    block_params = list(dswx_sar_util.block_param_generator(
         lines_per_block,
         data_shape,
-        pad_shape)
+        pad_shape))
 
-    ref_land_tif_str = os.path.join(
-        outputdir, "landcover_darklandcandidate_spatial_coverage.tif")
+    # The dry dark land pixels are counted for each component
+    # block by block.
+    ref_land_count = np.zeros(len(component_index.sizes))
     for block_param in block_params:
         mask_excluded = dswx_sar_util.get_raster_block(
             mask_landcover_path, block_param)
@@ -592,85 +554,27 @@ def compute_spatial_coverage_from_ancillary_parallel(
         dry_darkland = np.logical_and(
             mask_excluded, water_block/water_max_value < 0.05)
 
-        dswx_sar_util.write_raster_block(
-            out_raster=ref_land_tif_str,
-            data=dry_darkland.astype(np.uint8),
-            block_param=block_param,
-            geotransform=meta_info['geotransform'],
-            projection=meta_info['projection'],
-            datatype='byte')
+        ref_land_count += component_index.component_sum(
+            dry_darkland, block_param)
 
-    # Arrange arguments to be used for parallel processing
-    args_list = [(i, sizes[i], spatial_coverage_threshold, coord_list[i],
-                  water_label_str, ref_land_tif_str)
-                 for i in range(len(sizes))]
-
-    # Output consists of index and 2D image consisting of True/Flase.
     # True represents the land and False represents not-land.
-    results = Parallel(n_jobs=number_workers)(
-        delayed(compute_spatial_coverage)(args)
-        for args in args_list)
-
-    test_output = np.zeros(len(sizes))
-    for i, test_output_i in results:
-        test_output[i] = test_output_i
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ref_land_portion = ref_land_count / component_index.sizes
+    land_components = np.array(
+        ref_land_portion > spatial_coverage_threshold, dtype='uint8')
 
-    # Convert 1D array result to 2D image.
-    old_val = np.arange(1, nb_components_water + 1) - 0.1
-    kin = np.searchsorted(old_val, label_image)
-    test_output = np.insert(test_output, 0, 0, axis=0)
-    mask_water_image = test_output[kin]
-
-    dswx_sar_util.save_dswx_product(
-        mask_water_image,
-        output_file_path,
-        geotransform=meta_info['geotransform'],
-        projection=meta_info['projection'],
-        scratch_dir=outputdir
-        )
-
-
-def compute_spatial_coverage(args):
-    """Compute the spatial coverage of non-water areas
-    based on given arguments.
-
-    Parameters
-    ----------
-    args (tuple): Tuple containing the following arguments:
-        i (int): Index of the current iteration.
-        size (int): Size of the current component.
-        threshold (float): Threshold value for comparison.
-        bounds (list): List containing the bounds of the subset.
-        water_label_str (str): Path to the water label file.
-        ref_land_tif_str (str): Path to the reference land file.
-
-    Returns
-    -------
-        tuple: Tuple containing the index (i) and the test output
-               (test_output_i).
-    """
-    i, _, threshold, bounds, water_label_str, ref_land_tif_str = args
-
-    x_off = bounds[0]
-    y_off = bounds[2]
-    width = bounds[1] - bounds[0]
-    height = bounds[3] - bounds[2]
-    window = Window(x_off, y_off, width, height)
-
-    # read subset of water map and intensity from given bounding box
-    with rasterio.open(ref_land_tif_str) as src:
-        mask_excluded_ancillary = src.read(window=window)
-        mask_excluded_ancillary = np.squeeze(mask_excluded_ancillary)
-
-    with rasterio.open(water_label_str) as src:
-        water_label = src.read(window=window)
-        water_label = np.squeeze(water_label)
-
-    mask_water = water_label == i + 1
-    ref_land_portion = np.nanmean(mask_excluded_ancillary[mask_water])
-    test_output_i = ref_land_portion > threshold
-
-    return i, test_output_i
+    with dswx_sar_util.DSWxProductWriter(
+            output_file_path,
+            geotransform=meta_info['geotransform'],
+            projection=meta_info['projection'],
+            length=meta_info['length'],
+            width=meta_info['width'],
+            scratch_dir=outputdir) as mask_writer:
+        for block_param in block_params:
+            label_block = dswx_sar_util.get_raster_block(
+                component_index.label_path, block_param)
+            mask_writer.write_block(land_components[label_block],
+                                    block_param)
 
 
 def remove_small_components(image, min_size=3):
@@ -690,22 +594,8 @@ def remove_small_components(image, min_size=3):
     cleaned_image : ndarray
         2D binary image with small components removed.
     """
-    nb_components_water, output_water, stats_water, _ = \
-        cv2.connectedComponentsWithStats(image.astype(np.uint8),
-                                         connectivity=8)
-    sizes = stats_water[1:, -1]
-    nb_components_water = nb_components_water - 1
-
-    if nb_components_water > 65535:
-        output_water_type = 'uint32'
-    else:
-        output_water_type = 'uint16'
-
-    old_val = np.arange(1, nb_components_water + 1) - .1
-    index_array_to_image = np.searchsorted(
-        old_val, output_water).astype(dtype=output_water_type)
-    size_output_add = np.insert(sizes, 0, 0, axis=0)
-    size_image = size_output_add[index_array_to_image]
+    component_stats = dswx_sar_util.compute_component_stats(image)
+    size_image = component_stats.to_image(component_stats.sizes)
 
     # Use the mask to remove small components
     cleaned_image = size_image > min_size
@@ -721,7 +611,8 @@ def extend_land_cover(landcover_path,
                       minimum_pixel,
                       water_buffer,
                       metainfo,
-                      scratch_dir):
+                      scratch_dir,
+                      rg_engine='dilation'):
     """
     Extends the specified type of land cover within a geographical dataset.
 
@@ -746,6 +637,8 @@ def extend_land_cover(landcover_path,
         Metadata including geotransform and projection information.
     scratch_dir (str):
         Directory for saving intermediate and output files.
+    rg_engine (str):
+        Region growing engine, 'dilation' or 'labeling'.
 
     Returns
     -------
@@ -810,6 +703,19 @@ def extend_land_cover(landcover_path,
         scratch_dir=scratch_dir,
         datatype='float32')
 
+    if rg_engine == 'labeling':
+        # The second region growing over the entire image does not
+        # use the excluded area, so a single labeling pass over the
+        # candidates gives the same result as the two passes below.
+        region_grow_map = region_growing.region_growing_labeling(
+            new_landcover,
+            initial_threshold=0.9,
+            relaxed_threshold=0.7,
+            maxiter=0)
+        reference_landcover_binary[region_grow_map] = 1
+
+        return reference_landcover_binary
+
     temp_rg_tif_path = os.path.join(
         scratch_dir, 'landcover_temp_transition.tif')
 
@@ -890,38 +796,39 @@ def hand_filter_along_boundary(
         Binary array representing the filtered HAND data.
     """
     target_area = dswx_sar_util.read_geotiff(target_area_path)
-    hand_obj = gdal.Open(hand_path)
 
-    coord_lists, sizes, output_water = \
-        extract_bbox_with_buffer(target_area, 10)
-    nb_components_water = len(sizes)
+    component_index = dswx_sar_util.ComponentIndex.build(
+        target_area_path,
+        os.path.join(scratch_dir, 'hand_filter_water_label.tif'),
+        buffer=10,
+        scratch_dir=scratch_dir)
 
     hand_filtered_binary = np.zeros(target_area.shape, dtype='byte')
     hand_std_image = np.zeros(target_area.shape, dtype='float32')
 
     if debug_mode:
-        height_array = np.zeros(nb_components_water)
-
-    for ind, coord_list in enumerate(coord_lists):
-        sub_x_start, sub_x_end, sub_y_start, sub_y_end = coord_list
-        sub_win_x = int(sub_x_end - sub_x_start)
-        sub_win_y = int(sub_y_end - sub_y_start)
-        sub_water_label = output_water[sub_y_start:sub_y_end,
-                                       sub_x_start:sub_x_end]
-        sub_hand = hand_obj.ReadAsArray(sub_x_start,
-                                        sub_y_start,
-                                        sub_win_x,
-                                        sub_win_y)
-        initial_area = sub_water_label == ind + 1
+        height_array = np.zeros(len(component_index.sizes))
+
+    for label in component_index.select():
+        (sub_x_start, sub_y_start, sub_win_x, sub_win_y), sub_water_label = \
+            component_index.read_labels(label)
+        sub_x_end = sub_x_start + sub_win_x
+        sub_y_end = sub_y_start + sub_win_y
+        sub_hand = dswx_sar_util.get_raster_window(hand_path,
+                                                   sub_x_start,
+                                                   sub_y_start,
+                                                   sub_win_x,
+                                                   sub_win_y)
+        initial_area = sub_water_label == label
 
         water_boundary = extract_boundary(
-            np.array(sub_water_label == ind + 1, dtype='byte'))
+            np.array(initial_area, dtype='byte'))
         hand_line_data, hand_image_data = \
             extract_values_using_boundary(water_boundary, sub_hand)
         hand_std = np.nanstd(hand_line_data)
 
         if debug_mode:
-            height_array[ind] = np.nanstd(hand_line_data)
+            height_array[label] = np.nanstd(hand_line_data)
 
         hand_std_image[sub_y_start:sub_y_end,
                        sub_x_start:sub_x_end] += hand_image_data
@@ -952,14 +859,11 @@ def hand_filter_along_boundary(
             hand_filtered_binary[sub_y_start:sub_y_end,
                                  sub_x_start:sub_x_end] += initial_area
 
-    output_water = np.array(output_water)
-    old_val = np.arange(1, nb_components_water + 1) - .1
-    index_array_to_image = np.searchsorted(old_val, output_water)
-
     if debug_mode:
-        height_array = np.insert(height_array, 0, 0, axis=0)
-        height_std_raster = np.array(height_array[index_array_to_image],
-                                     dtype='float32')
+        height_std_raster = np.array(
+            height_array[dswx_sar_util.read_geotiff(
+                component_index.label_path)],
+            dtype='float32')
 
     target_area[hand_filtered_binary == 0] = 0
 
@@ -999,7 +903,6 @@ def hand_filter_along_boundary(
             projection=metainfo['projection'],
             scratch_dir=scratch_dir
             )
-    del hand_obj
 
 
 def get_darkland_from_intensity_ancillary(
@@ -1100,6 +1003,8 @@ def run(cfg):
     t_all = time.time()
     outputdir = cfg.groups.product_path_group.scratch_path
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='masking_ancillary')
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
 
@@ -1169,7 +1074,8 @@ def run(cfg):
             water_buffer=water_buffer,
             minimum_pixel=extend_minimum,
             metainfo=water_meta,
-            scratch_dir=outputdir)
+            scratch_dir=outputdir,
+            rg_engine=processing_cfg.region_growing.engine)
         logger.info('Landcover extension completed.')
 
     mask_excluded_landcover_path = os.path.join(
@@ -1250,7 +1156,6 @@ def run(cfg):
         merged_layer_path=false_water_candidate_path,
         lines_per_block=lines_per_block,
         mode='and',
-        cog_flag=True,
         scratch_dir=outputdir)
 
     adjacent_false_positive_bindary_path = \
@@ -1283,7 +1188,6 @@ def run(cfg):
         merged_layer_path=darkland_removed_path,
         lines_per_block=lines_per_block,
         mode='and',
-        cog_flag=True,
         scratch_dir=outputdir)
 
     if hand_variation_mask:
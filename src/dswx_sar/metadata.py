@@ -4,7 +4,11 @@ import glob
 import os
 
 import numpy as np
+from pyproj import Transformer
 import rasterio
+from shapely import STRtree, wkt
+from shapely.geometry import Polygon
+from shapely.ops import transform
 
 from dswx_sar.dswx_runconfig import DSWX_S1_POL_DICT
 from dswx_sar.dswx_sar_util import (band_assign_value_dict,
@@ -28,7 +32,8 @@ DEFAULT_METADATA = {
 }
 
 
-def _copy_meta_data_from_rtc(metapath_list, dswx_metadata_dict):
+def _copy_meta_data_from_rtc(metapath_list, dswx_metadata_dict,
+                             burst_index=None):
     """Copy metadata dictionary from RTC metadata.
 
     Parameters
@@ -37,6 +42,8 @@ def _copy_meta_data_from_rtc(metapath_list, dswx_metadata_dict):
         List of metadata GeoTIFF file paths.
     dswx_metadata_dict : collections.OrderedDict
         Metadata dictionary to populate.
+    burst_index : RTCBurstIndex, optional
+        Index whose cached tags are used instead of reopening the files.
     """
     metadata_dict = defaultdict(list)
 
@@ -57,16 +64,19 @@ def _copy_meta_data_from_rtc(metapath_list, dswx_metadata_dict):
 
     for meta_path in metapath_list:
 
-        with rasterio.open(meta_path) as src:
-            # Accessing tags (additional metadata) of specific band
-            # (e.g., band 1)
-            tags = src.tags(0)
-            for rtc_field, dswx_field in dswx_meta_mapping.items():
-                rtc_meta_content = tags[rtc_field]
-                # 'INPUT_L1_SLC_GRANULES' in RTC GeoTIFF has [' '].
-                if rtc_field == 'INPUT_L1_SLC_GRANULES':
-                    rtc_meta_content = rtc_meta_content[2:-2]
-                metadata_dict[rtc_field].append(rtc_meta_content)
+        if burst_index is not None:
+            tags = burst_index.get_tags(meta_path)
+        else:
+            with rasterio.open(meta_path) as src:
+                # Accessing tags (additional metadata) of specific band
+                # (e.g., band 1)
+                tags = src.tags(0)
+        for rtc_field, dswx_field in dswx_meta_mapping.items():
+            rtc_meta_content = tags[rtc_field]
+            # 'INPUT_L1_SLC_GRANULES' in RTC GeoTIFF has [' '].
+            if rtc_field == 'INPUT_L1_SLC_GRANULES':
+                rtc_meta_content = rtc_meta_content[2:-2]
+            metadata_dict[rtc_field].append(rtc_meta_content)
 
     for rtc_field, dswx_field in dswx_meta_mapping.items():
         values = metadata_dict[rtc_field]
@@ -429,7 +439,123 @@ def gather_rtc_files(rtc_dirs, pols):
     return tif_files
 
 
-def collect_burst_id(rtc_dirs, pol):
+class RTCBurstIndex:
+    """Index of the input RTC bursts and their footprints.
+
+    The GeoTIFF tags of the RTC files are read once and cached, and
+    the burst footprints (`BOUNDING_POLYGON`) are reprojected once per
+    requested EPSG code and stored in an STRtree, so that many
+    bounding boxes (e.g., MGRS tiles) can be intersected with the
+    bursts without reopening or reprojecting them.
+
+    Parameters
+    ----------
+    rtc_dirs : list
+        List of directories containing RTC files.
+    co_pol_list : list, optional
+        Co-polarizations used to find the RTC file that carries the
+        burst footprint. Defaults to DSWX_S1_POL_DICT['CO_POL'].
+    """
+    def __init__(self, rtc_dirs, co_pol_list=None):
+        if co_pol_list is None:
+            co_pol_list = DSWX_S1_POL_DICT['CO_POL']
+        self._tags = {}
+        self._rtc_files = {}
+        self._transformers = {}
+        self._trees = {}
+
+        # footprints of the bursts in the input order
+        self.rtc_dir_list = []
+        self._footprints = []
+        for rtc_dir in rtc_dirs:
+            copol_file_list = [f for f in glob.glob(f'{rtc_dir}/*.tif')
+                               if any(pol in f for pol in co_pol_list)]
+            if not copol_file_list:
+                continue
+            tags = self.get_tags(copol_file_list[0])
+            self.rtc_dir_list.append(rtc_dir)
+            self._footprints.append(
+                (wkt.loads(tags['BOUNDING_POLYGON']),
+                 int(tags['BOUNDING_POLYGON_EPSG_CODE'])))
+
+    def get_tags(self, rtc_file):
+        """Return the (cached) tags of the first band of `rtc_file`."""
+        if rtc_file not in self._tags:
+            with rasterio.open(rtc_file) as src:
+                self._tags[rtc_file] = src.tags(0)
+        return self._tags[rtc_file]
+
+    def gather_rtc_files(self, rtc_dirs, pols):
+        """Same as `gather_rtc_files` with cached directory listings."""
+        tif_files = []
+        for pol in pols:
+            for rtc_input_dir in rtc_dirs:
+                key = (rtc_input_dir, pol.upper())
+                if key not in self._rtc_files:
+                    self._rtc_files[key] = glob.glob(
+                        os.path.join(rtc_input_dir, f'*{pol.upper()}*.tif'))
+                tif_files.extend(self._rtc_files[key])
+        return tif_files
+
+    def _get_tree(self, epsg):
+        """Return the STRtree of the footprints projected to `epsg`."""
+        epsg = int(epsg)
+        if epsg not in self._trees:
+            footprint_list = []
+            for rtc_polygon, rtc_epsg in self._footprints:
+                if rtc_epsg != epsg:
+                    if (rtc_epsg, epsg) not in self._transformers:
+                        self._transformers[(rtc_epsg, epsg)] = \
+                            Transformer.from_crs(f'EPSG:{rtc_epsg}',
+                                                 f'EPSG:{epsg}',
+                                                 always_xy=True)
+                    transformer = self._transformers[(rtc_epsg, epsg)]
+                    rtc_polygon = transform(transformer.transform,
+                                            rtc_polygon)
+                footprint_list.append(rtc_polygon)
+            self._trees[epsg] = STRtree(footprint_list)
+        return self._trees[epsg]
+
+    def query_bboxes(self, bbox_list, epsg_list):
+        """Find the bursts intersecting each bounding box.
+
+        Parameters
+        ----------
+        bbox_list : list
+            List of bounding boxes, [minx, miny, maxx, maxy]
+        epsg_list : list
+            EPSG code of each bounding box
+
+        Returns
+        -------
+        list
+            For each bounding box, the list of the RTC directories
+            whose footprint intersects it, in the input order.
+        """
+        overlapped_list = [[] for _ in bbox_list]
+        if not self._footprints:
+            return overlapped_list
+
+        epsg_list = [int(epsg) for epsg in epsg_list]
+        for epsg in sorted(set(epsg_list)):
+            bbox_ind_list = [ind for ind, bbox_epsg in enumerate(epsg_list)
+                             if bbox_epsg == epsg]
+            ref_polygon_list = []
+            for bbox_ind in bbox_ind_list:
+                minx, miny, maxx, maxy = bbox_list[bbox_ind]
+                ref_polygon_list.append(Polygon([(minx, miny),
+                                                 (minx, maxy),
+                                                 (maxx, maxy),
+                                                 (maxx, miny)]))
+            query_ind, burst_ind = self._get_tree(epsg).query(
+                ref_polygon_list, predicate='intersects')
+            for ref_ind, rtc_ind in sorted(zip(query_ind, burst_ind)):
+                overlapped_list[bbox_ind_list[ref_ind]].append(
+                    self.rtc_dir_list[rtc_ind])
+        return overlapped_list
+
+
+def collect_burst_id(rtc_dirs, pol, burst_index=None):
     """
     Collect burst IDs from RTC files for a specific polarization.
 
@@ -440,6 +566,8 @@ def collect_burst_id(rtc_dirs, pol):
     pol : str
         The polarization for which to collect burst IDs
         (e.g., 'HH', 'VV', 'HV', 'VH').
+    burst_index : RTCBurstIndex, optional
+        Index whose cached tags and file listings are used.
 
     Returns
     -------
@@ -447,14 +575,20 @@ def collect_burst_id(rtc_dirs, pol):
         A list of unique burst IDs found in the RTC files
         for the specified polarization.
     """
-    rtc_list = gather_rtc_files(rtc_dirs, pol)
+    if burst_index is not None:
+        rtc_list = burst_index.gather_rtc_files(rtc_dirs, pol)
+    else:
+        rtc_list = gather_rtc_files(rtc_dirs, pol)
     burst_id_list = []
     for rtc_file in rtc_list:
-        with rasterio.open(rtc_file) as src:
-            # Accessing tags (additional metadata) of specific band
-            # (e.g., band 1)
-            tags = src.tags(0)
-            burst_id_list.append(tags['BURST_ID'])
+        if burst_index is not None:
+            tags = burst_index.get_tags(rtc_file)
+        else:
+            with rasterio.open(rtc_file) as src:
+                # Accessing tags (additional metadata) of specific band
+                # (e.g., band 1)
+                tags = src.tags(0)
+        burst_id_list.append(tags['BURST_ID'])
 
     return list(set(burst_id_list))
 
@@ -462,7 +596,8 @@ def collect_burst_id(rtc_dirs, pol):
 def create_dswx_sar_metadata(cfg,
                              rtc_dirs,
                              product_version=None,
-                             extra_meta_data=None):
+                             extra_meta_data=None,
+                             burst_index=None):
     """
     Create dictionary containing metadata.
 
@@ -477,6 +612,9 @@ def create_dswx_sar_metadata(cfg,
     extra_meta_data: dict, optional
         Additional metadata to merge with dswx_metadata_dict.
         Defaults to None.
+    burst_index: RTCBurstIndex, optional
+        Index whose cached tags and file listings are used.
+        Defaults to None.
 
     Returns
     -------
@@ -490,8 +628,13 @@ def create_dswx_sar_metadata(cfg,
     # Add metadata related to ancillary data
     ancillary_cfg = cfg.groups.dynamic_ancillary_file_group
 
-    h5path_list = gather_rtc_files(rtc_dirs, DSWX_S1_POL_DICT['CO_POL'])
-    _copy_meta_data_from_rtc(h5path_list, dswx_metadata_dict)
+    if burst_index is not None:
+        h5path_list = burst_index.gather_rtc_files(
+            rtc_dirs, DSWX_S1_POL_DICT['CO_POL'])
+    else:
+        h5path_list = gather_rtc_files(rtc_dirs, DSWX_S1_POL_DICT['CO_POL'])
+    _copy_meta_data_from_rtc(h5path_list, dswx_metadata_dict,
+                             burst_index=burst_index)
 
     _populate_ancillary_metadata_datasets(dswx_metadata_dict, ancillary_cfg)
     _populate_processing_metadata_datasets(dswx_metadata_dict, cfg)
@@ -35,8 +35,12 @@ class DataReader(ABC):
 
 
 class RTCReader(DataReader):
-    def __init__(self, row_blk_size: int, col_blk_size: int):
+    def __init__(self, row_blk_size: int, col_blk_size: int,
+                 memory_budget_mb: float = 1024,
+                 num_prefetch_bursts: int = 0):
         super().__init__(row_blk_size, col_blk_size)
+        self.memory_budget_mb = memory_budget_mb
+        self.num_prefetch_bursts = num_prefetch_bursts
 
     def process_rtc_hdf5(
             self,
@@ -333,6 +337,8 @@ class RTCReader(DataReader):
                 scratch_dir=scratch_dir,
                 geogrid_in=geogrid_in,
                 temp_files_list=None,
+                memory_budget_mb=self.memory_budget_mb,
+                num_prefetch_bursts=self.num_prefetch_bursts,
                 )
 
         # Mosaic layover shadow mask
@@ -354,6 +360,8 @@ class RTCReader(DataReader):
                 scratch_dir=scratch_dir,
                 geogrid_in=geogrid_in,
                 temp_files_list=None,
+                memory_budget_mb=self.memory_budget_mb,
+                num_prefetch_bursts=self.num_prefetch_bursts,
             )
 
     def extract_file_name(self, input_rtc):
@@ -750,6 +758,8 @@ def run(cfg):
     reader = RTCReader(
         row_blk_size=row_blk_size,
         col_blk_size=col_blk_size,
+        memory_budget_mb=mosaic_cfg.memory_budget_mb,
+        num_prefetch_bursts=mosaic_cfg.num_prefetch_bursts,
     )
 
     # Mosaic input RTC into output Geotiff
@@ -1,19 +1,21 @@
 '''
 A module to mosaic Sentinel-1 geobursts from RTC workflow
 '''
+import contextlib
 import copy
 import glob
+import itertools
 import logging
 import mimetypes
 import os
 import tempfile
 import time
 
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import numpy as np
 from osgeo import osr, gdal
-from scipy import ndimage
 
 from dswx_sar.dswx_runconfig import _get_parser, RunConfig
 from dswx_sar import (dswx_geogrid,
@@ -235,47 +237,326 @@ def requires_reprojection(geogrid_mosaic,
     return flag_requires_reprojection
 
 
-def _compute_distance_to_burst_center(image, geotransform):
+def _compute_distance_to_burst_center(shape, geotransform, center_of_mass,
+                                      line_offset=0,
+                                      column_offset=0):
     '''
-    Compute distance from burst center
+    Compute distance from burst center. The squared line and column
+    distances are computed along vectors and broadcast into the
+    distance image, which avoids allocating full-size coordinate grids.
 
     Parameters
     -----------
-       image: np.ndarray
-           Input image
+       shape: tuple(int)
+           Shape (length, width) of the distance image
        geotransform: list(float)
            Data geotransform
+       center_of_mass: tuple(float)
+           Center of mass (line, column) of the valid pixels of the
+           whole burst
+       line_offset: int (optional)
+           Line of the burst corresponding to the first line of
+           the distance image
+       column_offset: int (optional)
+           Column of the burst corresponding to the first column of
+           the distance image
 
     Returns
         distance_image: np.ndarray
             Distance image
     '''
 
-    length, width = image.shape
-    center_of_mass = ndimage.center_of_mass(np.isfinite(image))
+    length, width = shape
 
-    x_vector = np.arange(width, dtype=np.float32)
-    y_vector = np.arange(length, dtype=np.float32)
+    x_vector = np.arange(column_offset, column_offset + width,
+                         dtype=np.float32)
+    y_vector = np.arange(line_offset, line_offset + length,
+                         dtype=np.float32)
 
     _, dx, _, _, _, dy = geotransform
 
-    x_distance_image, y_distance_image = np.meshgrid(x_vector, y_vector)
-    distance = np.sqrt((dy * (y_distance_image - center_of_mass[0])) ** 2 +
-                       (dx * (x_distance_image - center_of_mass[1])) ** 2)
+    y_distance_squared = (dy * (y_vector - center_of_mass[0])) ** 2
+    x_distance_squared = (dx * (x_vector - center_of_mass[1])) ** 2
+    distance = np.sqrt(y_distance_squared[:, np.newaxis] +
+                       x_distance_squared[np.newaxis, :])
 
     return distance
 
 
-def compute_mosaic_array(list_rtc_images,
-                         list_nlooks,
-                         mosaic_mode,
-                         scratch_dir='',
-                         geogrid_in=None,
-                         temp_files_list=None,
-                         no_data_value=np.isnan,
-                         verbose=True):
+def _compute_burst_center_of_mass(path_rtc, length, width, lines_per_block):
     '''
-    Mosaic S-1 geobursts and return the mosaic as dictionary
+    Compute the center of mass of the valid pixels in the first band
+    of a burst reading the raster in blocks of lines. The result is
+    identical to `ndimage.center_of_mass(np.isfinite(image))`.
+
+    Parameters
+    -----------
+       path_rtc: str
+           Path to the RTC burst
+       length: int
+           Number of lines of the burst that fall into the mosaic
+       width: int
+           Number of columns of the burst that fall into the mosaic
+       lines_per_block: int
+           Number of lines to read at once
+
+    Returns
+        center_of_mass: tuple(float)
+            Center of mass (line, column)
+    '''
+    rtc_image_gdal_ds = gdal.Open(path_rtc, gdal.GA_ReadOnly)
+    band_ds = rtc_image_gdal_ds.GetRasterBand(1)
+
+    valid_count = 0
+    line_sum = 0
+    column_sum = 0
+    column_index = np.arange(width, dtype=np.int64)
+    for line_start in range(0, length, lines_per_block):
+        block_length = min(lines_per_block, length - line_start)
+        valid_mask = np.isfinite(
+            band_ds.ReadAsArray(0, line_start, width, block_length))
+        valid_per_line = np.sum(valid_mask, axis=1, dtype=np.int64)
+        valid_count += valid_per_line.sum()
+        line_sum += np.sum(
+            valid_per_line * np.arange(line_start,
+                                       line_start + block_length,
+                                       dtype=np.int64))
+        column_sum += np.sum(
+            np.sum(valid_mask, axis=0, dtype=np.int64) * column_index)
+    rtc_image_gdal_ds = None
+
+    if valid_count == 0:
+        return (np.float64(np.nan), np.float64(np.nan))
+    return (np.int64(line_sum) / np.int64(valid_count),
+            np.int64(column_sum) / np.int64(valid_count))
+
+
+def _get_mosaic_accumulator_dtype(mosaic_mode, datatype):
+    '''
+    Determine the data type used to accumulate the mosaic.
+    The `first` and `bursts_center` modes only copy input values, so
+    that float32 is used whenever it represents the input data type
+    exactly. The `average` mode accumulates weighted sums in float64.
+
+    Parameters
+    -----------
+       mosaic_mode: str
+           Mosaic mode. Choices: "average", "first", and "bursts_center"
+       datatype: int
+           GDAL data type of the input rasters
+
+    Returns
+        accumulator_dtype: np.dtype
+            Data type of the mosaic accumulator
+    '''
+    float32_exact_datatypes = [gdal.GDT_Byte, gdal.GDT_UInt16,
+                               gdal.GDT_Int16, gdal.GDT_Float32]
+    if (mosaic_mode.lower() != 'average' and
+            datatype in float32_exact_datatypes):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def _get_mosaic_lines_per_window(mosaic_info, memory_budget_mb,
+                                 num_prefetch_bursts=0):
+    '''
+    Determine the number of mosaic lines processed at once so that
+    the memory used by the accumulators and the burst subwindows
+    stays within the memory budget.
+
+    Parameters
+    -----------
+       mosaic_info: dict
+           Mosaic geogrid and burst information from
+           `_prepare_mosaic_inputs`
+       memory_budget_mb: float
+           Memory budget in MB. If None, the whole mosaic is processed
+           at once
+       num_prefetch_bursts: int (optional)
+           Number of burst subwindows read ahead of the current burst
+
+    Returns
+        lines_per_window: int
+            Number of mosaic lines per window
+    '''
+    length = mosaic_info['length']
+    if memory_budget_mb is None:
+        return max(length, 1)
+
+    accumulator_itemsize = mosaic_info['accumulator_dtype'].itemsize
+    max_burst_width = max([burst['width'] for burst in mosaic_info['bursts']],
+                          default=0)
+    # auxiliary arrays: denominator (average), or distance, winner,
+    # and last covering burst (bursts_center)
+    auxiliary_itemsize = {'average': 8,
+                          'bursts_center': 16}.get(
+                              mosaic_info['mosaic_mode'], 0)
+    # accumulators, the burst subwindows held in memory (all bands and
+    # nlooks) and the arrays derived from the current burst
+    bytes_per_line = (
+        mosaic_info['width'] *
+        (mosaic_info['num_bands'] * accumulator_itemsize +
+         auxiliary_itemsize) +
+        max_burst_width * 8 *
+        ((num_prefetch_bursts + 1) * (mosaic_info['num_bands'] + 1) + 3))
+    lines_per_window = int(memory_budget_mb * 1024 ** 2 //
+                           max(bytes_per_line, 1))
+    return int(np.clip(lines_per_window, 1, max(length, 1)))
+
+
+def _get_prefetch_executor(num_prefetch_bursts):
+    '''
+    Create the thread pool used to prefetch bursts
+
+    Parameters
+    -----------
+       num_prefetch_bursts: int
+           Number of bursts processed ahead of the current burst.
+           If 0, no thread pool is created
+
+    Returns
+        executor: ThreadPoolExecutor or contextlib.nullcontext
+            Context manager returning the thread pool or None
+    '''
+    if num_prefetch_bursts is None or num_prefetch_bursts < 1:
+        return contextlib.nullcontext()
+    return ThreadPoolExecutor(max_workers=num_prefetch_bursts)
+
+
+def _map_with_prefetch(func, args_list, executor=None, num_prefetch=0):
+    '''
+    Apply a function to a list of arguments and yield the results in
+    the order of the arguments. When a thread pool is provided, up to
+    `num_prefetch` upcoming items are processed in the pool while the
+    caller consumes the current result.
+
+    Parameters
+    -----------
+       func: callable
+           Function to apply
+       args_list: list
+           List of tuples with the positional arguments of `func`
+       executor: ThreadPoolExecutor (optional)
+           Thread pool. If None, the items are processed sequentially
+       num_prefetch: int (optional)
+           Maximum number of items processed ahead of the current item
+
+    Yields
+        result:
+            Result of `func` for each item of `args_list`
+    '''
+    if executor is None or num_prefetch < 1:
+        for args in args_list:
+            yield func(*args)
+        return
+
+    args_iter = iter(args_list)
+    pending_futures = deque(
+        executor.submit(func, *args)
+        for args in itertools.islice(args_iter, num_prefetch))
+    while pending_futures:
+        future = pending_futures.popleft()
+        next_args = next(args_iter, None)
+        if next_args is not None:
+            pending_futures.append(executor.submit(func, *next_args))
+        yield future.result()
+
+
+def _relocate_burst(path_rtc, path_nlooks, geogrid_in, wkt_projection,
+                    scratch_dir=''):
+    '''
+    Reproject the burst RTC and nlooks rasters onto the mosaic geogrid
+    if they are not aligned with it
+
+    Parameters
+    -----------
+       path_rtc: str
+           Path to the RTC burst
+       path_nlooks: str
+           Path to the nlooks raster. None if not available
+       geogrid_in: isce3.product.GeoGridParameters
+           Mosaic geogrid. If None, no reprojection is applied
+       wkt_projection: str
+           Projection of the mosaic in WKT format
+       scratch_dir: str (optional)
+           Directory for temporary files
+
+    Returns
+        relocated_burst: dict
+            Paths to the rasters to be mosaicked, flag indicating if
+            they were reprojected, and time spent reprojecting
+    '''
+    t_start = time.time()
+    relocated_burst = {'path_rtc': path_rtc,
+                       'path_nlooks': path_nlooks,
+                       'relocated': False,
+                       'warp_time': 0.0}
+
+    if geogrid_in is None or not requires_reprojection(
+            geogrid_in, path_rtc, path_nlooks):
+        return relocated_burst
+
+    output_bounds = [
+        geogrid_in.start_x,
+        geogrid_in.start_y + geogrid_in.length * geogrid_in.spacing_y,
+        geogrid_in.start_x + geogrid_in.width * geogrid_in.spacing_x,
+        geogrid_in.start_y]
+
+    relocated_file = tempfile.NamedTemporaryFile(
+        dir=scratch_dir, suffix='.tif').name
+
+    warp_creation_options = gdal.WarpOptions(
+        creationOptions=['COMPRESS=DEFLATE',
+                         'PREDICTOR=2'])
+
+    gdal.Warp(
+        relocated_file, path_rtc,
+        format='GTiff',
+        dstSRS=wkt_projection,
+        outputBounds=output_bounds,
+        multithread=True,
+        xRes=geogrid_in.spacing_x,
+        yRes=abs(geogrid_in.spacing_y),
+        resampleAlg='average',
+        errorThreshold=0,
+        dstNodata=np.nan,
+        options=warp_creation_options
+        )
+    relocated_burst['path_rtc'] = relocated_file
+
+    if path_nlooks is not None:
+        relocated_file_nlooks = tempfile.NamedTemporaryFile(
+            dir=scratch_dir, suffix='.tif').name
+
+        gdal.Warp(
+            relocated_file_nlooks, path_nlooks,
+            format='GTiff',
+            dstSRS=wkt_projection,
+            outputBounds=output_bounds,
+            multithread=True,
+            xRes=geogrid_in.spacing_x,
+            yRes=abs(geogrid_in.spacing_y),
+            resampleAlg='cubic',
+            errorThreshold=0,
+            dstNodata=np.nan)
+        relocated_burst['path_nlooks'] = relocated_file_nlooks
+
+    relocated_burst['relocated'] = True
+    relocated_burst['warp_time'] = time.time() - t_start
+    return relocated_burst
+
+
+def _prepare_mosaic_inputs(list_rtc_images,
+                           list_nlooks,
+                           mosaic_mode,
+                           scratch_dir='',
+                           geogrid_in=None,
+                           temp_files_list=None,
+                           num_prefetch_bursts=0,
+                           verbose=True):
+    '''
+    Determine the mosaic geogrid and the placement of each burst
+    within the mosaic, reprojecting the bursts when necessary.
 
     Parameters
     -----------
@@ -295,11 +576,14 @@ def compute_mosaic_array(list_rtc_images,
             Mutable list of temporary files. If provided,
             paths to the temporary files generated will be
             appended to this list
+       num_prefetch_bursts: int (optional)
+            Number of bursts reprojected concurrently. If 0, the bursts
+            are reprojected sequentially
        verbose: flag (optional)
             Flag to enable (True) or disable (False) the verbose mode
     Returns
-        mosaic_dict: dict
-            Mosaic dictionary
+        mosaic_info: dict
+            Mosaic geogrid and burst information
     '''
 
     mosaic_mode_choices_list = ['average', 'first', 'bursts_center']
@@ -326,6 +610,7 @@ def compute_mosaic_array(list_rtc_images,
         # input RTC rasters
         if num_bands is None:
             num_bands = raster_in.RasterCount
+            datatype = raster_in.GetRasterBand(1).DataType
 
         elif num_bands != raster_in.RasterCount:
             raise ValueError(f'ERROR: the file "{os.path.basename(path_rtc)}"'
@@ -343,12 +628,11 @@ def compute_mosaic_array(list_rtc_images,
     if geogrid_in is None:
         # determine GeoTransformation, posting, dimension, and projection from
         # the input raster
-        for i in range(num_raster):
-            if list_geo_transform[:, 1].max() == list_geo_transform[:, 1].min():
-                posting_x = list_geo_transform[0, 1]
+        if list_geo_transform[:, 1].max() == list_geo_transform[:, 1].min():
+            posting_x = list_geo_transform[0, 1]
 
-            if list_geo_transform[:, 5].max() == list_geo_transform[:, 5].min():
-                posting_y = list_geo_transform[0, 5]
+        if list_geo_transform[:, 5].max() == list_geo_transform[:, 5].min():
+            posting_y = list_geo_transform[0, 5]
 
         # determine the dimension and the upper left corner of the output
         # mosaic
@@ -393,211 +677,577 @@ def compute_mosaic_array(list_rtc_images,
         print('        width:', dim_mosaic[1])
         print('        length:', dim_mosaic[0])
         print('        projection:', wkt_projection)
-        print('        number of bands: {num_bands}')
-
-    if mosaic_mode.lower() == 'average':
-        arr_numerator = np.zeros((num_bands, dim_mosaic[0], dim_mosaic[1]),
-                                 dtype=float)
-        arr_denominator = np.zeros(dim_mosaic, dtype=float)
-    else:
-        arr_numerator = np.full((num_bands, dim_mosaic[0], dim_mosaic[1]),
-                                np.nan, dtype=float)
-        if mosaic_mode.lower() == 'bursts_center':
-            arr_distance = np.full(dim_mosaic, np.nan, dtype=float)
+        print(f'        number of bands: {num_bands}')
 
+    burst_args_list = []
     for i, path_rtc in enumerate(list_rtc_images):
         if i < len(list_nlooks):
             path_nlooks = list_nlooks[i]
         else:
             path_nlooks = None
+        burst_args_list.append((path_rtc, path_nlooks, geogrid_in,
+                                wkt_projection, scratch_dir))
+
+    burst_list = []
+    with _get_prefetch_executor(num_prefetch_bursts) as executor:
+        relocated_bursts = _map_with_prefetch(
+            _relocate_burst, burst_args_list, executor, num_prefetch_bursts)
+
+        for i, relocated_burst in enumerate(relocated_bursts):
+            path_rtc = relocated_burst['path_rtc']
+            path_nlooks = relocated_burst['path_nlooks']
 
-        if verbose:
-            print(f'    mosaicking ({i+1}/{num_raster}): '
-                  f'{os.path.basename(path_rtc)}')
-        if geogrid_in is not None and requires_reprojection(
-                geogrid_in, path_rtc, path_nlooks):
             if verbose:
-                print('        the image requires reprojection/relocation')
-
-                relocated_file = tempfile.NamedTemporaryFile(
-                    dir=scratch_dir, suffix='.tif').name
-
-                print('        reprojecting image to temporary file:',
-                      relocated_file)
-
-            if temp_files_list is not None:
-                temp_files_list.append(relocated_file)
-
-            warp_creation_options = gdal.WarpOptions(
-                creationOptions=['COMPRESS=DEFLATE',
-                                 'PREDICTOR=2'])
-
-            gdal.Warp(
-                relocated_file, path_rtc,
-                format='GTiff',
-                dstSRS=wkt_projection,
-                outputBounds=[
-                    geogrid_in.start_x,
-                    geogrid_in.start_y +
-                    geogrid_in.length * geogrid_in.spacing_y,
-                    geogrid_in.start_x +
-                    geogrid_in.width * geogrid_in.spacing_x,
-                    geogrid_in.start_y],
-                multithread=True,
-                xRes=geogrid_in.spacing_x,
-                yRes=abs(geogrid_in.spacing_y),
-                resampleAlg='average',
-                errorThreshold=0,
-                dstNodata=np.nan,
-                options=warp_creation_options
-                )
-            path_rtc = relocated_file
-
-            if path_nlooks is not None:
-                relocated_file_nlooks = tempfile.NamedTemporaryFile(
-                    dir=scratch_dir, suffix='.tif').name
-
-                print('        reprojecting number of looks layer to temporary'
-                      ' file:', relocated_file_nlooks)
+                print(f'    preparing ({i+1}/{num_raster}): '
+                      f'{os.path.basename(list_rtc_images[i])}')
+
+            if relocated_burst['relocated']:
+                if verbose:
+                    print('        the image requires reprojection/relocation')
+                    print('        reprojected image to temporary file:',
+                          path_rtc)
+                    if path_nlooks is not None:
+                        print('        reprojected number of looks layer to'
+                              ' temporary file:', path_nlooks)
 
                 if temp_files_list is not None:
-                    temp_files_list.append(relocated_file_nlooks)
-
-                gdal.Warp(
-                    relocated_file_nlooks, path_nlooks,
-                    format='GTiff',
-                    dstSRS=wkt_projection,
-                    outputBounds=[
-                        geogrid_in.start_x,
-                        geogrid_in.start_y +
-                        geogrid_in.length * geogrid_in.spacing_y,
-                        geogrid_in.start_x +
-                        geogrid_in.width * geogrid_in.spacing_x,
-                        geogrid_in.start_y],
-                    multithread=True,
-                    xRes=geogrid_in.spacing_x,
-                    yRes=abs(geogrid_in.spacing_y),
-                    resampleAlg='cubic',
-                    errorThreshold=0,
-                    dstNodata=np.nan)
-                path_nlooks = relocated_file_nlooks
-
-            offset_imgx = 0
-            offset_imgy = 0
-        else:
+                    temp_files_list.append(path_rtc)
+                    if path_nlooks is not None:
+                        temp_files_list.append(path_nlooks)
 
-            # calculate the burst RTC's offset wrt. the output mosaic in
-            # the image coordinate
-            offset_imgx = int((list_geo_transform[i, 0] - xmin_mosaic) /
-                              posting_x + 0.5)
-            offset_imgy = int((list_geo_transform[i, 3] - ymax_mosaic) /
-                              posting_y + 0.5)
-
-        if verbose:
-            print('        image offset (x, y): '
-                  f'({offset_imgx}, {offset_imgy})')
-
-        if path_nlooks is not None:
-            nlooks_gdal_ds = gdal.Open(path_nlooks, gdal.GA_ReadOnly)
-            arr_nlooks = nlooks_gdal_ds.ReadAsArray()
-            invalid_ind = np.isnan(arr_nlooks)
-            arr_nlooks[invalid_ind] = 0.0
-        else:
-            arr_nlooks = 1
+                offset_imgx = 0
+                offset_imgy = 0
+            else:
+
+                # calculate the burst RTC's offset wrt. the output mosaic in
+                # the image coordinate
+                offset_imgx = int((list_geo_transform[i, 0] - xmin_mosaic) /
+                                  posting_x + 0.5)
+                offset_imgy = int((list_geo_transform[i, 3] - ymax_mosaic) /
+                                  posting_y + 0.5)
+
+            if verbose:
+                print('        image offset (x, y): '
+                      f'({offset_imgx}, {offset_imgy})')
+
+            rtc_image_gdal_ds = gdal.Open(path_rtc, gdal.GA_ReadOnly)
+            geotransform = rtc_image_gdal_ds.GetGeoTransform()
+
+            # Image needs to be cropped to fit in the mosaic
+            length = max(min(rtc_image_gdal_ds.RasterYSize,
+                             dim_mosaic[0] - offset_imgy), 0)
+            width = max(min(rtc_image_gdal_ds.RasterXSize,
+                            dim_mosaic[1] - offset_imgx), 0)
+            rtc_image_gdal_ds = None
+
+            burst_list.append({'name': os.path.basename(list_rtc_images[i]),
+                               'path_rtc': path_rtc,
+                               'path_nlooks': path_nlooks,
+                               'offset_x': offset_imgx,
+                               'offset_y': offset_imgy,
+                               'length': length,
+                               'width': width,
+                               'geotransform': geotransform,
+                               'center_of_mass': None,
+                               'timing': {
+                                   'warp': relocated_burst['warp_time'],
+                                   'read': 0.0,
+                                   'accumulate': 0.0}})
+
+    mosaic_info = {
+        'bursts': burst_list,
+        'mosaic_mode': mosaic_mode.lower(),
+        'description_list': description_list,
+        'length': dim_mosaic[0],
+        'width': dim_mosaic[1],
+        'num_bands': num_bands,
+        'datatype': datatype,
+        'accumulator_dtype': _get_mosaic_accumulator_dtype(mosaic_mode,
+                                                           datatype),
+        'wkt_projection': wkt_projection,
+        'xmin_mosaic': xmin_mosaic,
+        'ymax_mosaic': ymax_mosaic,
+        'posting_x': posting_x,
+        'posting_y': posting_y
+    }
+    return mosaic_info
 
-        rtc_image_gdal_ds = gdal.Open(path_rtc, gdal.GA_ReadOnly)
 
+def _read_burst_window(burst, burst_x0, burst_y0, sub_width, sub_length,
+                       num_bands):
+    '''
+    Read a subwindow of all bands of the burst RTC and of its
+    nlooks raster
+
+    Parameters
+    -----------
+       burst: dict
+           Burst information from `_prepare_mosaic_inputs`
+       burst_x0: int
+           First column of the subwindow in the burst
+       burst_y0: int
+           First line of the subwindow in the burst
+       sub_width: int
+           Number of columns of the subwindow
+       sub_length: int
+           Number of lines of the subwindow
+       num_bands: int
+           Number of bands of the burst RTC
+
+    Returns
+        burst_window: dict
+            RTC bands, nlooks, and time spent reading
+    '''
+    t_start = time.time()
+    if burst['path_nlooks'] is not None:
+        nlooks_gdal_ds = gdal.Open(burst['path_nlooks'], gdal.GA_ReadOnly)
+        arr_nlooks = nlooks_gdal_ds.ReadAsArray(
+            burst_x0, burst_y0, sub_width, sub_length)
+        invalid_ind = np.isnan(arr_nlooks)
+        arr_nlooks[invalid_ind] = 0.0
+        nlooks_gdal_ds = None
+    else:
+        arr_nlooks = 1
+
+    rtc_image_gdal_ds = gdal.Open(burst['path_rtc'], gdal.GA_ReadOnly)
+    rtc_list = []
+    for i_band in range(num_bands):
+        band_ds = rtc_image_gdal_ds.GetRasterBand(i_band + 1)
+        rtc_list.append(band_ds.ReadAsArray(
+            burst_x0, burst_y0, sub_width, sub_length))
+    rtc_image_gdal_ds = None
+
+    burst_window = {'rtc': rtc_list,
+                    'nlooks': arr_nlooks,
+                    'read_time': time.time() - t_start}
+    return burst_window
+
+
+def _get_burst_subwindows(mosaic_info, line_start, line_end):
+    '''
+    Find the bursts that intersect the mosaic lines [line_start, line_end)
+    and the corresponding subwindows
+
+    Parameters
+    -----------
+       mosaic_info: dict
+           Mosaic geogrid and burst information from
+           `_prepare_mosaic_inputs`
+       line_start: int
+           First mosaic line of the window
+       line_end: int
+           Mosaic line after the last line of the window
+
+    Returns
+        burst_subwindow_list: list
+            List of tuples (burst, burst_x0, burst_y0, window_slice) with
+            the first column and line of the subwindow in the burst, and
+            the slice of the subwindow in the mosaic window, in the
+            input order of the bursts
+    '''
+    burst_subwindow_list = []
+    for burst in mosaic_info['bursts']:
+        # intersection between the burst and the window in the
+        # mosaic image coordinates
+        mosaic_y0 = max(line_start, burst['offset_y'])
+        mosaic_y1 = min(line_end, burst['offset_y'] + burst['length'])
+        mosaic_x0 = max(0, burst['offset_x'])
+        mosaic_x1 = min(mosaic_info['width'],
+                        burst['offset_x'] + burst['width'])
+        if mosaic_y1 <= mosaic_y0 or mosaic_x1 <= mosaic_x0:
+            continue
+
+        burst_y0 = mosaic_y0 - burst['offset_y']
+        burst_x0 = mosaic_x0 - burst['offset_x']
+        window_slice = np.s_[mosaic_y0 - line_start: mosaic_y1 - line_start,
+                             mosaic_x0: mosaic_x1]
+        burst_subwindow_list.append((burst, burst_x0, burst_y0,
+                                     window_slice))
+    return burst_subwindow_list
+
+
+def _compute_bursts_center_window(mosaic_info,
+                                  window_shape,
+                                  burst_subwindow_list,
+                                  no_data_value=np.nan,
+                                  executor=None,
+                                  num_prefetch_bursts=0):
+    '''
+    Mosaic a window in the `bursts_center` mode. Each pixel is assigned
+    to the burst whose center is the nearest, with ties going to the
+    later burst. The assignment only depends on the burst centers and
+    extents, so it is resolved before reading any data, and each burst
+    is then read only over the bounding box of the pixels it wins.
+
+    Parameters
+    -----------
+       mosaic_info: dict
+           Mosaic geogrid and burst information from
+           `_prepare_mosaic_inputs`
+       window_shape: tuple(int)
+           Shape (lines, width) of the mosaic window
+       burst_subwindow_list: list
+           Bursts intersecting the window from `_get_burst_subwindows`
+       no_data_value: float (optional)
+           Value of the invalid pixels in the input rasters
+       executor: ThreadPoolExecutor (optional)
+           Thread pool used to read the burst subwindows ahead
+       num_prefetch_bursts: int (optional)
+           Number of burst subwindows read ahead of the current burst
+
+    Returns
+        arr_numerator: np.ndarray
+            Mosaic window with shape (num_bands, lines, width)
+    '''
+    num_bands = mosaic_info['num_bands']
+    arr_numerator = np.full((num_bands, *window_shape), np.nan,
+                            dtype=mosaic_info['accumulator_dtype'])
+
+    # Bursts without valid pixels have no center. Their distance is
+    # infinite, so that they only take pixels not covered by any other
+    # burst before them, and lose them to any burst after them.
+    arr_distance = np.full(window_shape, np.inf, dtype=np.float64)
+    arr_winner = np.full(window_shape, -1, dtype=np.int32)
+    arr_last_cover = np.full(window_shape, -1, dtype=np.int32)
+
+    for burst_index, (burst, burst_x0, burst_y0, window_slice) in \
+            enumerate(burst_subwindow_list):
+        t_start = time.time()
+        sub_shape = (window_slice[0].stop - window_slice[0].start,
+                     window_slice[1].stop - window_slice[1].start)
+        arr_new_distance = _compute_distance_to_burst_center(
+            sub_shape, burst['geotransform'], burst['center_of_mass'],
+            line_offset=burst_y0, column_offset=burst_x0)
+        arr_new_distance[np.isnan(arr_new_distance)] = np.inf
+
+        arr_distance_temp = arr_distance[window_slice]
+        ind = arr_new_distance <= arr_distance_temp
+        arr_distance_temp[ind] = arr_new_distance[ind]
+        arr_winner[window_slice][ind] = burst_index
+        arr_last_cover[window_slice] = burst_index
+        burst['timing']['accumulate'] += time.time() - t_start
+
+    del arr_distance
+
+    # read each burst over the bounding box of the pixels it wins
+    read_list = []
+    read_args_list = []
+    for burst_index, (burst, burst_x0, burst_y0, window_slice) in \
+            enumerate(burst_subwindow_list):
+        win_mask = arr_winner[window_slice] == burst_index
+        win_lines = np.flatnonzero(win_mask.any(axis=1))
+        if win_lines.size == 0:
+            continue
+        win_columns = np.flatnonzero(win_mask.any(axis=0))
+        box_y0, box_y1 = win_lines[0], win_lines[-1] + 1
+        box_x0, box_x1 = win_columns[0], win_columns[-1] + 1
+        box_slice = np.s_[window_slice[0].start + box_y0:
+                          window_slice[0].start + box_y1,
+                          window_slice[1].start + box_x0:
+                          window_slice[1].start + box_x1]
+        read_list.append((burst, box_slice,
+                          win_mask[box_y0:box_y1, box_x0:box_x1]))
+        read_args_list.append((burst, burst_x0 + box_x0, burst_y0 + box_y0,
+                               box_x1 - box_x0, box_y1 - box_y0, num_bands))
+
+    burst_window_iter = _map_with_prefetch(
+        _read_burst_window, read_args_list, executor, num_prefetch_bursts)
+
+    for (burst, box_slice, win_mask), burst_window in zip(
+            read_list, burst_window_iter):
+        t_start = time.time()
+        for i_band in range(num_bands):
+            arr_numerator[i_band][box_slice][win_mask] = \
+                burst_window['rtc'][i_band][win_mask]
+        burst['timing']['read'] += burst_window['read_time']
+        burst['timing']['accumulate'] += time.time() - t_start
+        del burst_window
+
+    # A pixel whose value is the no-data value is invalidated when a
+    # later burst covers it, as done in the `first` mode
+    if not np.isnan(no_data_value):
+        covered_later = arr_last_cover > arr_winner
         for i_band in range(num_bands):
+            arr_numerator[i_band][
+                covered_later & (arr_numerator[i_band] == no_data_value)] = \
+                np.nan
 
-            band_ds = rtc_image_gdal_ds.GetRasterBand(i_band + 1)
-            arr_rtc = band_ds.ReadAsArray()
+    return arr_numerator
 
-            if i_band == 0:
-                length = min(arr_rtc.shape[0], dim_mosaic[0] - offset_imgy)
-                width = min(arr_rtc.shape[1], dim_mosaic[1] - offset_imgx)
 
-            if (length != arr_rtc.shape[0] or
-                    width != arr_rtc.shape[1]):
-                # Image needs to be cropped to fit in the mosaic
-                arr_rtc = arr_rtc[0:length, 0:width]
+def _compute_mosaic_window(mosaic_info,
+                           line_start,
+                           line_end,
+                           no_data_value=np.nan,
+                           executor=None,
+                           num_prefetch_bursts=0):
+    '''
+    Mosaic the bursts over the mosaic lines [line_start, line_end),
+    reading only the burst subwindows that intersect those lines.
+    The bursts are accumulated in their input order, while the
+    subwindows of the next bursts may be read concurrently.
+
+    Parameters
+    -----------
+       mosaic_info: dict
+           Mosaic geogrid and burst information from
+           `_prepare_mosaic_inputs`
+       line_start: int
+           First mosaic line of the window
+       line_end: int
+           Mosaic line after the last line of the window
+       no_data_value: float (optional)
+           Value of the invalid pixels in the input rasters for the
+           `first` and `bursts_center` modes
+       executor: ThreadPoolExecutor (optional)
+           Thread pool used to read the burst subwindows ahead
+       num_prefetch_bursts: int (optional)
+           Number of burst subwindows read ahead of the current burst
+
+    Returns
+        arr_numerator: np.ndarray
+            Mosaic window with shape (num_bands, lines, width)
+    '''
+    mosaic_mode = mosaic_info['mosaic_mode']
+    num_bands = mosaic_info['num_bands']
+    window_shape = (line_end - line_start, mosaic_info['width'])
+    burst_subwindow_list = _get_burst_subwindows(mosaic_info, line_start,
+                                                 line_end)
+
+    if mosaic_mode == 'bursts_center':
+        return _compute_bursts_center_window(
+            mosaic_info, window_shape, burst_subwindow_list,
+            no_data_value=no_data_value, executor=executor,
+            num_prefetch_bursts=num_prefetch_bursts)
+
+    if mosaic_mode == 'average':
+        arr_numerator = np.zeros((num_bands, *window_shape),
+                                 dtype=mosaic_info['accumulator_dtype'])
+        arr_denominator = np.zeros(window_shape, dtype=np.float64)
+    else:
+        arr_numerator = np.full((num_bands, *window_shape), np.nan,
+                                dtype=mosaic_info['accumulator_dtype'])
+
+    read_args_list = [
+        (burst, burst_x0, burst_y0,
+         window_slice[1].stop - window_slice[1].start,
+         window_slice[0].stop - window_slice[0].start,
+         num_bands)
+        for burst, burst_x0, burst_y0, window_slice in burst_subwindow_list]
+
+    burst_window_iter = _map_with_prefetch(
+        _read_burst_window, read_args_list, executor, num_prefetch_bursts)
 
-            if mosaic_mode.lower() == 'average':
+    for (burst, _, _, window_slice), burst_window in zip(
+            burst_subwindow_list, burst_window_iter):
+        t_start = time.time()
+        arr_nlooks = burst_window['nlooks']
+
+        for i_band in range(num_bands):
+
+            arr_rtc = burst_window['rtc'][i_band]
+
+            if mosaic_mode == 'average':
                 # Replace NaN values with 0
                 arr_rtc[np.isnan(arr_rtc)] = 0.0
 
-                arr_numerator[i_band,
-                              offset_imgy: offset_imgy + length,
-                              offset_imgx: offset_imgx + width] += \
-                    arr_rtc * arr_nlooks
+                arr_numerator[i_band][window_slice] += arr_rtc * arr_nlooks
 
-                if path_nlooks is not None:
-                    arr_denominator[
-                        offset_imgy: offset_imgy + length,
-                        offset_imgx: offset_imgx + width] += arr_nlooks
+                if i_band > 0:
+                    continue
+                if burst['path_nlooks'] is not None:
+                    arr_denominator[window_slice] += arr_nlooks
                 else:
-                    arr_denominator[
-                        offset_imgy: offset_imgy + length,
-                        offset_imgx: offset_imgx + width] += np.asarray(
+                    arr_denominator[window_slice] += np.asarray(
                         arr_rtc > 0, dtype=np.byte)
 
                 continue
 
-            arr_temp = arr_numerator[i_band, offset_imgy: offset_imgy + length,
-                                     offset_imgx: offset_imgx + width].copy()
+            arr_temp = arr_numerator[i_band][window_slice].copy()
             if not np.isnan(no_data_value):
                 arr_temp[arr_temp == no_data_value] = np.nan
 
-            if i_band == 0 and mosaic_mode.lower() == 'first':
+            if i_band == 0:
                 ind = np.isnan(arr_temp)
-            elif i_band == 0 and mosaic_mode.lower() == 'bursts_center':
-                geotransform = rtc_image_gdal_ds.GetGeoTransform()
-
-                arr_new_distance = _compute_distance_to_burst_center(
-                    arr_rtc, geotransform)
-
-                arr_distance_temp = arr_distance[
-                    offset_imgy: offset_imgy + length,
-                    offset_imgx: offset_imgx + width]
-                ind = np.logical_or(np.isnan(arr_distance_temp),
-                                    arr_new_distance <= arr_distance_temp)
-
-                arr_distance_temp[ind] = arr_new_distance[ind]
-                arr_distance[
-                    offset_imgy: offset_imgy + length,
-                    offset_imgx: offset_imgx + width] = arr_distance_temp
-
-                del arr_distance_temp
 
             arr_temp[ind] = arr_rtc[ind]
-            arr_numerator[i_band,
-                          offset_imgy: offset_imgy + length,
-                          offset_imgx: offset_imgx + width] = arr_temp
+            arr_numerator[i_band][window_slice] = arr_temp
 
-        rtc_image_gdal_ds = None
-        nlooks_gdal_ds = None
+        burst['timing']['read'] += burst_window['read_time']
+        burst['timing']['accumulate'] += time.time() - t_start
+        del burst_window
 
-    if mosaic_mode.lower() == 'average':
+    if mosaic_mode == 'average':
         # Mode: average
         # `arr_numerator` holds the accumulated sum. Now, we divide it
         # by `arr_denominator` to get the average value
+        valid_ind = arr_denominator > 0
         for i_band in range(num_bands):
-            valid_ind = arr_denominator > 0
             arr_numerator[i_band][valid_ind] = \
                 arr_numerator[i_band][valid_ind] / arr_denominator[valid_ind]
 
             arr_numerator[i_band][arr_denominator == 0] = np.nan
 
+    return arr_numerator
+
+
+def _iterate_mosaic_windows(mosaic_info,
+                            memory_budget_mb=None,
+                            no_data_value=np.nan,
+                            num_prefetch_bursts=0):
+    '''
+    Generate the mosaic in windows of lines whose size is determined
+    by the memory budget
+
+    Parameters
+    -----------
+       mosaic_info: dict
+           Mosaic geogrid and burst information from
+           `_prepare_mosaic_inputs`
+       memory_budget_mb: float (optional)
+           Memory budget in MB. If None, the whole mosaic is
+           generated in a single window
+       no_data_value: float (optional)
+           Value of the invalid pixels in the input rasters for the
+           `first` and `bursts_center` modes
+       num_prefetch_bursts: int (optional)
+           Number of bursts read ahead of the current burst on a
+           thread pool. If 0, the bursts are read sequentially
+
+    Yields
+        line_start: int
+            First mosaic line of the window
+        arr_window: np.ndarray
+            Mosaic window with shape (num_bands, lines, width)
+    '''
+    lines_per_window = _get_mosaic_lines_per_window(
+        mosaic_info, memory_budget_mb,
+        num_prefetch_bursts=num_prefetch_bursts)
+
+    with _get_prefetch_executor(num_prefetch_bursts) as executor:
+        if mosaic_info['mosaic_mode'] == 'bursts_center':
+            # the distance to the burst center requires the center of mass
+            # of the entire burst, which is computed before mosaicking.
+            center_of_mass_iter = _map_with_prefetch(
+                _compute_burst_center_of_mass,
+                [(burst['path_rtc'], burst['length'], burst['width'],
+                  lines_per_window) for burst in mosaic_info['bursts']],
+                executor, num_prefetch_bursts)
+            for burst, center_of_mass in zip(mosaic_info['bursts'],
+                                             center_of_mass_iter):
+                burst['center_of_mass'] = center_of_mass
+
+        for line_start in range(0, mosaic_info['length'], lines_per_window):
+            line_end = min(line_start + lines_per_window,
+                           mosaic_info['length'])
+            yield line_start, _compute_mosaic_window(
+                mosaic_info, line_start, line_end,
+                no_data_value=no_data_value,
+                executor=executor,
+                num_prefetch_bursts=num_prefetch_bursts)
+
+
+def _log_mosaic_timing(mosaic_info, elapsed_time):
+    '''
+    Report the time spent reprojecting, reading, and accumulating
+    each burst, and how much of it overlapped
+
+    Parameters
+    -----------
+       mosaic_info: dict
+           Mosaic geogrid and burst information from
+           `_prepare_mosaic_inputs`
+       elapsed_time: float
+           Wall-clock time of the whole mosaic in seconds
+    '''
+    total_io_time = 0
+    total_accumulate_time = 0
+    logger.info('    mosaic time per burst (warp / read / accumulate):')
+    for burst in mosaic_info['bursts']:
+        timing = burst['timing']
+        logger.info(f"        {burst['name']}: {timing['warp']:.3f} / "
+                    f"{timing['read']:.3f} / {timing['accumulate']:.3f} sec")
+        total_io_time += timing['warp'] + timing['read']
+        total_accumulate_time += timing['accumulate']
+
+    overlap_time = max(total_io_time + total_accumulate_time - elapsed_time,
+                       0)
+    logger.info(f'    mosaic I/O time: {total_io_time:.3f} sec, '
+                f'accumulation time: {total_accumulate_time:.3f} sec, '
+                f'elapsed time: {elapsed_time:.3f} sec, '
+                f'overlapped time: {overlap_time:.3f} sec')
+
+
+def compute_mosaic_array(list_rtc_images,
+                         list_nlooks,
+                         mosaic_mode,
+                         scratch_dir='',
+                         geogrid_in=None,
+                         temp_files_list=None,
+                         no_data_value=np.nan,
+                         num_prefetch_bursts=0,
+                         verbose=True):
+    '''
+    Mosaic S-1 geobursts and return the mosaic as dictionary
+
+    Parameters
+    -----------
+       list_rtc: list
+           List of the path to the rtc geobursts
+       list_nlooks: list
+           List of the nlooks raster that corresponds to list_rtc
+       mosaic_mode: str
+            Mosaic mode. Choices: "average", "first", and "bursts_center"
+       scratch_dir: str (optional)
+            Directory for temporary files
+       geogrid_in: isce3.product.GeoGridParameters, default: None
+            Geogrid information to determine the output mosaic's shape and
+            projection. The geogrid of the output mosaic will automatically
+            determined when it is None
+       temp_files_list: list (optional)
+            Mutable list of temporary files. If provided,
+            paths to the temporary files generated will be
+            appended to this list
+       num_prefetch_bursts: int (optional)
+            Number of bursts reprojected and read ahead of the
+            burst being accumulated. If 0, the bursts are processed
+            sequentially
+       verbose: flag (optional)
+            Flag to enable (True) or disable (False) the verbose mode
+    Returns
+        mosaic_dict: dict
+            Mosaic dictionary
+    '''
+    t_start = time.time()
+    mosaic_info = _prepare_mosaic_inputs(
+        list_rtc_images, list_nlooks, mosaic_mode, scratch_dir=scratch_dir,
+        geogrid_in=geogrid_in, temp_files_list=temp_files_list,
+        num_prefetch_bursts=num_prefetch_bursts, verbose=verbose)
+
+    arr_numerator = np.full(
+        (mosaic_info['num_bands'], mosaic_info['length'],
+         mosaic_info['width']),
+        np.nan, dtype=mosaic_info['accumulator_dtype'])
+    for line_start, arr_window in _iterate_mosaic_windows(
+            mosaic_info, no_data_value=no_data_value,
+            num_prefetch_bursts=num_prefetch_bursts):
+        arr_numerator[:, line_start: line_start + arr_window.shape[1]] = \
+            arr_window
+
+    if verbose:
+        _log_mosaic_timing(mosaic_info, time.time() - t_start)
+
     mosaic_dict = {
         'mosaic_array': arr_numerator,
-        'description_list': description_list,
-        'length': dim_mosaic[0],
-        'width': dim_mosaic[1],
-        'num_bands': num_bands,
-        'wkt_projection': wkt_projection,
-        'xmin_mosaic': xmin_mosaic,
-        'ymax_mosaic': ymax_mosaic,
-        'posting_x': posting_x,
-        'posting_y': posting_y
+        'description_list': mosaic_info['description_list'],
+        'length': mosaic_info['length'],
+        'width': mosaic_info['width'],
+        'num_bands': mosaic_info['num_bands'],
+        'wkt_projection': mosaic_info['wkt_projection'],
+        'xmin_mosaic': mosaic_info['xmin_mosaic'],
+        'ymax_mosaic': mosaic_info['ymax_mosaic'],
+        'posting_x': mosaic_info['posting_x'],
+        'posting_y': mosaic_info['posting_y']
     }
     return mosaic_dict
 
@@ -605,9 +1255,12 @@ def compute_mosaic_array(list_rtc_images,
 def mosaic_single_output_file(list_rtc_images, list_nlooks, mosaic_filename,
                               mosaic_mode, scratch_dir='', geogrid_in=None,
                               temp_files_list=None, no_data_value=np.nan,
+                              memory_budget_mb=1024, num_prefetch_bursts=0,
                               verbose=True):
     '''
-    Mosaic RTC images saving the output into a single multi-band file
+    Mosaic RTC images saving the output into a single multi-band file.
+    The mosaic is computed in windows of lines that are written
+    directly into the output file.
 
     Parameters
     -----------
@@ -627,51 +1280,63 @@ def mosaic_single_output_file(list_rtc_images, list_nlooks, mosaic_filename,
             Mutable list of temporary files. If provided,
             paths to the temporary files generated will be
             appended to this list
+        memory_budget_mb: float (optional)
+            Memory budget in MB for a mosaic window. If None,
+            the whole mosaic is computed at once
+        num_prefetch_bursts: int (optional)
+            Number of bursts reprojected and read ahead of the
+            burst being accumulated. If 0, the bursts are processed
+            sequentially
         verbose : bool
             Flag to enable/disable the verbose mode
     '''
-    mosaic_dict = compute_mosaic_array(
+    t_start = time.time()
+    mosaic_info = _prepare_mosaic_inputs(
         list_rtc_images, list_nlooks, mosaic_mode, scratch_dir=scratch_dir,
         geogrid_in=geogrid_in, temp_files_list=temp_files_list,
-        verbose=verbose, no_data_value=no_data_value)
-
-    arr_numerator = mosaic_dict['mosaic_array']
-    description_list = mosaic_dict['description_list']
-    length = mosaic_dict['length']
-    width = mosaic_dict['width']
-    num_bands = mosaic_dict['num_bands']
-    wkt_projection = mosaic_dict['wkt_projection']
-    xmin_mosaic = mosaic_dict['xmin_mosaic']
-    ymax_mosaic = mosaic_dict['ymax_mosaic']
-    posting_x = mosaic_dict['posting_x']
-    posting_y = mosaic_dict['posting_y']
-
-    # Retrieve the datatype information from the first input image
-    reference_raster = gdal.Open(list_rtc_images[0], gdal.GA_ReadOnly)
-    datatype_mosaic = reference_raster.GetRasterBand(1).DataType
-    reference_raster = None
+        num_prefetch_bursts=num_prefetch_bursts, verbose=verbose)
+
+    num_bands = mosaic_info['num_bands']
 
     # Write out the array
     drv_out = gdal.GetDriverByName('Gtiff')
     raster_out = drv_out.Create(mosaic_filename,
-                                width, length, num_bands,
-                                datatype_mosaic)
+                                mosaic_info['width'], mosaic_info['length'],
+                                num_bands, mosaic_info['datatype'])
 
-    raster_out.SetGeoTransform((xmin_mosaic, posting_x, 0,
-                                ymax_mosaic, 0, posting_y))
-    raster_out.SetProjection(wkt_projection)
+    raster_out.SetGeoTransform((mosaic_info['xmin_mosaic'],
+                                mosaic_info['posting_x'], 0,
+                                mosaic_info['ymax_mosaic'], 0,
+                                mosaic_info['posting_y']))
+    raster_out.SetProjection(mosaic_info['wkt_projection'])
 
     for i_band in range(num_bands):
         gdal_band = raster_out.GetRasterBand(i_band+1)
-        gdal_band.WriteArray(arr_numerator[i_band])
-        gdal_band.SetDescription(description_list[i_band])
+        gdal_band.SetDescription(mosaic_info['description_list'][i_band])
+
+    for line_start, arr_window in _iterate_mosaic_windows(
+            mosaic_info, memory_budget_mb=memory_budget_mb,
+            no_data_value=no_data_value,
+            num_prefetch_bursts=num_prefetch_bursts):
+        for i_band in range(num_bands):
+            gdal_band = raster_out.GetRasterBand(i_band+1)
+            gdal_band.WriteArray(arr_window[i_band], xoff=0, yoff=line_start)
+
+    raster_out.FlushCache()
+    raster_out = None
+
+    if verbose:
+        _log_mosaic_timing(mosaic_info, time.time() - t_start)
 
 
 def mosaic_multiple_output_files(
         list_rtc_images, list_nlooks, output_file_list, mosaic_mode,
-        scratch_dir='', geogrid_in=None, temp_files_list=None, verbose=True):
+        scratch_dir='', geogrid_in=None, temp_files_list=None,
+        memory_budget_mb=1024, num_prefetch_bursts=0, verbose=True):
     '''
-    Mosaic RTC images saving each mosaicked band into a separate file
+    Mosaic RTC images saving each mosaicked band into a separate file.
+    The mosaic is computed in windows of lines that are written
+    directly into the output files.
 
     Paremeters:
     -----------
@@ -693,52 +1358,62 @@ def mosaic_multiple_output_files(
             Mutable list of temporary files. If provided,
             paths to the temporary files generated will be
             appended to this list
+        memory_budget_mb: float (optional)
+            Memory budget in MB for a mosaic window. If None,
+            the whole mosaic is computed at once
+        num_prefetch_bursts: int (optional)
+            Number of bursts reprojected and read ahead of the
+            burst being accumulated. If 0, the bursts are processed
+            sequentially
         verbose : bool
             Flag to enable/disable the verbose mode
 
     '''
-    mosaic_dict = compute_mosaic_array(
+    t_start = time.time()
+    mosaic_info = _prepare_mosaic_inputs(
         list_rtc_images, list_nlooks, mosaic_mode, scratch_dir=scratch_dir,
         geogrid_in=geogrid_in, temp_files_list=temp_files_list,
-        verbose=verbose)
-
-    arr_numerator = mosaic_dict['mosaic_array']
-    length = mosaic_dict['length']
-    width = mosaic_dict['width']
-    num_bands = mosaic_dict['num_bands']
-    wkt_projection = mosaic_dict['wkt_projection']
-    xmin_mosaic = mosaic_dict['xmin_mosaic']
-    ymax_mosaic = mosaic_dict['ymax_mosaic']
-    posting_x = mosaic_dict['posting_x']
-    posting_y = mosaic_dict['posting_y']
+        num_prefetch_bursts=num_prefetch_bursts, verbose=verbose)
 
+    num_bands = mosaic_info['num_bands']
     if num_bands != len(output_file_list):
         error_str = (f'ERROR number of output files ({len(output_file_list)})'
                      ' does not match with the number'
                      f' of input bursts` bands ({num_bands})')
         raise ValueError(error_str)
 
-    for i_band, output_file in enumerate(output_file_list):
-
-        # Retrieve the datatype information from the first input image
-        reference_raster = gdal.Open(list_rtc_images[0], gdal.GA_ReadOnly)
-        datatype_mosaic = reference_raster.GetRasterBand(1).DataType
-        reference_raster = None
-
+    raster_out_list = []
+    for output_file in output_file_list:
         # Write out the array
         drv_out = gdal.GetDriverByName('Gtiff')
         nbands = 1
         raster_out = drv_out.Create(output_file,
-                                    width, length, nbands,
-                                    datatype_mosaic)
+                                    mosaic_info['width'],
+                                    mosaic_info['length'],
+                                    nbands,
+                                    mosaic_info['datatype'])
+
+        raster_out.SetGeoTransform((mosaic_info['xmin_mosaic'],
+                                    mosaic_info['posting_x'], 0,
+                                    mosaic_info['ymax_mosaic'], 0,
+                                    mosaic_info['posting_y']))
+
+        raster_out.SetProjection(mosaic_info['wkt_projection'])
+        raster_out_list.append(raster_out)
+
+    for line_start, arr_window in _iterate_mosaic_windows(
+            mosaic_info, memory_budget_mb=memory_budget_mb,
+            num_prefetch_bursts=num_prefetch_bursts):
+        for i_band, raster_out in enumerate(raster_out_list):
+            raster_out.GetRasterBand(1).WriteArray(
+                arr_window[i_band], xoff=0, yoff=line_start)
+
+    for raster_out in raster_out_list:
+        raster_out.FlushCache()
+    raster_out_list = None
 
-        raster_out.SetGeoTransform((xmin_mosaic, posting_x, 0,
-                                    ymax_mosaic, 0, posting_y))
-
-        raster_out.SetProjection(wkt_projection)
-
-        # for i_band in range(num_bands):
-        raster_out.GetRasterBand(1).WriteArray(arr_numerator[i_band])
+    if verbose:
+        _log_mosaic_timing(mosaic_info, time.time() - t_start)
 
 
 def run(cfg):
@@ -761,6 +1436,8 @@ def run(cfg):
     mosaic_cfg = cfg.groups.processing.mosaic
 
     mosaic_mode = mosaic_cfg.mosaic_mode
+    memory_budget_mb = mosaic_cfg.memory_budget_mb
+    num_prefetch_bursts = mosaic_cfg.num_prefetch_bursts
     product_prefix = processing_cfg.mosaic.mosaic_prefix
     pol_list = copy.deepcopy(processing_cfg.polarizations)
 
@@ -911,7 +1588,9 @@ def run(cfg):
                         rtc_burst_imagery_list, nlooks_list, geo_pol_filename,
                         mosaic_mode, scratch_dir=scratch_path,
                         geogrid_in=geogrid_in, temp_files_list=None,
-                        no_data_value=0)
+                        no_data_value=0,
+                        memory_budget_mb=memory_budget_mb,
+                        num_prefetch_bursts=num_prefetch_bursts)
 
         if mask_list:
             geo_mask_filename = \
@@ -923,7 +1602,9 @@ def run(cfg):
                 mask_list, nlooks_list, geo_mask_filename,
                 mosaic_mode, scratch_dir=scratch_path,
                 geogrid_in=geogrid_in, temp_files_list=None,
-                no_data_value=255)
+                no_data_value=255,
+                memory_budget_mb=memory_budget_mb,
+                num_prefetch_bursts=num_prefetch_bursts)
 
         # save files as COG format.
         if processing_cfg.mosaic.mosaic_cog_enable:
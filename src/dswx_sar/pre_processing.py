@@ -1,3 +1,4 @@
+import contextlib
 import copy
 import glob
 import logging
@@ -9,6 +10,7 @@ import shutil
 import tempfile
 import time
 
+from joblib import Parallel, delayed
 from osgeo import gdal, osr, ogr
 from pathlib import Path
 
@@ -145,7 +147,7 @@ class AncillaryRelocation:
             temp_files_list=None,
             no_data=no_data)
 
-        dswx_sar_util._save_as_cog(
+        dswx_sar_util.save_scratch_raster(
             os.path.join(self.scratch_dir, relocated_file_str),
             self.scratch_dir)
 
@@ -541,42 +543,399 @@ def replace_reference_water_nodata_from_ancillary(
 
     landcover_label = get_label_landcover_esa_10()
 
-    for block_param in block_params:
-        ref_water_block, landcover_block, hand_block = [
-            dswx_sar_util.get_raster_block(path, block_param)
-            for path in [temp_water_path,
-                         landcover_path,
-                         hand_path]]
-
-        # Both invalid and no-water areas have zero value
-        # in reference water. The area with zero values are
-        # replaced with maximum values where the permanent water
-        # area in landcover.
-
-        replaced_area = np.logical_and(
-            ref_water_block == reference_water_no_data,
-            landcover_block == landcover_label['Permanent water bodies'])
-
-        no_data_area = np.logical_and(
-            ref_water_block == reference_water_no_data,
-            hand_block <= 0.002)
-        ref_water_block[no_data_area | replaced_area] = reference_water_max
-
-        replaced_area = np.logical_and(
-            ref_water_block == reference_water_no_data,
-            landcover_block != landcover_label['Permanent water bodies'])
-        ref_water_block[replaced_area] = 0
-
-        # write updated reference water
-        dswx_sar_util.write_raster_block(
-            out_raster=reference_water_path,
-            data=ref_water_block,
-            block_param=block_param,
+    with dswx_sar_util.RasterBlockWriter(
+            reference_water_path,
             geotransform=im_meta['geotransform'],
             projection=im_meta['projection'],
             datatype='float32',
-            cog_flag=True,
-            scratch_dir=scratch_dir)
+            scratch_dir=scratch_dir) as ref_water_writer:
+        for block_param in block_params:
+            ref_water_block, landcover_block, hand_block = [
+                dswx_sar_util.get_raster_block(path, block_param)
+                for path in [temp_water_path,
+                             landcover_path,
+                             hand_path]]
+
+            # Both invalid and no-water areas have zero value
+            # in reference water. The area with zero values are
+            # replaced with maximum values where the permanent water
+            # area in landcover.
+
+            replaced_area = np.logical_and(
+                ref_water_block == reference_water_no_data,
+                landcover_block == landcover_label['Permanent water bodies'])
+
+            no_data_area = np.logical_and(
+                ref_water_block == reference_water_no_data,
+                hand_block <= 0.002)
+            ref_water_block[no_data_area | replaced_area] = reference_water_max
+
+            replaced_area = np.logical_and(
+                ref_water_block == reference_water_no_data,
+                landcover_block != landcover_label['Permanent water bodies'])
+            ref_water_block[replaced_area] = 0
+
+            # write updated reference water
+            ref_water_writer.write_block(ref_water_block, block_param)
+
+
+def get_filtering_method(filter_method, filter_options):
+    """Get the speckle filter and its options from the filter
+    runconfig group.
+
+    Parameters
+    ----------
+    filter_method: str
+        'lee', 'anisotropic_diffusion', 'guided_filter', or 'bregman'
+    filter_options: RunConfig
+        filter group of the runconfig
+
+    Returns
+    -------
+    filtering_method: callable
+        filter function of `filter_SAR`
+    filter_option: dict
+        keyword arguments of the filter function
+    """
+    if filter_method == 'lee':
+        filtering_method = filter_SAR.lee_enhanced_filter
+        filter_option = vars(filter_options.lee_filter)
+
+    elif filter_method == 'anisotropic_diffusion':
+        filtering_method = filter_SAR.anisotropic_diffusion
+        filter_option = vars(filter_options.anisotropic_diffusion)
+
+    elif filter_method == 'guided_filter':
+        filtering_method = filter_SAR.guided_filter
+        filter_option = vars(filter_options.guided_filter)
+
+    elif filter_method == 'bregman':
+        filtering_method = filter_SAR.tv_bregman
+        filter_option = vars(filter_options.bregman)
+    else:
+        err_msg = f'Invalid filter method: {filter_method}'
+        raise ValueError(err_msg)
+
+    return filtering_method, filter_option
+
+
+def _to_filtered_image_band(band):
+    """Cast a band of the filtered image to float32 and replace
+    zero values with NaN."""
+    band = np.array(band, dtype='float32')
+    band[band == 0] = np.nan
+    return band
+
+
+def compute_filtered_band(block_param,
+                          pol,
+                          intensity_path=None,
+                          band_ind=None,
+                          ratio_paths=None,
+                          filtering_method=None,
+                          filter_option=None):
+    """Compute a band of the filtered image for a padded block.
+    The inputs are read by the function itself, so that it can
+    run in a worker process.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        Object specifying where to read the block and its padding
+    pol: str
+        Polarization, 'ratio', or 'span'
+    intensity_path: str
+        Intensity raster of `pol`
+    band_ind: int, optional
+        If given, the band of `intensity_path` is read as a whole
+        (i.e., for a single RTC input) instead of the block.
+    ratio_paths: list
+        Co- and cross-polarization rasters for 'ratio' and 'span'
+    filtering_method: callable, optional
+        Filter function applied to the intensity.
+        If None, the intensity is not filtered.
+    filter_option: dict
+        Keyword arguments of `filtering_method`
+
+    Returns
+    -------
+    band_dict: dict
+        Filtered band of the padded block in float32 keyed by `pol`.
+        Zero values are replaced with NaN.
+    """
+    if pol in ['ratio', 'span']:
+        temp_raster_set = []
+        for filename in ratio_paths:
+            block_data = dswx_sar_util.get_raster_block(
+                filename,
+                block_param)
+            temp_raster_set.append(block_data)
+
+        temp_raster_set = np.array(temp_raster_set)
+        if pol in ['ratio']:
+            filtered_band = pol_ratio(np.squeeze(temp_raster_set[0, :, :]),
+                                      np.squeeze(temp_raster_set[1, :, :]))
+        else:
+            filtered_band = np.squeeze(temp_raster_set[0, :, :] +
+                                       2 * temp_raster_set[1, :, :])
+    else:
+        if band_ind is None:
+            intensity = dswx_sar_util.get_raster_block(
+                intensity_path, block_param)
+        else:
+            intensity = dswx_sar_util.read_geotiff(
+                intensity_path, band_ind=band_ind)
+        # need to replace 0 value in padded area to NaN.
+        intensity[intensity == 0] = np.nan
+        if filtering_method is not None:
+            filtered_band = filtering_method(intensity, **filter_option)
+        else:
+            filtered_band = intensity
+
+    return {pol: _to_filtered_image_band(filtered_band)}
+
+
+def compute_polarimetric_bands(block_param,
+                               copol,
+                               crosspol,
+                               copol_path,
+                               crosspol_path,
+                               band_list,
+                               filtering_method=None,
+                               filter_option=None,
+                               ratio_filtering_method=None,
+                               ratio_filter_option=None):
+    """Compute the co- and cross-polarization bands of the filtered
+    image and the layers derived from them for a padded block.
+    Each polarization is read once.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        Object specifying where to read the block and its padding
+    copol: str
+        Co-polarization (e.g., 'VV')
+    crosspol: str
+        Cross-polarization (e.g., 'VH')
+    copol_path: str
+        Intensity raster of `copol`
+    crosspol_path: str
+        Intensity raster of `crosspol`
+    band_list: list
+        Bands to compute among `copol`, `crosspol`, 'ratio', 'span',
+        and 'filtered_ratio'. 'ratio' and 'span' are computed from the
+        intensities before filtering. 'filtered_ratio' is the ratio of
+        the filtered intensities filtered by `ratio_filtering_method`,
+        which is used to map the inundated vegetation.
+    filtering_method: callable, optional
+        Filter function applied to the intensities.
+        If None, the intensities are not filtered.
+    filter_option: dict
+        Keyword arguments of `filtering_method`
+    ratio_filtering_method: callable, optional
+        Filter function applied to the ratio of the filtered
+        intensities for 'filtered_ratio'
+    ratio_filter_option: dict
+        Keyword arguments of `ratio_filtering_method`
+
+    Returns
+    -------
+    band_dict: dict
+        Bands of the padded block keyed by the names in `band_list`
+    """
+    copol_intensity = dswx_sar_util.get_raster_block(
+        copol_path, block_param)
+    crosspol_intensity = dswx_sar_util.get_raster_block(
+        crosspol_path, block_param)
+
+    band_dict = {}
+    if 'ratio' in band_list:
+        band_dict['ratio'] = _to_filtered_image_band(
+            pol_ratio(copol_intensity, crosspol_intensity))
+    if 'span' in band_list:
+        band_dict['span'] = _to_filtered_image_band(
+            copol_intensity + 2 * crosspol_intensity)
+
+    for pol, intensity in [(copol, copol_intensity),
+                           (crosspol, crosspol_intensity)]:
+        # need to replace 0 value in padded area to NaN.
+        intensity[intensity == 0] = np.nan
+        if filtering_method is not None:
+            intensity = filtering_method(intensity, **filter_option)
+        band_dict[pol] = _to_filtered_image_band(intensity)
+
+    if 'filtered_ratio' in band_list:
+        rtc_ratio = pol_ratio(band_dict[copol], band_dict[crosspol])
+        band_dict['filtered_ratio'] = np.asarray(
+            ratio_filtering_method(rtc_ratio, **ratio_filter_option),
+            dtype='float32')
+
+    return {band_name: band_dict[band_name] for band_name in band_list}
+
+
+def get_filtering_tasks(pol_list,
+                        co_pol,
+                        cross_pol,
+                        scratch_dir,
+                        mosaic_prefix,
+                        mosaic_flag,
+                        ref_filename,
+                        filtering_method=None,
+                        filter_option=None,
+                        ratio_filtering_method=None,
+                        ratio_filter_option=None):
+    """Get the tasks computing the bands of the filtered image for
+    a block. For dual-polarization mosaics, the co- and
+    cross-polarization intensities and the layers derived from them
+    are computed by a single task reading each polarization once.
+
+    Parameters
+    ----------
+    pol_list: list
+        Bands of the filtered image (polarizations, 'ratio', 'span')
+    co_pol: list
+        Co-polarizations
+    cross_pol: list
+        Cross-polarizations
+    scratch_dir: str
+        Scratch directory with the mosaicked intensities
+    mosaic_prefix: str
+        Prefix of the mosaicked intensities
+    mosaic_flag: bool
+        True if the intensities are mosaicked in `scratch_dir`
+    ref_filename: str
+        Intensity raster of a single RTC input
+    filtering_method: callable, optional
+        Filter function applied to the intensities
+    filter_option: dict
+        Keyword arguments of `filtering_method`
+    ratio_filtering_method: callable, optional
+        If given, the filtered ratio used for the inundated vegetation
+        is computed as 'filtered_ratio' with this filter function.
+    ratio_filter_option: dict
+        Keyword arguments of `ratio_filtering_method`
+
+    Returns
+    -------
+    task_list: list
+        Tuples of a function and its keyword arguments computing a
+        dictionary of bands for a block
+    filtered_ratio_flag: bool
+        True if 'filtered_ratio' is computed by the tasks
+    """
+    copol = next((pol for pol in pol_list if pol in ['HH', 'VV']), None)
+    crosspol = next((pol for pol in pol_list if pol in ['HV', 'VH']), None)
+    derived_list = [pol for pol in pol_list if pol in ['ratio', 'span']]
+
+    polarimetric_flag = mosaic_flag and \
+        copol is not None and crosspol is not None and \
+        (bool(derived_list) or ratio_filtering_method is not None)
+
+    task_list = []
+    if polarimetric_flag:
+        band_list = [copol, crosspol] + derived_list
+        if ratio_filtering_method is not None:
+            band_list.append('filtered_ratio')
+        logger.info(f'  >> computing {band_list} from {copol}/{crosspol}')
+        task_list.append((compute_polarimetric_bands, {
+            'copol': copol,
+            'crosspol': crosspol,
+            'copol_path': f'{scratch_dir}/{mosaic_prefix}_{copol}.tif',
+            'crosspol_path': f'{scratch_dir}/{mosaic_prefix}_{crosspol}.tif',
+            'band_list': band_list,
+            'filtering_method': filtering_method,
+            'filter_option': filter_option,
+            'ratio_filtering_method': ratio_filtering_method,
+            'ratio_filter_option': ratio_filter_option}))
+
+    for polind, pol in enumerate(pol_list):
+        if polarimetric_flag and pol in band_list:
+            continue
+        if pol in ['ratio', 'span']:
+            # If ratio/span is in the list,
+            # then compute the ratio from VVVV and VHVH
+            temp_pol_list = co_pol + cross_pol
+            logger.info(f'  >> computing {pol} {temp_pol_list}')
+            task_list.append((compute_filtered_band, {
+                'pol': pol,
+                'ratio_paths': [
+                    f'{scratch_dir}/{mosaic_prefix}_{temp_pol}.tif'
+                    for temp_pol in temp_pol_list]}))
+        elif mosaic_flag:
+            task_list.append((compute_filtered_band, {
+                'pol': pol,
+                'intensity_path': f'{scratch_dir}/{mosaic_prefix}_{pol}.tif',
+                'filtering_method': filtering_method,
+                'filter_option': filter_option}))
+        else:
+            task_list.append((compute_filtered_band, {
+                'pol': pol,
+                'intensity_path': ref_filename,
+                'band_ind': polind,
+                'filtering_method': filtering_method,
+                'filter_option': filter_option}))
+
+    return task_list, polarimetric_flag and \
+        ratio_filtering_method is not None
+
+
+def filter_image_blocks(block_params,
+                        task_list,
+                        output_list,
+                        number_workers=1):
+    """Run the (block, task) pairs on a pool of worker processes
+    and write the blocks in order.
+
+    Each task reads its padded block and returns the computed bands,
+    so the halo of the block is handled by the worker. The results
+    are consumed in the order of the tasks and written as soon as
+    all bands of a block are available.
+
+    Parameters
+    ----------
+    block_params: iterable
+        BlockParam objects of the blocks with padding
+    task_list: list
+        Tuples of a function and its keyword arguments. The function
+        is called with a BlockParam and returns a dictionary of bands.
+    output_list: list
+        Tuples of a dswx_sar_util.RasterBlockWriter and the names of
+        the bands written to it in order
+    number_workers: int
+        Number of worker processes. -1 uses all available CPUs.
+    """
+    block_param_list = list(block_params)
+    number_tasks = len(task_list)
+
+    block_bands = Parallel(n_jobs=number_workers,
+                           return_as='generator')(
+        delayed(task_function)(block_param, **task_args)
+        for block_param in block_param_list
+        for task_function, task_args in task_list)
+
+    for block_ind, block_param in enumerate(block_param_list):
+        band_dict = {}
+        for _ in range(number_tasks):
+            band_dict.update(next(block_bands))
+        logger.info(f'  block processing {block_ind} '
+                    f'({block_ind + 1}/{len(block_param_list)})')
+        for writer, band_names in output_list:
+            writer.write_block(
+                np.array([band_dict[band_name] for band_name in band_names],
+                         dtype='float32'),
+                block_param)
+
+
+def get_filtered_ratio_path(scratch_dir, pol_all_str):
+    """Path of the filtered ratio cached for the inundated vegetation"""
+    return os.path.join(scratch_dir, f'filtered_ratio_{pol_all_str}.tif')
+
+
+def remove_filtered_ratio(filtered_ratio_path):
+    """Remove a filtered ratio left from a previous run"""
+    dswx_sar_util.scratch_store.release(filtered_ratio_path)
+    if os.path.isfile(filtered_ratio_path):
+        os.remove(filtered_ratio_path)
 
 
 def run(cfg):
@@ -586,6 +945,8 @@ def run(cfg):
 
     t_all = time.time()
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='pre_processing')
     dynamic_data_cfg = cfg.groups.dynamic_ancillary_file_group
 
     input_list = cfg.groups.input_file_group.input_file_path
@@ -741,88 +1102,62 @@ def run(cfg):
                     im_meta['width']),
         pad_shape=pad_shape)
 
-    for block_ind, block_param in enumerate(block_params):
-        output_image_set = []
-        for polind, pol in enumerate(pol_list):
-            logger.info(f'  block processing {block_ind} - {pol}')
-
-            if pol in ['ratio', 'span']:
-
-                # If ratio/span is in the list,
-                # then compute the ratio from VVVV and VHVH
-                temp_pol_list = co_pol + cross_pol
-                logger.info(f'  >> computing {pol} {temp_pol_list}')
-
-                temp_raster_set = []
-                for temp_pol in temp_pol_list:
-                    filename = \
-                        f'{scratch_dir}/{mosaic_prefix}_{temp_pol}.tif'
-
-                    block_data = dswx_sar_util.get_raster_block(
-                        filename,
-                        block_param)
-
-                    temp_raster_set.append(block_data)
-
-                temp_raster_set = np.array(temp_raster_set)
-                if pol in ['ratio']:
-                    ratio = pol_ratio(np.squeeze(temp_raster_set[0, :, :]),
-                                      np.squeeze(temp_raster_set[1, :, :]))
-                    output_image_set.append(ratio)
-                    logger.info(f'  computing ratio {co_pol}/{cross_pol}')
-
-                if pol in ['span']:
-                    span = np.squeeze(temp_raster_set[0, :, :] +
-                                      2 * temp_raster_set[1, :, :])
-                    output_image_set.append(span)
-            else:
-                if mosaic_flag:
-                    intensity_path = \
-                        f'{scratch_dir}/{mosaic_prefix}_{pol}.tif'
-
-                    intensity = dswx_sar_util.get_raster_block(
-                        intensity_path, block_param)
-                else:
-                    intensity = dswx_sar_util.read_geotiff(
-                            ref_filename, band_ind=polind)
-                # need to replace 0 value in padded area to NaN.
-                intensity[intensity == 0] = np.nan
-                if filter_flag:
-                    if filter_method == 'lee':
-                        filtering_method = filter_SAR.lee_enhanced_filter
-                        filter_option = vars(filter_options.lee_filter)
-
-                    elif filter_method == 'anisotropic_diffusion':
-                        filtering_method = filter_SAR.anisotropic_diffusion
-                        filter_option = vars(filter_options.anisotropic_diffusion)
-
-                    elif filter_method == 'guided_filter':
-                        filtering_method = filter_SAR.guided_filter
-                        filter_option = vars(filter_options.guided_filter)
-
-                    elif filter_method == 'bregman':
-                        filtering_method = filter_SAR.tv_bregman
-                        filter_option = vars(filter_options.bregman)
-                    print(filter_option)
-                    filtered_intensity = filtering_method(
-                                                intensity, **filter_option)
-                else:
-                    filtered_intensity = intensity
-
-                output_image_set.append(filtered_intensity)
-
-        output_image_set = np.array(output_image_set, dtype='float32')
-        output_image_set[output_image_set == 0] = np.nan
-
-        dswx_sar_util.write_raster_block(
-            out_raster=filtered_image_path,
-            data=output_image_set,
-            block_param=block_param,
-            geotransform=im_meta['geotransform'],
-            projection=im_meta['projection'],
-            datatype='float32')
+    if filter_flag:
+        filtering_method, filter_option = get_filtering_method(
+            filter_method, filter_options)
+        logger.info(f'  filter {filter_method}: {filter_option}')
+    else:
+        filtering_method, filter_option = None, None
+
+    # The ratio of the filtered dual polarizations is filtered once here
+    # and reused by the inundated vegetation mapping.
+    inundated_vege_cfg = processing_cfg.inundated_vegetation
+    if processing_cfg.dswx_workflow == 'opera_dswx_s1' and \
+       ((inundated_vege_cfg.enabled == 'auto' and len(pol_list) >= 2) or
+            inundated_vege_cfg.enabled is True):
+        ratio_filtering_method, ratio_filter_option = get_filtering_method(
+            filter_method, filter_options)
+    else:
+        ratio_filtering_method, ratio_filter_option = None, None
 
-    dswx_sar_util._save_as_cog(filtered_image_path, scratch_dir)
+    task_list, filtered_ratio_flag = get_filtering_tasks(
+        pol_list, co_pol, cross_pol,
+        scratch_dir=scratch_dir,
+        mosaic_prefix=mosaic_prefix,
+        mosaic_flag=mosaic_flag,
+        ref_filename=ref_filename,
+        filtering_method=filtering_method,
+        filter_option=filter_option,
+        ratio_filtering_method=ratio_filtering_method,
+        ratio_filter_option=ratio_filter_option)
+    filtered_ratio_path = get_filtered_ratio_path(scratch_dir, pol_all_str)
+    remove_filtered_ratio(filtered_ratio_path)
+
+    # The writers are closed without finalizing if the filtering fails.
+    with contextlib.ExitStack() as stack:
+        filtered_writer = stack.enter_context(
+            dswx_sar_util.RasterBlockWriter(
+                filtered_image_path,
+                geotransform=im_meta['geotransform'],
+                projection=im_meta['projection'],
+                datatype='float32',
+                scratch_dir=scratch_dir))
+        output_list = [(filtered_writer, pol_list)]
+
+        if filtered_ratio_flag:
+            filtered_ratio_writer = stack.enter_context(
+                dswx_sar_util.RasterBlockWriter(
+                    filtered_ratio_path,
+                    geotransform=im_meta['geotransform'],
+                    projection=im_meta['projection'],
+                    datatype='float32',
+                    scratch_dir=scratch_dir))
+            output_list.append((filtered_ratio_writer, ['filtered_ratio']))
+
+        filter_image_blocks(block_params,
+                            task_list,
+                            output_list,
+                            number_workers=filter_options.number_cpu)
 
     no_data_geotiff_path = os.path.join(
         scratch_dir, f"no_data_area_{pol_all_str}.tif")
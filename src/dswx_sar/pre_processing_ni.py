@@ -26,6 +26,8 @@ def run(cfg):
 
     t_all = time.time()
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='pre_processing')
     dynamic_data_cfg = cfg.groups.dynamic_ancillary_file_group
 
     input_list = cfg.groups.input_file_group.input_file_path
@@ -170,74 +172,34 @@ def run(cfg):
                     im_meta['width']),
         pad_shape=pad_shape)
 
-    for block_ind, block_param in enumerate(block_params):
-        output_image_set = []
-        for polind, pol in enumerate(pol_list):
-            logger.info(f'  block processing {block_ind} - {pol}')
-
-            if pol in ['ratio', 'span']:
-
-                # If ratio/span is in the list,
-                # then compute the ratio from VVVV and VHVH
-                temp_pol_list = co_pol + cross_pol
-                logger.info(f'  >> computing {pol} {temp_pol_list}')
-
-                temp_raster_set = []
-                for temp_pol in temp_pol_list:
-                    filename = \
-                        f'{scratch_dir}/{mosaic_prefix}_{temp_pol}.tif'
-
-                    block_data = dswx_sar_util.get_raster_block(
-                        filename,
-                        block_param)
-
-                    temp_raster_set.append(block_data)
-
-                temp_raster_set = np.array(temp_raster_set)
-                if pol in ['ratio']:
-                    ratio = pre_processing.pol_ratio(
-                        np.squeeze(temp_raster_set[0, :, :]),
-                        np.squeeze(temp_raster_set[1, :, :]))
-                    output_image_set.append(ratio)
-                    logger.info(f'  computing ratio {co_pol}/{cross_pol}')
-
-                if pol in ['span']:
-                    span = np.squeeze(temp_raster_set[0, :, :] +
-                                      2 * temp_raster_set[1, :, :])
-                    output_image_set.append(span)
-            else:
-                if mosaic_flag:
-                    intensity_path = \
-                        f'{scratch_dir}/{mosaic_prefix}_{pol}.tif'
-
-                    intensity = dswx_sar_util.get_raster_block(
-                        intensity_path, block_param)
-                else:
-                    intensity = dswx_sar_util.read_geotiff(
-                            ref_filename, band_ind=polind)
-                # need to replace 0 value in padded area to NaN.
-                intensity[intensity == 0] = np.nan
-                if filter_flag:
-                    filtered_intensity = filter_SAR.lee_enhanced_filter(
-                                    intensity,
-                                    win_size=filter_size)
-                else:
-                    filtered_intensity = intensity
-
-                output_image_set.append(filtered_intensity)
-
-        output_image_set = np.array(output_image_set, dtype='float32')
-        output_image_set[output_image_set == 0] = np.nan
-
-        dswx_sar_util.write_raster_block(
-            out_raster=filtered_image_path,
-            data=output_image_set,
-            block_param=block_param,
+    if filter_flag:
+        filtering_method = filter_SAR.lee_enhanced_filter
+        filter_option = {'win_size': filter_size}
+    else:
+        filtering_method, filter_option = None, None
+
+    task_list, _ = pre_processing.get_filtering_tasks(
+        pol_list, co_pol, cross_pol,
+        scratch_dir=scratch_dir,
+        mosaic_prefix=mosaic_prefix,
+        mosaic_flag=mosaic_flag,
+        ref_filename=ref_filename,
+        filtering_method=filtering_method,
+        filter_option=filter_option)
+    pre_processing.remove_filtered_ratio(
+        pre_processing.get_filtered_ratio_path(scratch_dir, pol_all_str))
+
+    with dswx_sar_util.RasterBlockWriter(
+            filtered_image_path,
             geotransform=im_meta['geotransform'],
             projection=im_meta['projection'],
-            datatype='float32')
-
-    dswx_sar_util._save_as_cog(filtered_image_path, scratch_dir)
+            datatype='float32',
+            scratch_dir=scratch_dir) as filtered_writer:
+        pre_processing.filter_image_blocks(
+            block_params,
+            task_list,
+            [(filtered_writer, pol_list)],
+            number_workers=processing_cfg.filter.number_cpu)
 
     no_data_geotiff_path = os.path.join(
         scratch_dir, f"no_data_area_{pol_all_str}.tif")
@@ -1,10 +1,10 @@
+import contextlib
 import copy
 import logging
 import mimetypes
 import os
 import time
 
-import cv2
 from joblib import Parallel, delayed
 import numpy as np
 import scipy
@@ -12,7 +12,6 @@ from scipy import ndimage, stats
 from scipy.optimize import curve_fit
 from skimage.filters import (threshold_otsu,
                              threshold_multiotsu)
-import gc
 
 from dswx_sar import (dswx_sar_util,
                       generate_log,
@@ -809,6 +808,133 @@ def process_bright_water_component(args):
     return bt_value, ad_value, ind_bright_water
 
 
+def process_dark_land_task(block_param,
+                           labels,
+                           label_path,
+                           shared_rasters,
+                           pol_indices,
+                           thresholds,
+                           minimum_pixel,
+                           debug_mode):
+    """Process the dark land components of a task.
+    The lines of the task are read once and shared by its components.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        lines of the task covering the boxes of its components
+    labels: numpy.ndarray
+        labels of the components of the task
+    label_path: str
+        label raster of the dswx_sar_util.ComponentIndex
+    shared_rasters: dict
+        dswx_sar_util.SharedRaster of the 'intensity', 'ref_land',
+        and 'label' rasters
+    pol_indices: list
+        indices of the polarizations to process
+    thresholds: list
+        List of the thresholds to determine bimiodality.
+    minimum_pixel: int
+        minimum number of pixels to accept as water bodies.
+    debug_mode: bool
+        Flag indicating whether to enable debug mode.
+
+    Returns
+    -------
+    results: list
+        (pol_ind, label, bimodality, ref_land_portion, metric_output)
+        for each component and polarization
+    """
+    component_index = dswx_sar_util.ComponentIndex.load(label_path)
+    intensity_block = shared_rasters['intensity'].get_block(block_param)
+    refland_block = shared_rasters['ref_land'].get_block(block_param)
+    label_block = shared_rasters['label'].get_block(block_param)
+
+    results = []
+    for label in labels:
+        bbox_x, bbox_y, bbox_w, bbox_h = component_index.bboxes[label]
+        size = component_index.sizes[label]
+        margin = int((np.sqrt(2) - 1.2) * np.sqrt(size))
+        margin = max(margin, 1)
+        bounds = [max(bbox_x - margin, 0),
+                  min(bbox_x + bbox_w + margin, component_index.cols),
+                  max(bbox_y - margin, 0),
+                  min(bbox_y + bbox_h + margin, component_index.rows)]
+
+        for pol_ind in pol_indices:
+            _, bimodality, ref_land_portion, metric_output = \
+                process_dark_land_component(
+                    (label - 1, size, list(bounds), refland_block,
+                     pol_ind, intensity_block, label_block, thresholds,
+                     minimum_pixel, debug_mode,
+                     block_param.read_start_line,
+                     block_param.block_length))
+            results.append((pol_ind, label, bimodality,
+                            ref_land_portion, metric_output))
+
+    return results
+
+
+def process_bright_water_task(block_param,
+                              labels,
+                              label_path,
+                              shared_rasters,
+                              pol_indices,
+                              threshold):
+    """Process the bright water components of a task.
+    The lines of the task are read once and shared by its components.
+
+    Parameters
+    ----------
+    block_param: BlockParam
+        lines of the task covering the boxes of its components
+    labels: numpy.ndarray
+        labels of the components of the task
+    label_path: str
+        label raster of the dswx_sar_util.ComponentIndex
+    shared_rasters: dict
+        dswx_sar_util.SharedRaster of the 'intensity', 'landcover',
+        'ref_land', and 'label' rasters
+    pol_indices: list
+        indices of the polarizations to process
+    threshold: list
+        two threshold values for Bt and Ad metrics.
+
+    Returns
+    -------
+    results: list
+        (pol_ind, label, bimodality) for each component and polarization
+    """
+    component_index = dswx_sar_util.ComponentIndex.load(label_path)
+    intensity_block = shared_rasters['intensity'].get_block(block_param)
+    landcover_block = shared_rasters['landcover'].get_block(block_param)
+    refland_block = shared_rasters['ref_land'].get_block(block_param)
+    label_block = shared_rasters['label'].get_block(block_param)
+
+    results = []
+    for label in labels:
+        bbox_x, bbox_y, bbox_w, bbox_h = component_index.bboxes[label]
+        size = component_index.sizes[label]
+        margin = int((np.sqrt(2) - 1.2) * np.sqrt(size))
+        bounds = [max(bbox_x - margin, 0),
+                  min(bbox_x + bbox_w + margin + 1, component_index.cols),
+                  max(bbox_y - margin, 0),
+                  min(bbox_y + bbox_h + margin + 1, component_index.rows)]
+
+        for pol_ind in pol_indices:
+            bt_value, ad_value, _ = process_bright_water_component(
+                (label - 1, size, list(bounds), label_block,
+                 landcover_block, intensity_block, refland_block,
+                 pol_ind, threshold,
+                 block_param.read_start_line,
+                 block_param.block_length))
+            bimodality = (bt_value < threshold[0]) | \
+                         (ad_value < threshold[1])
+            results.append((pol_ind, label, bimodality))
+
+    return results
+
+
 def remove_false_water_bimodality_parallel(water_mask_path,
                                            pol_list,
                                            thresholds,
@@ -851,296 +977,139 @@ def remove_false_water_bimodality_parallel(water_mask_path,
     debug_mode: bool
         If True, additional output metrics and
         images are saved for debugging purposes.
+    number_workers: int
+        Number of parallel jobs for the component tasks.
     lines_per_block: int
-        lines of the block processing
+        lines of the block processing. Components are grouped
+        into tasks spanning at most this number of lines unless
+        a single component is taller.
 
     Returns
     -------
-    bimodality_total: numpy.ndarray
-        An image indicating the bimodality values across the entire scene.
+    removed_false_water_path: str
+        Path of the binary water mask without the false water bodies.
     """
     rows, cols = meta_info['length'], meta_info['width']
-
-    input_lines_per_block = lines_per_block
     pol_str = "_".join(pol_list)
 
-    # To minimize memory usage, the bimodality test will be
-    # carried out with the block first, and entire image will be
-    # used for the remained componenets.
-    lines_per_block_set = [input_lines_per_block,
-                           input_lines_per_block*3,
-                           input_lines_per_block*20,
-                           rows]
-
-    data_shape = [rows, cols]
-    pad_shape = (0, 0)
-
-    remove_false_path_prefix = 'remove_false_water_temp'
-    remove_false_water_path_set = []
-
-    for block_iter, lines_per_block in enumerate(lines_per_block_set):
-        block_params = dswx_sar_util.block_param_generator(
-            lines_per_block,
-            data_shape,
-            pad_shape)
-        removed_false_water_path = os.path.join(
-            outputdir,
-            f'{remove_false_path_prefix}_{pol_str}_{block_iter}.tif')
-        remove_false_water_path_set.append(removed_false_water_path)
-
-        for block_ind, block_param in enumerate(block_params):
-
-            logger.info(
-                'remove_false_water_bimodality_parallel '
-                f'block #{block_ind} from '
-                f'{block_param.read_start_line} to '
-                f'{block_param.read_start_line + block_param.read_length}')
-
-            water_mask = dswx_sar_util.get_raster_block(
-                water_mask_path, block_param)
-
-            # computes the connected components labeled image of boolean image
-            # and also produces a statistics output for each label
-            nb_components_water, output_water, stats_water, _ = \
-                cv2.connectedComponentsWithStats(water_mask.astype(np.uint8),
-                                                 connectivity=8)
-
-            nb_components_water = nb_components_water - 1
-            logger.info(f'detected component number : {nb_components_water}')
-
-            # save the water label into file
-            water_label_str = os.path.join(
-                outputdir, f'false_water_label_{pol_str}_{block_iter}.tif')
-            dswx_sar_util.write_raster_block(
-                water_label_str,
-                output_water,
+    pol_indices = [pol_ind for pol_ind, pol in enumerate(pol_list)
+                   if pol in ['VV', 'VH', 'HH', 'HV']]
+    if not pol_indices:
+        # If the polarization is not in the list
+        # ['VV', 'VH', 'HH', 'HV'],
+        # Return input as it is without further modification.
+        return water_mask_path
+
+    # The water bodies are labeled once over the frame, and every
+    # component is assigned to exactly one task.
+    component_index = dswx_sar_util.ComponentIndex.build(
+        water_mask_path,
+        os.path.join(outputdir, f'false_water_label_{pol_str}.tif'),
+        lines_per_block=lines_per_block,
+        number_workers=number_workers,
+        scratch_dir=outputdir)
+    nb_components_water = component_index.number_components
+    logger.info(f'detected component number : {nb_components_water}')
+
+    task_list = dswx_sar_util.schedule_component_tasks(
+        component_index,
+        component_index.select(),
+        max_lines_per_task=lines_per_block)
+    logger.info(f'{nb_components_water} components are assigned to '
+                f'{len(task_list)} tasks')
+
+    for pol_ind in pol_indices:
+        logger.info('removing false water using bimodality '
+                    f'for {pol_list[pol_ind]}')
+
+    # 1 dimensional arrays for bimodality values. The first element
+    # is the background.
+    bimodality_output = np.zeros([len(pol_list), nb_components_water + 1],
+                                 dtype=bool)
+    if debug_mode:
+        metric_output = np.zeros([len(pol_list), nb_components_water + 1, 5])
+        ref_land_portion_output = np.zeros(
+            [len(pol_list), nb_components_water + 1])
+        ref_land_portion_output[:, 0] = -1
+
+    # The layers are published once and sliced by the workers.
+    with dswx_sar_util.publish_shared_rasters(
+            {'intensity': input_dict['intensity'],
+             'ref_land': input_dict['ref_land'],
+             'label': component_index.label_path},
+            lines_per_block=lines_per_block,
+            shared_dir=outputdir,
+            number_workers=number_workers) as shared_rasters:
+        task_results = Parallel(n_jobs=number_workers,
+                                return_as='generator')(
+            delayed(process_dark_land_task)(
                 block_param,
+                labels,
+                label_path=component_index.label_path,
+                shared_rasters=shared_rasters,
+                pol_indices=pol_indices,
+                thresholds=thresholds,
+                minimum_pixel=minimum_pixel,
+                debug_mode=debug_mode)
+            for block_param, labels in task_list)
+
+        # Assign results computed in parallel into variables
+        for results in task_results:
+            for pol_ind, label, bimodality_array_i, \
+                    ref_land_portion_output_i, metric_output_i in results:
+                bimodality_output[pol_ind, label] = bimodality_array_i
+                if debug_mode:
+                    ref_land_portion_output[pol_ind, label] = \
+                        ref_land_portion_output_i
+                    metric_output[pol_ind, label, :] = metric_output_i
+
+    # 0 value in the labels indicates the non-water
+    bimodality_total = np.any(bimodality_output, axis=0)
+    bimodality_total[0] = False
+    del bimodality_output
+
+    removed_false_water_path = os.path.join(
+        outputdir, f'merged_removed_false_water_{pol_str}.tif')
+
+    # The writers are closed without finalizing if a block fails.
+    with contextlib.ExitStack() as stack:
+        def _get_writer(output_path, datatype):
+            return stack.enter_context(dswx_sar_util.RasterBlockWriter(
+                output_path,
                 geotransform=meta_info['geotransform'],
                 projection=meta_info['projection'],
-                datatype='int32',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-            intensity_block = dswx_sar_util.get_raster_block(
-                input_dict['intensity'], block_param)
-            refland_block = dswx_sar_util.get_raster_block(
-                input_dict['ref_land'], block_param)
-
-            bimodality_set = []
-
-            # sizes are last column and
-            # bounding boxes are first to forth column.
-            sizes = stats_water[1:, -1]
-            bounding_boxes = stats_water[1:, :4]
-            index_set = []
-            component_data = {}
-
-            for ind in range(0, nb_components_water):
-                bbox_x, bbox_y, bbox_w, bbox_h = bounding_boxes[ind, :]
-                size = sizes[ind]
-
-                # Check if the component touches the boundary
-                if bbox_y != 0 and \
-                   (bbox_y + bbox_h) != block_param.block_length:
-                    margin = int((np.sqrt(2) - 1.2) * np.sqrt(size))
-                    margin = max(margin, 1)
-
-                    sub_x_start = bbox_x - margin
-                    sub_x_end = bbox_x + bbox_w + margin
-                    sub_y_start = bbox_y - margin + block_param.read_start_line
-                    sub_y_end = bbox_y + bbox_h + margin + \
-                        block_param.read_start_line
-
-                    # Adjust the bounds to be within the valid range
-                    sub_x_start = np.maximum(sub_x_start, 0)
-                    sub_y_start = np.maximum(sub_y_start, 0)
-                    sub_x_end = np.minimum(sub_x_end, cols)
-                    sub_y_end = np.minimum(sub_y_end, rows)
-
-                    index_set.append(ind)
-                    component_data[ind] = (ind, size,
-                                           [sub_x_start, sub_x_end,
-                                            sub_y_start, sub_y_end])
-
-            for pol_ind, pol in enumerate(pol_list):
-                if pol in ['VV', 'VH', 'HH', 'HV']:
-                    logger.info('removing false water using bimodality '
-                                f'for {pol}')
-                    # 1 dimensional array for bimodality values
-                    bimodality_output = np.zeros(nb_components_water,
-                                                 dtype='byte')
-                    check_output = np.ones(len(sizes), dtype='byte')
-
-                    if debug_mode:
-                        metric_output = np.zeros([nb_components_water, 5])
-                        ref_land_portion_output = \
-                            np.zeros(nb_components_water)
-
-                    args_list = [(component_data[i][0],
-                                  component_data[i][1],
-                                  component_data[i][2],
-                                  refland_block,
-                                  pol_ind,
-                                  intensity_block,
-                                  output_water,
-                                  thresholds,
-                                  minimum_pixel,
-                                  debug_mode,
-                                  block_param.read_start_line,
-                                  block_param.block_length)
-                                 for i in component_data.keys()]
-                    with Parallel(n_jobs=number_workers) as parallel:
-                        results = parallel(
-                            delayed(process_dark_land_component)(args)
-                            for args in args_list)
-
-                    # Assign results computed in parallel into variables
-                    for result in results:
-                        bimodal_ind, bimodality_array_i, \
-                            ref_land_portion_output_i, metric_output_i = result
-                        bimodality_output[bimodal_ind] = bimodality_array_i
-                        check_output[bimodal_ind] = 0
-                        if debug_mode:
-                            ref_land_portion_output[bimodal_ind] = \
-                                ref_land_portion_output_i
-                            metric_output[bimodal_ind, :] = metric_output_i
-                    if nb_components_water > 65535:
-                        output_water_type = 'uint32'
-                    else:
-                        output_water_type = 'uint16'
-                    output_water = output_water.astype(output_water_type)
-                    old_val = np.arange(1, nb_components_water + 1) - .1
-                    index_array_to_image = np.searchsorted(
-                        old_val, output_water).astype(dtype=output_water_type)
-                    bimodality_output_add = np.insert(bimodality_output, 0, 0,
-                                                      axis=0)
-                    bimodality_image = bimodality_output_add[
-                        index_array_to_image].astype('byte')
-                    del bimodality_output
-
-                    # Skip saving the checking file in last iteration
-                    if block_iter < len(lines_per_block_set)-1:
-                        check_output = np.insert(check_output, 0, 0, axis=0)
-                        check_image = check_output[
-                            index_array_to_image].astype('byte')
-
-                    bimodality_set.append(bimodality_image)
+                datatype=datatype,
+                scratch_dir=outputdir))
+
+        writer_list = [(_get_writer(removed_false_water_path, 'byte'),
+                        bimodality_total)]
+        if debug_mode:
+            metric_detail_name = ['binary_ahman', 'binary_bhc',
+                                  'binary_asurface_ratio', 'binary_bm_coeff',
+                                  'binary_bc_coeff']
+            for pol_ind in pol_indices:
+                pol = pol_list[pol_ind]
+                writer_list.append(
+                    (_get_writer(os.path.join(outputdir,
+                                              f'land_portion_{pol}.tif'),
+                                 'float32'),
+                     ref_land_portion_output[pol_ind]))
+                for metric_ind, metric_name in enumerate(metric_detail_name):
+                    writer_list.append(
+                        (_get_writer(os.path.join(outputdir,
+                                                  f'{metric_name}_{pol}.tif'),
+                                     'float32'),
+                         metric_output[pol_ind, :, metric_ind]))
 
-                    if debug_mode:
-                        ref_land_portion_output = np.insert(
-                            ref_land_portion_output, 0, -1, axis=0)
-                        ref_land_portion_image = ref_land_portion_output[
-                            index_array_to_image]
-                        dswx_sar_util.write_raster_block(
-                            os.path.join(
-                                outputdir,
-                                f'land_portion_{pol}_{block_iter}.tif'),
-                            ref_land_portion_image,
-                            block_param,
-                            geotransform=meta_info['geotransform'],
-                            projection=meta_info['projection'],
-                            datatype='float32',
-                            cog_flag=True,
-                            scratch_dir=outputdir)
-
-                        metric_detail_name = [
-                            f'binary_ahman_{pol}_{block_iter}.tif',
-                            f'binary_bhc_{pol}_{block_iter}.tif',
-                            f'binary_asurface_ratio_{pol}_{block_iter}.tif',
-                            f'binary_bm_coeff_{pol}_{block_iter}.tif',
-                            f'binary_bc_coeff_{pol}_{block_iter}.tif']
-
-                        metric_output = np.insert(metric_output,
-                                                  0,
-                                                  np.zeros([1, 5]),
-                                                  axis=0)
-                        for metric_ind, metric_name in enumerate(
-                             metric_detail_name):
-
-                            metric_image0 = metric_output[index_array_to_image,
-                                                          metric_ind]
-                            dswx_sar_util.write_raster_block(
-                                os.path.join(outputdir, metric_name),
-                                metric_image0,
-                                block_param,
-                                geotransform=meta_info['geotransform'],
-                                projection=meta_info['projection'],
-                                datatype='float32',
-                                cog_flag=True,
-                                scratch_dir=outputdir)
-                    del results, bimodality_output_add
-                    del bimodality_image, check_output
-                    gc.collect()
-
-            if {'HH', 'HV', 'VV', 'VH'}.intersection(set(pol_list)):
-                bimodality_total = np.array(
-                    np.nansum(bimodality_set, axis=0) > 0,
-                    dtype='byte')
-                # 0 value in output_water indicates the non-water
-                bimodality_total[output_water == 0] = False
-            else:
-                # If the polarization is not in the list
-                # ['VV', 'VH', 'HH', 'HV'],
-                # Return input as it is without further modification.
-                bimodality_total = water_mask
-            del output_water, bimodality_set
-
-            dswx_sar_util.write_raster_block(
-                removed_false_water_path,
-                bimodality_total,
-                block_param,
-                geotransform=meta_info['geotransform'],
-                projection=meta_info['projection'],
-                datatype='byte',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-            # Skip saving the checking file in last iteration
-            if block_iter < len(lines_per_block_set) - 1:
-                # 'check_remove_false_water' has 1 value
-                # for unprocessed components
-                # due to its touching the boundaries and
-                # has 0 value for processed components.
-                check_remove_false_water_path = os.path.join(
-                    outputdir,
-                    f'check_remove_false_water_{pol_str}_{block_iter}.tif')
-                dswx_sar_util.write_raster_block(
-                    check_remove_false_water_path,
-                    check_image,
-                    block_param,
-                    geotransform=meta_info['geotransform'],
-                    projection=meta_info['projection'],
-                    datatype='byte',
-                    cog_flag=True,
-                    scratch_dir=outputdir)
-                # In last block, the input water change to entire image.
-                # When dealing with the entire image, only remaining components
-                # will be checked.
-                if block_param.block_length + \
-                   block_param.read_start_line >= rows:
-
-                    water_mask_path = check_remove_false_water_path
-                del check_image
-            del bimodality_total
-            gc.collect()
-
-    if len(remove_false_water_path_set) >= 2:
-        # Merge two results processed with block and entire image
-        merged_removed_false_water_path = os.path.join(
-            outputdir, f'merged_removed_false_water_{pol_str}.tif'
-        )
-        dswx_sar_util.merge_binary_layers(
-            layer_list=remove_false_water_path_set,
-            value_list=[1] * len(lines_per_block_set),
-            merged_layer_path=merged_removed_false_water_path,
-            lines_per_block=input_lines_per_block,
-            mode='or',
-            cog_flag=True,
-            scratch_dir=outputdir)
-    else:
-        merged_removed_false_water_path = remove_false_water_path_set[0]
+        block_params = dswx_sar_util.block_param_generator(
+            lines_per_block, [rows, cols], (0, 0))
+        for block_param in block_params:
+            label_block = dswx_sar_util.get_raster_block(
+                component_index.label_path, block_param)
+            for writer, component_values in writer_list:
+                writer.write_block(component_values[label_block], block_param)
 
-    return merged_removed_false_water_path
+    return removed_false_water_path
 
 
 def fill_gap_water_bimodality_parallel(
@@ -1175,226 +1144,104 @@ def fill_gap_water_bimodality_parallel(
     input_dict : dict
         A dictionary containing file paths for landcover, intensity bands,
         binary water mask, and raster dataset representing land areas.
+    number_workers: int
+        Number of parallel jobs for the component tasks.
     lines_per_block: int
         Number of lines to be used for the block processing
 
     Returns
     -------
-    bimodal_ad_binary : numpy.ndarray
-        A binary 2D NumPy array indicating the water gaps.
+    fill_gap_path : str
+        Path of the binary raster indicating the water gaps.
     """
     if threshold is None:
         threshold = [0.7, 1.5]
 
     rows, cols = meta_info['length'], meta_info['width']
-    input_lines_per_block = lines_per_block
     pol_str = "_".join(pol_list)
 
-    # To minimize memory usage, the bimodality test will be
-    # carried out with the block first, and entire image will be
-    # used for the remained componenets.
-    lines_per_block_set = [lines_per_block,
-                           lines_per_block * 20,
-                           rows]
-    data_shape = [rows, cols]
-    pad_shape = (0, 0)
-
-    fill_gap_path_prefix = 'fill_gap_water_temp'
-    remove_bright_water_path_set = []
-
-    for block_iter, lines_per_block in enumerate(lines_per_block_set):
+    pol_indices = [pol_ind for pol_ind, pol in enumerate(pol_list)
+                   if pol in ['VV', 'VH', 'HH', 'HV']]
 
-        block_params = dswx_sar_util.block_param_generator(
-            lines_per_block,
-            data_shape,
-            pad_shape)
-        removed_bright_water_path = os.path.join(
-            outputdir,
-            f'{fill_gap_path_prefix}_{pol_str}_{block_iter}.tif')
-
-        remove_bright_water_path_set.append(removed_bright_water_path)
-
-        for block_ind, block_param in enumerate(block_params):
-            logger.info(
-                f'fill_gap_water_bimodality_parallel block #{block_ind} '
-                f'from {block_param.read_start_line} to '
-                f'{block_param.read_start_line + block_param.read_length}')
-            water_mask = dswx_sar_util.get_raster_block(
-                bright_water_path, block_param)
-            out_boundary = dswx_sar_util.get_raster_block(
-                input_dict['no_data'], block_param)
-            water_mask[out_boundary == 1] = 0
-            intensity_block = dswx_sar_util.get_raster_block(
-                input_dict['intensity'], block_param)
-            landcover_block = dswx_sar_util.get_raster_block(
-                input_dict['landcover'], block_param)
-            refland_block = dswx_sar_util.get_raster_block(
-                input_dict['ref_land'], block_param)
-
-            # computes the connected components labeled image of boolean image
-            # and also produces a statistics output for each label
-            nb_components_water, output_water, stats_water, _ = \
-                cv2.connectedComponentsWithStats(water_mask.astype(np.uint8),
-                                                 connectivity=8)
-            if nb_components_water > 65535:
-                output_water_type = 'uint32'
-            else:
-                output_water_type = 'uint16'
-            del out_boundary, water_mask
-
-            nb_components_water = nb_components_water - 1
-            logger.info(f'detected component number : {nb_components_water}')
-
-            water_label_str = os.path.join(
-                outputdir, f'water_label_bright_water_{pol_str}.tif')
-            dswx_sar_util.write_raster_block(
-                water_label_str,
-                output_water,
-                block_param,
-                geotransform=meta_info['geotransform'],
-                projection=meta_info['projection'],
-                datatype='int32',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-            bimodality_set = np.zeros([block_param.block_length, cols],
-                                      dtype='byte')
-
-            sizes = stats_water[1:, -1]
-            bounding_boxes = stats_water[1:, :4]
-            index_set = []
-            component_data = {}
-            for ind in range(0, nb_components_water):
-                bbox_x, bbox_y, bbox_w, bbox_h = bounding_boxes[ind, :]
-
-                # Check if the component touches the boundary
-                if bbox_y != 0 and \
-                   (bbox_y + bbox_h) != block_param.block_length:
-
-                    margin = int((np.sqrt(2) - 1.2) * np.sqrt(sizes[ind]))
-                    sub_x_start = bbox_x - margin
-                    sub_x_end = bbox_x + bbox_w + margin + 1
-                    sub_y_start = bbox_y - margin + block_param.read_start_line
-                    sub_y_end = bbox_y + bbox_h + \
-                        margin + 1 + block_param.read_start_line
-
-                    # Adjust the bounds to be within the valid range
-                    sub_x_start = np.maximum(sub_x_start, 0)
-                    sub_y_start = np.maximum(sub_y_start, 0)
-                    sub_x_end = np.minimum(sub_x_end, cols)
-                    sub_y_end = np.minimum(sub_y_end, rows)
-
-                    size = sizes[ind]
-                    index_set.append(ind)
-                    component_data[ind] = (ind,
-                                           size,
-                                           [sub_x_start,
-                                            sub_x_end,
-                                            sub_y_start,
-                                            sub_y_end])
-
-            for pol_ind, pol in enumerate(pol_list):
-                if pol in ['VV', 'VH', 'HH', 'HV']:
-                    logger.info(
-                        'filling bright water bodies with bimodality '
-                        f'using {pol}')
-                    bimodality_output = np.zeros(len(sizes),
-                                                 dtype='byte')
-                    check_output = np.ones(len(sizes),
-                                           dtype='byte')
-
-                    args_list = [(
-                        component_data[i][0],
-                        component_data[i][1],
-                        component_data[i][2],
-                        output_water,
-                        landcover_block,
-                        intensity_block,
-                        refland_block,
-                        pol_ind,
-                        threshold,
-                        block_param.read_start_line,
-                        block_param.block_length)
-                        for i in component_data.keys()]
-
-                with Parallel(n_jobs=number_workers) as parallel:
-                    results = parallel(
-                        delayed(process_bright_water_component)(args)
-                        for args in args_list)
-
-                for res in results:
-                    bt_value, ad_value, result_ind = res
-                    bimodality_bright_water = \
-                        (bt_value < threshold[0]) | \
-                        (ad_value < threshold[1])
-                    bimodality_output[result_ind] = bimodality_bright_water
-
-                    # To avoid the duplicated jobs,
-                    # the checked compoenents is recorded.
-                    check_output[result_ind] = 0
-
-                output_water = output_water.astype(output_water_type)
-
-                old_val = np.arange(1, nb_components_water + 1) - .1
-                index_array_to_image = np.searchsorted(
-                    old_val, output_water).astype(output_water_type)
-                bimodality_output = np.insert(bimodality_output, 0, 0, axis=0)
-                check_output = np.insert(check_output, 0, 0, axis=0)
-
-                bimodality_image = bimodality_output[
-                    index_array_to_image].astype(dtype='byte')
-                check_image = check_output[
-                    index_array_to_image].astype(dtype='byte')
-                bimodality_set += bimodality_image
-
-            bimodal_ad_binary = bimodality_set > 0
-            # 0 value in output_water indicates the non-water
-            bimodal_ad_binary[output_water == 0] = False
-            del bimodality_set
-            gc.collect()
-            dswx_sar_util.write_raster_block(
-                removed_bright_water_path,
-                bimodal_ad_binary,
-                block_param,
-                geotransform=meta_info['geotransform'],
-                projection=meta_info['projection'],
-                datatype='byte',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-            check_fill_gap_path = os.path.join(
-                outputdir, f'check_fill_gap_{pol_str}_{block_iter}.tif')
-
-            dswx_sar_util.write_raster_block(
-                check_fill_gap_path,
-                check_image,
-                block_param,
-                geotransform=meta_info['geotransform'],
-                projection=meta_info['projection'],
-                datatype='byte',
-                cog_flag=True,
-                scratch_dir=outputdir)
-
-        # In last block, the input water change to entire image.
-        # When dealing with the entire image, only remaining components
-        # will be checked.
-        if block_param.block_length + block_param.read_start_line >= rows:
-            bright_water_path = check_fill_gap_path
-
-    # Merge two results processed with block and entire image
-    meregd_fill_gap_layer_path = os.path.join(
-        outputdir, f'merged_fill_gap_{pol_str}.tif'
-    )
+    # Bright water outside of the valid area is not considered.
+    valid_bright_water_path = os.path.join(
+        outputdir, f'valid_bright_water_{pol_str}.tif')
     dswx_sar_util.merge_binary_layers(
-        layer_list=remove_bright_water_path_set,
-        value_list=[1] * len(lines_per_block_set),
-        merged_layer_path=meregd_fill_gap_layer_path,
-        lines_per_block=input_lines_per_block,
-        mode='or',
-        cog_flag=True,
+        layer_list=[bright_water_path, input_dict['no_data']],
+        value_list=[1, 0],
+        merged_layer_path=valid_bright_water_path,
+        lines_per_block=lines_per_block,
+        mode='and',
         scratch_dir=outputdir)
 
-    return meregd_fill_gap_layer_path
+    # The bright water bodies are labeled once over the frame, and every
+    # component is assigned to exactly one task.
+    component_index = dswx_sar_util.ComponentIndex.build(
+        valid_bright_water_path,
+        os.path.join(outputdir, f'water_label_bright_water_{pol_str}.tif'),
+        lines_per_block=lines_per_block,
+        number_workers=number_workers,
+        scratch_dir=outputdir)
+    nb_components_water = component_index.number_components
+    logger.info(f'detected component number : {nb_components_water}')
+
+    task_list = dswx_sar_util.schedule_component_tasks(
+        component_index,
+        component_index.select(),
+        max_lines_per_task=lines_per_block)
+    logger.info(f'{nb_components_water} components are assigned to '
+                f'{len(task_list)} tasks')
+
+    for pol_ind in pol_indices:
+        logger.info('filling bright water bodies with bimodality '
+                    f'using {pol_list[pol_ind]}')
+
+    # The first element is the background.
+    bimodality_output = np.zeros(nb_components_water + 1, dtype=bool)
+    if pol_indices:
+        # The layers are published once and sliced by the workers.
+        with dswx_sar_util.publish_shared_rasters(
+                {'intensity': input_dict['intensity'],
+                 'landcover': input_dict['landcover'],
+                 'ref_land': input_dict['ref_land'],
+                 'label': component_index.label_path},
+                lines_per_block=lines_per_block,
+                shared_dir=outputdir,
+                number_workers=number_workers) as shared_rasters:
+            task_results = Parallel(n_jobs=number_workers,
+                                    return_as='generator')(
+                delayed(process_bright_water_task)(
+                    block_param,
+                    labels,
+                    label_path=component_index.label_path,
+                    shared_rasters=shared_rasters,
+                    pol_indices=pol_indices,
+                    threshold=threshold)
+                for block_param, labels in task_list)
+
+            for results in task_results:
+                for _, label, bimodality in results:
+                    bimodality_output[label] |= bimodality
+
+    # 0 value in the labels indicates the non-water
+    bimodality_output[0] = False
+
+    fill_gap_path = os.path.join(
+        outputdir, f'merged_fill_gap_{pol_str}.tif')
+    block_params = dswx_sar_util.block_param_generator(
+        lines_per_block, [rows, cols], (0, 0))
+    with dswx_sar_util.RasterBlockWriter(
+            fill_gap_path,
+            geotransform=meta_info['geotransform'],
+            projection=meta_info['projection'],
+            datatype='byte',
+            scratch_dir=outputdir) as writer:
+        for block_param in block_params:
+            label_block = dswx_sar_util.get_raster_block(
+                component_index.label_path, block_param)
+            writer.write_block(bimodality_output[label_block], block_param)
+
+    return fill_gap_path
 
 
 def run(cfg):
@@ -1404,6 +1251,8 @@ def run(cfg):
 
     outputdir = cfg.groups.product_path_group.scratch_path
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='refine_with_bimodality')
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
 
@@ -1428,7 +1277,7 @@ def run(cfg):
         outputdir, f"no_data_area_{pol_str}.tif")
     im_meta = dswx_sar_util.get_meta_from_tif(filt_im_str)
 
-    # read the result of landcover masindex_array_to_imageg
+    # read the result of landcover masking
     water_map_tif_str = os.path.join(
         outputdir, f'refine_landcover_binary_{pol_str}.tif')
 
@@ -1497,7 +1346,7 @@ def run(cfg):
         value_list=[0],
         merged_layer_path=bright_water_path,
         lines_per_block=lines_per_block,
-        mode='or', cog_flag=True,
+        mode='or',
         scratch_dir=outputdir)
 
     fill_gap_bindary_path = \
@@ -1520,7 +1369,6 @@ def run(cfg):
         merged_layer_path=water_tif_str,
         lines_per_block=lines_per_block,
         mode='or',
-        cog_flag=True,
         scratch_dir=outputdir)
 
     t_time_end = time.time()
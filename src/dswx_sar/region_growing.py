@@ -1,3 +1,4 @@
+import contextlib
 import copy
 import gc
 import mimetypes
@@ -6,7 +7,8 @@ import os
 import time
 
 import numpy as np
-from scipy import ndimage
+from scipy import ndimage, sparse
+from scipy.sparse.csgraph import connected_components
 from joblib import Parallel, delayed
 
 from dswx_sar import (dswx_sar_util,
@@ -18,6 +20,26 @@ from dswx_sar.dswx_runconfig import (DSWX_S1_POL_DICT,
 logger = logging.getLogger('dswx_sar')
 
 
+def _check_region_growing_thresholds(initial_threshold,
+                                     relaxed_threshold,
+                                     mode):
+    """Check that the relaxed threshold lies beyond the seed threshold
+    in the direction of the region growing mode.
+    """
+    if mode == 'descending':
+        if initial_threshold <= relaxed_threshold:
+            err_str = f"Initial threshold {initial_threshold} " \
+                      " should be larger than relaxed threshold" \
+                      f"{relaxed_threshold}."
+            raise ValueError(err_str)
+    elif mode == 'ascending':
+        if initial_threshold >= relaxed_threshold:
+            err_str = f"Initial threshold {initial_threshold} " \
+                      " should be smaller than relaxed threshold" \
+                      f"{relaxed_threshold}."
+            raise ValueError(err_str)
+
+
 def region_growing(likelihood_image,
                    initial_threshold=0.6,
                    relaxed_threshold=0.45,
@@ -62,18 +84,9 @@ def region_growing(likelihood_image,
         1: the pixels involved in region growing (i.e., water)
         0: the pixels not involved in region growing (i.e., non-water)
     """
-    if mode == 'descending':
-        if initial_threshold <= relaxed_threshold:
-            err_str = f"Initial threshold {initial_threshold} " \
-                      " should be larger than relaxed threshold" \
-                      f"{relaxed_threshold}."
-            raise ValueError(err_str)
-    elif mode == 'ascending':
-        if initial_threshold >= relaxed_threshold:
-            err_str = f"Initial threshold {initial_threshold} " \
-                      " should be smaller than relaxed threshold" \
-                      f"{relaxed_threshold}."
-            raise ValueError(err_str)
+    _check_region_growing_thresholds(initial_threshold,
+                                     relaxed_threshold,
+                                     mode)
 
     # Create initial binary image using seed value
     if mode == 'descending':
@@ -125,6 +138,115 @@ def region_growing(likelihood_image,
     return binary_image
 
 
+def get_region_growing_masks(likelihood_image,
+                             initial_threshold=0.6,
+                             relaxed_threshold=0.45,
+                             exclude_area=None,
+                             mode='descending'):
+    """Compute the seed pixels and the pixels that region growing
+    is allowed to reach.
+
+    Parameters
+    ----------
+    likelihood_image : numpy.ndarray
+        fuzzy image with values [0, 1] representing
+        likelihood of features (e.g. water)
+    initial_threshold : float
+        seed threshold of region growing
+    relaxed_threshold : float
+        threshold where region growing stops
+    exclude_area : numpy.ndarray
+        area where region growing is not allowed to extend
+    mode : str
+        'ascending' or 'descending'
+
+    Returns
+    ----------
+    seed_binary : numpy.ndarray
+        pixels where region growing starts
+    grow_binary : numpy.ndarray
+        seed pixels and the pixels satisfying the relaxed threshold
+        outside of `exclude_area`
+    """
+    if mode == 'descending':
+        seed_binary = likelihood_image > initial_threshold
+        grow_binary = likelihood_image > relaxed_threshold
+    else:
+        seed_binary = likelihood_image < initial_threshold
+        grow_binary = likelihood_image < relaxed_threshold
+
+    if exclude_area is not None:
+        grow_binary &= np.invert(exclude_area.astype(bool))
+    grow_binary |= seed_binary
+
+    return seed_binary, grow_binary
+
+
+def region_growing_labeling(likelihood_image,
+                            initial_threshold=0.6,
+                            relaxed_threshold=0.45,
+                            maxiter=0,
+                            exclude_area=None,
+                            mode='descending'):
+    """Region growing based on connected component labeling.
+    The pixels satisfying the relaxed threshold are labeled once
+    and the components containing the seed pixels are kept, which
+    gives the same result as `region_growing` with `maxiter=0`.
+    For a finite `maxiter`, the growth is bounded to the pixels
+    within `maxiter` steps from the seeds.
+
+    Parameters
+    ----------
+    likelihood_image : numpy.ndarray
+        fuzzy image with values [0, 1] representing
+        likelihood of features (e.g. water) where 0 is 0% and 1 is 100%
+    initial_threshold : float
+        Initial threshold [0 - 1] used to classify
+        `likelihood_image` into feature and non-feature pixels.
+    relaxed_threshold : float
+        relaxed threshold to be used for transient area
+        between feature and non-feature.
+    maxiter : integer
+        maximum distance in pixels for region growing.
+        Defaults to 0 which translates to unbounded growth.
+    exclude_area : numpy.ndarray
+        area where region growing is not allowed to extend
+    mode : str
+        'ascending' or 'descending'
+
+    Returns
+    ----------
+    binary_image : numpy.ndarray
+        result of region growing algorithm
+        1: the pixels involved in region growing (i.e., water)
+        0: the pixels not involved in region growing (i.e., non-water)
+    """
+    _check_region_growing_thresholds(initial_threshold,
+                                     relaxed_threshold,
+                                     mode)
+    seed_binary, grow_binary = get_region_growing_masks(
+        likelihood_image,
+        initial_threshold=initial_threshold,
+        relaxed_threshold=relaxed_threshold,
+        exclude_area=exclude_area,
+        mode=mode)
+
+    if maxiter > 0:
+        # Only the pixels changed in the previous iteration are
+        # visited by the iterative dilation, and the dilation
+        # stops once no pixel is added.
+        return ndimage.binary_dilation(seed_binary,
+                                       iterations=maxiter,
+                                       mask=grow_binary)
+
+    label_image, num_labels = ndimage.label(grow_binary)
+    seeded_labels = np.zeros(num_labels + 1, dtype=bool)
+    seeded_labels[label_image[seed_binary]] = True
+    seeded_labels[0] = False
+
+    return seeded_labels[label_image]
+
+
 def process_region_growing_block(block_param,
                                  loopind,
                                  base_dir,
@@ -286,35 +408,287 @@ def run_parallel_region_growing(input_tif_path,
                 maxiter)
             for block_param in block_params)
 
-        for block_param, region_grow_block in result:
-            fuzzy_map_temp = \
-                f'{base_dir}/{fuzzy_base_name}_temp_loop_{loopind + 1}.tif'
-
-            dswx_sar_util.write_raster_block(
-                fuzzy_map_temp,
-                region_grow_block,
-                block_param,
-                geotransform=meta_dict['geotransform'],
-                projection=meta_dict['projection'],
-                datatype='float32',
-                cog_flag=True,
-                scratch_dir=base_dir)
-
-            # In final loop, write the result to output_tif_path
-            if loopind == num_loop - 1:
-                dswx_sar_util.write_raster_block(
-                    output_tif_path,
-                    region_grow_block,
-                    block_param,
+        fuzzy_map_temp = \
+            f'{base_dir}/{fuzzy_base_name}_temp_loop_{loopind + 1}.tif'
+        # The writers are closed without finalizing if writing fails.
+        with contextlib.ExitStack() as stack:
+            writer_list = [stack.enter_context(
+                dswx_sar_util.RasterBlockWriter(
+                    fuzzy_map_temp,
                     geotransform=meta_dict['geotransform'],
                     projection=meta_dict['projection'],
                     datatype='float32',
-                    cog_flag=True,
-                    scratch_dir=base_dir)
+                    scratch_dir=base_dir))]
+
+            # In final loop, write the result to output_tif_path
+            if loopind == num_loop - 1:
+                writer_list.append(stack.enter_context(
+                    dswx_sar_util.RasterBlockWriter(
+                        output_tif_path,
+                        geotransform=meta_dict['geotransform'],
+                        projection=meta_dict['projection'],
+                        datatype='float32',
+                        scratch_dir=base_dir)))
+
+            for block_param, region_grow_block in result:
+                for writer in writer_list:
+                    writer.write_block(region_grow_block, block_param)
+
         del result, region_grow_block
         gc.collect()  # Invoke garbage collector
 
 
+def get_region_growing_tiles(data_shape,
+                             lines_per_block,
+                             columns_per_block=None):
+    """Split a raster into 2-D tiles for region growing.
+
+    Parameters
+    ----------
+    data_shape: list
+        length and width of the raster
+    lines_per_block: int
+        lines per tile
+    columns_per_block: int
+        columns per tile. If None or 0, the tiles span the entire width.
+
+    Returns
+    ----------
+    tile_list: list
+        (xoff, yoff, xsize, ysize) of the tiles in row-major order
+    tile_grid_shape: tuple
+        number of tiles along the lines and the columns
+    """
+    data_length, data_width = data_shape
+    lines_per_block = min(data_length, int(lines_per_block))
+    if not columns_per_block:
+        columns_per_block = data_width
+    columns_per_block = min(data_width, int(columns_per_block))
+
+    line_starts = range(0, data_length, lines_per_block)
+    column_starts = range(0, data_width, columns_per_block)
+    tile_list = [(xoff,
+                  yoff,
+                  min(columns_per_block, data_width - xoff),
+                  min(lines_per_block, data_length - yoff))
+                 for yoff in line_starts
+                 for xoff in column_starts]
+
+    return tile_list, (len(line_starts), len(column_starts))
+
+
+def process_region_growing_label_tile(tile,
+                                      input_tif_path,
+                                      exclude_area_path,
+                                      initial_threshold,
+                                      relaxed_threshold,
+                                      mode,
+                                      kept_labels=None):
+    """Label the connected components of the region growing area
+    in a tile.
+
+    Parameters
+    ----------
+    tile: tuple
+        (xoff, yoff, xsize, ysize) of the tile
+    input_tif_path: str
+        path of fuzzy-logic value Geotiff
+    exclude_area_path: str
+        path of the area where region growing is not allowed to extend
+    initial_threshold : float
+        seed threshold of region growing
+    relaxed_threshold : float
+        threshold where region growing stops
+    mode : str
+        'ascending' or 'descending'
+    kept_labels: numpy.ndarray
+        Boolean lookup of the labels to keep in the tile.
+        If None, the labels are summarized for the seam exchange.
+
+    Returns
+    ----------
+    tile: tuple
+        (xoff, yoff, xsize, ysize) of the tile
+    If `kept_labels` is None,
+        num_labels: int
+            number of labels in the tile
+        seeded_labels: numpy.ndarray
+            Boolean array whose elements are True for the labels
+            including seed pixels. The first element is the background.
+        border_labels: dict
+            labels along the 'top', 'bottom', 'left', and 'right'
+            borders of the tile
+    Otherwise,
+        binary_tile: numpy.ndarray
+            region growing result of the tile
+    """
+    data_tile = dswx_sar_util.get_raster_window(
+        input_tif_path, *tile)
+    if exclude_area_path is not None:
+        exclude_tile = dswx_sar_util.get_raster_window(
+            exclude_area_path, *tile)
+    else:
+        exclude_tile = None
+
+    seed_binary, grow_binary = get_region_growing_masks(
+        data_tile,
+        initial_threshold=initial_threshold,
+        relaxed_threshold=relaxed_threshold,
+        exclude_area=exclude_tile,
+        mode=mode)
+    del data_tile, exclude_tile
+
+    label_image, num_labels = ndimage.label(grow_binary)
+    del grow_binary
+
+    if kept_labels is not None:
+        return tile, kept_labels[label_image]
+
+    seeded_labels = np.zeros(num_labels + 1, dtype=bool)
+    seeded_labels[label_image[seed_binary]] = True
+    seeded_labels[0] = False
+
+    border_labels = {'top': label_image[0].copy(),
+                     'bottom': label_image[-1].copy(),
+                     'left': label_image[:, 0].copy(),
+                     'right': label_image[:, -1].copy()}
+
+    return tile, num_labels, seeded_labels, border_labels
+
+
+def run_parallel_region_growing_labeling(input_tif_path,
+                                         exclude_area_path=None,
+                                         lines_per_block=200,
+                                         columns_per_block=None,
+                                         initial_threshold=0.6,
+                                         relaxed_threshold=0.45,
+                                         mode='descending'):
+    """Perform labeling-based region growing over 2-D tiles in parallel.
+    The tiles are labeled independently, and only the labels along the
+    tile borders are exchanged across the horizontal and vertical seams.
+    The labels touching across the seams are merged, and the merged
+    components containing seed pixels are kept. The result is identical
+    to running `region_growing` with `maxiter=0` over the entire image.
+
+    Parameters
+    ----------
+    input_tif_path: str
+        path of fuzzy-logic value Geotiff
+    exclude_area_path: str
+        path of the area where region growing is not allowed to extend
+    lines_per_block: int
+        lines per tile
+    columns_per_block: int
+        columns per tile. If None or 0, the tiles span the entire width.
+    initial_threshold: float
+        Initial seed values where region-growing starts.
+    relaxed_threshold: float
+        value where region-growing stops.
+    mode : str
+        'ascending' or 'descending'
+
+    Returns
+    ----------
+    binary_image : numpy.ndarray
+        result of region growing algorithm
+    """
+    _check_region_growing_thresholds(initial_threshold,
+                                     relaxed_threshold,
+                                     mode)
+    meta_dict = dswx_sar_util.get_meta_from_tif(input_tif_path)
+    data_shape = [meta_dict['length'], meta_dict['width']]
+
+    tile_list, (num_tile_rows, num_tile_cols) = get_region_growing_tiles(
+        data_shape, lines_per_block, columns_per_block)
+    use_cpu = min(os.cpu_count(), len(tile_list))
+
+    # First pass: label the tiles and summarize the tile borders
+    tile_summary = Parallel(n_jobs=use_cpu)(
+        delayed(process_region_growing_label_tile)(
+            tile,
+            input_tif_path,
+            exclude_area_path,
+            initial_threshold,
+            relaxed_threshold,
+            mode)
+        for tile in tile_list)
+
+    # Global index of the labels. Label 0 (background) of every tile
+    # is mapped to the node 0.
+    label_offsets = np.cumsum(
+        [0] + [summary[1] for summary in tile_summary])
+    num_nodes = label_offsets[-1] + 1
+
+    seeded_nodes = np.zeros(num_nodes, dtype=bool)
+    for tile_ind, summary in enumerate(tile_summary):
+        seeded_nodes[label_offsets[tile_ind] + 1:
+                     label_offsets[tile_ind + 1] + 1] = summary[2][1:]
+
+    # Seam exchange: link the labels touching across the borders
+    # between the vertically and horizontally adjacent tiles
+    seam_pairs = []
+    for tile_row in range(num_tile_rows):
+        for tile_col in range(num_tile_cols):
+            tile_ind = tile_row * num_tile_cols + tile_col
+            if tile_row + 1 < num_tile_rows:
+                seam_pairs.append((tile_ind, 'bottom',
+                                   tile_ind + num_tile_cols, 'top'))
+            if tile_col + 1 < num_tile_cols:
+                seam_pairs.append((tile_ind, 'right',
+                                   tile_ind + 1, 'left'))
+
+    edge_src = [np.zeros(0, dtype=np.int64)]
+    edge_dst = [np.zeros(0, dtype=np.int64)]
+    for tile_ind, border, neighbor_ind, neighbor_border in seam_pairs:
+        tile_strip = tile_summary[tile_ind][3][border]
+        neighbor_strip = tile_summary[neighbor_ind][3][neighbor_border]
+        touching = (tile_strip > 0) & (neighbor_strip > 0)
+        edge_src.append(tile_strip[touching] + label_offsets[tile_ind])
+        edge_dst.append(neighbor_strip[touching] +
+                        label_offsets[neighbor_ind])
+    edge_src = np.concatenate(edge_src)
+    edge_dst = np.concatenate(edge_dst)
+
+    # The connectivity over all seams is resolved at once, which is
+    # the converged state of propagating the labels seam by seam.
+    label_graph = sparse.coo_matrix(
+        (np.ones(len(edge_src), dtype=np.int8), (edge_src, edge_dst)),
+        shape=(num_nodes, num_nodes))
+    _, component_ind = connected_components(label_graph,
+                                            directed=False)
+    seeded_components = np.zeros(component_ind.max() + 1, dtype=bool)
+    seeded_components[component_ind[seeded_nodes]] = True
+    kept_nodes = seeded_components[component_ind]
+    kept_nodes[0] = False
+
+    logger.info(f'region growing labeled {num_nodes - 1} components '
+                f'over {num_tile_rows} x {num_tile_cols} tiles with '
+                f'{len(edge_src)} seam links')
+
+    # Second pass: keep the labels connected to the seeds
+    result = Parallel(n_jobs=use_cpu)(
+        delayed(process_region_growing_label_tile)(
+            tile,
+            input_tif_path,
+            exclude_area_path,
+            initial_threshold,
+            relaxed_threshold,
+            mode,
+            np.concatenate(
+                [[False],
+                 kept_nodes[label_offsets[tile_ind] + 1:
+                            label_offsets[tile_ind + 1] + 1]]))
+        for tile_ind, tile in enumerate(tile_list))
+
+    binary_image = np.zeros(data_shape, dtype=bool)
+    for (xoff, yoff, xsize, ysize), binary_tile in result:
+        binary_image[yoff:yoff + ysize, xoff:xoff + xsize] = binary_tile
+    del result, tile_summary
+    gc.collect()
+
+    return binary_image
+
+
 def run(cfg):
     '''
     Run region growing with parameters in cfg dictionary
@@ -324,6 +698,8 @@ def run(cfg):
     t_all = time.time()
 
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='region_growing')
     outputdir = cfg.groups.product_path_group.scratch_path
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
@@ -338,43 +714,57 @@ def run(cfg):
     region_growing_seed = region_growing_cfg.initial_threshold
     region_growing_relaxed_threshold = region_growing_cfg.relaxed_threshold
     region_growing_line_per_block = region_growing_cfg.line_per_block
+    region_growing_column_per_block = region_growing_cfg.column_per_block
+    region_growing_engine = region_growing_cfg.engine
 
     logger.info(f'Region Growing Seed: {region_growing_seed}')
     logger.info('Region Growing relaxed threshold: '
                 f'{region_growing_relaxed_threshold}')
+    logger.info(f'Region Growing engine: {region_growing_engine}')
 
     fuzzy_tif_path = os.path.join(
         outputdir, f'fuzzy_image_{pol_str}.tif')
     feature_meta = dswx_sar_util.get_meta_from_tif(fuzzy_tif_path)
     feature_tif_path = os.path.join(
         outputdir, f"region_growing_output_binary_{pol_str}.tif")
-    temp_rg_tif_path = os.path.join(
-        outputdir, f'temp_region_growing_{pol_str}.tif')
-
-    # First, run region-growing algorithm for blocks
-    # to avoid to repeatly run with large image.
-    run_parallel_region_growing(
-        fuzzy_tif_path,
-        temp_rg_tif_path,
-        lines_per_block=region_growing_line_per_block,
-        initial_threshold=region_growing_seed,
-        relaxed_threshold=region_growing_relaxed_threshold,
-        maxiter=0)
-
-    fuzzy_map = dswx_sar_util.read_geotiff(fuzzy_tif_path)
-    temp_rg = dswx_sar_util.read_geotiff(temp_rg_tif_path)
-
-    # replace the fuzzy values with 1 for the pixels
-    # where the region-growing already applied
-    fuzzy_map[temp_rg == 1] = 1
-    del temp_rg
-
-    # Run region-growing again for entire image
-    region_grow_map = region_growing(
-        fuzzy_map,
-        initial_threshold=region_growing_seed,
-        relaxed_threshold=region_growing_relaxed_threshold,
-        maxiter=0)
+
+    if region_growing_engine == 'labeling':
+        # Label the 2-D tiles and merge the labels across the tile
+        # seams. No intermediate loop is required.
+        region_grow_map = run_parallel_region_growing_labeling(
+            fuzzy_tif_path,
+            lines_per_block=region_growing_line_per_block,
+            columns_per_block=region_growing_column_per_block,
+            initial_threshold=region_growing_seed,
+            relaxed_threshold=region_growing_relaxed_threshold)
+    else:
+        temp_rg_tif_path = os.path.join(
+            outputdir, f'temp_region_growing_{pol_str}.tif')
+
+        # First, run region-growing algorithm for blocks
+        # to avoid to repeatly run with large image.
+        run_parallel_region_growing(
+            fuzzy_tif_path,
+            temp_rg_tif_path,
+            lines_per_block=region_growing_line_per_block,
+            initial_threshold=region_growing_seed,
+            relaxed_threshold=region_growing_relaxed_threshold,
+            maxiter=0)
+
+        fuzzy_map = dswx_sar_util.read_geotiff(fuzzy_tif_path)
+        temp_rg = dswx_sar_util.read_geotiff(temp_rg_tif_path)
+
+        # replace the fuzzy values with 1 for the pixels
+        # where the region-growing already applied
+        fuzzy_map[temp_rg == 1] = 1
+        del temp_rg
+
+        # Run region-growing again for entire image
+        region_grow_map = region_growing(
+            fuzzy_map,
+            initial_threshold=region_growing_seed,
+            relaxed_threshold=region_growing_relaxed_threshold,
+            maxiter=0)
 
     dswx_sar_util.save_dswx_product(
         region_grow_map,
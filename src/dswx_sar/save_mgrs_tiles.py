@@ -1,23 +1,24 @@
 import ast
+import contextlib
 import copy
 import datetime
 import glob
 import logging
 import mimetypes
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import geopandas as gpd
 import mgrs
 import numpy as np
 from osgeo import gdal, osr
-from pyproj import CRS, Transformer
+from pyproj import CRS
 import rasterio
 from rasterio.warp import transform_bounds
 from rasterio.merge import merge
-from shapely import wkt
 from shapely.geometry import Polygon
-from shapely.ops import transform
 
 from dswx_sar import (dswx_sar_util,
                       generate_log)
@@ -26,6 +27,7 @@ from dswx_sar.dswx_sar_util import (band_assign_value_dict,
 from dswx_sar.dswx_runconfig import RunConfig, _get_parser, DSWX_S1_POL_DICT
 from dswx_sar.metadata import (create_dswx_sar_metadata,
                                collect_burst_id,
+                               RTCBurstIndex,
                                _populate_statics_metadata_datasets)
 
 logger = logging.getLogger('dswx_sar')
@@ -80,6 +82,109 @@ def merge_pol_layers(list_layers,
     dswx_sar_util._save_as_cog(output_file, scratch_dir)
 
 
+class MGRSDatabase:
+    """Accessor of an MGRS tile or MGRS collection database that is
+    parsed once per process.
+
+    Along with the records, the accessor keeps a dictionary from MGRS
+    tile name to record and the records reprojected to EPSG:4326 with
+    their spatial index, so that bounding box lookups are O(1) and
+    intersection queries only overlay the candidate records.
+    Use `MGRSDatabase.get` to obtain the shared accessor of a file.
+
+    Parameters
+    ----------
+    db_path: str
+        Path to the MGRS tile or MGRS collection database file
+    """
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.signature = self._file_signature(db_path)
+        self.gdf = gpd.read_file(db_path)
+        self._gdf_4326 = None
+        self._tile_rows = None
+        self._column_rows = {}
+
+    @staticmethod
+    def _file_signature(db_path):
+        stat = os.stat(db_path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def get(cls, db_path):
+        """Return the shared accessor of `db_path`, loading the database
+        only if it was not loaded yet or it changed on disk."""
+        key = os.path.abspath(db_path)
+        with cls._lock:
+            instance = cls._instances.get(key)
+            if (instance is None or
+                    instance.signature != cls._file_signature(db_path)):
+                logger.info(f'Loading MGRS database {db_path}')
+                instance = cls(db_path)
+                cls._instances[key] = instance
+        return instance
+
+    def get_bounding_box(self, mgrs_tile_name):
+        """Return minx, maxx, miny, maxy, and EPSG code of an MGRS tile"""
+        if self._tile_rows is None:
+            self._tile_rows = {}
+            for row, tile_name in enumerate(self.gdf['mgrs_tile'].values):
+                self._tile_rows.setdefault(tile_name, row)
+        if mgrs_tile_name not in self._tile_rows:
+            raise ValueError(f'MGRS tile {mgrs_tile_name} is not found in '
+                             f'{self.db_path}')
+        row = self._tile_rows[mgrs_tile_name]
+        return (self.gdf['xmin'].values[row],
+                self.gdf['xmax'].values[row],
+                self.gdf['ymin'].values[row],
+                self.gdf['ymax'].values[row],
+                self.gdf['epsg'].values[row])
+
+    def _get_rows_with_value(self, column, value):
+        if column not in self._column_rows:
+            self._column_rows[column] = {
+                key: np.sort(rows)
+                for key, rows in self.gdf.groupby(column).indices.items()}
+        return self._column_rows[column].get(value,
+                                             np.array([], dtype=np.int64))
+
+    def overlay_intersection(self, geometry_gdf, column=None, value=None):
+        """Intersect polygons with the database records.
+
+        Parameters
+        ----------
+        geometry_gdf: geopandas.GeoDataFrame
+            Polygons in EPSG:4326
+        column: str, optional
+            If given, only the records whose `column` is
+            equal to `value` are intersected.
+        value: optional
+            Value of `column` of the records to intersect
+
+        Returns
+        -------
+        intersection: geopandas.GeoDataFrame
+            Result of `gpd.overlay` with `how='intersection'`
+            in EPSG:4326
+        """
+        if self._gdf_4326 is None:
+            self._gdf_4326 = self.gdf.to_crs("EPSG:4326")
+
+        _, candidate_rows = self._gdf_4326.sindex.query(
+            geometry_gdf.geometry.values, predicate='intersects')
+        candidate_rows = np.unique(candidate_rows)
+        if column is not None:
+            candidate_rows = np.intersect1d(
+                candidate_rows, self._get_rows_with_value(column, value))
+
+        return gpd.overlay(geometry_gdf,
+                           self._gdf_4326.iloc[candidate_rows],
+                           how='intersection')
+
+
 def get_bounding_box_from_mgrs_tile_db(
         mgrs_tile_name,
         mgrs_db_path):
@@ -106,22 +211,8 @@ def get_bounding_box_from_mgrs_tile_db(
     epsg: int
         EPSG code
     """
-    # Load the database from the MGRS db file.
-    vector_gdf = gpd.read_file(mgrs_db_path)
-
-    # Filter the MGRS database using the provided "mgrs_tile_name"
-    filtered_gdf = vector_gdf[vector_gdf['mgrs_tile'] ==
-                              mgrs_tile_name]
-
-    # Get the bounding box coordinates and
-    # EPSG code from the filtered data
-    minx = filtered_gdf['xmin'].values[0]
-    maxx = filtered_gdf['xmax'].values[0]
-    miny = filtered_gdf['ymin'].values[0]
-    maxy = filtered_gdf['ymax'].values[0]
-    epsg = filtered_gdf['epsg'].values[0]
-
-    return minx, maxx, miny, maxy, epsg
+    # The database is loaded once and the tile is looked up by name.
+    return MGRSDatabase.get(mgrs_db_path).get_bounding_box(mgrs_tile_name)
 
 
 def get_bounding_box_from_mgrs_tile(mgrs_tile_name):
@@ -184,7 +275,8 @@ def get_bounding_box_from_mgrs_tile(mgrs_tile_name):
 
 def find_intersecting_burst_with_bbox(ref_bbox,
                                       ref_epsg,
-                                      input_rtc_dirs):
+                                      input_rtc_dirs,
+                                      burst_index=None):
     """Find bursts overlapped with the reference bbox.
 
     Parameters
@@ -195,45 +287,23 @@ def find_intersecting_burst_with_bbox(ref_bbox,
         reference EPSG code.
     input_rtc_dirs: list
         List of rtc directories
+    burst_index: RTCBurstIndex, optional
+        Footprint index of the rtc bursts. If not provided,
+        it is built from `input_rtc_dirs`.
 
     Returns
     -------
     overlapped_rtc_dir_list: list
         List of rtc bursts overlapped with given bbox
     """
-    minx, miny, maxx, maxy = ref_bbox
-    ref_polygon = Polygon([(minx, miny),
-                           (minx, maxy),
-                           (maxx, maxy),
-                           (maxx, miny)])
-
-    overlapped_rtc_dir_list = []
-    for input_dir in input_rtc_dirs:
-
-        copol_file_list = [f for f in glob.glob(f'{input_dir}/*.tif')
-                           if any(pol in f
-                                  for pol in DSWX_S1_POL_DICT['CO_POL'])]
-        if copol_file_list:
-            with rasterio.open(copol_file_list[0]) as src:
-                tags = src.tags(0)
-                rtc_polygon_str = tags['BOUNDING_POLYGON']
-                epsg_code = int(tags['BOUNDING_POLYGON_EPSG_CODE'])
-                rtc_polygon = wkt.loads(rtc_polygon_str)
-
-                # Reproject to EPSG 4326 if the current EPSG is not 4326
-                if epsg_code != ref_epsg:
-                    # # Create a transformer
-                    transformer = Transformer.from_crs(f'EPSG:{epsg_code}',
-                                                       f'EPSG:{ref_epsg}',
-                                                       always_xy=True)
-
-                    # Transform the polygon
-                    rtc_polygon = transform(transformer.transform, rtc_polygon)
-
-            # Check if bursts intersect the reference polygon
-            if ref_polygon.intersects(rtc_polygon) or \
-               ref_polygon.overlaps(rtc_polygon):
-                overlapped_rtc_dir_list.append(input_dir)
+    if burst_index is None:
+        burst_index = RTCBurstIndex(input_rtc_dirs,
+                                    DSWX_S1_POL_DICT['CO_POL'])
+
+    overlapped_rtc_dir_list = [
+        rtc_dir for rtc_dir in burst_index.query_bboxes(
+            [ref_bbox], [ref_epsg])[0]
+        if rtc_dir in input_rtc_dirs]
 
     if not overlapped_rtc_dir_list:
         logger.warning('fail to find the overlapped rtc')
@@ -252,7 +322,8 @@ def crop_and_save_mgrs_tile(
         metadata,
         cog_compression,
         cog_nbits,
-        interpolation_method='nearest'):
+        interpolation_method='nearest',
+        output_spacing=None):
     """Crop the product along the MGRS tile grid and
     save it as a Cloud-Optimized GeoTIFF (COG).
 
@@ -279,14 +350,21 @@ def crop_and_save_mgrs_tile(
         Compression nbits
     interpolation_method : str
         Interpolation method for cropping, by default 'nearest'.
+    output_spacing : float, optional
+        Output pixel spacing. If not given, the spacing of
+        the input TIFF is used.
     """
     input_tif_obj = gdal.Open(source_tif_path)
     band = input_tif_obj.GetRasterBand(1)
     no_data_value = band.GetNoDataValue()
 
     # Retrieve spatial resolution from input TIFF
-    xspacing = input_tif_obj.GetGeoTransform()[1]
-    yspacing = input_tif_obj.GetGeoTransform()[5]
+    if output_spacing is None:
+        xspacing = input_tif_obj.GetGeoTransform()[1]
+        yspacing = input_tif_obj.GetGeoTransform()[5]
+    else:
+        xspacing = output_spacing
+        yspacing = output_spacing
 
     # Create output file path
     output_tif_file_path = os.path.join(output_dir_path,
@@ -324,6 +402,413 @@ def crop_and_save_mgrs_tile(
             nbits=cog_nbits)
 
 
+def _is_stackable(source_tif_paths):
+    """Check if the rasters share the grid, data type and the presence
+    of the no-data value so that they can be warped as one stack."""
+    grid_list = []
+    for source_tif_path in source_tif_paths:
+        input_tif_obj = gdal.Open(source_tif_path)
+        band = input_tif_obj.GetRasterBand(1)
+        grid_list.append((input_tif_obj.RasterXSize,
+                          input_tif_obj.RasterYSize,
+                          input_tif_obj.RasterCount,
+                          tuple(input_tif_obj.GetGeoTransform()),
+                          input_tif_obj.GetProjection(),
+                          band.DataType,
+                          band.GetNoDataValue() is None))
+        input_tif_obj = None
+    return len(set(grid_list)) == 1 and grid_list[0][2] == 1
+
+
+def crop_and_save_mgrs_tile_layers(
+        source_tif_paths,
+        output_dir_path,
+        output_tif_names,
+        output_bbox,
+        output_epsg,
+        output_format,
+        metadata,
+        cog_compression,
+        cog_nbits,
+        interpolation_method='nearest',
+        output_spacing=None):
+    """Crop the product layers along the MGRS tile grid with a single
+    warp and save each layer as a Cloud-Optimized GeoTIFF (COG).
+
+    The layers are stacked in a VRT and warped at once so that the
+    coordinate transformation is computed once per MGRS tile. Layers
+    that do not share the same grid are cropped one by one with
+    `crop_and_save_mgrs_tile`.
+
+    Parameters
+    ----------
+    source_tif_paths : list
+        Paths to the original single-band TIFF files.
+    output_dir_path : str
+        Path to the directory to save the output files.
+    output_tif_names : list
+        Filenames for the cropped GeoTIFFs in the order of
+        `source_tif_paths`.
+    output_bbox : list
+        List of bounding box
+        i.e. [x_min, y_min, x_max, y_max]
+    output_epsg : int
+        EPSG for output GeoTIFF
+    output_format : str
+        Output file format (i.e., COG, GeoTIFF)
+    metadata : dict
+        Dictionry for metadata
+    cog_compression: str
+        Compression method for COG
+    cog_nbits: int
+        Compression nbits
+    interpolation_method : str
+        Interpolation method for cropping, by default 'nearest'.
+    output_spacing : float, optional
+        Output pixel spacing. If not given, the spacing of
+        the input TIFFs is used.
+    """
+    if not _is_stackable(source_tif_paths):
+        for source_tif_path, output_tif_name in zip(source_tif_paths,
+                                                    output_tif_names):
+            crop_and_save_mgrs_tile(
+                source_tif_path=source_tif_path,
+                output_dir_path=output_dir_path,
+                output_tif_name=output_tif_name,
+                output_bbox=output_bbox,
+                output_epsg=output_epsg,
+                output_format=output_format,
+                metadata=metadata,
+                cog_compression=cog_compression,
+                cog_nbits=cog_nbits,
+                interpolation_method=interpolation_method,
+                output_spacing=output_spacing)
+        return
+
+    input_tif_obj_list = [gdal.Open(source_tif_path)
+                          for source_tif_path in source_tif_paths]
+    band_list = [input_tif_obj.GetRasterBand(1)
+                 for input_tif_obj in input_tif_obj_list]
+    no_data_list = [band.GetNoDataValue() for band in band_list]
+    data_type = band_list[0].DataType
+
+    # Retrieve spatial resolution from input TIFF
+    if output_spacing is None:
+        xspacing = input_tif_obj_list[0].GetGeoTransform()[1]
+        yspacing = input_tif_obj_list[0].GetGeoTransform()[5]
+    else:
+        xspacing = output_spacing
+        yspacing = output_spacing
+
+    if no_data_list[0] is None:
+        dst_no_data = None
+    else:
+        dst_no_data = ' '.join(str(no_data) for no_data in no_data_list)
+
+    # Warp all layers at once from a band-stacked VRT
+    stack_vrt = gdal.BuildVRT('', source_tif_paths, separate=True)
+    warp_options = gdal.WarpOptions(
+        dstSRS=f'EPSG:{output_epsg}',
+        outputType=data_type,
+        xRes=xspacing,
+        yRes=yspacing,
+        outputBounds=output_bbox,
+        resampleAlg=interpolation_method,
+        dstNodata=dst_no_data,
+        format='MEM')
+    warped_obj = gdal.Warp('', stack_vrt, options=warp_options)
+    stack_vrt = None
+
+    driver = gdal.GetDriverByName('GTiff')
+    for band_index, output_tif_name in enumerate(output_tif_names):
+        input_tif_obj = input_tif_obj_list[band_index]
+        input_band = band_list[band_index]
+
+        output_tif_file_path = os.path.join(output_dir_path,
+                                            output_tif_name)
+        output_tif_obj = driver.Create(output_tif_file_path,
+                                       warped_obj.RasterXSize,
+                                       warped_obj.RasterYSize,
+                                       1,
+                                       data_type)
+        output_tif_obj.SetGeoTransform(warped_obj.GetGeoTransform())
+        output_tif_obj.SetProjection(warped_obj.GetProjection())
+        output_tif_obj.SetMetadata(input_tif_obj.GetMetadata())
+
+        # Carry the band attributes of the layer as gdal.Warp does
+        output_band = output_tif_obj.GetRasterBand(1)
+        output_band.WriteArray(
+            warped_obj.GetRasterBand(band_index + 1).ReadAsArray())
+        if no_data_list[band_index] is not None:
+            output_band.SetNoDataValue(no_data_list[band_index])
+        output_band.SetMetadata(input_band.GetMetadata())
+        output_band.SetDescription(input_band.GetDescription())
+        color_table = input_band.GetColorTable()
+        if color_table is not None:
+            output_band.SetColorTable(color_table)
+        output_band.FlushCache()
+        output_tif_obj = None
+
+        _populate_statics_metadata_datasets(metadata,
+                                            output_tif_file_path)
+
+        with rasterio.open(output_tif_file_path, 'r+') as src:
+            src.update_tags(**metadata)
+
+        if output_format == 'COG':
+            dswx_sar_util._save_as_cog(
+                output_tif_file_path,
+                output_dir_path,
+                logger,
+                compression=cog_compression,
+                nbits=cog_nbits)
+
+    warped_obj = None
+    input_tif_obj_list = None
+
+
+def write_mgrs_tiles(tile_writer, mgrs_tile_list, number_workers=1):
+    """Write the products of independent MGRS tiles on a bounded
+    pool of worker threads.
+
+    GDAL releases the GIL while warping and translating the rasters,
+    so the tiles are written concurrently by threads that share
+    the inputs of the caller.
+
+    Parameters
+    ----------
+    tile_writer: callable
+        Function that writes the products of a MGRS tile given
+        the index and the name of the MGRS tile
+    mgrs_tile_list: list
+        List of the MGRS tile names
+    number_workers: int
+        Maximum number of MGRS tiles written concurrently.
+        -1 uses all available CPUs.
+
+    Returns
+    -------
+    results: list
+        Outputs of `tile_writer` in the order of `mgrs_tile_list`
+    """
+    if not mgrs_tile_list:
+        return []
+    if number_workers is None or number_workers < 1:
+        number_workers = os.cpu_count() or 1
+    number_workers = min(int(number_workers), len(mgrs_tile_list))
+
+    def _write_tile(mgrs_num_id, mgrs_tile_id):
+        t_tile = time.time()
+        result = tile_writer(mgrs_num_id, mgrs_tile_id)
+        t_tile_elapsed = time.time() - t_tile
+        logger.info(f'MGRS tile {mgrs_tile_id} was written in '
+                    f'{t_tile_elapsed:.3f} seconds')
+        return result, t_tile_elapsed
+
+    logger.info(f'Writing {len(mgrs_tile_list)} MGRS tiles with '
+                f'{number_workers} workers')
+    if number_workers == 1:
+        outputs = [_write_tile(mgrs_num_id, mgrs_tile_id)
+                   for mgrs_num_id, mgrs_tile_id in enumerate(mgrs_tile_list)]
+    else:
+        with ThreadPoolExecutor(max_workers=number_workers) as executor:
+            futures = [executor.submit(_write_tile, mgrs_num_id, mgrs_tile_id)
+                       for mgrs_num_id, mgrs_tile_id
+                       in enumerate(mgrs_tile_list)]
+            outputs = [future.result() for future in futures]
+
+    t_tiles = [t_tile_elapsed for _, t_tile_elapsed in outputs]
+    logger.info(f'MGRS tile writing time: mean {np.mean(t_tiles):.3f}, '
+                f'max {np.max(t_tiles):.3f} seconds')
+    return [result for result, _ in outputs]
+
+
+def save_full_dswx_products(paths,
+                            output_path_dict,
+                            water_meta,
+                            hand_path,
+                            hand_mask_value,
+                            layover_shadow_mask_path=None,
+                            ocean_mask=None,
+                            save_all_layers=True,
+                            lines_per_block=1000,
+                            scratch_dir='.'):
+    """Assemble the full-frame WTR, BWTR, CONF, and DIAG products
+    block by block from the layers in the scratch directory.
+
+    All products are written in a single pass over the blocks,
+    so the peak memory is bounded by `lines_per_block`.
+
+    Parameters
+    ----------
+    paths: dict
+        Paths of the layers with keys 'final_water', 'no_data_area',
+        'region_growing', 'landcover_mask', 'fuzzy_value', and
+        'inundated_veg' if the inundated vegetation is enabled.
+    output_path_dict: dict
+        Paths of the full-frame products with keys
+        'WTR', 'BWTR', 'CONF', and 'DIAG'
+    water_meta: dict
+        Metadata of the final water map
+    hand_path: str
+        Path of the interpolated HAND
+    hand_mask_value: float
+        HAND value above which the pixels are masked
+    layover_shadow_mask_path: str, optional
+        Path of the layover/shadow mask
+    ocean_mask: numpy.ndarray, optional
+        Ocean mask (0: land, 1: ocean) of the frame
+    save_all_layers: bool
+        If True, BWTR, CONF, and DIAG are saved along with WTR.
+        Otherwise (i.e., Twele's workflow), only WTR is saved.
+    lines_per_block: int
+        Number of lines per block
+    scratch_dir: str
+        Directory for intermediate files
+    """
+    length = water_meta['length']
+    width = water_meta['width']
+    no_data_value = band_assign_value_dict['no_data']
+    inundated_vege_flag = 'inundated_veg' in paths
+
+    if inundated_vege_flag:
+        logger.info('Inudated vegetation file was found.')
+    else:
+        logger.warning('Inudated vegetation file was disabled.')
+
+    # description and flag for the diagnostic layer of the products
+    product_dict = {'WTR': ('Water classification (WTR)', False)}
+    if save_all_layers:
+        product_dict['BWTR'] = ('Binary Water classification (BWTR)', False)
+        product_dict['CONF'] = ('Confidence values (CONF)', False)
+        product_dict['DIAG'] = ('Diagnostic layer (DIAG)', True)
+
+    with contextlib.ExitStack() as stack:
+        writer_dict = {
+            key: stack.enter_context(dswx_sar_util.DSWxProductWriter(
+                output_path_dict[key],
+                geotransform=water_meta['geotransform'],
+                projection=water_meta['projection'],
+                length=length,
+                width=width,
+                scratch_dir=scratch_dir,
+                description=description,
+                is_diag=is_diag,
+                logger=logger))
+            for key, (description, is_diag) in product_dict.items()}
+
+        for block_param in dswx_sar_util.block_param_generator(
+                lines_per_block=lines_per_block,
+                data_shape=[length, width],
+                pad_shape=(0, 0)):
+            start_line = block_param.write_start_line
+            end_line = start_line + block_param.block_length
+
+            # 1) water map
+            water_map = dswx_sar_util.get_raster_block(
+                paths['final_water'], block_param)
+            no_data_raster = dswx_sar_util.get_raster_block(
+                paths['no_data_area'], block_param)
+            no_data_raster = (no_data_raster > 0) | \
+                (water_map == no_data_value)
+
+            # 2) layover/shadow
+            if layover_shadow_mask_path is not None:
+                layover_shadow_mask = dswx_sar_util.get_raster_block(
+                    layover_shadow_mask_path, block_param) > 0
+            else:
+                layover_shadow_mask = None
+
+            # 3) hand excluded
+            hand_mask = dswx_sar_util.get_raster_block(
+                hand_path, block_param) > hand_mask_value
+
+            # 4) inundated_vegetation
+            if inundated_vege_flag:
+                inundated_vegetation = dswx_sar_util.get_raster_block(
+                    paths['inundated_veg'], block_param)
+                inundated_vegetation_mask = (inundated_vegetation == 2) & \
+                                            (water_map == 1)
+                inundated_vegetation[inundated_vegetation_mask] = 1
+                inundated_vegetation = inundated_vegetation == 2
+            else:
+                inundated_vegetation = False
+
+            # 5) ocean mask
+            if ocean_mask is not None:
+                ocean_mask_block = ocean_mask[start_line:end_line]
+            else:
+                ocean_mask_block = None
+
+            if not save_all_layers:
+                # In Twele's workflow, bright water/dark land/inundated
+                # vegetation is not saved.
+                writer_dict['WTR'].write_block(
+                    water_map == 1,
+                    block_param,
+                    layover_shadow_mask=layover_shadow_mask,
+                    hand_mask=hand_mask,
+                    no_data=no_data_raster)
+                continue
+
+            # Open water/inundated vegetation
+            # layover shadow mask/hand mask/no_data
+            # will be saved in WTR product
+            writer_dict['WTR'].write_block(
+                water_map == 1,
+                block_param,
+                layover_shadow_mask=layover_shadow_mask,
+                hand_mask=hand_mask,
+                inundated_vegetation=inundated_vegetation,
+                no_data=no_data_raster,
+                ocean_mask=ocean_mask_block)
+
+            # water/ No-water
+            # layover shadow mask/hand mask/no_data
+            # will be saved in BWTR product
+            # Water includes open water and inundated vegetation.
+            writer_dict['BWTR'].write_block(
+                np.logical_or(water_map == 1, inundated_vegetation),
+                block_param,
+                layover_shadow_mask=layover_shadow_mask,
+                hand_mask=hand_mask,
+                ocean_mask=ocean_mask_block,
+                no_data=no_data_raster)
+
+            # Open water/landcover mask/bright water/dark land
+            # layover shadow mask/hand mask/inundated vegetation
+            # will be saved in CONF product
+            region_grow_map = dswx_sar_util.get_raster_block(
+                paths['region_growing'], block_param)
+            landcover_map = dswx_sar_util.get_raster_block(
+                paths['landcover_mask'], block_param)
+            writer_dict['CONF'].write_block(
+                water_map == 1,
+                block_param,
+                landcover_mask=(region_grow_map == 1) & (landcover_map != 1),
+                bright_water_fill=(landcover_map == 0) & (water_map == 1),
+                dark_land_mask=(landcover_map == 1) & (water_map == 0),
+                layover_shadow_mask=layover_shadow_mask,
+                hand_mask=hand_mask,
+                ocean_mask=ocean_mask_block,
+                inundated_vegetation=inundated_vegetation,
+                no_data=no_data_raster)
+
+            # Values ranging from 0 to 100 are used to represent the
+            # likelihood or possibility of the presence of water. A higher
+            # value within this range signifies a higher likelihood of
+            # water being present.
+            fuzzy_value = dswx_sar_util.get_raster_block(
+                paths['fuzzy_value'], block_param)
+            writer_dict['DIAG'].write_block(
+                np.round(fuzzy_value * 100),
+                block_param,
+                layover_shadow_mask=layover_shadow_mask,
+                hand_mask=hand_mask,
+                ocean_mask=ocean_mask_block,
+                no_data=no_data_raster)
+
+
 def get_intersecting_mgrs_tiles_list_from_db(
         image_tif,
         mgrs_collection_file,
@@ -397,22 +882,15 @@ def get_intersecting_mgrs_tiles_list_from_db(
                                       geometry=[raster_polygon],
                                       crs=4326)
 
-    # Load the vector data
-    vector_gdf = gpd.read_file(mgrs_collection_file)
-
+    # Calculate the intersection with the MGRS tile collection.
     # If track number is given, then search MGRS tile collection with
     # track number
+    mgrs_collection_db = MGRSDatabase.get(mgrs_collection_file)
     if track_number is not None:
-        vector_gdf = vector_gdf[
-            vector_gdf['relative_orbit_number'] ==
-            track_number].to_crs("EPSG:4326")
+        intersection = mgrs_collection_db.overlay_intersection(
+            raster_gdf, column='relative_orbit_number', value=track_number)
     else:
-        vector_gdf = vector_gdf.to_crs("EPSG:4326")
-
-    # Calculate the intersection
-    intersection = gpd.overlay(raster_gdf,
-                               vector_gdf,
-                               how='intersection')
+        intersection = mgrs_collection_db.overlay_intersection(raster_gdf)
 
     # Add a new column with the intersection area
     intersection['Area'] = intersection.to_crs(epsg=epsg_code).geometry.area
@@ -425,7 +903,8 @@ def get_intersecting_mgrs_tiles_list_from_db(
     return list(set(mgrs_list)), most_overlapped
 
 
-def get_intersecting_mgrs_tiles_list(image_tif: str):
+def get_intersecting_mgrs_tiles_list(image_tif: str,
+                                     burst_index=None):
     """Find and return a list of MGRS tiles
     that intersect a reference GeoTIFF file.
 
@@ -433,6 +912,10 @@ def get_intersecting_mgrs_tiles_list(image_tif: str):
     ----------
     image_tif: str
         Path to the input GeoTIFF file.
+    burst_index: RTCBurstIndex, optional
+        Footprint index of the input rtc bursts. If provided,
+        only the MGRS tiles intersecting at least one burst
+        footprint are returned.
 
     Returns
     ----------
@@ -521,7 +1004,23 @@ def get_intersecting_mgrs_tiles_list(image_tif: str):
             mgrs_tile = mgrs_obj.toMGRS(lat, lon)
             mgrs_list.append(mgrs_tile[0:5])
 
-    return list(set(mgrs_list))
+    mgrs_list = list(set(mgrs_list))
+    if burst_index is not None:
+        mgrs_bbox_list = []
+        mgrs_epsg_list = []
+        for mgrs_tile_id in mgrs_list:
+            (x_value_min, x_value_max,
+             y_value_min, y_value_max, epsg_output) = \
+                get_bounding_box_from_mgrs_tile(mgrs_tile_id)
+            mgrs_bbox_list.append(
+                [x_value_min, y_value_min, x_value_max, y_value_max])
+            mgrs_epsg_list.append(epsg_output)
+        overlapped_list = burst_index.query_bboxes(mgrs_bbox_list,
+                                                   mgrs_epsg_list)
+        mgrs_list = [mgrs_tile_id for mgrs_tile_id, overlapped_burst
+                     in zip(mgrs_list, overlapped_list) if overlapped_burst]
+
+    return mgrs_list
 
 
 def run(cfg):
@@ -544,6 +1043,8 @@ def run(cfg):
 
     # Processing parameters
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='save_mgrs_tiles')
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
     if pol_options is not None:
@@ -584,6 +1085,7 @@ def run(cfg):
     ocean_mask_enabled = processing_cfg.ocean_mask.mask_enabled
     margin_km = processing_cfg.ocean_mask.mask_margin_km
     polygon_water = processing_cfg.ocean_mask.mask_polygon_water
+    mgrs_tiles_cfg = processing_cfg.mgrs_tiles
 
     if product_version is None:
         logger.warning('WARNING: product version was not provided.')
@@ -719,6 +1221,9 @@ def run(cfg):
             list_layers = [os.path.join(scratch_dir,
                                         f'{prefix}_{pol_cand_str}.tif')
                            for pol_cand_str in merge_pol_list]
+            # Layers kept in the scratch store are merged from GeoTIFFs
+            for layer_path in list_layers:
+                dswx_sar_util.scratch_store.materialize(layer_path)
             if key == 'no_data_area':
                 extra_args = {'nodata_value': 1}
             elif key == 'fuzzy_value':
@@ -738,30 +1243,16 @@ def run(cfg):
     # e.g. geotransform, projection, length, width, utmzon, epsg
     water_meta = dswx_sar_util.get_meta_from_tif(paths['final_water'])
 
-    # repackage the water map
-    # 1) water map
-    water_map = dswx_sar_util.read_geotiff(paths['final_water'])
-    no_data_raster = dswx_sar_util.read_geotiff(paths['no_data_area'])
-    no_data_raster = (no_data_raster > 0) | \
-        (water_map == band_assign_value_dict['no_data'])
-
-    # 2) layover/shadow
+    # layover/shadow mask
     layover_shadow_mask_path = \
         os.path.join(scratch_dir, 'mosaic_layovershadow_mask.tif')
 
     if os.path.exists(layover_shadow_mask_path):
-        layover_shadow_mask = \
-            dswx_sar_util.read_geotiff(layover_shadow_mask_path)
         logger.info('Layover/shadow mask found')
     else:
-        layover_shadow_mask = np.zeros(np.shape(water_map), dtype='byte')
+        layover_shadow_mask_path = None
         logger.warning('No layover/shadow mask found')
 
-    # 3) hand excluded
-    hand = dswx_sar_util.read_geotiff(
-        os.path.join(scratch_dir, 'interpolated_hand.tif'))
-    hand_mask = hand > hand_mask_value
-
     full_wtr_water_set_path = \
         os.path.join(scratch_dir, 'full_water_binary_WTR_set.tif')
     full_bwtr_water_set_path = \
@@ -771,19 +1262,7 @@ def run(cfg):
     full_diag_water_set_path = \
         os.path.join(scratch_dir, 'full_water_binary_DIAG_set.tif')
 
-    # 4) inundated_vegetation
-    if total_inundated_vege_flag:
-        inundated_vegetation = dswx_sar_util.read_geotiff(
-            paths['inundated_veg'])
-        inundated_vegetation_mask = (inundated_vegetation == 2) & \
-                                    (water_map == 1)
-        inundated_vegetation[inundated_vegetation_mask] = 1
-        logger.info('Inudated vegetation file was found.')
-    else:
-        inundated_vegetation = None
-        logger.warning('Inudated vegetation file was disabled.')
-
-    # 5) create ocean mask
+    # create ocean mask
     if ocean_mask_enabled:
         logger.info('Ocean mask enabled')
         ocean_mask = _create_ocean_mask(
@@ -801,108 +1280,29 @@ def run(cfg):
     if dswx_workflow == 'opera_dswx_s1':
         logger.info('BWTR and WTR Files are created from pre-computed files.')
 
-        region_grow_map = \
-            dswx_sar_util.read_geotiff(paths['region_growing'])
-        landcover_map =\
-            dswx_sar_util.read_geotiff(paths['landcover_mask'])
-
-        landcover_mask = (region_grow_map == 1) & (landcover_map != 1)
-        dark_land_mask = (landcover_map == 1) & (water_map == 0)
-        bright_water_mask = (landcover_map == 0) & (water_map == 1)
-
-        # Open water/inundated vegetation
-        # layover shadow mask/hand mask/no_data
-        # will be saved in WTR product
-        dswx_sar_util.save_dswx_product(
-            water_map == 1,
-            full_wtr_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Water classification (WTR)',
-            scratch_dir=scratch_dir,
-            logger=logger,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            inundated_vegetation=inundated_vegetation == 2,
-            no_data=no_data_raster,
-            ocean_mask=ocean_mask
-            )
-
-        # water/ No-water
-        # layover shadow mask/hand mask/no_data
-        # will be saved in BWTR product
-        # Water includes open water and inundated vegetation.
-        dswx_sar_util.save_dswx_product(
-            np.logical_or(water_map == 1, inundated_vegetation == 2),
-            full_bwtr_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Binary Water classification (BWTR)',
-            scratch_dir=scratch_dir,
-            logger=logger,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            ocean_mask=ocean_mask,
-            no_data=no_data_raster)
-
-        # Open water/landcover mask/bright water/dark land
-        # layover shadow mask/hand mask/inundated vegetation
-        # will be saved in CONF product
-        dswx_sar_util.save_dswx_product(
-            water_map == 1,
-            full_conf_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Confidence values (CONF)',
-            scratch_dir=scratch_dir,
-            logger=logger,
-            landcover_mask=landcover_mask,
-            bright_water_fill=bright_water_mask,
-            dark_land_mask=dark_land_mask,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            ocean_mask=ocean_mask,
-            inundated_vegetation=inundated_vegetation == 2,
-            no_data=no_data_raster,
-            )
-
-        # Values ranging from 0 to 100 are used to represent the likelihood
-        # or possibility of the presence of water. A higher value within
-        # this range signifies a higher likelihood of water being present.
-        fuzzy_value = dswx_sar_util.read_geotiff(paths['fuzzy_value'])
-        fuzzy_value = np.round(fuzzy_value * 100)
-        dswx_sar_util.save_dswx_product(
-            fuzzy_value,
-            full_diag_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Diagnostic layer (DIAG)',
-            is_diag=True,
-            scratch_dir=scratch_dir,
-            datatype='uint8',
-            logger=logger,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            ocean_mask=ocean_mask,
-            no_data=no_data_raster)
-    else:
-
-        # In Twele's workflow, bright water/dark land/inundated vegetation
-        # is not saved.
-        dswx_sar_util.save_dswx_product(
-                water_map == 1,
-                full_wtr_water_set_path,
-                geotransform=water_meta['geotransform'],
-                projection=water_meta['projection'],
-                description='Water classification (WTR)',
-                scratch_dir=scratch_dir,
-                layover_shadow_mask=layover_shadow_mask > 0,
-                hand_mask=hand_mask,
-                no_data=no_data_raster)
+    # repackage the water map block by block
+    save_full_dswx_products(
+        paths,
+        output_path_dict={'WTR': full_wtr_water_set_path,
+                          'BWTR': full_bwtr_water_set_path,
+                          'CONF': full_conf_water_set_path,
+                          'DIAG': full_diag_water_set_path},
+        water_meta=water_meta,
+        hand_path=os.path.join(scratch_dir, 'interpolated_hand.tif'),
+        hand_mask_value=hand_mask_value,
+        layover_shadow_mask_path=layover_shadow_mask_path,
+        ocean_mask=ocean_mask,
+        save_all_layers=dswx_workflow == 'opera_dswx_s1',
+        lines_per_block=mgrs_tiles_cfg.line_per_block,
+        scratch_dir=scratch_dir)
 
     # Get list of MGRS tiles overlapped with mosaic RTC image
     mgrs_meta_dict = {}
 
+    # Footprints and tags of the input bursts are read once and
+    # shared by the MGRS tile search and the metadata
+    burst_index = RTCBurstIndex(input_list, DSWX_S1_POL_DICT['CO_POL'])
+
     if database_bool:
         mgrs_tile_list, most_overlapped = \
             get_intersecting_mgrs_tiles_list_from_db(
@@ -915,7 +1315,8 @@ def run(cfg):
         expected_burst_list = ast.literal_eval(most_overlapped['bursts'])
         logger.info(f"Input RTCs are within {most_overlapped['mgrs_set_id']}")
         actual_burst_id = collect_burst_id(input_list,
-                                           DSWX_S1_POL_DICT['CO_POL'])
+                                           DSWX_S1_POL_DICT['CO_POL'],
+                                           burst_index=burst_index)
         number_burst = len(actual_burst_id)
         mgrs_meta_dict['MGRS_COLLECTION_EXPECTED_NUMBER_OF_BURSTS'] = \
             maximum_burst
@@ -928,18 +1329,18 @@ def run(cfg):
         mgrs_meta_dict['MGRS_POL_MODE'] = pol_mode
     else:
         mgrs_tile_list = get_intersecting_mgrs_tiles_list(
-            image_tif=paths['final_water'])
+            image_tif=paths['final_water'],
+            burst_index=burst_index)
 
-    unique_mgrs_tile_list = list(set(mgrs_tile_list))
+    unique_mgrs_tile_list = sorted(set(mgrs_tile_list))
     logger.info(f'MGRS tiles: {unique_mgrs_tile_list}')
 
     processing_time = datetime.datetime.now().strftime("%Y%m%dT%H%M%SZ")
     if dswx_workflow == 'opera_dswx_s1':
 
-        for mgrs_num_id, mgrs_tile_id in enumerate(unique_mgrs_tile_list):
-
-            logger.info(f'MGRS tile {mgrs_num_id + 1}: {mgrs_tile_id}')
-
+        mgrs_bbox_list = []
+        mgrs_epsg_list = []
+        for mgrs_tile_id in unique_mgrs_tile_list:
             if mgrs_db_path is None:
                 (x_value_min, x_value_max,
                  y_value_min, y_value_max, epsg_output) = \
@@ -949,11 +1350,24 @@ def run(cfg):
                  y_value_min, y_value_max, epsg_output) = \
                     get_bounding_box_from_mgrs_tile_db(mgrs_tile_id,
                                                        mgrs_db_path)
-            mgrs_bbox = [x_value_min, y_value_min, x_value_max, y_value_max]
-            overlapped_burst = find_intersecting_burst_with_bbox(
-                ref_bbox=mgrs_bbox,
-                ref_epsg=epsg_output,
-                input_rtc_dirs=input_list)
+            mgrs_bbox_list.append(
+                [x_value_min, y_value_min, x_value_max, y_value_max])
+            mgrs_epsg_list.append(epsg_output)
+
+        # Intersect all MGRS tiles with the burst footprints at once
+        overlapped_burst_list = burst_index.query_bboxes(mgrs_bbox_list,
+                                                         mgrs_epsg_list)
+
+        def _write_mgrs_tile(mgrs_num_id, mgrs_tile_id):
+
+            logger.info(f'MGRS tile {mgrs_num_id + 1}: {mgrs_tile_id}')
+
+            mgrs_bbox = mgrs_bbox_list[mgrs_num_id]
+            epsg_output = mgrs_epsg_list[mgrs_num_id]
+            overlapped_burst = overlapped_burst_list[mgrs_num_id]
+            if not overlapped_burst:
+                logger.warning('fail to find the overlapped rtc')
+                overlapped_burst = None
             logger.info(f'overlapped_bursts: {overlapped_burst}')
 
             # Metadata
@@ -962,7 +1376,8 @@ def run(cfg):
                     cfg,
                     overlapped_burst,
                     product_version=product_version,
-                    extra_meta_data=mgrs_meta_dict)
+                    extra_meta_data=mgrs_meta_dict,
+                    burst_index=burst_index)
 
                 dswx_name_format_prefix = (f'OPERA_L3_DSWx-S1_T{mgrs_tile_id}_'
                                            f'{date_str_id}_{processing_time}_'
@@ -991,20 +1406,17 @@ def run(cfg):
                                      output_mgrs_conf,
                                      output_mgrs_diag]
 
-                for full_input_file_path, output_file_path in zip(
-                    full_input_file_paths, output_file_paths
-                ):
-                    crop_and_save_mgrs_tile(
-                        source_tif_path=full_input_file_path,
-                        output_dir_path=sas_outputdir,
-                        output_tif_name=output_file_path,
-                        output_bbox=mgrs_bbox,
-                        output_epsg=epsg_output,
-                        output_format=output_imagery_format,
-                        metadata=dswx_metadata_dict,
-                        cog_compression=output_imagery_compression,
-                        cog_nbits=output_imagery_nbits,
-                        interpolation_method='nearest')
+                crop_and_save_mgrs_tile_layers(
+                    source_tif_paths=full_input_file_paths,
+                    output_dir_path=sas_outputdir,
+                    output_tif_names=output_file_paths,
+                    output_bbox=mgrs_bbox,
+                    output_epsg=epsg_output,
+                    output_format=output_imagery_format,
+                    metadata=dswx_metadata_dict,
+                    cog_compression=output_imagery_compression,
+                    cog_nbits=output_imagery_nbits,
+                    interpolation_method='nearest')
 
                 if browse_image_flag:
                     dswx_sar_util.create_browse_image(
@@ -1023,6 +1435,10 @@ def run(cfg):
                         set_ocean_masked_to_nodata=set_ocean_masked_to_nodata,
                         save_tif_to_output_dir=save_tif_to_output)
 
+        write_mgrs_tiles(_write_mgrs_tile,
+                         unique_mgrs_tile_list,
+                         number_workers=mgrs_tiles_cfg.number_cpu)
+
     t_all_elapsed = time.time() - t_all
     logger.info("successfully ran save_mgrs_tiles in "
                 f"{t_all_elapsed:.3f} seconds")
@@ -9,7 +9,6 @@ import time
 import geopandas as gpd
 import h5py
 import numpy as np
-from osgeo import gdal
 from pyproj import Transformer
 import rasterio
 from rasterio.warp import transform_bounds
@@ -20,103 +19,26 @@ from shapely.ops import transform
 from dswx_sar import (dswx_sar_util,
                       generate_log,
                       mosaic_gcov_frame)
-from dswx_sar.dswx_sar_util import (band_assign_value_dict,
-                                    _create_ocean_mask)
+from dswx_sar.dswx_sar_util import _create_ocean_mask
 from dswx_sar.dswx_ni_runconfig import (RunConfig,
                                         _get_parser,
                                         get_pol_rtc_hdf5,
                                         DSWX_S1_POL_DICT)
 from dswx_sar.metadata import (create_dswx_ni_metadata,
-                               collect_burst_id,
-                               _populate_statics_metadata_datasets)
+                               collect_burst_id)
 from dswx_sar.save_mgrs_tiles import (
+    MGRSDatabase,
+    crop_and_save_mgrs_tile_layers,
     get_bounding_box_from_mgrs_tile,
     get_bounding_box_from_mgrs_tile_db,
     get_intersecting_mgrs_tiles_list,
-    merge_pol_layers)
+    merge_pol_layers,
+    save_full_dswx_products,
+    write_mgrs_tiles)
 
 logger = logging.getLogger('dswx_sar')
 
 
-def crop_and_save_mgrs_tile_spacing(
-        source_tif_path,
-        output_dir_path,
-        output_tif_name,
-        output_bbox,
-        output_epsg,
-        output_spacing,
-        output_format,
-        metadata,
-        cog_compression,
-        cog_nbits,
-        interpolation_method='nearest'):
-    """Crop the product along the MGRS tile grid and
-    save it as a Cloud-Optimized GeoTIFF (COG).
-
-    Parameters
-    ----------
-    source_tif_path : str
-        Path to the original TIFF file.
-    output_dir_path : str
-        Path to the directory to save the output file.
-    output_tif_name : str
-        Filename for the cropped GeoTIFF.
-    output_bbox : list
-        List of bounding box
-        i.e. [x_min, y_min, x_max, y_max]
-    output_epsg : int
-        EPSG for output GeoTIFF
-    output_format : str
-        Output file format (i.e., COG, GeoTIFF)
-    metadata : dict
-        Dictionry for metadata
-    cog_compression: str
-        Compression method for COG
-    cog_nbits: int
-        Compression nbits
-    interpolation_method : str
-        Interpolation method for cropping, by default 'nearest'.
-    """
-    input_tif_obj = gdal.Open(source_tif_path)
-    band = input_tif_obj.GetRasterBand(1)
-    no_data_value = band.GetNoDataValue()
-
-    # Create output file path
-    output_tif_file_path = os.path.join(output_dir_path,
-                                        output_tif_name)
-
-    # Define GDAL Warp options
-    warp_options = gdal.WarpOptions(
-        dstSRS=f'EPSG:{output_epsg}',
-        outputType=band.DataType,
-        xRes=output_spacing,
-        yRes=output_spacing,
-        outputBounds=output_bbox,
-        resampleAlg=interpolation_method,
-        dstNodata=no_data_value,
-        format='GTIFF')
-
-    gdal.Warp(output_tif_file_path,
-              source_tif_path,
-              options=warp_options)
-
-    _populate_statics_metadata_datasets(metadata,
-                                        output_tif_file_path)
-
-    with rasterio.open(output_tif_file_path, 'r+') as src:
-        src.update_tags(**metadata)
-
-    input_tif_obj = None
-
-    if output_format == 'COG':
-        dswx_sar_util._save_as_cog(
-            output_tif_file_path,
-            output_dir_path,
-            logger,
-            compression=cog_compression,
-            nbits=cog_nbits)
-
-
 def find_intersecting_frames_with_bbox(ref_bbox,
                                        ref_epsg,
                                        input_rtc_files):
@@ -246,22 +168,15 @@ def get_intersecting_mgrs_tiles_list_from_db(
                                       geometry=[raster_polygon],
                                       crs=4326)
 
-    # Load the vector data
-    vector_gdf = gpd.read_file(mgrs_collection_file)
-
+    # Calculate the intersection with the MGRS tile collection.
     # If track number is given, then search MGRS tile collection with
     # track number
+    mgrs_collection_db = MGRSDatabase.get(mgrs_collection_file)
     if track_number is not None:
-        vector_gdf = vector_gdf[
-            vector_gdf['track_number'] ==
-            track_number].to_crs("EPSG:4326")
+        intersection = mgrs_collection_db.overlay_intersection(
+            raster_gdf, column='track_number', value=track_number)
     else:
-        vector_gdf = vector_gdf.to_crs("EPSG:4326")
-
-    # Calculate the intersection
-    intersection = gpd.overlay(raster_gdf,
-                               vector_gdf,
-                               how='intersection')
+        intersection = mgrs_collection_db.overlay_intersection(raster_gdf)
 
     # Add a new column with the intersection area
     intersection['Area'] = intersection.to_crs(epsg=epsg_code).geometry.area
@@ -295,6 +210,8 @@ def run(cfg):
 
     # Processing parameters
     processing_cfg = cfg.groups.processing
+    dswx_sar_util.scratch_raster_policy.configure_from_cfg(
+        processing_cfg, stage='save_mgrs_tiles')
     pol_list = copy.deepcopy(processing_cfg.polarizations)
     pol_options = processing_cfg.polarimetric_option
     if pol_options is not None:
@@ -335,6 +252,7 @@ def run(cfg):
     ocean_mask_enabled = processing_cfg.ocean_mask.mask_enabled
     margin_km = processing_cfg.ocean_mask.mask_margin_km
     polygon_water = processing_cfg.ocean_mask.mask_polygon_water
+    mgrs_tiles_cfg = processing_cfg.mgrs_tiles
 
     if product_version is None:
         logger.warning('WARNING: product version was not provided.')
@@ -459,6 +377,9 @@ def run(cfg):
             list_layers = [os.path.join(scratch_dir,
                                         f'{prefix}_{pol_cand_str}.tif')
                            for pol_cand_str in merge_pol_list]
+            # Layers kept in the scratch store are merged from GeoTIFFs
+            for layer_path in list_layers:
+                dswx_sar_util.scratch_store.materialize(layer_path)
             if key == 'no_data_area':
                 extra_args = {'nodata_value': 1}
             elif key == 'fuzzy_value':
@@ -478,30 +399,16 @@ def run(cfg):
     # e.g. geotransform, projection, length, width, utmzon, epsg
     water_meta = dswx_sar_util.get_meta_from_tif(paths['final_water'])
 
-    # repackage the water map
-    # 1) water map
-    water_map = dswx_sar_util.read_geotiff(paths['final_water'])
-    no_data_raster = dswx_sar_util.read_geotiff(paths['no_data_area'])
-    no_data_raster = (no_data_raster > 0) | \
-        (water_map == band_assign_value_dict['no_data'])
-
-    # 2) layover/shadow
+    # layover/shadow mask
     layover_shadow_mask_path = \
         os.path.join(scratch_dir, 'mosaic_layovershadow_mask.tif')
 
     if os.path.exists(layover_shadow_mask_path):
-        layover_shadow_mask = \
-            dswx_sar_util.read_geotiff(layover_shadow_mask_path)
         logger.info('Layover/shadow mask found')
     else:
-        layover_shadow_mask = np.zeros(np.shape(water_map), dtype='byte')
+        layover_shadow_mask_path = None
         logger.warning('No layover/shadow mask found')
 
-    # 3) hand excluded
-    hand = dswx_sar_util.read_geotiff(
-        os.path.join(scratch_dir, 'interpolated_hand.tif'))
-    hand_mask = hand > hand_mask_value
-
     full_wtr_water_set_path = \
         os.path.join(scratch_dir, 'full_water_binary_WTR_set.tif')
     full_bwtr_water_set_path = \
@@ -511,19 +418,7 @@ def run(cfg):
     full_diag_water_set_path = \
         os.path.join(scratch_dir, 'full_water_binary_DIAG_set.tif')
 
-    # 4) inundated_vegetation
-    if total_inundated_vege_flag:
-        inundated_vegetation = dswx_sar_util.read_geotiff(
-            paths['inundated_veg'])
-        inundated_vegetation_mask = (inundated_vegetation == 2) & \
-                                    (water_map == 1)
-        inundated_vegetation[inundated_vegetation_mask] = 1
-        logger.info('Inudated vegetation file was found.')
-    else:
-        inundated_vegetation = None
-        logger.warning('Inudated vegetation file was disabled.')
-
-    # 5) create ocean mask
+    # create ocean mask
     if ocean_mask_enabled:
         logger.info('Ocean mask enabled')
         ocean_mask = _create_ocean_mask(
@@ -541,104 +436,21 @@ def run(cfg):
     if dswx_workflow == 'opera_dswx_ni':
         logger.info('BWTR and WTR Files are created from pre-computed files.')
 
-        region_grow_map = \
-            dswx_sar_util.read_geotiff(paths['region_growing'])
-        landcover_map =\
-            dswx_sar_util.read_geotiff(paths['landcover_mask'])
-
-        landcover_mask = (region_grow_map == 1) & (landcover_map != 1)
-        dark_land_mask = (landcover_map == 1) & (water_map == 0)
-        bright_water_mask = (landcover_map == 0) & (water_map == 1)
-
-        # Open water/inundated vegetation
-        # layover shadow mask/hand mask/no_data
-        # will be saved in WTR product
-        dswx_sar_util.save_dswx_product(
-            water_map == 1,
-            full_wtr_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Water classification (WTR)',
-            scratch_dir=scratch_dir,
-            logger=logger,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            inundated_vegetation=inundated_vegetation == 2,
-            no_data=no_data_raster,
-            ocean_mask=ocean_mask
-            )
-
-        # water/ No-water
-        # layover shadow mask/hand mask/no_data
-        # will be saved in BWTR product
-        # Water includes open water and inundated vegetation.
-        dswx_sar_util.save_dswx_product(
-            np.logical_or(water_map == 1, inundated_vegetation == 2),
-            full_bwtr_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Binary Water classification (BWTR)',
-            scratch_dir=scratch_dir,
-            logger=logger,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            ocean_mask=ocean_mask,
-            no_data=no_data_raster)
-
-        # Open water/landcover mask/bright water/dark land
-        # layover shadow mask/hand mask/inundated vegetation
-        # will be saved in CONF product
-        dswx_sar_util.save_dswx_product(
-            water_map == 1,
-            full_conf_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Confidence values (CONF)',
-            scratch_dir=scratch_dir,
-            logger=logger,
-            landcover_mask=landcover_mask,
-            bright_water_fill=bright_water_mask,
-            dark_land_mask=dark_land_mask,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            ocean_mask=ocean_mask,
-            inundated_vegetation=inundated_vegetation == 2,
-            no_data=no_data_raster,
-            )
-
-        # Values ranging from 0 to 100 are used to represent the likelihood
-        # or possibility of the presence of water. A higher value within
-        # this range signifies a higher likelihood of water being present.
-        fuzzy_value = dswx_sar_util.read_geotiff(paths['fuzzy_value'])
-        fuzzy_value = np.round(fuzzy_value * 100)
-        dswx_sar_util.save_dswx_product(
-            fuzzy_value,
-            full_diag_water_set_path,
-            geotransform=water_meta['geotransform'],
-            projection=water_meta['projection'],
-            description='Diagnostic layer (DIAG)',
-            is_diag=True,
-            scratch_dir=scratch_dir,
-            datatype='uint8',
-            logger=logger,
-            layover_shadow_mask=layover_shadow_mask > 0,
-            hand_mask=hand_mask,
-            ocean_mask=ocean_mask,
-            no_data=no_data_raster)
-    else:
-
-        # In Twele's workflow, bright water/dark land/inundated vegetation
-        # is not saved.
-        dswx_sar_util.save_dswx_product(
-                water_map == 1,
-                full_wtr_water_set_path,
-                geotransform=water_meta['geotransform'],
-                projection=water_meta['projection'],
-                description='Water classification (WTR)',
-                scratch_dir=scratch_dir,
-                layover_shadow_mask=layover_shadow_mask > 0,
-                hand_mask=hand_mask,
-                no_data=no_data_raster)
+    # repackage the water map block by block
+    save_full_dswx_products(
+        paths,
+        output_path_dict={'WTR': full_wtr_water_set_path,
+                          'BWTR': full_bwtr_water_set_path,
+                          'CONF': full_conf_water_set_path,
+                          'DIAG': full_diag_water_set_path},
+        water_meta=water_meta,
+        hand_path=os.path.join(scratch_dir, 'interpolated_hand.tif'),
+        hand_mask_value=hand_mask_value,
+        layover_shadow_mask_path=layover_shadow_mask_path,
+        ocean_mask=ocean_mask,
+        save_all_layers=dswx_workflow == 'opera_dswx_ni',
+        lines_per_block=mgrs_tiles_cfg.line_per_block,
+        scratch_dir=scratch_dir)
 
     # Get list of MGRS tiles overlapped with mosaic RTC image
     mgrs_meta_dict = {}
@@ -670,13 +482,13 @@ def run(cfg):
         mgrs_tile_list = get_intersecting_mgrs_tiles_list(
             image_tif=paths['final_water'])
 
-    unique_mgrs_tile_list = list(set(mgrs_tile_list))
+    unique_mgrs_tile_list = sorted(set(mgrs_tile_list))
     logger.info(f'MGRS tiles: {unique_mgrs_tile_list}')
 
     processing_time = datetime.datetime.now().strftime("%Y%m%dT%H%M%SZ")
     if dswx_workflow == 'opera_dswx_ni':
 
-        for mgrs_num_id, mgrs_tile_id in enumerate(unique_mgrs_tile_list):
+        def _write_mgrs_tile(mgrs_num_id, mgrs_tile_id):
 
             logger.info(f'MGRS tile {mgrs_num_id + 1}: {mgrs_tile_id}')
 
@@ -732,21 +544,18 @@ def run(cfg):
                                      output_mgrs_conf,
                                      output_mgrs_diag]
 
-                for full_input_file_path, output_file_path in zip(
-                    full_input_file_paths, output_file_paths
-                ):
-                    crop_and_save_mgrs_tile_spacing(
-                        source_tif_path=full_input_file_path,
-                        output_dir_path=sas_outputdir,
-                        output_tif_name=output_file_path,
-                        output_bbox=mgrs_bbox,
-                        output_epsg=epsg_output,
-                        output_spacing=output_spacing,
-                        output_format=output_imagery_format,
-                        metadata=dswx_metadata_dict,
-                        cog_compression=output_imagery_compression,
-                        cog_nbits=output_imagery_nbits,
-                        interpolation_method='nearest')
+                crop_and_save_mgrs_tile_layers(
+                    source_tif_paths=full_input_file_paths,
+                    output_dir_path=sas_outputdir,
+                    output_tif_names=output_file_paths,
+                    output_bbox=mgrs_bbox,
+                    output_epsg=epsg_output,
+                    output_format=output_imagery_format,
+                    metadata=dswx_metadata_dict,
+                    cog_compression=output_imagery_compression,
+                    cog_nbits=output_imagery_nbits,
+                    interpolation_method='nearest',
+                    output_spacing=output_spacing)
 
                 if browse_image_flag:
                     dswx_sar_util.create_browse_image(
@@ -765,6 +574,10 @@ def run(cfg):
                         set_ocean_masked_to_nodata=set_ocean_masked_to_nodata,
                         save_tif_to_output_dir=save_tif_to_output)
 
+        write_mgrs_tiles(_write_mgrs_tile,
+                         unique_mgrs_tile_list,
+                         number_workers=mgrs_tiles_cfg.number_cpu)
+
     t_all_elapsed = time.time() - t_all
     logger.info("successfully ran save_mgrs_tiles in "
                 f"{t_all_elapsed:.3f} seconds")
@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+import pytest
+from osgeo import osr
+
+from dswx_sar import dswx_sar_util
+
+
+def _save_binary(binary, path):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    dswx_sar_util.save_raster_gdal(
+        binary, str(path),
+        geotransform=[0, 1, 0, 0, 0, -1],
+        projection=srs.ExportToWkt(),
+        scratch_dir=str(path.parent),
+        datatype='uint8',
+        cog_flag=False)
+
+
+@pytest.mark.parametrize('connectivity', [4, 8])
+def test_build_matches_opencv(tmp_path, connectivity):
+    rng = np.random.default_rng(connectivity)
+    binary = (rng.random((300, 257)) > 0.55).astype(np.uint8)
+    binary_path = tmp_path / 'binary.tif'
+    _save_binary(binary, binary_path)
+
+    number_labels, ref_labels, ref_stats, _ = \
+        cv2.connectedComponentsWithStats(binary, connectivity=connectivity)
+
+    for lines_per_block in rng.integers(2, 300, size=3):
+        label_path = str(tmp_path / f'label_{lines_per_block}.tif')
+        component_index = dswx_sar_util.ComponentIndex.build(
+            str(binary_path),
+            label_path,
+            lines_per_block=int(lines_per_block),
+            connectivity=connectivity,
+            scratch_dir=str(tmp_path))
+        labels = dswx_sar_util.read_geotiff(component_index.label_path)
+
+        assert component_index.number_components == number_labels - 1
+        np.testing.assert_array_equal(labels == 0, ref_labels == 0)
+
+        # Each OpenCV label maps to exactly one label of the index.
+        foreground = ref_labels > 0
+        label_pairs = np.unique(
+            np.stack([ref_labels[foreground], labels[foreground]]), axis=1)
+        assert label_pairs.shape[1] == number_labels - 1
+        assert len(np.unique(label_pairs[1])) == number_labels - 1
+
+        ref_ind, label_ind = label_pairs
+        np.testing.assert_array_equal(component_index.sizes[label_ind],
+                                      ref_stats[ref_ind, cv2.CC_STAT_AREA])
+        np.testing.assert_array_equal(component_index.bboxes[label_ind],
+                                      ref_stats[ref_ind, :4])
+
+
+@pytest.mark.parametrize('max_lines_per_task', [30, 100, 1000])
+def test_schedule_component_tasks(tmp_path, max_lines_per_task):
+    rng = np.random.default_rng(max_lines_per_task)
+    binary = (rng.random((400, 200)) > 0.6).astype(np.uint8)
+    # A component taller than the smaller tasks
+    binary[50:300, 10:20] = 1
+    binary_path = tmp_path / 'binary.tif'
+    _save_binary(binary, binary_path)
+
+    component_index = dswx_sar_util.ComponentIndex.build(
+        str(binary_path),
+        str(tmp_path / 'label.tif'),
+        lines_per_block=64,
+        scratch_dir=str(tmp_path))
+    task_list = dswx_sar_util.schedule_component_tasks(
+        component_index, component_index.select(), max_lines_per_task)
+
+    # Each component is assigned to exactly one task.
+    task_labels = np.concatenate([labels for _, labels in task_list])
+    np.testing.assert_array_equal(np.sort(task_labels),
+                                  component_index.select())
+
+    for block_param, labels in task_list:
+        start_line = block_param.read_start_line
+        end_line = start_line + block_param.read_length
+        assert block_param.block_length == block_param.read_length
+        assert block_param.data_width == binary.shape[1]
+        assert end_line - start_line <= max_lines_per_task or \
+            len(labels) == 1
+
+        buffered_bboxes = component_index.buffered_bboxes[labels]
+        assert np.all(buffered_bboxes[:, 2] >= start_line)
+        assert np.all(buffered_bboxes[:, 3] <= end_line)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from dswx_sar import filter_SAR
+
+
+def _brute_force_nan_count(arr, winsize):
+    half = winsize // 2
+    padded = np.pad(np.isnan(arr), half, mode='constant',
+                    constant_values=False)
+    nan_count = np.zeros(arr.shape, dtype=np.int32)
+    for row in range(arr.shape[0]):
+        for col in range(arr.shape[1]):
+            nan_count[row, col] = np.count_nonzero(
+                padded[row:row + winsize, col:col + winsize])
+    return nan_count
+
+
+@pytest.mark.parametrize('winsize', [3, 5, 7])
+def test_window_nan_count_is_exact(winsize):
+    rng = np.random.default_rng(0)
+    arr = rng.random((40, 30)).astype(np.float32)
+    arr[rng.random(arr.shape) < 0.3] = np.nan
+
+    nan_count = filter_SAR.compute_window_nan_count(np.isnan(arr), winsize)
+
+    np.testing.assert_array_equal(nan_count,
+                                  _brute_force_nan_count(arr, winsize))
+
+
+@pytest.mark.parametrize('method', ['box', 'convolve'])
+def test_window_on_nan_threshold(method):
+    winsize = 5
+    rng = np.random.default_rng(1)
+    arr = rng.gamma(4, 0.25, (21, 21)).astype(np.float32)
+
+    # The window centered at (10, 10) has exactly 5 of its 25 pixels
+    # NaN (20 %), and the window centered at (10, 9) has 6 of them.
+    arr[8:13, 8] = np.nan
+    arr[8, 7] = np.nan
+
+    mean, std = filter_SAR.compute_window_mean_std(arr, winsize,
+                                                   method=method)
+
+    assert np.isfinite(mean[10, 10])
+    assert np.isfinite(std[10, 10])
+    assert np.isnan(mean[10, 9])
+
+    expected_mean = np.nanmean(arr[8:13, 8:13]) * 20 / 25
+    np.testing.assert_allclose(mean[10, 10], expected_mean, rtol=1e-5)
+
+    expected_invalid = 5 * _brute_force_nan_count(arr, winsize) > 25
+    np.testing.assert_array_equal(np.isnan(mean), expected_invalid)
+
+
+@pytest.mark.parametrize('winsize', [3, 5, 7])
+def test_box_and_convolve_agree(winsize):
+    rng = np.random.default_rng(2)
+    arr = rng.gamma(4, 0.25, (120, 150)).astype(np.float32)
+    arr[rng.random(arr.shape) < 0.15] = np.nan
+
+    filtered_box = filter_SAR.lee_enhanced_filter(
+        arr, window_size=winsize, method='box')
+    filtered_convolve = filter_SAR.lee_enhanced_filter(
+        arr, window_size=winsize, method='convolve')
+
+    np.testing.assert_array_equal(np.isnan(filtered_box),
+                                  np.isnan(filtered_convolve))
+    valid = np.isfinite(filtered_box)
+    np.testing.assert_allclose(filtered_box[valid],
+                               filtered_convolve[valid], rtol=1e-3)
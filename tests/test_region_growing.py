@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from osgeo import osr
+from scipy import ndimage
+
+from dswx_sar import dswx_sar_util, region_growing
+
+
+def _get_likelihood_image(shape, seed):
+    rng = np.random.default_rng(seed)
+    image = ndimage.gaussian_filter(rng.random(shape), sigma=3)
+    image -= image.min()
+    return (image / image.max()).astype(np.float32)
+
+
+def _get_exclude_area(shape, seed):
+    rng = np.random.default_rng(seed)
+    return ndimage.gaussian_filter(rng.random(shape), sigma=2) > 0.55
+
+
+def _save_raster(data, path, datatype):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    dswx_sar_util.save_raster_gdal(
+        data, str(path),
+        geotransform=[0, 1, 0, 0, 0, -1],
+        projection=srs.ExportToWkt(),
+        scratch_dir=str(path.parent),
+        datatype=datatype,
+        cog_flag=False)
+
+
+@pytest.mark.parametrize('mode', ['descending', 'ascending'])
+@pytest.mark.parametrize('maxiter', [0, 3, 10])
+@pytest.mark.parametrize('use_exclude_area', [False, True])
+def test_labeling_matches_dilation(mode, maxiter, use_exclude_area):
+    shape = (150, 170)
+    likelihood_image = _get_likelihood_image(shape, seed=0)
+    exclude_area = _get_exclude_area(shape, seed=1) \
+        if use_exclude_area else None
+    if mode == 'descending':
+        thresholds = dict(initial_threshold=0.7, relaxed_threshold=0.45)
+    else:
+        thresholds = dict(initial_threshold=0.3, relaxed_threshold=0.55)
+
+    expected = region_growing.region_growing(
+        likelihood_image,
+        maxiter=maxiter,
+        exclude_area=exclude_area,
+        mode=mode,
+        verbose=False,
+        **thresholds)
+    binary_image = region_growing.region_growing_labeling(
+        likelihood_image,
+        maxiter=maxiter,
+        exclude_area=exclude_area,
+        mode=mode,
+        **thresholds)
+
+    np.testing.assert_array_equal(binary_image, expected)
+
+
+@pytest.mark.parametrize('lines_per_block', [1, 17, 64, 500])
+@pytest.mark.parametrize('columns_per_block', [None, 1, 23])
+@pytest.mark.parametrize('use_exclude_area', [False, True])
+def test_parallel_labeling_matches_dilation(tmp_path, lines_per_block,
+                                            columns_per_block,
+                                            use_exclude_area):
+    shape = (150, 170)
+    likelihood_image = _get_likelihood_image(shape, seed=2)
+    input_path = tmp_path / 'fuzzy.tif'
+    _save_raster(likelihood_image, input_path, 'float32')
+
+    exclude_area = None
+    exclude_area_path = None
+    if use_exclude_area:
+        exclude_area = _get_exclude_area(shape, seed=3)
+        exclude_area_path = tmp_path / 'exclude.tif'
+        _save_raster(exclude_area.astype(np.uint8), exclude_area_path,
+                     'uint8')
+        exclude_area_path = str(exclude_area_path)
+
+    expected = region_growing.region_growing(
+        likelihood_image,
+        initial_threshold=0.7,
+        relaxed_threshold=0.45,
+        maxiter=0,
+        exclude_area=exclude_area,
+        verbose=False)
+    binary_image = region_growing.run_parallel_region_growing_labeling(
+        str(input_path),
+        exclude_area_path=exclude_area_path,
+        lines_per_block=lines_per_block,
+        columns_per_block=columns_per_block,
+        initial_threshold=0.7,
+        relaxed_threshold=0.45)
+
+    np.testing.assert_array_equal(binary_image, expected)